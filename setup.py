@@ -57,7 +57,7 @@ setup(
     packages=find_packages(exclude=["tests*"]),
     install_requires=[
         'bravado',
-        'kafka-python<1.0.0',
+        'kafka-python==0.9.5',
         'kazoo>=2.0.post2',
         'PyYAML>=3.10',
         'py_zipkin',
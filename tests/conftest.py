@@ -15,12 +15,20 @@
 from __future__ import absolute_import
 from __future__ import unicode_literals
 
+import sys
+
 import mock
 import pytest
 
 from yelp_kafka.config import ClusterConfig
 from yelp_kafka.config import KafkaConsumerConfig
 
+# asyncio modules use the python 3.5 async/await syntax
+collect_ignore = []
+if sys.version_info < (3, 5):
+    collect_ignore.append('test_asyncio_consumer_group.py')
+    collect_ignore.append('test_asyncio_producer.py')
+
 
 MOCK_SERVICES_YAML = {
     'service1.main': {'host': 'host1', 'port': 1111},
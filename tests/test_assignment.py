@@ -0,0 +1,292 @@
+# -*- coding: utf-8 -*-
+# Copyright 2016 Yelp Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+import json
+
+import mock
+import pytest
+from kazoo.exceptions import BadVersionError
+from kazoo.exceptions import NoNodeError
+from kazoo.recipe.partitioner import SetPartitioner
+
+from yelp_kafka.assignment import get_member_capacity
+from yelp_kafka.assignment import get_partition_rates
+from yelp_kafka.assignment import get_weights_change
+from yelp_kafka.assignment import make_member_identifier
+from yelp_kafka.assignment import quantize_weights
+from yelp_kafka.assignment import ThroughputAssignment
+from yelp_kafka.assignment import ThroughputWeights
+from yelp_kafka.assignment import WeightedAssignment
+from yelp_kafka.offsets import PartitionOffsets
+
+
+class TestWeightedAssignment(object):
+
+    partitions = ['topic1-{0}'.format(p) for p in range(6)]
+    members = ['host2-1', 'host1-1', 'host3-1']
+
+    def test_assign_by_count(self):
+        assignment = WeightedAssignment({}).assign(self.members, self.partitions)
+
+        assert sorted(
+            p for partitions in assignment.values() for p in partitions
+        ) == self.partitions
+        assert all(len(partitions) == 2 for partitions in assignment.values())
+
+    def test_assign_by_weight(self):
+        weights = {
+            'topic1-0': 100,
+            'topic1-1': 90,
+            'topic1-2': 80,
+            'topic1-3': 10,
+            'topic1-4': 1,
+            'topic1-5': 1,
+        }
+        assignment = WeightedAssignment(weights).assign(
+            self.members,
+            self.partitions,
+        )
+
+        assert assignment == {
+            'host1-1': ['topic1-0'],
+            'host2-1': ['topic1-1', 'topic1-4'],
+            'host3-1': ['topic1-2', 'topic1-3', 'topic1-5'],
+        }
+
+    def test_assign_by_count_same_as_kazoo(self):
+        assignment = WeightedAssignment({})
+        for member in self.members:
+            expected = SetPartitioner._partitioner(
+                mock.Mock(),
+                member,
+                self.members,
+                self.partitions,
+            )
+            assert assignment(member, self.members, self.partitions) == expected
+
+    def test_assign_by_capacity(self):
+        members = ['host1-1@4', 'host2-1', 'host3-1@3']
+        partitions = ['topic1-{0}'.format(p) for p in range(16)]
+
+        assignment = WeightedAssignment({}).assign(members, partitions)
+
+        assert len(assignment['host1-1@4']) == 8
+        assert len(assignment['host2-1']) == 2
+        assert len(assignment['host3-1@3']) == 6
+
+    def test_assign_by_weight_and_capacity(self):
+        weights = {'topic1-0': 30, 'topic1-1': 20, 'topic1-2': 10}
+        members = ['host1-1@2', 'host2-1']
+
+        assignment = WeightedAssignment(weights).assign(
+            members,
+            ['topic1-0', 'topic1-1', 'topic1-2'],
+        )
+
+        assert assignment == {
+            'host1-1@2': ['topic1-0', 'topic1-2'],
+            'host2-1': ['topic1-1'],
+        }
+
+    def test_partition_func(self):
+        assignment = WeightedAssignment({'topic1-5': 10})
+        assigned = [
+            assignment(member, list(reversed(self.members)), self.partitions)
+            for member in self.members
+        ]
+
+        assert sorted(p for partitions in assigned for p in partitions) == \
+            self.partitions
+        assert ['topic1-5'] in assigned
+
+
+def test_member_capacity():
+    assert make_member_identifier('host-1-0') == 'host-1-0'
+    assert make_member_identifier('host-1-0', 2.5) == 'host-1-0@2.5'
+    assert get_member_capacity('host-1-0@2.5') == 2.5
+    assert get_member_capacity('host-1-0@48') == 48
+    assert get_member_capacity('host-1-0') == 1
+    assert get_member_capacity('host-1-0@invalid') == 1
+    assert get_member_capacity('host-1-0@0') == 1
+
+
+def test_get_partition_rates():
+    rates = get_partition_rates(
+        {'topic1-0': 100, 'topic1-1': 100},
+        {'topic1-0': 300, 'topic1-1': 100, 'topic1-2': 50},
+        10,
+    )
+    assert rates == {'topic1-0': 20, 'topic1-1': 0}
+
+
+def test_quantize_weights():
+    assert quantize_weights({'topic1-0': 20.0, 'topic1-1': 0, 'topic1-2': 5}) == {
+        'topic1-0': 100,
+        'topic1-1': 1,
+        'topic1-2': 25,
+    }
+    assert quantize_weights({'topic1-0': 0}) == {}
+
+
+class TestThroughputWeights(object):
+
+    @pytest.fixture
+    def kazoo_client(self):
+        return mock.Mock()
+
+    @pytest.yield_fixture
+    def mock_watermarks(self):
+        with mock.patch(
+            'yelp_kafka.assignment.get_topics_watermarks',
+            autospec=True,
+            return_value={'topic1': {
+                0: PartitionOffsets('topic1', 0, 1100, 0),
+                1: PartitionOffsets('topic1', 1, 200, 0),
+            }},
+        ) as mock_watermarks:
+            yield mock_watermarks
+
+    @pytest.yield_fixture
+    def mock_time(self):
+        with mock.patch('yelp_kafka.assignment.time.time', return_value=1000) as mock_time:
+            yield mock_time
+
+    def throughput_weights(self, kazoo_client):
+        return ThroughputWeights(
+            kazoo_client,
+            '/group/weights',
+            mock.Mock(),
+            ['topic1'],
+            refresh_secs=60,
+        )
+
+    def encode(self, timestamp, watermarks, weights):
+        return json.dumps({
+            'timestamp': timestamp,
+            'watermarks': watermarks,
+            'weights': weights,
+        }).encode('utf-8')
+
+    def test_first_measure(self, kazoo_client, mock_watermarks, mock_time):
+        kazoo_client.get.side_effect = NoNodeError
+
+        assert self.throughput_weights(kazoo_client).refresh() is False
+
+        data = kazoo_client.create.call_args[0][1]
+        assert json.loads(data.decode('utf-8')) == {
+            'timestamp': 1000,
+            'watermarks': {'topic1-0': 1100, 'topic1-1': 200},
+            'weights': {},
+        }
+
+    def test_recent_measure(self, kazoo_client, mock_watermarks, mock_time):
+        kazoo_client.get.return_value = (
+            self.encode(990, {'topic1-0': 100}, {'topic1-0': 3}),
+            mock.Mock(version=1),
+        )
+
+        assert self.throughput_weights(kazoo_client).refresh() is False
+        assert not mock_watermarks.called
+        assert not kazoo_client.set.called
+
+    def test_stale_measure(self, kazoo_client, mock_watermarks, mock_time):
+        kazoo_client.get.return_value = (
+            self.encode(900, {'topic1-0': 100, 'topic1-1': 100}, {}),
+            mock.Mock(version=1),
+        )
+
+        assert self.throughput_weights(kazoo_client).refresh() is True
+
+        data = kazoo_client.set.call_args[0][1]
+        assert json.loads(data.decode('utf-8'))['weights'] == {
+            'topic1-0': 100,
+            'topic1-1': 10,
+        }
+        assert kazoo_client.set.call_args[1] == {'version': 1}
+
+    def test_stale_measure_small_change(self, kazoo_client, mock_watermarks, mock_time):
+        kazoo_client.get.return_value = (
+            self.encode(
+                900,
+                {'topic1-0': 100, 'topic1-1': 100},
+                {'topic1-0': 100, 'topic1-1': 12},
+            ),
+            mock.Mock(version=1),
+        )
+
+        assert self.throughput_weights(kazoo_client).refresh() is False
+
+        # The weights are kept, the next measure starts from now
+        data = kazoo_client.set.call_args[0][1]
+        assert json.loads(data.decode('utf-8')) == {
+            'timestamp': 1000,
+            'watermarks': {'topic1-0': 1100, 'topic1-1': 200},
+            'weights': {'topic1-0': 100, 'topic1-1': 12},
+        }
+
+    def test_concurrent_measure(self, kazoo_client, mock_watermarks, mock_time):
+        kazoo_client.get.return_value = (
+            self.encode(900, {'topic1-0': 100, 'topic1-1': 100}, {}),
+            mock.Mock(version=1),
+        )
+        kazoo_client.set.side_effect = BadVersionError
+
+        # Another member published the weights
+        assert self.throughput_weights(kazoo_client).refresh() is False
+
+    def test_read_weights(self, kazoo_client):
+        throughput_weights = self.throughput_weights(kazoo_client)
+        kazoo_client.get.return_value = (
+            self.encode(900, {}, {'topic1-0': 7}),
+            mock.Mock(version=1),
+        )
+        assert throughput_weights.read_weights() == {'topic1-0': 7}
+
+        # The last weights are used if zookeeper can't be read
+        kazoo_client.get.side_effect = Exception("Boom!")
+        assert throughput_weights.read_weights() == {'topic1-0': 7}
+
+        kazoo_client.get.side_effect = NoNodeError
+        assert throughput_weights.read_weights() == {}
+
+
+def test_get_weights_change():
+    assert get_weights_change({}, {}) == 0
+    assert get_weights_change({'topic1-0': 10}, {'topic1-0': 20}) == 0
+    assert get_weights_change(
+        {'topic1-0': 10, 'topic1-1': 10},
+        {'topic1-0': 20, 'topic1-1': 20},
+    ) == 0
+    # Partitions without weight have weight 1
+    assert get_weights_change(
+        {},
+        {'topic1-0': 3, 'topic1-1': 1},
+    ) == pytest.approx(0.25)
+
+
+def test_throughput_assignment():
+    throughput_weights = mock.Mock(spec=ThroughputWeights)
+    throughput_weights.read_weights.return_value = {'topic1-1': 10}
+    assignment = ThroughputAssignment(throughput_weights)
+    partitions = ['topic1-0', 'topic1-1', 'topic1-2']
+
+    assert assignment('host1', ['host1', 'host2'], partitions) == ['topic1-1']
+    assert assignment('host2', ['host1', 'host2'], partitions) == [
+        'topic1-0',
+        'topic1-2',
+    ]
+    assert throughput_weights.read_weights.call_count == 2
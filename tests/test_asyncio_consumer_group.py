@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+# Copyright 2016 Yelp Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+import asyncio
+import time
+
+import mock
+import pytest
+from kafka.common import ConsumerTimeout
+
+from yelp_kafka.asyncio_consumer_group import AsyncKafkaConsumerGroup
+from yelp_kafka.config import KafkaConsumerConfig
+from yelp_kafka.error import PartitionerError
+
+
+class TestAsyncKafkaConsumerGroup(object):
+
+    topics = ['topic1']
+
+    @pytest.yield_fixture
+    def loop(self):
+        loop = asyncio.new_event_loop()
+        yield loop
+        loop.close()
+
+    @pytest.yield_fixture
+    def group(self, loop, cluster):
+        config = KafkaConsumerConfig('my_group', cluster, consumer_timeout_ms=200)
+        with mock.patch(
+            'yelp_kafka.asyncio_consumer_group.KafkaConsumerGroup',
+            autospec=True,
+        ) as mock_group:
+            mock_group.return_value.iter_timeout = 200
+            mock_group.return_value._should_keep_trying.return_value = True
+            yield AsyncKafkaConsumerGroup(self.topics, config, loop=loop)
+
+    def test_start_stop(self, loop, group):
+        loop.run_until_complete(group.start())
+        group.group.start.assert_called_once_with()
+
+        loop.run_until_complete(group.stop())
+        loop.run_until_complete(group.stop())
+        group.group.stop.assert_called_once_with()
+
+    def test_async_iteration(self, loop, group):
+        group.group.poll.side_effect = [
+            None,
+            mock.sentinel.message1,
+            mock.sentinel.message2,
+        ]
+
+        async def consume():
+            messages = []
+            async with group:
+                async for message in group:
+                    messages.append(message)
+                    await group.task_done(message)
+                    if len(messages) == 2:
+                        break
+            return messages
+
+        messages = loop.run_until_complete(consume())
+
+        assert messages == [mock.sentinel.message1, mock.sentinel.message2]
+        assert group.group.poll.call_count == 3
+        assert group.group.task_done.call_args_list == [
+            mock.call(mock.sentinel.message1),
+            mock.call(mock.sentinel.message2),
+        ]
+        group.group.stop.assert_called_once_with()
+
+    def test_next_timeout(self, loop, group):
+        group.group.poll.return_value = None
+        group.group._should_keep_trying.side_effect = [True, True, False]
+
+        with pytest.raises(ConsumerTimeout):
+            loop.run_until_complete(group.next())
+        assert group.group.poll.call_count == 2
+
+    def test_async_iteration_timeout(self, loop, group):
+        group.group.poll.side_effect = [mock.sentinel.message1, None]
+        group.group._should_keep_trying.side_effect = [True, True, False]
+
+        async def consume():
+            messages = []
+            async for message in group:
+                messages.append(message)
+            return messages
+
+        messages = loop.run_until_complete(consume())
+
+        assert messages == [mock.sentinel.message1]
+
+    def test_stop_after_cancelled_start(self, loop, group):
+        started = asyncio.Event(loop=loop)
+
+        def start():
+            loop.call_soon_threadsafe(started.set)
+            time.sleep(0.05)
+
+        group.group.start.side_effect = start
+
+        async def start_and_cancel():
+            task = loop.create_task(group.start())
+            await started.wait()
+            task.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await task
+            await group.stop()
+
+        loop.run_until_complete(start_and_cancel())
+
+        group.group.stop.assert_called_once_with()
+
+    def test_failed_start_stops_group(self, loop, group):
+        group.group.start.side_effect = PartitionerError("Boom!")
+
+        async def consume():
+            async with group:
+                pass
+
+        with pytest.raises(PartitionerError):
+            loop.run_until_complete(consume())
+        group.group.stop.assert_called_once_with()
+
+    def test_commit(self, loop, group):
+        group.group.commit.return_value = True
+
+        assert loop.run_until_complete(group.commit()) is True
+        group.group.commit.assert_called_once_with()
+
+    def test_cancel_releases_group(self, loop, group):
+        group.group.poll.return_value = None
+
+        async def consume():
+            await group.start()
+            async for _ in group:
+                pass
+
+        task = loop.create_task(consume())
+        loop.call_later(0.05, task.cancel)
+        with pytest.raises(asyncio.CancelledError):
+            loop.run_until_complete(task)
+        group.group.stop.assert_called_once_with()
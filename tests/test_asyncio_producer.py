@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+# Copyright 2016 Yelp Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+import asyncio
+
+import mock
+import pytest
+
+from yelp_kafka.asyncio_producer import AsyncYelpKafkaProducer
+from yelp_kafka.error import ProducerClosedError
+from yelp_kafka.error import ProducerQueueFullError
+from yelp_kafka.error import YelpKafkaError
+from yelp_kafka.producer import YelpKafkaSimpleProducer
+
+
+@pytest.yield_fixture
+def loop():
+    loop = asyncio.new_event_loop()
+    yield loop
+    loop.close()
+
+
+@pytest.fixture
+def mock_client():
+    client = mock.Mock()
+    client.get_partition_ids_for_topic.return_value = [0]
+    client.send_produce_request.return_value = [mock.sentinel.response]
+    return client
+
+
+@pytest.yield_fixture
+def mock_producer(mock_client):
+    producer = YelpKafkaSimpleProducer(client=mock_client, report_metrics=False)
+    # Record the calls, the responses come from the producer
+    with mock.patch.object(
+        producer,
+        'send_messages',
+        wraps=producer.send_messages,
+    ):
+        yield producer
+
+
+@pytest.fixture
+def producer(loop, mock_producer):
+    return AsyncYelpKafkaProducer(mock_producer, max_in_flight=4, loop=loop)
+
+
+def test_send(loop, producer, mock_producer):
+    resp = loop.run_until_complete(producer.send('topic1', b'msg1', b'msg2'))
+
+    assert resp == [mock.sentinel.response]
+    mock_producer.send_messages.assert_called_once_with('topic1', b'msg1', b'msg2')
+    assert producer.in_flight == 0
+
+
+def test_concurrent_sends_are_batched(loop, producer, mock_producer):
+    tasks = [
+        loop.create_task(producer.send('topic1', b'msg1')),
+        loop.create_task(producer.send('topic2', b'msg2')),
+        loop.create_task(producer.send('topic1', b'msg3')),
+    ]
+    loop.run_until_complete(asyncio.wait(tasks))
+
+    assert mock_producer.send_messages.call_args_list == [
+        mock.call('topic1', b'msg1', b'msg3'),
+        mock.call('topic2', b'msg2'),
+    ]
+
+
+def test_send_failure(loop, producer, mock_client):
+    mock_client.send_produce_request.side_effect = YelpKafkaError("Boom!")
+
+    with pytest.raises(YelpKafkaError):
+        loop.run_until_complete(producer.send('topic1', b'msg1'))
+    assert producer.in_flight == 0
+
+
+def test_send_nowait(loop, producer, mock_producer):
+    futures = [
+        producer.send_nowait('topic1', b'msg1', b'msg2'),
+        producer.send_nowait('topic1', b'msg3', b'msg4'),
+    ]
+    with pytest.raises(ProducerQueueFullError):
+        producer.send_nowait('topic1', b'msg5')
+
+    loop.run_until_complete(producer.flush())
+
+    assert all(future.done() for future in futures)
+    mock_producer.send_messages.assert_called_once_with(
+        'topic1', b'msg1', b'msg2', b'msg3', b'msg4',
+    )
+    assert producer.in_flight == 0
+
+
+def test_send_waits_for_window(loop, producer, mock_producer):
+    producer.send_nowait('topic1', b'msg1', b'msg2', b'msg3')
+    loop.run_until_complete(producer.send('topic1', b'msg4', b'msg5'))
+
+    assert mock_producer.send_messages.call_args_list == [
+        mock.call('topic1', b'msg1', b'msg2', b'msg3'),
+        mock.call('topic1', b'msg4', b'msg5'),
+    ]
+
+
+def test_send_after_close(loop, producer, mock_producer):
+    loop.run_until_complete(producer.send('topic1', b'msg1'))
+    loop.run_until_complete(producer.close())
+
+    with pytest.raises(ProducerClosedError):
+        loop.run_until_complete(producer.send('topic1', b'msg2'))
+    with pytest.raises(ProducerClosedError):
+        producer.send_nowait('topic1', b'msg2')
+    assert producer.in_flight == 0
+    mock_producer.send_messages.assert_called_once_with('topic1', b'msg1')
+
+
+def test_close_fails_window_waiters(loop, producer, mock_producer):
+    first = producer.send_nowait('topic1', b'msg1', b'msg2', b'msg3')
+    waiting = loop.create_task(producer.send('topic1', b'msg4', b'msg5'))
+
+    loop.run_until_complete(producer.close())
+
+    assert first.result() == [mock.sentinel.response]
+    with pytest.raises(ProducerClosedError):
+        loop.run_until_complete(waiting)
+    assert producer.in_flight == 0
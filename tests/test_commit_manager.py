@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+# Copyright 2016 Yelp Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+import mock
+import pytest
+from kafka import KafkaClient
+from kafka.common import KafkaError
+from kafka.common import OffsetCommitRequest
+
+from yelp_kafka.commit_manager import OffsetCommitManager
+from yelp_kafka.config import KafkaConsumerConfig
+
+
+@pytest.yield_fixture
+def mock_client():
+    with mock.patch(
+        'yelp_kafka.commit_manager.KafkaClient',
+        autospec=True,
+    ) as mock_client:
+        yield mock_client.return_value
+
+
+@pytest.fixture
+def manager(config, mock_client):
+    manager = OffsetCommitManager(config, commit_interval_secs=60, commit_every_n=100)
+    manager.client = mock_client
+    return manager
+
+
+class TestOffsetCommitManager(object):
+
+    def test_mark_keeps_highest_offset(self, manager, mock_client):
+        manager.mark('topic1', 0, 10)
+        manager.mark('topic1', 0, 12)
+        manager.mark('topic1', 0, 11)
+        manager.mark('topic1', 1, 5)
+        manager.mark('topic2', 0, 3)
+
+        assert manager.flush() is True
+        mock_client.send_offset_commit_request.assert_called_once_with(
+            b'test_group',
+            [
+                OffsetCommitRequest(b'topic1', 0, 12, None),
+                OffsetCommitRequest(b'topic1', 1, 5, None),
+                OffsetCommitRequest(b'topic2', 0, 3, None),
+            ],
+        )
+
+    def test_flush_nothing_to_commit(self, manager, mock_client):
+        assert manager.flush() is True
+        assert not mock_client.send_offset_commit_request.called
+
+    def test_flush_dual(self, cluster, mock_client):
+        if getattr(KafkaClient, 'send_offset_commit_request_kafka', None) is None:
+            return
+
+        config = KafkaConsumerConfig('test_group', cluster, offset_storage='dual')
+        manager = OffsetCommitManager(config, commit_interval_secs=60, commit_every_n=100)
+        manager.client = mock_client
+        manager.mark('topic1', 0, 10)
+
+        manager.flush()
+
+        expected = [OffsetCommitRequest(b'topic1', 0, 10, None)]
+        mock_client.send_offset_commit_request.assert_called_once_with(
+            b'test_group', expected,
+        )
+        mock_client.send_offset_commit_request_kafka.assert_called_once_with(
+            b'test_group', expected,
+        )
+
+    def test_flush_failure_retries_on_next_flush(self, manager, mock_client):
+        mock_client.send_offset_commit_request.side_effect = [KafkaError('Boom!'), None]
+        manager.mark('topic1', 0, 10)
+
+        assert manager.flush() is False
+        manager.mark('topic1', 1, 4)
+        assert manager.flush() is True
+
+        assert mock_client.send_offset_commit_request.call_args_list[1] == mock.call(
+            b'test_group',
+            [
+                OffsetCommitRequest(b'topic1', 0, 10, None),
+                OffsetCommitRequest(b'topic1', 1, 4, None),
+            ],
+        )
+
+    def test_background_commit_every_n(self, config, mock_client):
+        manager = OffsetCommitManager(config, commit_interval_secs=60, commit_every_n=2)
+        manager.start()
+        try:
+            manager.mark('topic1', 0, 10)
+            manager.mark('topic1', 0, 11)
+            for _ in range(100):
+                if mock_client.send_offset_commit_request.called:
+                    break
+                manager._stopped.wait(0.01)
+        finally:
+            manager.stop()
+
+        mock_client.send_offset_commit_request.assert_called_once_with(
+            b'test_group',
+            [OffsetCommitRequest(b'topic1', 0, 11, None)],
+        )
+        mock_client.close.assert_called_once_with()
+
+    def test_stop_flushes(self, config, mock_client):
+        manager = OffsetCommitManager(config, commit_interval_secs=60, commit_every_n=100)
+        manager.start()
+        manager.mark('topic1', 0, 10)
+
+        assert manager.stop() is True
+
+        mock_client.send_offset_commit_request.assert_called_once_with(
+            b'test_group',
+            [OffsetCommitRequest(b'topic1', 0, 10, None)],
+        )
@@ -16,6 +16,8 @@ from __future__ import absolute_import
 from __future__ import unicode_literals
 
 import contextlib
+import pickle
+import threading
 from io import StringIO
 
 import mock
@@ -26,10 +28,14 @@ import yelp_kafka.config
 from yelp_kafka.config import AUTO_COMMIT_INTERVAL_SECS
 from yelp_kafka.config import ClusterConfig
 from yelp_kafka.config import get_kafka_discovery_client
+from yelp_kafka.config import get_topology_cache
 from yelp_kafka.config import KafkaConsumerConfig
 from yelp_kafka.config import load_yaml_config
 from yelp_kafka.config import MAX_MESSAGE_SIZE_BYTES
+from yelp_kafka.config import normalize_hosts
+from yelp_kafka.config import TopologyCache
 from yelp_kafka.config import TopologyConfiguration
+from yelp_kafka.config import TopologyWatcher
 from yelp_kafka.error import ConfigurationError
 
 TEST_BASE_KAFKA = '/base/kafka_discovery'
@@ -85,22 +91,25 @@ MOCK_NO_SCRIBE_YAML = {
 
 
 def test_get_kafka_discovery_client(mock_swagger_yaml):
-    if getattr(yelp_kafka.config, 'SmartStackClient', None) is None:
+    try:
+        import bravado_decorators  # noqa
+    except ImportError:
         return
+    get_kafka_discovery_client.cache_clear()
     with mock.patch(
-        "yelp_kafka.config.SmartStackClient",
+        "bravado_decorators.retry.SmartStackClient",
         autospec=True,
     ) as mock_client:
         with mock.patch(
-            "yelp_kafka.config.SwaggerClient",
+            "bravado.client.SwaggerClient",
             autospec=True,
         ) as mock_swagger:
             with mock.patch(
-                'yelp_kafka.config.RequestsClient',
+                'bravado.requests_client.RequestsClient',
                 autospec=True,
             ) as mock_request:
                 with mock.patch(
-                    'yelp_kafka.config.ZipkinClientDecorator',
+                    'swagger_zipkin.zipkin_decorator.ZipkinClientDecorator',
                     autospec=True,
                 ) as mock_zipkin_wrapper:
                     mock_swagger.from_url.return_value = mock.sentinel.swagger_client
@@ -214,16 +223,90 @@ class TestClusterConfig():
         )
         assert cluster_config1 != cluster_config2
 
+    def test___eq___broker_list_and_str(self):
+        cluster_config1 = ClusterConfig(
+            type='some_type',
+            name='some_cluster',
+            broker_list=['kafka-cluster-1:9092', 'kafka-cluster-2:9092'],
+            zookeeper='zookeeper-cluster-1:2181,zookeeper-cluster-2:2181,'
+        )
+        cluster_config2 = ClusterConfig(
+            type='some_type',
+            name='some_cluster',
+            broker_list='kafka-cluster-2:9092,kafka-cluster-1:9092',
+            zookeeper='zookeeper-cluster-2:2181,zookeeper-cluster-1:2181'
+        )
+        assert cluster_config1 == cluster_config2
+        assert hash(cluster_config1) == hash(cluster_config2)
+        assert {cluster_config1: 1}[cluster_config2] == 1
+
+    def test___ne___other_types(self):
+        cluster_config = ClusterConfig(
+            type='some_type',
+            name='some_cluster',
+            broker_list=['kafka-cluster-1:9092'],
+            zookeeper='zookeeper-cluster-1:2181'
+        )
+        assert cluster_config != hash(cluster_config)
+        assert cluster_config != 'some_cluster'
+
+    def test_canonical_key(self):
+        cluster_config = ClusterConfig(
+            type='some_type',
+            name='some_cluster',
+            broker_list='kafka-cluster-2:9092,kafka-cluster-1:9092,',
+            zookeeper='zookeeper-cluster-2:2181,zookeeper-cluster-1:2181'
+        )
+        with mock.patch(
+            'yelp_kafka.config.normalize_hosts',
+            wraps=normalize_hosts,
+        ) as mock_normalize:
+            assert cluster_config.canonical_key == (
+                'some_type',
+                'some_cluster',
+                ('kafka-cluster-1:9092', 'kafka-cluster-2:9092'),
+                ('zookeeper-cluster-1:2181', 'zookeeper-cluster-2:2181'),
+            )
+            hash(cluster_config)
+            cluster_config.canonical_key
+            # Brokers and zookeeper hosts normalized only once
+            assert mock_normalize.call_count == 2
+
+    def test_pickle(self):
+        cluster_config = ClusterConfig(
+            type='some_type',
+            name='some_cluster',
+            broker_list=['kafka-cluster-1:9092'],
+            zookeeper='zookeeper-cluster-1:2181'
+        )
+        hash(cluster_config)
+
+        actual = pickle.loads(pickle.dumps(cluster_config))
+
+        assert not hasattr(actual, '_hash')
+        assert actual == cluster_config
+        assert actual.broker_list == ['kafka-cluster-1:9092']
+
+
+@pytest.yield_fixture
+def mock_signature():
+    get_topology_cache().clear()
+    with mock.patch(
+        'yelp_kafka.config.get_file_signature',
+        return_value=(1, 2, 3.0, 4),
+    ) as m:
+        yield m
+    get_topology_cache().clear()
+
 
 @pytest.yield_fixture
-def mock_yaml():
+def mock_yaml(mock_signature):
     with mock.patch(
         'yelp_kafka.config.load_yaml_config',
         return_value=MOCK_SCRIBE_YAML,
         create=True
     ) as m:
-        with mock.patch('os.path.isfile', return_value=True):
-            yield m
+        yield m
 
 
 def test_load_yaml():
@@ -244,11 +327,10 @@ class TestTopologyConfig(object):
 
     def test_missing_cluster(self):
         with pytest.raises(ConfigurationError):
-            with mock.patch("os.path.isfile", return_value=False):
-                TopologyConfiguration(
-                    cluster_type="wrong_cluster",
-                    kafka_topology_path=TEST_BASE_KAFKA
-                )
+            TopologyConfiguration(
+                cluster_type="wrong_cluster",
+                kafka_topology_path=TEST_BASE_KAFKA
+            )
 
     def test_get_local_cluster(self, mock_yaml):
         topology = TopologyConfiguration(
@@ -343,6 +425,146 @@ class TestTopologyConfig(object):
         topology2 = TopologyConfiguration("no_scribe")
         assert topology1 != topology2
 
+    def test_topology_file_is_cached(self, mock_yaml):
+        topology1 = TopologyConfiguration("scribe")
+        topology2 = TopologyConfiguration("scribe")
+
+        assert mock_yaml.call_count == 1
+        assert (
+            topology1.get_local_cluster() is topology2.get_local_cluster()
+        )
+
+    def test_topology_file_reloaded_on_change(self, mock_yaml, mock_signature):
+        topology1 = TopologyConfiguration("scribe")
+        mock_yaml.return_value = MOCK_NO_SCRIBE_YAML
+        mock_signature.return_value = (1, 2, 5.0, 4)
+        topology2 = TopologyConfiguration("scribe")
+
+        assert mock_yaml.call_count == 2
+        assert topology1.get_scribe_local_prefix() == 'my.prefix.'
+        assert not topology2.get_scribe_local_prefix()
+
+
+class TestTopologyCache(object):
+
+    def test_get_missing_file(self):
+        cache = TopologyCache()
+        with pytest.raises(ConfigurationError):
+            cache.get('/does/not/exist.yaml', 'mykafka')
+
+    def test_get_invalid_file(self, mock_yaml):
+        mock_yaml.return_value = {'clusters': {}}
+        cache = TopologyCache()
+        with pytest.raises(ConfigurationError):
+            cache.get('/base/kafka_discovery/mykafka.yaml', 'mykafka')
+
+    @pytest.mark.parametrize('content', ['clusters: [cluster1', '', 'clusters'])
+    def test_get_invalid_yaml(self, tmpdir, content):
+        path = tmpdir.join('mykafka.yaml')
+        path.write(content)
+        cache = TopologyCache()
+        with pytest.raises(ConfigurationError):
+            cache.get(str(path), 'mykafka')
+
+    def test_clear(self, mock_yaml):
+        cache = TopologyCache()
+        cache.get('/base/kafka_discovery/mykafka.yaml', 'mykafka')
+        cache.clear()
+        cache.get('/base/kafka_discovery/mykafka.yaml', 'mykafka')
+        assert mock_yaml.call_count == 2
+
+
+class TestTopologyWatcher(object):
+
+    def test_check_unchanged(self, mock_yaml):
+        callback = mock.Mock()
+        watcher = TopologyWatcher('mykafka', callback, TEST_BASE_KAFKA)
+        watcher._signature = (1, 2, 3.0, 4)
+
+        assert not watcher.check()
+        assert not callback.called
+
+    def test_check_changed(self, mock_yaml, mock_signature):
+        callback = mock.Mock()
+        watcher = TopologyWatcher('mykafka', callback, TEST_BASE_KAFKA)
+        watcher._signature = (1, 2, 3.0, 4)
+        mock_signature.return_value = (1, 2, 5.0, 4)
+
+        assert watcher.check()
+        topology = callback.call_args[0][0]
+        assert topology.cluster_type == 'mykafka'
+        assert topology.local_config == MOCK_SCRIBE_YAML['local_config']
+        assert not watcher.check()
+        assert callback.call_count == 1
+
+    def test_check_invalid_topology(self, mock_yaml, mock_signature):
+        callback = mock.Mock()
+        watcher = TopologyWatcher('mykafka', callback, TEST_BASE_KAFKA)
+        watcher._signature = (1, 2, 3.0, 4)
+        mock_signature.return_value = (1, 2, 5.0, 4)
+        mock_yaml.return_value = {'clusters': {}}
+
+        assert not watcher.check()
+        assert not callback.called
+        # The new topology is loaded again at the next check
+        mock_yaml.return_value = MOCK_SCRIBE_YAML
+        assert watcher.check()
+        assert callback.call_count == 1
+
+    def test_check_invalid_yaml(self, tmpdir):
+        get_topology_cache().clear()
+        path = tmpdir.join('mykafka.yaml')
+        path.write(MOCK_TOPOLOGY_CONFIG)
+        callback = mock.Mock()
+        watcher = TopologyWatcher('mykafka', callback, str(tmpdir))
+        watcher._signature = (1, 2, 3.0, 4)
+        path.write('clusters: [cluster1\n')
+
+        assert not watcher.check()
+        assert not callback.called
+        path.write(MOCK_TOPOLOGY_CONFIG)
+        assert watcher.check()
+        assert callback.call_count == 1
+        get_topology_cache().clear()
+
+    def test_run_survives_errors(self, mock_yaml):
+        watcher = TopologyWatcher(
+            'mykafka', mock.Mock(), TEST_BASE_KAFKA, interval_secs=0.001,
+        )
+        checked = threading.Event()
+
+        def check():
+            if mock_check.call_count >= 2:
+                checked.set()
+            raise ValueError("Unexpected")
+
+        with mock.patch.object(
+            watcher, 'check', side_effect=check,
+        ) as mock_check:
+            watcher.start()
+            assert checked.wait(5)
+            assert watcher._thread.is_alive()
+            watcher.stop()
+
+    def test_check_missing_file(self, mock_signature):
+        callback = mock.Mock()
+        watcher = TopologyWatcher('mykafka', callback, TEST_BASE_KAFKA)
+        mock_signature.side_effect = OSError
+
+        assert not watcher.check()
+        assert not callback.called
+
+    def test_start_stop(self, mock_yaml):
+        callback = mock.Mock()
+        watcher = TopologyWatcher(
+            'mykafka', callback, TEST_BASE_KAFKA, interval_secs=0.01,
+        )
+        watcher.start()
+        assert watcher._signature == (1, 2, 3.0, 4)
+        watcher.stop()
+        assert watcher._thread is None
+        assert not callback.called
+
 
 class TestKafkaConsumerConfig(object):
 
@@ -516,3 +738,131 @@ class TestKafkaConsumerConfig(object):
         assert kafka_config['auto_commit_interval_ms'] == AUTO_COMMIT_INTERVAL_SECS * 1000
         assert kafka_config['socket_timeout_ms'] == DEFAULT_CONSUMER_CONFIG['socket_timeout_ms']
         assert kafka_config['consumer_timeout_ms'] == 5000
+
+    def test_static_membership_from_environment(self):
+        cluster_config = ClusterConfig(
+            type='mykafka',
+            name='some_cluster',
+            broker_list=['kafka:9092'],
+            zookeeper='zookeeper:2181'
+        )
+        with mock.patch.dict('os.environ', {
+            'YELP_KAFKA_MEMBER_INDEX': '3',
+            'YELP_KAFKA_MEMBER_COUNT': '8',
+        }):
+            config = KafkaConsumerConfig('some_group', cluster_config)
+            assert config.static_member_index == 3
+            assert config.static_member_count == 8
+
+            config = KafkaConsumerConfig(
+                'some_group',
+                cluster_config,
+                static_member_index=1,
+            )
+            assert config.static_member_index == 1
+            assert config.static_member_count == 8
+
+        with mock.patch.dict('os.environ', {'YELP_KAFKA_MEMBER_COUNT': 'many'}):
+            with pytest.raises(ConfigurationError):
+                KafkaConsumerConfig('some_group', cluster_config)
+
+    def test_immutable(self, config):
+        with pytest.raises(AttributeError):
+            config.group_id = b'other_group'
+        with pytest.raises(AttributeError):
+            del config.cluster
+
+    def test_copy(self, config):
+        new_config = config.copy(client_id='other_client', consumer_pool_size=2)
+
+        assert new_config.client_id == 'other_client'
+        assert new_config.consumer_pool_size == 2
+        assert new_config.group_id == config.group_id
+        assert new_config.cluster == config.cluster
+        assert config.client_id == 'test_client_id'
+        assert config.consumer_pool_size == 0
+
+    def test_pickle(self, cluster):
+        config = KafkaConsumerConfig(
+            'some_group',
+            cluster,
+            auto_offset_reset='smallest',
+            metrics_dimensions={'region': 'uswest1'},
+        )
+
+        actual = pickle.loads(pickle.dumps(config))
+
+        assert actual == config
+        assert (
+            actual.get_kafka_consumer_config() ==
+            config.get_kafka_consumer_config()
+        )
+        assert actual.metrics_dimensions == config.metrics_dimensions
+
+    def test_pickle_keeps_environment_settings(self, cluster):
+        with mock.patch.dict('os.environ', {
+            'YELP_KAFKA_MEMBER_INDEX': '1',
+            'YELP_KAFKA_MEMBER_COUNT': '3',
+        }):
+            config = KafkaConsumerConfig('some_group', cluster)
+            data = pickle.dumps(config)
+
+        with mock.patch.dict('os.environ', {
+            'YELP_KAFKA_MEMBER_INDEX': '2',
+            'YELP_KAFKA_MEMBER_COUNT': '4',
+        }):
+            actual = pickle.loads(data)
+
+        assert actual.static_member_index == 1
+        assert actual.static_member_count == 3
+        assert (
+            actual.get_kafka_consumer_config() ==
+            config.get_kafka_consumer_config()
+        )
+        assert actual.get_simple_consumer_args() == config.get_simple_consumer_args()
+
+    def test_derived_configs_computed_once(self, cluster):
+        with mock.patch.object(
+            KafkaConsumerConfig,
+            '_build_kafka_consumer_config',
+            return_value={'group_id': b'some_group'},
+        ) as mock_build:
+            config = KafkaConsumerConfig('some_group', cluster)
+            first = config.get_kafka_consumer_config()
+            first['consumer_timeout_ms'] = 10
+            second = config.get_kafka_consumer_config()
+
+        assert mock_build.call_count == 1
+        assert second == {'group_id': b'some_group'}
+
+    def test_metrics_dimensions(self, cluster):
+        dimensions = {'region': 'uswest1'}
+        config = KafkaConsumerConfig(
+            'some_group',
+            cluster,
+            metrics_dimensions=dimensions,
+        )
+
+        assert config.metrics_dimensions == {
+            'region': 'uswest1',
+            'group_id': b'some_group',
+            'cluster_name': 'mycluster',
+            'cluster_type': 'cluster_type',
+        }
+        assert dimensions == {'region': 'uswest1'}
+
+    @pytest.mark.parametrize('settings', [
+        {'consumer_capacity': 0},
+        {'concurrent_workers': -1},
+        {'partitioner_cooldown': -1},
+        {'consumer_pool_size': -2},
+        {'pre_rebalance_callback': 'not_callable'},
+        {'offset_storage': 'redis'},
+        {'metrics_dimensions': ['region']},
+        {'static_member_index': 2, 'static_member_count': 2},
+        {'static_member_index': 'first'},
+    ])
+    def test_invalid_settings(self, cluster, settings):
+        with mock.patch.dict('os.environ', clear=True):
+            with pytest.raises(ConfigurationError):
+                KafkaConsumerConfig('some_group', cluster, **settings)
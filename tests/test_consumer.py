@@ -16,6 +16,8 @@ from __future__ import absolute_import
 from __future__ import unicode_literals
 
 import contextlib
+import sys
+import threading
 
 import mock
 import pytest
@@ -25,9 +27,12 @@ from kafka.common import OffsetCommitRequest
 from setproctitle import getproctitle
 
 from yelp_kafka.config import KafkaConsumerConfig
+from yelp_kafka.consumer import KafkaConcurrentConsumerBase
 from yelp_kafka.consumer import KafkaConsumerBase
 from yelp_kafka.consumer import KafkaSimpleConsumer
 from yelp_kafka.consumer import Message
+from yelp_kafka.dispatcher import KeyedDispatcher
+from yelp_kafka.dispatcher import ThreadPoolDispatcher
 from yelp_kafka.error import ProcessMessageError
 
 
@@ -103,6 +108,17 @@ class TestKafkaSimpleConsumer(object):
                 mock_commit.assert_called_once_with(consumer)
                 mock_client.return_value.close.assert_called_once_with()
 
+    def test_connect_metrics_recorder(self, config):
+        with mock_kafka() as (mock_client, _):
+            consumer = KafkaSimpleConsumer('test_topic', config)
+            consumer.metrics_recorder = mock.Mock()
+            consumer.connect()
+
+            assert (
+                mock_client.return_value.metrics_responder ==
+                consumer.metrics_recorder.record_kafka_metric
+            )
+
     def test_close_no_commit(self, cluster):
         config = KafkaConsumerConfig(
             cluster=cluster,
@@ -162,7 +178,7 @@ class TestKafkaSimpleConsumer(object):
             return
 
         with mock_kafka() as (mock_client, mock_consumer):
-            config._config['offset_storage'] = 'zookeeper'
+            config = config.copy(offset_storage='zookeeper')
             consumer = KafkaSimpleConsumer('test_topic', config)
             consumer.connect()
 
@@ -182,7 +198,7 @@ class TestKafkaSimpleConsumer(object):
             return
 
         with mock_kafka() as (mock_client, mock_consumer):
-            config._config['offset_storage'] = 'kafka'
+            config = config.copy(offset_storage='kafka')
             consumer = KafkaSimpleConsumer('test_topic', config)
             consumer.connect()
 
@@ -203,7 +219,7 @@ class TestKafkaSimpleConsumer(object):
             return
 
         with mock_kafka() as (mock_client, mock_consumer):
-            config._config['offset_storage'] = 'dual'
+            config = config.copy(offset_storage='dual')
             consumer = KafkaSimpleConsumer('test_topic', config)
             consumer.connect()
 
@@ -235,6 +251,33 @@ class TestKafkaSimpleConsumer(object):
             )
             assert actual is False
 
+    def test_commit_message_async(self, cluster):
+        config = KafkaConsumerConfig(
+            cluster=cluster,
+            group_id='test_group',
+            async_commit=True,
+        )
+        with mock_kafka() as (mock_client, mock_consumer):
+            with mock.patch(
+                'yelp_kafka.consumer.OffsetCommitManager',
+                autospec=True,
+            ) as mock_manager:
+                consumer = KafkaSimpleConsumer('test_topic', config)
+                consumer.connect()
+
+                actual = consumer.commit_message(
+                    Message(0, 100, 'mykey', 'myvalue'),
+                )
+
+                assert actual is True
+                assert not mock_client.return_value.send_offset_commit_request.called
+                mock_manager.return_value.mark.assert_called_once_with(
+                    'test_topic'.encode(), 0, 100,
+                )
+
+                consumer.close()
+                mock_manager.return_value.stop.assert_called_once_with()
+
 
 class TestKafkaConsumer(object):
 
@@ -302,3 +345,134 @@ class TestKafkaConsumer(object):
                     messages=['1', '2', '3', '4', '5'],
                 )
             mock_setproctitle.assert_called_with(expected_name)
+
+
+class TestKafkaConcurrentConsumer(object):
+
+    @pytest.fixture
+    def concurrent_config(self, cluster):
+        return KafkaConsumerConfig(
+            cluster=cluster,
+            group_id='test_group',
+            client_id='test_client_id',
+            concurrent_workers=4,
+            max_in_flight_messages=2,
+        )
+
+    def run_consumer(self, consumer, messages):
+        def iter_messages():
+            for message in messages:
+                yield message
+            consumer.terminate()
+
+        with mock.patch.object(
+            KafkaConcurrentConsumerBase,
+            '__iter__',
+            side_effect=iter_messages,
+        ):
+            consumer.run()
+
+    def test_connect_disables_auto_commit(self, concurrent_config):
+        with mock_kafka() as (_, mock_consumer):
+            consumer = KafkaConcurrentConsumerBase('test_topic', concurrent_config)
+            consumer.connect()
+            assert mock_consumer.call_args[1]['auto_commit'] is False
+
+    def test_create_dispatcher(self, concurrent_config):
+        consumer = KafkaConcurrentConsumerBase('test_topic', concurrent_config)
+        assert type(consumer._create_dispatcher()) is ThreadPoolDispatcher
+
+        concurrent_config = concurrent_config.copy(dispatch_by_key=True)
+        consumer = KafkaConcurrentConsumerBase('test_topic', concurrent_config)
+        dispatcher = consumer._create_dispatcher()
+        assert isinstance(dispatcher, KeyedDispatcher)
+        assert dispatcher.workers == 4
+
+    def test_dispatch_waits_for_in_flight_slot(self, concurrent_config):
+        consumer = KafkaConcurrentConsumerBase('test_topic', concurrent_config)
+        consumer.dispatcher = mock.Mock()
+        messages = [Message(0, offset, 'key', 'value') for offset in range(3)]
+        consumer._dispatch(messages[0])
+        consumer._dispatch(messages[1])
+
+        thread = threading.Thread(target=consumer._dispatch, args=(messages[2],))
+        thread.start()
+        thread.join(0.1)
+        # The window of 2 messages is full
+        assert thread.is_alive()
+
+        consumer._on_done(messages[0], None)
+        thread.join(1)
+
+        assert not thread.is_alive()
+        assert consumer.dispatcher.dispatch.call_args_list == [
+            mock.call(message) for message in messages
+        ]
+
+    def test_dispatch_waiting_raises_process_error(self, concurrent_config):
+        consumer = KafkaConcurrentConsumerBase('test_topic', concurrent_config)
+        consumer.dispatcher = mock.Mock()
+        messages = [Message(0, offset, 'key', 'value') for offset in range(3)]
+        consumer._dispatch(messages[0])
+        consumer._dispatch(messages[1])
+        errors = []
+
+        def dispatch():
+            try:
+                consumer._dispatch(messages[2])
+            except ProcessMessageError as e:
+                errors.append(e)
+
+        thread = threading.Thread(target=dispatch)
+        thread.start()
+        try:
+            raise Exception('Boom!')
+        except Exception:
+            consumer._on_done(messages[0], sys.exc_info())
+        thread.join(1)
+
+        assert not thread.is_alive()
+        assert len(errors) == 1
+        assert consumer.dispatcher.dispatch.call_count == 2
+
+    def test_run_commits_processed_offsets(self, concurrent_config):
+        messages = [
+            Message(0, 10, 'key1', 'value1'),
+            Message(1, 20, 'key2', 'value2'),
+            Message(0, 11, 'key3', 'value3'),
+        ]
+        with mock_kafka() as (mock_client, _):
+            consumer = KafkaConcurrentConsumerBase('test_topic', concurrent_config)
+            consumer.process = mock.Mock()
+            self.run_consumer(consumer, messages)
+
+            assert sorted(
+                call[0][0] for call in consumer.process.call_args_list
+            ) == sorted(messages)
+            mock_client.return_value.send_offset_commit_request \
+                .assert_called_once_with(
+                    'test_group'.encode(),
+                    [
+                        OffsetCommitRequest('test_topic'.encode(), 0, 12, None),
+                        OffsetCommitRequest('test_topic'.encode(), 1, 21, None),
+                    ],
+                )
+
+    def test_run_does_not_commit_unprocessed_messages(self, concurrent_config):
+        messages = [
+            Message(0, 10, 'key1', 'value1'),
+            Message(0, 11, 'key2', 'value2'),
+        ]
+
+        def process(message):
+            if message.offset == 10:
+                raise Exception('Boom!')
+
+        with mock_kafka() as (mock_client, _):
+            consumer = KafkaConcurrentConsumerBase('test_topic', concurrent_config)
+            consumer.process = process
+            with pytest.raises(ProcessMessageError):
+                self.run_consumer(consumer, messages)
+
+            assert consumer.offset_tracker.committable_offsets() == {}
+            assert not mock_client.return_value.send_offset_commit_request.called
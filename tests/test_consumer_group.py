@@ -16,6 +16,7 @@ from __future__ import absolute_import
 from __future__ import unicode_literals
 
 import os
+import re
 import time
 from multiprocessing import Process
 
@@ -23,6 +24,8 @@ import mock
 import pytest
 from kafka.common import ConsumerTimeout
 from kafka.common import KafkaUnavailableError
+from kafka.consumer.kafka import OffsetsStruct
+from kafka.util import kafka_bytestring
 
 from yelp_kafka.config import KafkaConsumerConfig
 from yelp_kafka.consumer_group import ConsumerGroup
@@ -32,6 +35,23 @@ from yelp_kafka.error import ConsumerGroupError
 from yelp_kafka.error import PartitionerError
 from yelp_kafka.error import PartitionerZookeeperError
 from yelp_kafka.error import ProcessMessageError
+from yelp_kafka.metadata_cache import TopicMetadataCache
+from yelp_kafka.metrics_responder import MetricsResponder
+
+
+def mock_kafka_consumer(fetch=None, task_done=None):
+    """Mocked KafkaConsumer with its offsets"""
+    consumer = mock.Mock(_offsets=OffsetsStruct(
+        fetch=fetch or {},
+        commit={},
+        highwater={},
+        task_done=task_done or {},
+    ))
+    consumer.offsets.side_effect = lambda: {
+        'fetch': dict(consumer._offsets.fetch),
+        'task_done': dict(consumer._offsets.task_done),
+    }
+    return consumer
 
 
 @mock.patch('yelp_kafka.consumer_group.Partitioner', autospec=True)
@@ -103,6 +123,21 @@ class TestConsumerGroup(object):
         group._release(partitions)
         mock_consumer.return_value.close.assert_called_once_with()
 
+    @mock.patch('yelp_kafka.consumer_group.KafkaSimpleConsumer', autospec=True)
+    def test__release_kept_partitions(self, mock_consumer, _, config):
+        group = ConsumerGroup(self.topic, config, mock.Mock())
+        group._acquire({self.topic: [0, 1]})
+
+        group._release({self.topic: [1]})
+
+        mock_consumer.return_value.close.assert_called_once_with()
+        assert mock_consumer.call_args[0][2] == [0]
+        assert group.consumer is mock_consumer.return_value
+
+        group._acquire({self.topic: [2]})
+
+        assert mock_consumer.call_args[0][2] == [0, 2]
+
 
 class TestKafkaConsumerGroup(object):
 
@@ -117,6 +152,46 @@ class TestKafkaConsumerGroup(object):
         with pytest.raises(AssertionError):
             KafkaConsumerGroup(self.topic, None)
 
+    @mock.patch('yelp_kafka.consumer_group.Partitioner', autospec=True)
+    def test___init__topic_pattern(self, mock_partitioner, cluster):
+        config = KafkaConsumerConfig(self.group, cluster)
+        pattern = re.compile(r'scribe\..*')
+
+        KafkaConsumerGroup(pattern, config)
+
+        assert mock_partitioner.call_args[0][1] is pattern
+
+    @mock.patch('yelp_kafka.consumer_group.KafkaConsumer', autospec=True)
+    @mock.patch('yelp_kafka.partitioner.KafkaClient', autospec=True)
+    def test_static_member_without_partitions(
+        self,
+        _,
+        mock_consumer,
+        config,
+    ):
+        # More static members than partitions
+        config = config.copy(
+            rebalance_protocol='static',
+            static_member_index=2,
+            static_member_count=3,
+        )
+        group = KafkaConsumerGroup([self.topic], config)
+        group.partitioner.metadata_cache = TopicMetadataCache()
+        with mock.patch(
+            'yelp_kafka.metadata_cache.get_kafka_topics_partitions',
+            autospec=True,
+            return_value={kafka_bytestring(self.topic): [0, 1]},
+        ):
+            group.start()
+            with mock.patch('yelp_kafka.consumer_group.time.sleep') as mock_sleep:
+                assert group.poll() is None
+            assert mock_sleep.called
+            assert group.commit() is None
+            group.stop()
+
+        assert group.consumer is None
+        assert not mock_consumer.called
+
     def test__should_keep_trying_no_timeout(self, cluster):
         config = KafkaConsumerConfig(
             self.group,
@@ -214,7 +289,7 @@ class TestKafkaConsumerGroup(object):
         )
         consumer = KafkaConsumerGroup([], config)
 
-        consumer.consumer = mock.Mock()
+        consumer.consumer = mock_kafka_consumer()
         consumer._acquire(example_partitions)
 
         consumer.consumer.set_topic_partitions.assert_called_once_with(example_partitions)
@@ -242,7 +317,7 @@ class TestKafkaConsumerGroup(object):
         )
         consumer = KafkaConsumerGroup([], config)
 
-        mock_consumer = mock.Mock()
+        mock_consumer = mock_kafka_consumer()
         consumer.consumer = mock_consumer
         consumer._release(example_partitions)
 
@@ -250,6 +325,45 @@ class TestKafkaConsumerGroup(object):
         mock_consumer.set_topic_partitions.assert_called_once_with({})
         mock_pre_rebalance_cb.assert_called_once_with(example_partitions)
 
+    def test__release_kept_partitions(self, cluster):
+        config = KafkaConsumerConfig(self.group, cluster)
+        consumer = KafkaConsumerGroup([], config)
+        mock_consumer = mock_kafka_consumer(
+            fetch={(b'topic1', 0): 10, (b'topic1', 1): 20},
+            task_done={(b'topic1', 0): 9, (b'topic1', 1): 19},
+        )
+
+        def set_topic_partitions(*topics):
+            # KafkaConsumer resets the offsets
+            mock_consumer._offsets = OffsetsStruct(
+                fetch={}, commit={}, highwater={}, task_done={},
+            )
+
+        mock_consumer.set_topic_partitions.side_effect = set_topic_partitions
+        consumer.consumer = mock_consumer
+
+        consumer._release({'topic1': [1]})
+
+        # The kept partition resumes from its fetch offset
+        mock_consumer.set_topic_partitions.assert_called_once_with(
+            {(b'topic1', 0): 10},
+            {},
+        )
+        assert mock_consumer._offsets.task_done == {(b'topic1', 0): 9}
+
+    def test__acquire_kept_partitions(self, cluster):
+        config = KafkaConsumerConfig(self.group, cluster)
+        consumer = KafkaConsumerGroup([], config)
+        mock_consumer = mock_kafka_consumer(fetch={(b'topic1', 0): 10})
+        consumer.consumer = mock_consumer
+
+        consumer._acquire({'topic2': [0]})
+
+        mock_consumer.set_topic_partitions.assert_called_once_with(
+            {(b'topic1', 0): 10},
+            {'topic2': [0]},
+        )
+
     def test__release_retry(self, cluster):
         config = KafkaConsumerConfig(
             self.group,
@@ -258,7 +372,7 @@ class TestKafkaConsumerGroup(object):
         )
         consumer = KafkaConsumerGroup([], config)
 
-        mock_consumer = mock.Mock()
+        mock_consumer = mock_kafka_consumer()
         mock_consumer.set_topic_partitions.side_effect = KafkaUnavailableError
         consumer.consumer = mock_consumer
 
@@ -275,12 +389,12 @@ class TestMultiprocessingConsumerGroup(object):
     @mock.patch('yelp_kafka.consumer_group.Partitioner', autospec=True)
     def group(
         self, _,
+        cluster,
         mock_pre_rebalance_cb,
         mock_post_rebalance_cb
     ):
         config = KafkaConsumerConfig(
-            cluster={'broker_list': ['test_broker:9292'],
-                     'zookeeper': 'zookeeper_uri1:2181,zookeeper_uri2:2181'},
+            cluster=cluster,
             group_id='test_group',
             client_id='test_client_id',
             max_termination_timeout_secs=0.1,
@@ -344,6 +458,24 @@ class TestMultiprocessingConsumerGroup(object):
         assert not group.get_consumers()
         mock_pre_rebalance_cb.assert_called_once_with(None)
 
+    def test_release_partitions(self, group, mock_pre_rebalance_cb):
+        released = mock.Mock(topic=b'topic1', partitions=[0])
+        kept = mock.Mock(topic=b'topic1', partitions=[1])
+        released_proc = mock.Mock(spec=Process, **{'is_alive.return_value': False})
+        kept_proc = mock.Mock(spec=Process, **{'is_alive.return_value': True})
+        group.consumer_procs = {released_proc: released, kept_proc: kept}
+        group.metrics_slots = {released_proc: None, kept_proc: None}
+
+        with mock.patch.object(os, 'kill', autospec=True) as mock_kill:
+            group.release({'topic1': [0]})
+
+        assert not mock_kill.called
+        released.terminate.assert_called_once_with()
+        assert not kept.terminate.called
+        assert group.consumer_procs == {kept_proc: kept}
+        assert group.get_consumers() == [kept]
+        mock_pre_rebalance_cb.assert_called_once_with({'topic1': [0]})
+
     def test_release_and_kill_unresponsive_consumer(self, group):
         consumer = mock.Mock()
         args = {'is_alive.return_value': True}
@@ -377,6 +509,131 @@ class TestMultiprocessingConsumerGroup(object):
         assert mock_new_proc in group.consumer_procs
         mock_start.assert_called_once_with(group, consumer1)
 
+    @mock.patch('yelp_kafka.consumer_group.Process', autospec=True)
+    def test_acquire_metrics(self, mock_process, group):
+        mock_process.side_effect = lambda **kwargs: mock.Mock(spec=Process)
+        group.shared_metrics = mock.Mock()
+        group.shared_metrics.acquire_slot.side_effect = [0, 1]
+
+        group.acquire({'topic1': [0, 1]})
+
+        assert sorted(group.metrics_slots.values()) == [0, 1]
+        assert group.consumer_factory.return_value.metrics_recorder == (
+            group.shared_metrics.get_recorder.return_value
+        )
+
+        with mock.patch.object(os, 'kill', autospec=True):
+            for proc in group.consumer_procs:
+                proc.is_alive.return_value = False
+            group.release(None)
+
+        assert sorted(
+            call[0][0]
+            for call in group.shared_metrics.release_slot.call_args_list
+        ) == [0, 1]
+        assert group.metrics_slots == {}
+
+    def test_monitor_metrics_slot(self, group):
+        dead_proc = mock.Mock(spec=Process, **{'is_alive.return_value': False})
+        group.consumer_procs = {dead_proc: mock.Mock()}
+        group.metrics_slots = {dead_proc: 3}
+        with mock.patch.object(
+            MultiprocessingConsumerGroup, 'start_consumer', autospec=True
+        ) as mock_start:
+            group.monitor()
+
+        assert group.metrics_slots == {mock_start.return_value: 3}
+
+    @mock.patch('yelp_kafka.consumer_group.SharedMetricsReporter', autospec=True)
+    @mock.patch('yelp_kafka.consumer_group.SharedMetrics', autospec=True)
+    def test_start_group_metrics(self, mock_shared, mock_reporter, config):
+        with mock.patch('yelp_kafka.consumer_group.Partitioner', autospec=True):
+            group = MultiprocessingConsumerGroup(
+                self.topics,
+                config,
+                mock.Mock(),
+                metrics_responder=mock.Mock(spec=MetricsResponder),
+            )
+        group.termination_flag = None
+
+        with mock.patch.object(group, 'monitor', side_effect=[None, ValueError]):
+            with pytest.raises(ValueError):
+                group.start_group(refresh_timeout=0)
+
+        mock_reporter.assert_called_once_with(
+            mock_shared.return_value,
+            group.metrics_responder,
+            'yelp_kafka.MultiprocessingConsumerGroup',
+            config.metrics_dimensions,
+        )
+        # Once in the loop and once when the group stops
+        assert mock_reporter.return_value.flush.call_count == 2
+        mock_shared.return_value.close.assert_called_once_with()
+        assert group.shared_metrics is None
+
+    @mock.patch('yelp_kafka.consumer_group.ConsumerWorkerPool', autospec=True)
+    def test_start_group_worker_pool(self, mock_pool, group):
+        group.config = group.config.copy(consumer_pool_size=4)
+        group.termination_flag = None
+
+        with mock.patch.object(group, 'monitor', side_effect=ValueError):
+            with pytest.raises(ValueError):
+                group.start_group(refresh_timeout=0)
+
+        mock_pool.assert_called_once_with(
+            group.consumer_factory,
+            group.config,
+            4,
+            None,
+        )
+        mock_pool.return_value.start.assert_called_once_with()
+        mock_pool.return_value.stop.assert_called_once_with(0.1)
+        assert group.worker_pool is None
+
+    @mock.patch('yelp_kafka.consumer_group.Process', autospec=True)
+    def test_acquire_worker_pool(self, mock_process, group):
+        group.worker_pool = mock.Mock(workers=[
+            mock.Mock(busy=True), mock.Mock(busy=False),
+        ])
+
+        group.acquire({'topic1': [0, 1]})
+
+        group.worker_pool.assign.assert_has_calls([
+            mock.call('topic1', [0]),
+            mock.call('topic1', [1]),
+        ])
+        assert group.get_consumers() == group.worker_pool.workers[:1]
+        assert not mock_process.called
+        assert not group.consumer_factory.called
+
+    def test_release_worker_pool(self, group, mock_pre_rebalance_cb):
+        group.worker_pool = mock.Mock(workers=[mock.Mock(busy=False)])
+        group.consumers = [mock.Mock()]
+
+        group.release(None)
+
+        group.worker_pool.release.assert_called_once_with(0.1, None)
+        assert group.get_consumers() is None
+        mock_pre_rebalance_cb.assert_called_once_with(None)
+
+    def test_release_partitions_worker_pool(self, group):
+        kept = mock.Mock(busy=True)
+        group.worker_pool = mock.Mock(workers=[kept, mock.Mock(busy=False)])
+
+        group.release({'topic1': [0]})
+
+        group.worker_pool.release.assert_called_once_with(0.1, {'topic1': [0]})
+        assert group.get_consumers() == [kept]
+
+    def test_monitor_worker_pool(self, group):
+        new_worker = mock.Mock(busy=True)
+        group.worker_pool = mock.Mock(workers=[new_worker])
+        group.worker_pool.monitor.return_value = [mock.Mock()]
+
+        group.monitor()
+
+        assert group.get_consumers() == [new_worker]
+
     def test_get_consumers(self, group):
         group.consumers = [mock.Mock(), mock.Mock]
         actual = group.get_consumers()
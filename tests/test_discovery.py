@@ -98,6 +98,12 @@ def mock_http_err():
     )
 
 
+@pytest.fixture(autouse=True)
+def clear_region_cache():
+    discovery._get_local_region.cache_clear()
+    discovery._get_local_superregion.cache_clear()
+
+
 @pytest.yield_fixture
 def mock_kafka_discovery_client():
     with mock.patch(
@@ -124,6 +130,9 @@ def test_get_local_region():
         actual = discovery._get_local_region()
         mock_open.assert_called_once_with(discovery.REGION_FILE_PATH, 'r')
         assert actual == 'region1'
+        # The region file is read only once
+        assert discovery._get_local_region() == 'region1'
+        assert mock_open.call_count == 1
 
 
 def test_get_local_superregion():
@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+# Copyright 2016 Yelp Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+import threading
+
+import mock
+
+from yelp_kafka.consumer import Message
+from yelp_kafka.dispatcher import KeyedDispatcher
+from yelp_kafka.dispatcher import ThreadPoolDispatcher
+
+
+class TestThreadPoolDispatcher(object):
+
+    def test_dispatch(self):
+        on_done = mock.Mock()
+        dispatcher = ThreadPoolDispatcher(4, lambda message: None, on_done)
+        messages = [Message(0, offset, None, 'value') for offset in range(10)]
+
+        dispatcher.start()
+        for message in messages:
+            dispatcher.dispatch(message)
+        dispatcher.stop()
+
+        assert sorted(
+            call[0] for call in on_done.call_args_list
+        ) == sorted((message, None) for message in messages)
+
+    def test_dispatch_process_error(self):
+        on_done = mock.Mock()
+        error = ValueError('Boom!')
+        dispatcher = ThreadPoolDispatcher(2, mock.Mock(side_effect=error), on_done)
+        message = Message(0, 1, None, 'value')
+
+        dispatcher.start()
+        dispatcher.dispatch(message)
+        dispatcher.stop()
+
+        (done_message, exc_info), _ = on_done.call_args
+        assert done_message == message
+        assert exc_info[1] is error
+
+
+class TestKeyedDispatcher(object):
+
+    def test_get_worker(self):
+        dispatcher = KeyedDispatcher(8, mock.Mock(), mock.Mock())
+
+        assert dispatcher.get_worker(b'key1') == dispatcher.get_worker('key1')
+        assert 0 <= dispatcher.get_worker(b'key1') < 8
+
+    def test_dispatch_preserves_key_order(self):
+        processed = {}
+        lock = threading.Lock()
+
+        def process(message):
+            with lock:
+                processed.setdefault(message.key, []).append(message.offset)
+
+        dispatcher = KeyedDispatcher(4, process, mock.Mock())
+        keys = [b'key1', b'key2', b'key3']
+        dispatcher.start()
+        for offset in range(300):
+            dispatcher.dispatch(Message(0, offset, keys[offset % 3], 'value'))
+        dispatcher.stop()
+
+        for i, key in enumerate(keys):
+            assert processed[key] == list(range(i, 300, 3))
+
+    def test_dispatch_no_key_round_robin(self):
+        dispatcher = KeyedDispatcher(3, mock.Mock(), mock.Mock())
+        queues = [
+            dispatcher._queue_for(Message(0, offset, None, 'value'))
+            for offset in range(6)
+        ]
+
+        assert queues[:3] == dispatcher._queues
+        assert queues[3:] == dispatcher._queues
@@ -0,0 +1,215 @@
+# -*- coding: utf-8 -*-
+# Copyright 2016 Yelp Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+import mock
+import pytest
+from kazoo.exceptions import LockTimeout
+from kazoo.handlers.threading import SequentialThreadingHandler
+from kazoo.protocol.states import KazooState
+from kazoo.recipe.partitioner import PartitionState
+
+from yelp_kafka.incremental_partitioner import IncrementalSetPartitioner
+
+
+class TestIncrementalSetPartitioner(object):
+
+    items = ['topic1-0', 'topic1-1', 'topic1-2', 'topic1-3']
+
+    @pytest.fixture
+    def client(self):
+        client = mock.Mock()
+        client.handler = SequentialThreadingHandler()
+        client.ShallowParty.return_value.__iter__ = mock.Mock(
+            side_effect=lambda: iter(self.members),
+        )
+        client.Lock.side_effect = lambda path, identifier: mock.Mock(path=path)
+        return client
+
+    @pytest.yield_fixture
+    def mock_watch(self):
+        with mock.patch(
+            'yelp_kafka.incremental_partitioner.PatientChildrenWatch',
+            autospec=True,
+        ) as mock_watch:
+            yield mock_watch
+
+    @pytest.fixture
+    def partitioner(self, client, mock_watch):
+        self.members = ['member1']
+        return IncrementalSetPartitioner(
+            client,
+            '/group',
+            self.items,
+            identifier='member1',
+        )
+
+    def allocate(self, partitioner, children_async=None):
+        result = mock.Mock(exception=None)
+        result.get.return_value = (
+            self.members,
+            children_async or mock.Mock(),
+        )
+        partitioner._allocate_transition(result)
+
+    def lock_paths(self, partitioner):
+        return sorted(lock.path for lock in partitioner._locks.values())
+
+    def test_join(self, client, partitioner, mock_watch):
+        client.ShallowParty.assert_called_once_with(
+            '/group/party',
+            identifier='member1',
+        )
+        client.ShallowParty.return_value.join.assert_called_once_with()
+        mock_watch.assert_called_once_with(client, '/group/party', 1)
+        assert partitioner.allocating
+
+    def test_allocate(self, partitioner):
+        self.allocate(partitioner)
+
+        assert partitioner.acquired
+        assert list(partitioner) == self.items
+        assert self.lock_paths(partitioner) == [
+            '/group/locks/' + item for item in self.items
+        ]
+
+    def test_release_set_only_moving_items(self, client, partitioner, mock_watch):
+        self.allocate(partitioner)
+        locks = dict(partitioner._locks)
+        partitioner.state = PartitionState.RELEASE
+
+        self.members = ['member1', 'member2']
+        partitioner.release_set()
+
+        assert partitioner.allocating
+        # member2 gets the items 1 and 3
+        assert sorted(partitioner._locks) == ['topic1-0', 'topic1-2']
+        locks['topic1-1'].release.assert_called_once_with()
+        locks['topic1-3'].release.assert_called_once_with()
+        assert not locks['topic1-0'].release.called
+        assert mock_watch.call_count == 2
+
+        client.Lock.reset_mock()
+        self.allocate(partitioner)
+        assert partitioner.acquired
+        assert list(partitioner) == ['topic1-0', 'topic1-2']
+        # The kept locks are not acquired again
+        assert not client.Lock.called
+
+    def test_release_set_kept_items(self, client, partitioner, mock_watch):
+        self.allocate(partitioner)
+        locks = dict(partitioner._locks)
+        partitioner.state = PartitionState.RELEASE
+
+        self.members = ['member1', 'member2']
+        keep = partitioner.get_kept_items()
+        assert keep == frozenset(['topic1-0', 'topic1-2'])
+        # The party changes again, the items computed before are kept
+        self.members = ['member1']
+        partitioner.release_set(keep)
+
+        assert sorted(partitioner._locks) == ['topic1-0', 'topic1-2']
+        locks['topic1-1'].release.assert_called_once_with()
+        locks['topic1-3'].release.assert_called_once_with()
+
+    def test_get_kept_items_not_in_party(self, partitioner):
+        self.allocate(partitioner)
+        self.members = ['member2']
+
+        assert partitioner.get_kept_items() == frozenset()
+
+    def test_allocate_gains_items(self, client, partitioner):
+        self.members = ['member1', 'member2']
+        self.allocate(partitioner)
+        assert list(partitioner) == ['topic1-0', 'topic1-2']
+
+        partitioner.state = PartitionState.RELEASE
+        self.members = ['member1']
+        partitioner.release_set()
+        assert sorted(partitioner._locks) == ['topic1-0', 'topic1-2']
+
+        self.allocate(partitioner)
+        assert list(partitioner) == self.items
+        assert sorted(
+            call[0][0] for call in client.Lock.call_args_list[2:]
+        ) == ['/group/locks/topic1-1', '/group/locks/topic1-3']
+
+    def test_allocate_party_change_keeps_locks(self, client, partitioner, mock_watch):
+        children_async = mock.Mock()
+
+        def party_changed(timeout):
+            # The party changes while waiting for the second lock
+            party_callback = children_async.rawlink.call_args[0][0]
+            party_callback(None)
+            raise LockTimeout()
+
+        client.Lock.side_effect = [
+            mock.Mock(),
+            mock.Mock(**{'acquire.side_effect': party_changed}),
+        ]
+
+        self.allocate(partitioner, children_async)
+
+        assert partitioner.allocating
+        assert list(partitioner._locks) == ['topic1-0']
+        assert mock_watch.call_count == 2
+
+    def test_update_set(self, client, partitioner):
+        self.allocate(partitioner)
+        party = client.ShallowParty.return_value
+
+        partitioner.update_set(self.items + ['topic2-0'])
+
+        assert partitioner.release
+        party.leave.assert_called_once_with()
+        assert party.join.call_count == 2
+
+        partitioner.release_set()
+        self.allocate(partitioner)
+        assert list(partitioner) == self.items + ['topic2-0']
+
+    def test_update_set_no_notify(self, client, partitioner):
+        self.allocate(partitioner)
+        party = client.ShallowParty.return_value
+
+        partitioner.update_set(self.items + ['topic2-0'], notify=False)
+
+        assert partitioner.acquired
+        assert not party.leave.called
+        assert party.join.call_count == 1
+        assert partitioner._set == self.items + ['topic2-0']
+
+    def test_finish(self, client, partitioner):
+        self.allocate(partitioner)
+        locks = list(partitioner._locks.values())
+        client.ShallowParty.return_value.participating = True
+
+        partitioner.finish()
+
+        assert partitioner.failed
+        assert partitioner._locks == {}
+        assert all(lock.release.called for lock in locks)
+        client.ShallowParty.return_value.leave.assert_called_once_with()
+        client.remove_listener.assert_called_once_with(
+            partitioner._establish_sessionwatch,
+        )
+
+    def test_session_suspended(self, partitioner):
+        self.allocate(partitioner)
+
+        partitioner._establish_sessionwatch(KazooState.SUSPENDED)
+
+        assert partitioner.release
@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+# Copyright 2016 Yelp Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+import mock
+import pytest
+from kazoo.protocol.states import KazooState
+
+from yelp_kafka.kazoo_session import KazooSessionManager
+
+
+RETRY_POLICY = {'max_tries': 1}
+
+
+@mock.patch('kazoo.client.KazooClient', autospec=True)
+class TestKazooSessionManager(object):
+
+    @pytest.fixture
+    def manager(self):
+        return KazooSessionManager()
+
+    def test_acquire_same_hosts(self, mock_kazoo, manager):
+        client = manager.acquire('zk:2181', RETRY_POLICY)
+
+        assert manager.acquire('zk:2181', RETRY_POLICY) is client
+        assert mock_kazoo.call_count == 1
+        assert len(manager) == 1
+
+    def test_acquire_different_hosts(self, mock_kazoo, manager):
+        mock_kazoo.side_effect = [mock.sentinel.client1, mock.sentinel.client2]
+
+        assert manager.acquire('zk1:2181', RETRY_POLICY) is mock.sentinel.client1
+        assert manager.acquire('zk2:2181', RETRY_POLICY) is mock.sentinel.client2
+        assert len(manager) == 2
+
+    def test_release(self, mock_kazoo, manager):
+        client = manager.acquire('zk:2181', RETRY_POLICY)
+        manager.acquire('zk:2181', RETRY_POLICY)
+
+        manager.release(client)
+        assert not client.stop.called
+
+        manager.release(client)
+        client.stop.assert_called_once_with()
+        client.close.assert_called_once_with()
+        assert len(manager) == 0
+        assert manager.acquire('zk:2181', RETRY_POLICY) is not None
+        assert mock_kazoo.call_count == 2
+
+    def test_ensure_connected(self, mock_kazoo, manager):
+        client = manager.acquire('zk:2181', RETRY_POLICY)
+        client.state = KazooState.CONNECTED
+        manager.ensure_connected(client)
+        assert not client.start.called
+
+        client.state = KazooState.LOST
+        manager.ensure_connected(client)
+        client.start.assert_called_once_with()
+
+    def test_acquire_after_fork(self, mock_kazoo, manager):
+        manager.acquire('zk:2181', RETRY_POLICY)
+        with mock.patch('yelp_kafka.kazoo_session.os.getpid', return_value=-1):
+            manager.acquire('zk:2181', RETRY_POLICY)
+        assert mock_kazoo.call_count == 2
@@ -0,0 +1,241 @@
+# -*- coding: utf-8 -*-
+# Copyright 2016 Yelp Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+import mock
+import pytest
+from kazoo.exceptions import NoNodeError
+
+from yelp_kafka.error import ConfigurationError
+from yelp_kafka.lag_monitor import ConsumerGroupLagMonitor
+from yelp_kafka.lag_monitor import estimate_consumers_needed
+from yelp_kafka.lag_monitor import estimate_time_to_catch_up
+from yelp_kafka.lag_monitor import get_party_members
+from yelp_kafka.monitoring import ConsumerPartitionOffsets
+from yelp_kafka.prometheus_metrics_responder import PrometheusMetricsResponder
+
+
+def make_offsets(*partitions):
+    return {
+        'topic1': [
+            ConsumerPartitionOffsets('topic1', i, current, highmark, lowmark)
+            for i, (current, highmark, lowmark) in enumerate(partitions)
+        ]
+    }
+
+
+def test_get_party_members():
+    kazoo_client = mock.Mock()
+    kazoo_client.get_children.return_value = [
+        'a1b2-host1-123-0',
+        'c3d4-host2-456-0@2',
+    ]
+
+    assert get_party_members(kazoo_client, '/yelp-kafka/group') == [
+        'host1-123-0',
+        'host2-456-0@2',
+    ]
+    kazoo_client.get_children.assert_called_once_with('/yelp-kafka/group/party')
+
+    kazoo_client.get_children.side_effect = NoNodeError
+    assert get_party_members(kazoo_client, '/yelp-kafka/group') == []
+
+
+def test_estimate_time_to_catch_up():
+    assert estimate_time_to_catch_up(0, 10) == 0
+    assert estimate_time_to_catch_up(1000, 0) is None
+    assert estimate_time_to_catch_up(1000, 5) is None
+    assert estimate_time_to_catch_up(1000, -50) == 20
+
+
+def test_estimate_consumers_needed():
+    # 100 msg/s produced + 6000 messages of lag in 60s: 200 msg/s
+    assert estimate_consumers_needed(6000, 100, 50, 60) == 4
+    assert estimate_consumers_needed(6000, 100, 30, 60) == 7
+    assert estimate_consumers_needed(6000, 100, 30, 60, max_consumers=5) == 5
+    assert estimate_consumers_needed(0, 0, 30, 60) == 0
+    assert estimate_consumers_needed(6000, 100, 0, 60) is None
+    assert estimate_consumers_needed(6000, 100, None, 60) is None
+
+
+class TestConsumerGroupLagMonitor(object):
+
+    @pytest.yield_fixture
+    def mock_offsets(self):
+        with mock.patch(
+            'yelp_kafka.lag_monitor.get_consumer_offsets_metadata',
+            autospec=True,
+        ) as mock_offsets:
+            yield mock_offsets
+
+    @pytest.yield_fixture
+    def mock_time(self):
+        with mock.patch('yelp_kafka.lag_monitor.time.time', autospec=True) as mock_time:
+            yield mock_time
+
+    @pytest.yield_fixture
+    def mock_kazoo_session_manager(self):
+        with mock.patch(
+            'yelp_kafka.lag_monitor.get_kazoo_session_manager',
+            autospec=True,
+        ) as mock_get_manager:
+            yield mock_get_manager.return_value
+
+    @pytest.yield_fixture
+    def monitor(self, config, mock_kazoo_session_manager):
+        with mock.patch(
+            'yelp_kafka.lag_monitor.KafkaClient',
+            autospec=True,
+        ):
+            monitor = ConsumerGroupLagMonitor(
+                ['topic1'],
+                config,
+                target_catch_up_secs=100,
+            )
+            monitor.start()
+            yield monitor
+            monitor.stop()
+
+    def test_invalid_settings(self, config):
+        with pytest.raises(ConfigurationError):
+            ConsumerGroupLagMonitor(['topic1'], config, target_catch_up_secs=0)
+        with pytest.raises(ConfigurationError):
+            ConsumerGroupLagMonitor(['topic1'], config, window_size=1)
+
+    def test_start_stop(self, monitor, mock_kazoo_session_manager):
+        kazoo_client = mock_kazoo_session_manager.acquire.return_value
+        kafka_client = monitor.kafka_client
+        mock_kazoo_session_manager.ensure_connected.assert_called_once_with(
+            kazoo_client,
+        )
+
+        monitor.stop()
+
+        mock_kazoo_session_manager.release.assert_called_once_with(kazoo_client)
+        assert kafka_client.close.called
+        assert monitor.kafka_client is None
+        assert monitor.kazoo_client is None
+
+    def test_static_group(self, config, mock_kazoo_session_manager):
+        config = config.copy(
+            rebalance_protocol='static',
+            static_member_index=0,
+            static_member_count=3,
+        )
+        with mock.patch('yelp_kafka.lag_monitor.KafkaClient', autospec=True):
+            with ConsumerGroupLagMonitor(['topic1'], config) as monitor:
+                assert monitor.get_members() == 3
+        assert not mock_kazoo_session_manager.acquire.called
+
+    def test_offset_storage(self, config):
+        monitor = ConsumerGroupLagMonitor(['topic1'], config)
+        assert monitor.offset_storage == 'zookeeper'
+        monitor = ConsumerGroupLagMonitor(
+            ['topic1'],
+            config.copy(offset_storage='dual'),
+        )
+        assert monitor.offset_storage == 'kafka'
+
+    def test_sample(self, monitor, mock_offsets, mock_time):
+        monitor.kazoo_client.get_children.return_value = ['a-c1', 'b-c2']
+        mock_time.side_effect = [10, 20]
+        mock_offsets.side_effect = [
+            make_offsets((100, 1100, 0), (500, 1000, 0)),
+            # The group consumed 600 messages and 200 were produced
+            make_offsets((400, 1200, 0), (800, 1100, 0)),
+        ]
+
+        first = monitor.sample()
+        assert first.total_lag == 1500
+        assert first.consumption_rate == 0
+        assert first.members == 2
+        assert first.time_to_catch_up is None
+        assert first.consumers_needed is None
+
+        stats = monitor.sample()
+        mock_offsets.assert_called_with(
+            monitor.kafka_client,
+            b'test_group',
+            ['topic1'],
+            offset_storage='zookeeper',
+        )
+        assert stats.total_lag == 1100
+        assert stats.lag_growth_rate == -40
+        assert stats.consumption_rate == 60
+        assert stats.production_rate == 20
+        assert stats.members == 2
+        assert stats.time_to_catch_up == 27.5
+        # 20 msg/s + 1100 messages in 100s = 31 msg/s, 30 msg/s per consumer
+        assert stats.consumers_needed == 2
+
+    def test_sample_lag_below_lowmark(self, monitor, mock_offsets, mock_time):
+        monitor.kazoo_client.get_children.return_value = []
+        mock_time.return_value = 10
+        mock_offsets.return_value = make_offsets((100, 1000, 500))
+
+        stats = monitor.sample()
+
+        assert stats.total_lag == 500
+        assert stats.members == 0
+
+    def test_window(self, config, mock_offsets, mock_time):
+        monitor = ConsumerGroupLagMonitor(
+            ['topic1'],
+            config,
+            consumer_rate=5,
+            window_size=2,
+        )
+        monitor.get_members = mock.Mock(return_value=1)
+        mock_time.side_effect = [0, 10, 20]
+        mock_offsets.side_effect = [
+            make_offsets((0, 1000, 0)),
+            make_offsets((500, 1000, 0)),
+            make_offsets((600, 1000, 0)),
+        ]
+
+        for _ in range(3):
+            stats = monitor.sample()
+
+        # Only the last 2 samples are in the window
+        assert stats.consumption_rate == 10
+        assert stats.total_lag == 400
+        # consumer_rate overrides the observed rate, but there is a single
+        # partition.
+        assert stats.consumers_needed == 1
+
+    def test_emit_metrics(self, config, mock_offsets, mock_time):
+        responder = PrometheusMetricsResponder()
+        monitor = ConsumerGroupLagMonitor(
+            ['topic1'],
+            config,
+            metrics_responder=responder,
+        )
+        monitor.get_members = mock.Mock(return_value=1)
+        mock_time.return_value = 0
+        mock_offsets.return_value = make_offsets((100, 1000, 0))
+
+        monitor.sample()
+
+        metrics = responder.render()
+        assert (
+            'yelp_kafka_ConsumerGroupLag_total_lag{'
+            'cluster_name="mycluster",cluster_type="cluster_type",'
+            'group_id="test_group"} 900'
+        ) in metrics
+        assert '# TYPE yelp_kafka_ConsumerGroupLag_members gauge' in metrics
+        # Unknown estimates are not reported
+        assert 'time_to_catch_up{' not in metrics
+        assert 'consumers_needed{' not in metrics
@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+# Copyright 2016 Yelp Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+import json
+import subprocess
+import sys
+
+import pytest
+
+# Slow to import, they must only be imported on first use. See
+# "make importtime" to find out what an import costs.
+LAZY_MODULES = [
+    'bravado.client',
+    'bravado_decorators.retry',
+    'kazoo.client',
+    'py_zipkin.zipkin',
+    'swagger_zipkin.zipkin_decorator',
+    'yaml',
+]
+
+
+def get_imported_modules(module):
+    output = subprocess.check_output([
+        sys.executable,
+        '-c',
+        'import json, sys; import {0}; '
+        'print(json.dumps(sorted(sys.modules)))'.format(module),
+    ])
+    return set(json.loads(output.decode()))
+
+
+@pytest.mark.parametrize('module', [
+    'yelp_kafka.config',
+    'yelp_kafka.consumer_group',
+    'yelp_kafka.offsets',
+    'yelp_kafka.partitioner',
+    'yelp_kafka.producer',
+])
+def test_lazy_imports(module):
+    imported = get_imported_modules(module)
+
+    assert module in imported
+    assert not imported.intersection(LAZY_MODULES)
@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+# Copyright 2016 Yelp Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+import re
+
+import mock
+
+from yelp_kafka.metadata_cache import get_metadata_cache
+from yelp_kafka.metadata_cache import TopicMetadataCache
+
+
+def test_get_metadata_cache():
+    cache = get_metadata_cache(['broker2:9092', 'broker1:9092'])
+    assert get_metadata_cache('broker1:9092, broker2:9092') is cache
+    assert get_metadata_cache(['broker3:9092']) is not cache
+
+
+@mock.patch('yelp_kafka.metadata_cache.time.time', autospec=True)
+@mock.patch('yelp_kafka.metadata_cache.get_kafka_topics_partitions', autospec=True)
+def test_get_topics_metadata(mock_topics, mock_time):
+    cache = TopicMetadataCache()
+    mock_client = mock.sentinel.client
+    mock_topics.return_value = {b'topic1': [0, 1]}
+    mock_time.return_value = 100
+
+    metadata = cache.get_topics_metadata(mock_client, ['topic1', 'topic2'], 10)
+    assert metadata[b'topic1'].partitions == (0, 1)
+    assert metadata[b'topic2'].partitions == ()
+    mock_topics.assert_called_once_with(mock_client, [b'topic1', b'topic2'])
+
+    # Fresh enough, no metadata request
+    mock_time.return_value = 105
+    assert cache.get_topics_metadata(mock_client, ['topic1'], 10) == {
+        b'topic1': metadata[b'topic1'],
+    }
+    assert mock_topics.call_count == 1
+
+    # Only the stale topics are refreshed
+    mock_time.return_value = 120
+    mock_topics.return_value = {b'topic1': [0, 1], b'topic2': [0]}
+    refreshed = cache.get_topics_metadata(mock_client, ['topic1', 'topic2'], 10)
+    mock_topics.assert_called_with(mock_client, [b'topic1', b'topic2'])
+    assert refreshed[b'topic1'].version == metadata[b'topic1'].version
+    assert refreshed[b'topic2'].version != metadata[b'topic2'].version
+    assert refreshed[b'topic2'].partitions == (0,)
+
+
+@mock.patch('yelp_kafka.metadata_cache.time.time', autospec=True, return_value=100)
+@mock.patch('yelp_kafka.metadata_cache.get_kafka_topics', autospec=True)
+def test_get_matching_topics(mock_all_topics, mock_time):
+    cache = TopicMetadataCache()
+    pattern = re.compile(r'scribe\.[^.]+\.stream1')
+    mock_all_topics.return_value = {
+        b'scribe.dc1.stream1': [0, 1],
+        b'scribe.dc2.stream1': [0],
+        b'scribe.dc1.stream10': [0],
+        b'other': [0],
+    }
+
+    topics = cache.get_matching_topics(mock.sentinel.client, pattern, 10)
+    assert topics == ['scribe.dc1.stream1', 'scribe.dc2.stream1']
+
+    # The partitions of all the topics are cached too
+    with mock.patch(
+        'yelp_kafka.metadata_cache.get_kafka_topics_partitions',
+        autospec=True,
+    ) as mock_topics:
+        metadata = cache.get_topics_metadata(mock.sentinel.client, topics, 10)
+        assert not mock_topics.called
+    assert metadata[b'scribe.dc1.stream1'].partitions == (0, 1)
+
+    # A new topic is created
+    mock_all_topics.return_value[b'scribe.dc3.stream1'] = [0]
+    assert cache.get_matching_topics(mock.sentinel.client, pattern, 10) == topics
+    mock_time.return_value = 200
+    assert cache.get_matching_topics(mock.sentinel.client, pattern, 10) == [
+        'scribe.dc1.stream1',
+        'scribe.dc2.stream1',
+        'scribe.dc3.stream1',
+    ]
+    assert mock_all_topics.call_count == 2
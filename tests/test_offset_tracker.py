@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+# Copyright 2016 Yelp Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+import pytest
+
+from yelp_kafka.offset_tracker import OffsetTracker
+from yelp_kafka.offset_tracker import PartitionOffsetTracker
+
+
+class TestPartitionOffsetTracker(object):
+
+    def test_in_order_completion(self):
+        tracker = PartitionOffsetTracker()
+        tracker.add(10)
+        tracker.add(11)
+
+        assert tracker.committable_offset is None
+        assert tracker.done(10) == 11
+        assert tracker.done(11) == 12
+        assert tracker.committable_offset == 12
+        assert tracker.in_flight == 0
+
+    def test_out_of_order_completion(self):
+        tracker = PartitionOffsetTracker()
+        for offset in [10, 11, 12, 15]:
+            tracker.add(offset)
+
+        assert tracker.done(12) is None
+        assert tracker.done(15) is None
+        assert tracker.committable_offset is None
+        assert tracker.in_flight == 2
+        assert tracker.done(10) == 11
+        assert tracker.done(11) == 16
+        assert len(tracker) == 0
+
+    def test_add_out_of_order(self):
+        tracker = PartitionOffsetTracker()
+        tracker.add(10)
+        with pytest.raises(ValueError):
+            tracker.add(10)
+        tracker.done(10)
+        with pytest.raises(ValueError):
+            tracker.add(9)
+
+
+class TestOffsetTracker(object):
+
+    def test_committable_offsets(self):
+        tracker = OffsetTracker()
+        tracker.add(0, 10)
+        tracker.add(0, 11)
+        tracker.add(1, 5)
+        tracker.add(2, 7)
+
+        assert tracker.done(0, 11) is None
+        assert tracker.done(1, 5) == 6
+        assert tracker.committable_offsets() == {1: 6}
+        assert tracker.in_flight == 2
+
+        tracker.done(0, 10)
+        assert tracker.committable_offsets() == {0: 12, 1: 6}
@@ -19,7 +19,10 @@ import copy
 
 import mock
 import pytest
+from kafka.common import FetchResponse
+from kafka.common import Message
 from kafka.common import NotLeaderForPartitionError
+from kafka.common import OffsetAndMessage
 from kafka.common import OffsetCommitResponse
 from kafka.common import OffsetFetchResponse
 from kafka.common import OffsetResponse
@@ -30,11 +33,13 @@ from yelp_kafka.error import InvalidOffsetStorageError
 from yelp_kafka.offsets import _verify_commit_offsets_requests
 from yelp_kafka.offsets import advance_consumer_offsets
 from yelp_kafka.offsets import get_current_consumer_offsets
+from yelp_kafka.offsets import get_offsets_for_times
 from yelp_kafka.offsets import get_topics_watermarks
 from yelp_kafka.offsets import OffsetCommitError
 from yelp_kafka.offsets import PartitionOffsets
 from yelp_kafka.offsets import rewind_consumer_offsets
 from yelp_kafka.offsets import set_consumer_offsets
+from yelp_kafka.offsets import set_consumer_offsets_to_time
 from yelp_kafka.offsets import UnknownPartitions
 from yelp_kafka.offsets import UnknownTopic
 
@@ -59,6 +64,10 @@ class MyKafkaClient(object):
         self.low_offsets = low_offsets
         self.commit_error = False
         self.offset_request_error = False
+        # topic: partition: offsets returned by time based offset requests
+        self.time_offsets = {}
+        # topic: partition: {offset: message value}
+        self.messages = {}
 
     def load_metadata_for_topics(self):
         pass
@@ -75,9 +84,11 @@ class MyKafkaClient(object):
         resps = []
         for req in payloads:
             if req.time == -1:
-                offset = self.high_offsets[req.topic.decode()].get(req.partition, -1)
+                offsets = (self.high_offsets[req.topic.decode()].get(req.partition, -1),)
+            elif req.time == -2:
+                offsets = (self.low_offsets[req.topic.decode()].get(req.partition, -1),)
             else:
-                offset = self.low_offsets[req.topic.decode()].get(req.partition, -1)
+                offsets = self.time_offsets[req.topic.decode()][req.partition]
             if self.offset_request_error:
                 error_code = NotLeaderForPartitionError.errno
             elif req.partition not in self.topics[req.topic.decode()]:
@@ -88,11 +99,35 @@ class MyKafkaClient(object):
                 req.topic.decode(),
                 req.partition,
                 error_code,
-                (offset,)
+                offsets,
             ))
 
         return [resp if not callback else callback(resp) for resp in resps]
 
+    def send_fetch_request(
+        self,
+        payloads=None,
+        fail_on_error=True,
+        callback=None,
+        max_wait_time=100,
+        min_bytes=4096,
+    ):
+        resps = []
+        for req in payloads:
+            messages = self.messages[req.topic.decode()][req.partition]
+            resps.append(FetchResponse(
+                req.topic.decode(),
+                req.partition,
+                0,
+                self.high_offsets[req.topic.decode()][req.partition],
+                iter([
+                    OffsetAndMessage(offset, Message(0, 0, None, value))
+                    for offset, value in sorted(messages.items())
+                    if offset >= req.offset
+                ][:2]),
+            ))
+        return resps
+
     def set_commit_error(self):
         self.commit_error = True
 
@@ -751,3 +786,148 @@ class TestOffsets(TestOffsetsBase):
         for expected in expected_status:
             assert any(actual == expected for actual in status)
         assert kafka_client_mock.group_offsets == self.group_offsets
+
+
+class TestOffsetsForTimes(TestOffsetsBase):
+
+    @pytest.fixture
+    def kafka_client_mock(self):
+        kafka_client = MyKafkaClient(
+            self.topics,
+            copy.deepcopy(self.group_offsets),
+            self.high_offsets,
+            self.low_offsets
+        )
+        kafka_client.time_offsets = {
+            'topic1': {
+                0: (20,),
+                # Older than the low watermark
+                1: (0,),
+                # No segment written before the timestamp
+                2: (),
+            },
+            'topic2': {
+                0: (10,),
+                1: (-1,),
+            },
+        }
+        # Message values are their timestamps
+        kafka_client.messages = {
+            'topic1': {
+                0: dict((offset, offset * 10) for offset in range(10, 30)),
+            },
+            'topic2': {
+                # Compacted partition
+                0: dict((offset, offset * 10) for offset in range(5, 50, 3)),
+            },
+        }
+        return kafka_client
+
+    def test_get_offsets_for_times(self, kafka_client_mock):
+        kafka_client_spy = mock.Mock(wraps=kafka_client_mock)
+
+        offsets = get_offsets_for_times(kafka_client_spy, ['topic1'], 250)
+
+        assert offsets == {'topic1': {0: 20, 1: 5, 2: 3}}
+        time_request = kafka_client_spy.send_offset_request.call_args_list[-1]
+        assert [req.time for req in time_request[0][0]] == [250000] * 3
+        assert not kafka_client_spy.send_fetch_request.called
+
+    def test_get_offsets_for_times_request_error(self, kafka_client_mock):
+        offsets = get_offsets_for_times(kafka_client_mock, ['topic2'], 250)
+
+        assert offsets == {'topic2': {0: 10}}
+
+    def test_get_offsets_for_times_watermarks_error(self, kafka_client_mock):
+        kafka_client_mock.high_offsets = copy.deepcopy(self.high_offsets)
+        # The watermark request fails, the time request succeeds
+        del kafka_client_mock.high_offsets['topic1'][0]
+        kafka_client_spy = mock.Mock(wraps=kafka_client_mock)
+
+        offsets = get_offsets_for_times(kafka_client_spy, ['topic1'], 250)
+        status = list(set_consumer_offsets_to_time(
+            kafka_client_spy,
+            "group",
+            ['topic1'],
+            250,
+        ))
+
+        assert offsets == {'topic1': {1: 5, 2: 3}}
+        assert status == []
+        assert kafka_client_mock.group_offsets['topic1'] == {0: 30, 1: 5, 2: 3}
+
+    def test_get_offsets_for_times_unknown_topic(self, kafka_client_mock):
+        with pytest.raises(UnknownTopic):
+            get_offsets_for_times(kafka_client_mock, ['unknown'], 250)
+        assert get_offsets_for_times(
+            kafka_client_mock,
+            ['unknown'],
+            250,
+            raise_on_error=False,
+        ) == {}
+
+    def test_get_offsets_for_times_binary_search(self, kafka_client_mock):
+        kafka_client_mock.time_offsets['topic1'][0] = (10,)
+
+        offsets = get_offsets_for_times(
+            kafka_client_mock,
+            {'topic1': [0], 'topic2': [0]},
+            255,
+            timestamp_fn=lambda message: message.value,
+        )
+
+        # topic2 has no message at offsets 24 and 25, consuming from 24
+        # starts from the message at 26.
+        assert offsets == {'topic1': {0: 26}, 'topic2': {0: 24}}
+
+    def test_get_offsets_for_times_binary_search_all_older(self, kafka_client_mock):
+        offsets = get_offsets_for_times(
+            kafka_client_mock,
+            {'topic1': [0]},
+            1000,
+            timestamp_fn=lambda message: message.value,
+        )
+
+        assert offsets == {'topic1': {0: 30}}
+
+    def test_get_offsets_for_times_binary_search_fetch_error(
+        self,
+        kafka_client_mock,
+    ):
+        kafka_client_spy = mock.Mock(wraps=kafka_client_mock)
+        kafka_client_spy.send_fetch_request.side_effect = lambda payloads, **kwargs: [
+            FetchResponse(
+                req.topic.decode(),
+                req.partition,
+                NotLeaderForPartitionError.errno,
+                -1,
+                iter([]),
+            )
+            for req in payloads
+        ]
+
+        offsets = get_offsets_for_times(
+            kafka_client_spy,
+            {'topic1': [0]},
+            255,
+            timestamp_fn=lambda message: message.value,
+        )
+
+        assert offsets == {'topic1': {0: 20}}
+        assert kafka_client_spy.send_fetch_request.call_count == 1
+
+    def test_set_consumer_offsets_to_time(self, kafka_client_mock):
+        kafka_client_spy = mock.Mock(wraps=kafka_client_mock)
+
+        status = list(set_consumer_offsets_to_time(
+            kafka_client_spy,
+            "group",
+            ['topic1'],
+            250,
+            offset_storage='kafka',
+        ))
+
+        assert status == []
+        assert kafka_client_mock.group_offsets['topic1'] == {0: 20, 1: 5, 2: 3}
+        assert kafka_client_spy.load_metadata_for_topics.called
+        assert kafka_client_spy.send_offset_commit_request_kafka.called
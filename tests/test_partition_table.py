@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+# Copyright 2016 Yelp Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+from yelp_kafka.partition_table import add_partitions
+from yelp_kafka.partition_table import diff_partitions
+from yelp_kafka.partition_table import group_by_topic
+from yelp_kafka.partition_table import PartitionTable
+from yelp_kafka.partition_table import remove_partitions
+
+
+class TestPartitionTable(object):
+
+    def test_get_key_interned(self):
+        table = PartitionTable()
+        key = table.get_key('topic1', 1)
+
+        assert table.get_key('topic1', 1) is key
+        assert table.get_keys('topic1', [0, 1])[1] is key
+        assert table.get_key('topic2', 1) is not key
+        assert len(table) == 3
+
+    def test_key_attributes(self):
+        table = PartitionTable()
+        key1 = table.get_key('topic1', 3)
+        key2 = table.get_key('topic-2', 0)
+
+        assert (key1.topic, key1.partition) == ('topic1', 3)
+        assert key1.topic_id == table.get_topic_id('topic1')
+        assert key2.topic_id == table.get_topic_id('topic-2') != key1.topic_id
+        assert str(key1) == 'topic1-3'
+        assert str(key2) == 'topic-2-0'
+
+    def test_keys_sort_as_strings(self):
+        table = PartitionTable()
+        keys = table.get_keys('topic1', range(12)) + table.get_keys('topic', [5])
+
+        assert [str(key) for key in sorted(keys)] == sorted(str(key) for key in keys)
+
+
+def test_diff_partitions():
+    table = PartitionTable()
+    old = table.get_keys('topic1', [0, 1, 2])
+    new = table.get_keys('topic1', [1, 2, 3])
+
+    added, removed = diff_partitions(old, new)
+
+    assert added == set([table.get_key('topic1', 3)])
+    assert removed == set([table.get_key('topic1', 0)])
+
+
+def test_group_by_topic():
+    table = PartitionTable()
+    keys = [
+        table.get_key('topic1', 2),
+        table.get_key('topic2', 0),
+        table.get_key('topic1', 1),
+    ]
+
+    assert group_by_topic(keys) == {'topic1': [2, 1], 'topic2': [0]}
+
+
+def test_add_partitions():
+    partitions = {'topic1': [0, 1]}
+
+    actual = add_partitions(partitions, {'topic1': [1, 2], 'topic2': [0]})
+
+    assert actual == {'topic1': [0, 1, 2], 'topic2': [0]}
+    assert partitions == {'topic1': [0, 1]}
+
+
+def test_remove_partitions():
+    partitions = {'topic1': [0, 1], 'topic2': [0]}
+
+    actual = remove_partitions(partitions, {'topic1': [1], 'topic2': [0]})
+
+    assert actual == {'topic1': [0]}
+    assert partitions == {'topic1': [0, 1], 'topic2': [0]}
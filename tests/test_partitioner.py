@@ -16,17 +16,25 @@ from __future__ import absolute_import
 from __future__ import unicode_literals
 
 import hashlib
+import re
 
 import mock
 import pytest
 from kafka.util import kafka_bytestring
+from kazoo.handlers.threading import SequentialThreadingHandler
 from kazoo.protocol.states import KazooState
 from kazoo.recipe.partitioner import PartitionState
 from kazoo.recipe.partitioner import SetPartitioner
 
+from yelp_kafka.assignment import ThroughputAssignment
+from yelp_kafka.assignment import WeightedAssignment
 from yelp_kafka.config import KafkaConsumerConfig
+from yelp_kafka.error import ConfigurationError
 from yelp_kafka.error import PartitionerError
 from yelp_kafka.error import PartitionerZookeeperError
+from yelp_kafka.incremental_partitioner import IncrementalSetPartitioner
+from yelp_kafka.kazoo_session import KazooSessionManager
+from yelp_kafka.metadata_cache import TopicMetadataCache
 from yelp_kafka.partitioner import Partitioner
 
 
@@ -40,11 +48,25 @@ class TestPartitioner(object):
 
     sha = hashlib.sha1(repr(sorted(topics)).encode()).hexdigest()
 
+    @pytest.yield_fixture(autouse=True)
+    def session_manager(self):
+        # Do not share zookeeper sessions across tests
+        manager = KazooSessionManager()
+        with mock.patch(
+            'yelp_kafka.partitioner.get_kazoo_session_manager',
+            autospec=True,
+            return_value=manager,
+        ):
+            yield manager
+
     @pytest.fixture
-    @mock.patch('yelp_kafka.partitioner.KazooClient', autospec=True)
+    @mock.patch('kazoo.client.KazooClient', autospec=True)
     @mock.patch('yelp_kafka.partitioner.KafkaClient', autospec=True)
     def partitioner(self, kazoo, kafka, config):
-        return Partitioner(config, self.topics, mock.Mock(), mock.Mock())
+        partitioner = Partitioner(config, self.topics, mock.Mock(), mock.Mock())
+        # Do not share the metadata across tests
+        partitioner.metadata_cache = TopicMetadataCache()
+        return partitioner
 
     def test_partitioner_use_sha(self, cluster):
         config = KafkaConsumerConfig(
@@ -76,19 +98,152 @@ class TestPartitioner(object):
 
     def test_get_partitions_set(self, partitioner):
         with mock.patch(
-            'yelp_kafka.partitioner.get_kafka_topics',
+            'yelp_kafka.metadata_cache.get_kafka_topics_partitions',
             autospec=True
         ) as mock_topics:
             mock_topics.return_value = {
                 kafka_bytestring('topic1'): [0, 1, 2, 3],
                 kafka_bytestring('topic2'): [0, 1, 2],
-                kafka_bytestring('topic3'): [0, 1, 2, 3],
             }
             actual = partitioner.get_partitions_set()
-            assert actual == set([
+            assert set(str(p) for p in actual) == set([
                 'topic1-0', 'topic1-1', 'topic1-2', 'topic1-3',
                 'topic2-0', 'topic2-1', 'topic2-2'
             ])
+            mock_topics.assert_called_once_with(
+                partitioner.kafka_client,
+                [kafka_bytestring('topic1'), kafka_bytestring('topic2')],
+            )
+
+    def test_get_partitions_set_topic_pattern(self, config):
+        partitioner = Partitioner(
+            config,
+            re.compile(r'topic\d'),
+            mock.Mock(),
+            mock.Mock(),
+        )
+        partitioner.metadata_cache = TopicMetadataCache()
+        topic_partitions = {
+            kafka_bytestring('topic1'): [0, 1],
+            kafka_bytestring('other'): [0],
+        }
+        with mock.patch(
+            'yelp_kafka.metadata_cache.get_kafka_topics',
+            autospec=True,
+            return_value=topic_partitions,
+        ):
+            actual = partitioner.get_partitions_set()
+            assert set(str(p) for p in actual) == set(['topic1-0', 'topic1-1'])
+            assert partitioner.subscribed_topics == ['topic1']
+
+            topic_partitions[kafka_bytestring('topic2')] = [0]
+            partitioner.metadata_cache._all_topics_timestamp = 0
+            actual = partitioner.get_partitions_set()
+            assert set(str(p) for p in actual) == set(['topic1-0', 'topic1-1', 'topic2-0'])
+            assert partitioner.subscribed_topics == ['topic1', 'topic2']
+
+    def test_partitioner_topic_pattern_group_path(self, config):
+        p = Partitioner(config, re.compile(r'topic\d'), mock.Mock(), mock.Mock())
+        sha = hashlib.sha1(repr([r'topic\d']).encode()).hexdigest()
+
+        assert p.zk_group_path == '/yelp-kafka/test_group/{sha}'.format(sha=sha)
+
+    def test__get_partitioner_incremental_set_change(self, partitioner):
+        incremental = mock.Mock(spec=IncrementalSetPartitioner, failed=False)
+        with mock.patch.object(
+            Partitioner,
+            '_create_partitioner',
+            return_value=incremental,
+        ) as mock_create, mock.patch.object(
+            Partitioner,
+            'get_partitions_set',
+            return_value=set(['topic1-0']),
+        ) as mock_partitions:
+            partitioner._get_partitioner()
+
+            partitioner.force_partitions_refresh = True
+            mock_partitions.return_value = set(['topic1-0', 'topic2-0'])
+            assert partitioner._get_partitioner() is incremental
+
+            incremental.update_set.assert_called_once_with(
+                set(['topic1-0', 'topic2-0']),
+            )
+            assert not incremental.finish.called
+            assert mock_create.call_count == 1
+
+    def test_get_partitions_set_missing_topic(self, partitioner):
+        with mock.patch(
+            'yelp_kafka.metadata_cache.get_kafka_topics_partitions',
+            autospec=True
+        ) as mock_topics:
+            mock_topics.return_value = {kafka_bytestring('topic1'): [0, 1]}
+            actual = partitioner.get_partitions_set()
+            assert actual == set(partitioner.partition_table.get_keys('topic1', [0, 1]))
+
+            mock_topics.return_value = {}
+            partitioner.metadata_cache.clear()
+            with pytest.raises(PartitionerError):
+                partitioner.get_partitions_set()
+
+    def test_get_partitions_set_unchanged_metadata(self, partitioner):
+        with mock.patch(
+            'yelp_kafka.metadata_cache.get_kafka_topics_partitions',
+            autospec=True
+        ) as mock_topics, mock.patch(
+            'yelp_kafka.metadata_cache.time.time',
+            autospec=True,
+        ) as mock_time, mock.patch.object(
+            partitioner,
+            '_build_partitions_set',
+            wraps=partitioner._build_partitions_set,
+        ) as mock_build:
+            mock_topics.return_value = {
+                kafka_bytestring('topic1'): [0, 1],
+                kafka_bytestring('topic2'): [0],
+            }
+            mock_time.return_value = 0
+            partitioner.force_partitions_refresh = False
+            first = partitioner.get_partitions_set()
+
+            # Metadata is refreshed but partitions didn't change
+            mock_time.return_value = 1000
+            second = partitioner.get_partitions_set()
+            assert mock_topics.call_count == 2
+            assert second is first
+            assert mock_build.call_count == 1
+
+            # A new partition is added
+            mock_topics.return_value[kafka_bytestring('topic2')] = [0, 1]
+            mock_time.return_value = 2000
+            third = partitioner.get_partitions_set()
+            assert third == set(
+                partitioner.partition_table.get_keys('topic1', [0, 1]) +
+                partitioner.partition_table.get_keys('topic2', [0, 1])
+            )
+            assert mock_build.call_count == 2
+
+    def test_get_partitions_set_shared_cache(self, config):
+        with mock.patch(
+            'yelp_kafka.metadata_cache.get_kafka_topics_partitions',
+            autospec=True,
+            return_value={
+                kafka_bytestring('topic1'): [0, 1],
+                kafka_bytestring('topic2'): [0],
+            },
+        ) as mock_topics:
+            cache = TopicMetadataCache()
+            partitioners = [
+                Partitioner(config, self.topics, mock.Mock(), mock.Mock())
+                for _ in range(3)
+            ]
+            assert all(
+                p.metadata_cache is partitioners[0].metadata_cache
+                for p in partitioners
+            )
+            for partitioner in partitioners:
+                partitioner.metadata_cache = cache
+                partitioner.get_partitions_set()
+            assert mock_topics.call_count == 1
 
     def test_handle_release(self, partitioner):
         mock_kpartitioner = mock.MagicMock(
@@ -120,6 +275,191 @@ class TestPartitioner(object):
         # User release function should be called only once
         partitioner.release.assert_called_once_with(expected_partitions)
 
+    @mock.patch.object(Partitioner, 'get_partitions_set', return_value=set())
+    def test_handle_release_incremental(self, _, partitioner):
+        table = partitioner.partition_table
+        keys = table.get_keys('topic1', [0, 1, 2]) + table.get_keys('topic2', [0])
+        mock_kpartitioner = mock.MagicMock(
+            spec=IncrementalSetPartitioner,
+            **get_partitioner_state(PartitionState.ACQUIRED)
+        )
+        mock_kpartitioner.__iter__.side_effect = lambda: iter(keys)
+        partitioner._handle_group(mock_kpartitioner)
+
+        kept = frozenset([keys[0], keys[2]])
+        mock_kpartitioner.state = PartitionState.RELEASE
+        mock_kpartitioner.get_kept_items.return_value = kept
+        partitioner._handle_group(mock_kpartitioner)
+
+        # Only the partitions moving to other members are released
+        partitioner.release.assert_called_once_with({'topic1': [1], 'topic2': [0]})
+        mock_kpartitioner.release_set.assert_called_once_with(kept)
+        assert partitioner.acquired_partitions == {'topic1': [0, 2]}
+        assert partitioner.released_flag is False
+
+        keys = [keys[0], keys[2]] + table.get_keys('topic3', [0])
+        mock_kpartitioner.state = PartitionState.ACQUIRED
+        partitioner._handle_group(mock_kpartitioner)
+
+        # Only the gained partitions are acquired
+        assert partitioner.acquire.call_args_list == [
+            mock.call({'topic1': [0, 1, 2], 'topic2': [0]}),
+            mock.call({'topic3': [0]}),
+        ]
+        assert partitioner.acquired_partitions == {'topic1': [0, 2], 'topic3': [0]}
+        assert partitioner.release.call_count == 1
+
+    @mock.patch.object(Partitioner, 'get_partitions_set', return_value=set())
+    def test_handle_release_incremental_nothing_kept(self, _, partitioner):
+        table = partitioner.partition_table
+        mock_kpartitioner = mock.MagicMock(
+            spec=IncrementalSetPartitioner,
+            **get_partitioner_state(PartitionState.ACQUIRED)
+        )
+        mock_kpartitioner.__iter__.side_effect = lambda: iter(
+            table.get_keys('topic1', [0, 1]),
+        )
+        partitioner._handle_group(mock_kpartitioner)
+
+        mock_kpartitioner.state = PartitionState.RELEASE
+        mock_kpartitioner.get_kept_items.return_value = frozenset()
+        partitioner._handle_group(mock_kpartitioner)
+        partitioner._handle_group(mock_kpartitioner)
+
+        partitioner.release.assert_called_once_with({'topic1': [0, 1]})
+        assert partitioner.released_flag is True
+        assert not partitioner.acquired_partitions
+
+    @mock.patch.object(Partitioner, 'get_partitions_set', return_value=set())
+    def test_handle_acquired_incremental_kept_partitions_lost(self, _, partitioner):
+        table = partitioner.partition_table
+        keys = table.get_keys('topic1', [0, 1, 2])
+        mock_kpartitioner = mock.MagicMock(
+            spec=IncrementalSetPartitioner,
+            **get_partitioner_state(PartitionState.ACQUIRED)
+        )
+        mock_kpartitioner.__iter__.side_effect = lambda: iter(keys)
+        partitioner._handle_group(mock_kpartitioner)
+        mock_kpartitioner.state = PartitionState.RELEASE
+        mock_kpartitioner.get_kept_items.return_value = frozenset(keys[:2])
+        partitioner._handle_group(mock_kpartitioner)
+
+        # The party changed again while allocating, topic1-1 moved away
+        keys = keys[:1]
+        mock_kpartitioner.state = PartitionState.ACQUIRED
+        partitioner._handle_group(mock_kpartitioner)
+
+        assert partitioner.release.call_args_list == [
+            mock.call({'topic1': [2]}),
+            mock.call({'topic1': [1]}),
+        ]
+        partitioner.acquire.assert_called_once_with({'topic1': [0, 1, 2]})
+        assert partitioner.acquired_partitions == {'topic1': [0]}
+
+    @mock.patch.object(Partitioner, 'get_partitions_set')
+    @mock.patch(
+        'yelp_kafka.incremental_partitioner.PatientChildrenWatch',
+        autospec=True,
+    )
+    def test_handle_group_incremental_party_changes_twice(
+        self,
+        _,
+        mock_partitions,
+        partitioner,
+    ):
+        keys = partitioner.partition_table.get_keys('topic1', [0, 1, 2, 3])
+        mock_partitions.return_value = frozenset(keys)
+        partitioner.partitions_set = frozenset(keys)
+        members = ['member1']
+        events = []
+        client = mock.Mock()
+        client.handler = SequentialThreadingHandler()
+        client.ShallowParty.return_value.__iter__ = mock.Mock(
+            side_effect=lambda: iter(list(members)),
+        )
+        client.Lock.side_effect = lambda path, identifier: mock.Mock(**{
+            'release.side_effect': lambda: events.append(('unlock', path)),
+        })
+        partitioner.release.side_effect = lambda partitions: events.append(
+            ('release', partitions),
+        )
+        kpartitioner = IncrementalSetPartitioner(
+            client,
+            '/group',
+            frozenset(keys),
+            identifier='member1',
+        )
+
+        def allocate():
+            result = mock.Mock(exception=None)
+            result.get.return_value = (list(members), mock.Mock())
+            kpartitioner._allocate_transition(result)
+
+        allocate()
+        partitioner._handle_group(kpartitioner)
+        assert partitioner.acquired_partitions == {'topic1': [0, 1, 2, 3]}
+
+        members.append('member2')
+        kpartitioner._set_state(PartitionState.RELEASE)
+        partitioner._handle_group(kpartitioner)
+        # The party changes again before the partitions are allocated,
+        # topic1-2 moves to member3.
+        members.append('member3')
+        allocate()
+        assert kpartitioner.release
+        assert ('unlock', '/group/locks/topic1-2') not in events
+        partitioner._handle_group(kpartitioner)
+        allocate()
+        partitioner._handle_group(kpartitioner)
+
+        assert events == [
+            ('release', {'topic1': [1, 3]}),
+            ('unlock', '/group/locks/topic1-1'),
+            ('unlock', '/group/locks/topic1-3'),
+            ('release', {'topic1': [2]}),
+            ('unlock', '/group/locks/topic1-2'),
+        ]
+        assert partitioner.acquired_partitions == {'topic1': [0, 3]}
+
+    def test_handle_release_incremental_set_change(self, partitioner):
+        table = partitioner.partition_table
+        keys = table.get_keys('topic1', [0, 1])
+        new_partitions = set(keys + table.get_keys('topic2', [0]))
+        mock_kpartitioner = mock.MagicMock(
+            spec=IncrementalSetPartitioner,
+            **get_partitioner_state(PartitionState.ACQUIRED)
+        )
+        mock_kpartitioner.__iter__.side_effect = lambda: iter(keys)
+        partitioner.partitions_set = set(keys)
+        partitioner._partitioner = mock_kpartitioner
+        partitioner._handle_group(mock_kpartitioner)
+
+        # Another member noticed topic2 and rejoined the party
+        mock_kpartitioner.state = PartitionState.RELEASE
+        mock_kpartitioner.get_kept_items.return_value = frozenset(keys)
+        with mock.patch.object(
+            Partitioner,
+            'get_partitions_set',
+            return_value=new_partitions,
+        ):
+            partitioner._handle_group(mock_kpartitioner)
+            # The new set is used in this rebalance, without notifying
+            # the party again.
+            mock_kpartitioner.update_set.assert_called_once_with(
+                new_partitions,
+                notify=False,
+            )
+            assert mock_kpartitioner.method_calls.index(
+                mock.call.update_set(new_partitions, notify=False),
+            ) < mock_kpartitioner.method_calls.index(
+                mock.call.get_kept_items(),
+            )
+            assert partitioner.partitions_set == new_partitions
+
+            partitioner.force_partitions_refresh = True
+            assert partitioner._get_partitioner() is mock_kpartitioner
+            assert mock_kpartitioner.update_set.call_count == 1
+
     def test_handle_release_failure(self, partitioner):
         mock_kpartitioner = mock.MagicMock(
             spec=SetPartitioner, **get_partitioner_state(PartitionState.RELEASE)
@@ -159,7 +499,10 @@ class TestPartitioner(object):
         mock_kpartitioner = mock.MagicMock(
             spec=SetPartitioner, **get_partitioner_state(PartitionState.ACQUIRED)
         )
-        mock_kpartitioner.__iter__.return_value = ['topic1-0', 'topic1-2', 'topic-2-1']
+        table = partitioner.partition_table
+        mock_kpartitioner.__iter__.return_value = (
+            table.get_keys('topic1', [0, 2]) + [table.get_key('topic-2', 1)]
+        )
         expected_partitions = {'topic1': [0, 2], 'topic-2': [1]}
 
         partitioner._handle_group(mock_kpartitioner)
@@ -168,11 +511,29 @@ class TestPartitioner(object):
         assert partitioner.released_flag is False
         partitioner.acquire.assert_called_once_with(expected_partitions)
 
+    def test_handle_acquired_unchanged(self, partitioner):
+        mock_kpartitioner = mock.MagicMock(
+            spec=SetPartitioner, **get_partitioner_state(PartitionState.ACQUIRED)
+        )
+        mock_kpartitioner.__iter__.side_effect = lambda: iter(
+            partitioner.partition_table.get_keys('topic1', [0, 2])
+        )
+
+        partitioner._handle_group(mock_kpartitioner)
+        partitioner._handle_group(mock_kpartitioner)
+
+        partitioner.acquire.assert_called_once_with({'topic1': [0, 2]})
+        # The user can't modify the acquired partitions
+        partitioner.acquire.call_args[0][0]['topic1'].append(3)
+        assert partitioner.acquired_partitions == {'topic1': [0, 2]}
+
     def test_handle_acquire_failure(self, partitioner):
         mock_kpartitioner = mock.MagicMock(
             spec=SetPartitioner, **get_partitioner_state(PartitionState.ACQUIRED)
         )
-        mock_kpartitioner.__iter__.return_value = ['topic1-0', 'topic1-2', 'topic-2-1']
+        mock_kpartitioner.__iter__.return_value = (
+            partitioner.partition_table.get_keys('topic1', [0, 2])
+        )
         partitioner.acquire.side_effect = Exception("Boom!")
 
         with pytest.raises(PartitionerError):
@@ -240,8 +601,231 @@ class TestPartitioner(object):
                     assert mock_create.call_count == 2
                     assert not partitioner.need_partitions_refresh()
 
+    def test__get_partitioner_weights_change(self, config):
+        config = config.copy(partition_assignment='throughput')
+        partitioner = Partitioner(config, self.topics, mock.Mock(), mock.Mock())
+        partitions = set(['topic1-0', 'topic1-1'])
+        with mock.patch.object(
+            Partitioner,
+            '_create_partitioner',
+            side_effect=[mock.sentinel.partitioner1, mock.sentinel.partitioner2],
+        ) as mock_create, mock.patch.object(
+            Partitioner,
+            'get_partitions_set',
+            return_value=partitions,
+        ), mock.patch.object(
+            Partitioner,
+            'refresh_partition_weights',
+            return_value=False,
+        ) as mock_weights, mock.patch.object(
+            Partitioner,
+            'release_and_finish',
+        ) as mock_destroy:
+            assert partitioner._get_partitioner() == mock.sentinel.partitioner1
+
+            partitioner.force_partitions_refresh = True
+            assert partitioner._get_partitioner() == mock.sentinel.partitioner1
+
+            # This member published new weights
+            partitioner.force_partitions_refresh = True
+            mock_weights.return_value = True
+            assert partitioner._get_partitioner() == mock.sentinel.partitioner2
+            assert mock_create.call_count == 2
+            assert mock_destroy.called
+
+    def test__get_partitioner_incremental_weights_change(self, config):
+        config = config.copy(partition_assignment='throughput')
+        partitioner = Partitioner(config, self.topics, mock.Mock(), mock.Mock())
+        partitions = set(['topic1-0', 'topic1-1'])
+        incremental = mock.Mock(spec=IncrementalSetPartitioner, failed=False)
+        partitioner._partitioner = incremental
+        partitioner.partitions_set = partitions
+        with mock.patch.object(
+            Partitioner,
+            'get_partitions_set',
+            return_value=partitions,
+        ), mock.patch.object(
+            Partitioner,
+            'refresh_partition_weights',
+            return_value=True,
+        ), mock.patch.object(
+            Partitioner,
+            'release_and_finish',
+        ) as mock_destroy:
+            assert partitioner._get_partitioner() is incremental
+
+        # The party change makes all the members read the new weights
+        incremental.update_set.assert_called_once_with(partitions)
+        assert not mock_destroy.called
+
+    def test_refresh_partition_weights(self, config):
+        config = config.copy(partition_assignment='throughput')
+        partitioner = Partitioner(config, self.topics, mock.Mock(), mock.Mock())
+        partitioner.subscribed_topics = ['topic1']
+        with mock.patch.object(
+            Partitioner,
+            '_connect_zookeeper',
+        ), mock.patch(
+            'yelp_kafka.partitioner.ThroughputWeights',
+            autospec=True,
+        ) as mock_weights:
+            mock_weights.return_value.refresh.return_value = True
+            assert partitioner.refresh_partition_weights() is True
+
+            mock_weights.return_value.refresh.side_effect = Exception("Boom!")
+            assert partitioner.refresh_partition_weights() is False
+
+        assert mock_weights.call_count == 1
+        assert mock_weights.return_value.topics == ['topic1']
+
+    def test_refresh_partition_weights_count(self, partitioner):
+        assert partitioner.refresh_partition_weights() is False
+
+    def test_get_identifier_capacity(self, config):
+        config = config.copy(consumer_capacity=6)
+        partitioner = Partitioner(config, self.topics, mock.Mock(), mock.Mock())
+
+        assert partitioner.get_identifier().endswith('@6')
+
+    @mock.patch('yelp_kafka.partitioner.IncrementalSetPartitioner', autospec=True)
+    @mock.patch('yelp_kafka.partitioner.KafkaClient', autospec=True)
+    @mock.patch('kazoo.client.KazooClient')
+    def test__create_partitioner_incremental(
+        self,
+        mock_kazoo,
+        _,
+        mock_incremental,
+        config,
+    ):
+        config = config.copy(rebalance_protocol='incremental')
+        mock_kazoo.return_value.state = KazooState.CONNECTED
+        partitioner = Partitioner(config, self.topics, mock.Mock(), mock.Mock())
+        with mock.patch.object(Partitioner, '_refresh'):
+            partitioner.start()
+        expected_partitions = set(['topic1-1', 'topic1-2'])
+
+        actual = partitioner._create_partitioner(expected_partitions)
+
+        assert actual == mock_incremental.return_value
+        mock_incremental.assert_called_once_with(
+            mock_kazoo.return_value,
+            path='/yelp-kafka/test_group/{sha}'.format(sha=self.sha),
+            set=expected_partitions,
+            partition_func=mock.ANY,
+            identifier=partitioner.get_identifier(),
+        )
+        partition_func = mock_incremental.call_args[1]['partition_func']
+        assert isinstance(partition_func, WeightedAssignment)
+        assert partition_func.weights == {}
+        assert not mock_kazoo.return_value.SetPartitioner.called
+
+    def test_invalid_rebalance_protocol(self, config):
+        config = config.copy(rebalance_protocol='lazy')
+        with pytest.raises(ConfigurationError):
+            Partitioner(config, self.topics, mock.Mock(), mock.Mock())
+
+    def test_invalid_partition_assignment(self, config):
+        config = config.copy(partition_assignment='random')
+        with pytest.raises(ConfigurationError):
+            Partitioner(config, self.topics, mock.Mock(), mock.Mock())
+
+    @pytest.mark.parametrize('member_index, member_count', [
+        (None, 2),
+        (1, None),
+        (2, 2),
+        (-1, 2),
+    ])
+    def test_invalid_static_membership(self, config, member_index, member_count):
+        with mock.patch.dict('os.environ', clear=True):
+            with pytest.raises(ConfigurationError):
+                config = config.copy(
+                    rebalance_protocol='static',
+                    static_member_index=member_index,
+                    static_member_count=member_count,
+                )
+                Partitioner(config, self.topics, mock.Mock(), mock.Mock())
+
+    def test_static_throughput_assignment(self, config):
+        config = config.copy(
+            rebalance_protocol='static',
+            partition_assignment='throughput',
+            static_member_index=0,
+            static_member_count=1,
+        )
+        with pytest.raises(ConfigurationError):
+            Partitioner(config, self.topics, mock.Mock(), mock.Mock())
+
+    @mock.patch('yelp_kafka.partitioner.KafkaClient', autospec=True)
+    @mock.patch('kazoo.client.KazooClient', autospec=True)
+    def test_start_static(self, mock_kazoo, _, config, session_manager):
+        config = config.copy(
+            rebalance_protocol='static',
+            static_member_index=1,
+            static_member_count=2,
+        )
+        mock_acquire = mock.Mock()
+        partitioner = Partitioner(config, self.topics, mock_acquire, mock.Mock())
+        partitioner.metadata_cache = TopicMetadataCache()
+        with mock.patch(
+            'yelp_kafka.metadata_cache.get_kafka_topics_partitions',
+            autospec=True,
+            return_value={
+                kafka_bytestring('topic1'): [0, 1],
+                kafka_bytestring('topic2'): [0, 1],
+            },
+        ):
+            partitioner.start()
+
+        # sorted: topic1-0, topic1-1, topic2-0, topic2-1
+        mock_acquire.assert_called_once_with({'topic1': [1], 'topic2': [1]})
+        assert not mock_kazoo.called
+        assert len(session_manager) == 0
+
+        partitioner.stop()
+        assert not mock_kazoo.called
+
+    @mock.patch('yelp_kafka.partitioner.KafkaClient', autospec=True)
+    @mock.patch('kazoo.client.KazooClient', autospec=True)
+    def test_start_static_no_partitions(self, mock_kazoo, _, config):
+        config = config.copy(
+            rebalance_protocol='static',
+            static_member_index=2,
+            static_member_count=3,
+        )
+        mock_acquire = mock.Mock()
+        partitioner = Partitioner(config, ['topic1'], mock_acquire, mock.Mock())
+        partitioner.metadata_cache = TopicMetadataCache()
+        with mock.patch(
+            'yelp_kafka.metadata_cache.get_kafka_topics_partitions',
+            autospec=True,
+            return_value={kafka_bytestring('topic1'): [0, 1]},
+        ):
+            partitioner.start()
+
+        assert not mock_acquire.called
+        assert partitioner.acquired_partitions == {}
+        assert not mock_kazoo.called
+
+    @mock.patch('yelp_kafka.partitioner.KafkaClient', autospec=True)
+    @mock.patch('kazoo.client.KazooClient')
+    def test__create_partitioner_weighted(self, mock_kazoo, _, config):
+        mock_kazoo.return_value.state = KazooState.CONNECTED
+        partitioner = Partitioner(config, self.topics, mock.Mock(), mock.Mock())
+        with mock.patch.object(Partitioner, '_refresh'):
+            partitioner.start()
+        partitioner.config = config.copy(partition_assignment='throughput')
+
+        partitioner._create_partitioner(set(['topic1-1', 'topic1-2']))
+
+        partition_func = mock_kazoo.return_value.SetPartitioner.call_args[1]['partition_func']
+        assert isinstance(partition_func, ThroughputAssignment)
+        assert partition_func.throughput_weights is partitioner._throughput_weights
+        assert partition_func.throughput_weights.path == (
+            partitioner.zk_group_path + '/weights'
+        )
+
     @mock.patch('yelp_kafka.partitioner.KafkaClient')
-    @mock.patch('yelp_kafka.partitioner.KazooClient')
+    @mock.patch('kazoo.client.KazooClient')
     def test__close_connections(self, mock_kazoo, mock_kafka, config):
         partitioner = Partitioner(config, self.topics, mock.Mock(), mock.Mock())
         with mock.patch.object(
@@ -261,7 +845,36 @@ class TestPartitioner(object):
             assert partitioner.last_partitions_refresh == 0
 
     @mock.patch('yelp_kafka.partitioner.KafkaClient', autospec=True)
-    @mock.patch('yelp_kafka.partitioner.KazooClient')
+    @mock.patch('kazoo.client.KazooClient', autospec=True)
+    def test_multiple_partitioners_share_session(
+        self,
+        mock_kazoo,
+        _,
+        config,
+        session_manager,
+    ):
+        partitioners = [
+            Partitioner(config, self.topics, mock.Mock(), mock.Mock())
+            for _ in range(3)
+        ]
+        with mock.patch.object(Partitioner, '_refresh', autospec=True):
+            for partitioner in partitioners:
+                partitioner.start()
+
+        assert mock_kazoo.call_count == 1
+        assert len(set(p.get_identifier() for p in partitioners)) == 3
+        assert all('@' not in p.get_identifier() for p in partitioners)
+
+        partitioners[0].stop()
+        partitioners[1].stop()
+        assert not mock_kazoo.return_value.stop.called
+        partitioners[2].stop()
+        mock_kazoo.return_value.stop.assert_called_once_with()
+        mock_kazoo.return_value.close.assert_called_once_with()
+        assert len(session_manager) == 0
+
+    @mock.patch('yelp_kafka.partitioner.KafkaClient', autospec=True)
+    @mock.patch('kazoo.client.KazooClient')
     def test__create_partitioner_with_kazoo_connection(
         self,
         mock_kazoo,
@@ -290,12 +903,14 @@ class TestPartitioner(object):
             mock_kazoo.return_value.SetPartitioner.assert_called_once_with(
                 path='/yelp-kafka/test_group/{sha}'.format(sha=self.sha),
                 set=expected_partitions,
+                partition_func=mock.ANY,
+                identifier=partitioner.get_identifier(),
                 time_boundary=0.5
             )
             assert not mock_kazoo.return_value.start.called
 
     @mock.patch('yelp_kafka.partitioner.KafkaClient', autospec=True)
-    @mock.patch('yelp_kafka.partitioner.KazooClient')
+    @mock.patch('kazoo.client.KazooClient')
     def test__create_partitioner_no_kazoo_connection(
         self,
         mock_kazoo,
@@ -324,6 +939,8 @@ class TestPartitioner(object):
             mock_kazoo.return_value.SetPartitioner.assert_called_once_with(
                 path='/yelp-kafka/test_group/{sha}'.format(sha=self.sha),
                 set=expected_partitions,
+                partition_func=mock.ANY,
+                identifier=partitioner.get_identifier(),
                 time_boundary=0.5
             )
             assert mock_kazoo.return_value.start.call_count == 1
@@ -357,10 +974,15 @@ class TestPartitioner(object):
         ) as mock_release:
             # Attach a mocked partitioner and kafka client
             mock_kpartitioner = mock.MagicMock(spec=SetPartitioner)
+            mock_kpartitioner._client = mock.Mock()
             partitioner._partitioner = mock_kpartitioner
 
             partitioner.release_and_finish()
 
             mock_kpartitioner.finish.assert_called_once_with()
+            # The shared session doesn't keep notifying the partitioner
+            mock_kpartitioner._client.remove_listener.assert_called_once_with(
+                mock_kpartitioner._establish_sessionwatch,
+            )
             assert partitioner._partitioner is None
             mock_release.assert_called_once_with(mock_kpartitioner)
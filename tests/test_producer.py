@@ -18,13 +18,24 @@ Tests for `yelp_kafka.producer` module.
 from __future__ import absolute_import
 from __future__ import unicode_literals
 
+import copy
+
 import mock
 import pytest
 from kafka import SimpleProducer
+from kafka.common import BrokerMetadata
+from kafka.common import FailedPayloadsError
+from kafka.common import NotLeaderForPartitionError
+from kafka.common import ProduceRequest
+from kafka.common import ProduceResponse
+from kafka.common import TopicAndPartition
 
 from yelp_kafka import metrics
 from yelp_kafka.config import ClusterConfig
 from yelp_kafka.error import YelpKafkaError
+from yelp_kafka.metrics_responder import MetricsResponder
+from yelp_kafka.producer import METRIC_PREFIX
+from yelp_kafka.producer import YelpKafkaKeyedProducer
 from yelp_kafka.producer import YelpKafkaProducerMetrics
 from yelp_kafka.producer import YelpKafkaSimpleProducer
 
@@ -52,7 +63,7 @@ def mock_kafka_send_messages():
 
 @pytest.fixture
 def mock_kafka_client():
-    return mock.Mock(client_id='test_id')
+    return mock.Mock(client_id='test_id', topics_to_brokers={})
 
 
 @pytest.fixture()
@@ -99,6 +110,10 @@ def test_setup_metrics(
         metrics_responder=mock_metrics_responder
     )
     assert mock_metrics_responder.get_timer_emitter.call_count == len(metrics.TIME_METRIC_NAMES)
+    # Failure counters and the enqueue exception counter
+    assert mock_metrics_responder.get_counter_emitter.call_count == (
+        len(metrics.FAILURE_COUNT_METRIC_NAMES) + 1
+    )
 
 
 def test_send_kafka_metrics(mock_producer_metrics):
@@ -116,6 +131,261 @@ def test_send_kafka_metrics(mock_producer_metrics):
     assert mock_producer_metrics._get_timer('unknown_metric').record.call_count == 0
 
 
+def test_send_kafka_metrics_failure(mock_producer_metrics):
+    metric = next(iter(metrics.FAILURE_COUNT_METRIC_NAMES))
+    mock_producer_metrics._send_kafka_metrics(metric, 10)
+    mock_producer_metrics.metrics_responder.record.assert_called_once_with(
+        mock_producer_metrics._get_counter(metric),
+        1,
+    )
+
+
+def test_send_kafka_metrics_unknown_logged_once(mock_producer_metrics):
+    with mock.patch.object(mock_producer_metrics, 'log') as mock_log:
+        mock_producer_metrics._send_kafka_metrics('unknown_metric', 10)
+        mock_producer_metrics._send_kafka_metrics('unknown_metric', 10)
+
+    mock_log.debug.assert_called_once_with("Unknown metric: %s", 'unknown_metric')
+    assert not mock_log.warn.called
+    assert not mock_producer_metrics.metrics_responder.record.called
+
+
+class FakeClient(object):
+    """Deep-copyable client recording the produce requests"""
+
+    client_id = 'test_id'
+
+    def __init__(self):
+        self.topics_to_brokers = {
+            TopicAndPartition('topic1', 0): BrokerMetadata(1, 'broker1', 9092),
+            TopicAndPartition('topic1', 1): BrokerMetadata(1, 'broker1', 9092),
+            TopicAndPartition('topic2', 0): BrokerMetadata(2, 'broker2', 9092),
+        }
+        self.requests = []
+
+    def send_produce_request(
+        self,
+        payloads=(),
+        acks=1,
+        timeout=1000,
+        fail_on_error=True,
+        callback=None,
+    ):
+        self.requests.append(payloads)
+        responses = [
+            ProduceResponse(payload.topic, payload.partition, 0, 0)
+            for payload in payloads
+        ]
+        return [callback(response) for response in responses]
+
+
+class TestProduceRequestMetrics(object):
+
+    @pytest.fixture
+    def client(self):
+        return FakeClient()
+
+    @pytest.fixture
+    def producer_metrics(self, client, mock_cluster_config):
+        responder = mock.Mock()
+        responder.get_counter_emitter.side_effect = (
+            lambda name, dimensions: ('counter', name, dimensions.get('topic'), dimensions.get('broker'))
+        )
+        responder.get_timer_emitter.side_effect = (
+            lambda name, default_dimensions: ('timer', name, default_dimensions.get('topic'), default_dimensions.get('broker'))
+        )
+        return YelpKafkaProducerMetrics(
+            client=client,
+            cluster_config=mock_cluster_config,
+            metrics_responder=responder,
+        )
+
+    def test_send_produce_request(self, client, producer_metrics):
+        payloads = [
+            ProduceRequest('topic1', 0, [mock.sentinel.msg1, mock.sentinel.msg2]),
+            ProduceRequest('topic1', 1, [mock.sentinel.msg3]),
+        ]
+
+        with mock.patch(
+            'yelp_kafka.producer.time.time',
+            side_effect=[10, 10.25],
+        ):
+            actual = client.send_produce_request(payloads, acks=1)
+
+        assert actual == [
+            ProduceResponse('topic1', 0, 0, 0),
+            ProduceResponse('topic1', 1, 0, 0),
+        ]
+        assert client.requests == [payloads]
+        records = producer_metrics.metrics_responder.record.call_args_list
+        assert sorted(records) == sorted([
+            mock.call(('timer', METRIC_PREFIX + 'produce_latency', 'topic1', 'broker1:9092'), 250),
+            mock.call(('timer', METRIC_PREFIX + 'produce_batch_size', 'topic1', 'broker1:9092'), 2),
+            mock.call(('timer', METRIC_PREFIX + 'produce_batch_size', 'topic1', 'broker1:9092'), 1),
+        ])
+
+    def test_send_produce_request_multiple_leaders(self, client, producer_metrics):
+        payloads = [
+            ProduceRequest('topic1', 0, [mock.sentinel.msg1, mock.sentinel.msg2]),
+            ProduceRequest('topic2', 0, [mock.sentinel.msg3]),
+            ProduceRequest('topic2', 1, [mock.sentinel.msg4]),
+        ]
+
+        with mock.patch(
+            'yelp_kafka.producer.time.time',
+            side_effect=[10, 10.25],
+        ):
+            client.send_produce_request(payloads)
+
+        records = producer_metrics.metrics_responder.record.call_args_list
+        assert sorted(records) == sorted([
+            mock.call(('timer', METRIC_PREFIX + 'produce_latency', 'topic1', 'multiple'), 250),
+            mock.call(('timer', METRIC_PREFIX + 'produce_latency', 'topic2', 'multiple'), 250),
+            mock.call(('timer', METRIC_PREFIX + 'produce_batch_size', 'topic1', 'broker1:9092'), 2),
+            mock.call(('timer', METRIC_PREFIX + 'produce_batch_size', 'topic2', 'broker2:9092'), 1),
+            mock.call(('timer', METRIC_PREFIX + 'produce_batch_size', 'topic2', 'unknown'), 1),
+        ])
+
+    def test_send_produce_request_callback(self, client, producer_metrics):
+        payloads = [ProduceRequest('topic1', 0, [mock.sentinel.msg1])]
+
+        actual = client.send_produce_request(
+            payloads,
+            callback=lambda response: response.offset + 1,
+        )
+
+        assert actual == [1]
+
+    def test_send_produce_request_failure(self, client, producer_metrics):
+        payloads = [
+            ProduceRequest('topic1', 0, [mock.sentinel.msg1]),
+            ProduceRequest('topic2', 0, [mock.sentinel.msg2]),
+        ]
+
+        with mock.patch.object(
+            FakeClient,
+            'send_produce_request',
+            side_effect=YelpKafkaError,
+        ):
+            client = copy.deepcopy(client)
+            with pytest.raises(YelpKafkaError):
+                client.send_produce_request(payloads)
+
+        responder = producer_metrics.metrics_responder
+        responder.record.assert_any_call(
+            ('counter', METRIC_PREFIX + 'produce_failure_count', 'topic1', 'broker1:9092'),
+            1,
+        )
+        responder.record.assert_any_call(
+            ('counter', METRIC_PREFIX + 'produce_failure_count', 'topic2', 'broker2:9092'),
+            1,
+        )
+        assert responder.record.call_count == 6
+
+    def test_send_produce_request_raised_error_response(self, client, producer_metrics):
+        payloads = [
+            ProduceRequest('topic1', 0, [mock.sentinel.msg1]),
+            ProduceRequest('topic2', 0, [mock.sentinel.msg2]),
+        ]
+        error = NotLeaderForPartitionError(ProduceResponse('topic2', 0, 6, -1))
+
+        with mock.patch.object(
+            FakeClient,
+            'send_produce_request',
+            side_effect=error,
+        ):
+            client = copy.deepcopy(client)
+            with pytest.raises(NotLeaderForPartitionError):
+                client.send_produce_request(payloads)
+
+        records = producer_metrics.metrics_responder.record.call_args_list
+        failures = [record for record in records if record[0][0][0] == 'counter']
+        assert failures == [mock.call(
+            ('counter', METRIC_PREFIX + 'produce_failure_count', 'topic2', 'broker2:9092'),
+            1,
+        )]
+
+    def test_send_produce_request_error_responses(self, client, producer_metrics):
+        payloads = [
+            ProduceRequest('topic1', 0, [mock.sentinel.msg1]),
+            ProduceRequest('topic1', 1, [mock.sentinel.msg2]),
+            ProduceRequest('topic2', 0, [mock.sentinel.msg3]),
+        ]
+        responses = [
+            ProduceResponse('topic1', 0, 0, 10),
+            ProduceResponse('topic1', 1, 6, -1),
+            FailedPayloadsError(payloads[2]),
+        ]
+
+        def send_produce_request(self, payloads, fail_on_error, callback, **kwargs):
+            assert not fail_on_error
+            return [callback(response) for response in responses]
+
+        with mock.patch.object(
+            FakeClient,
+            'send_produce_request',
+            send_produce_request,
+        ):
+            client = copy.deepcopy(client)
+            actual = client.send_produce_request(payloads, fail_on_error=False)
+
+        assert actual == responses
+        records = producer_metrics.metrics_responder.record.call_args_list
+        failures = [record for record in records if record[0][0][0] == 'counter']
+        assert sorted(failures) == sorted([
+            mock.call(('counter', METRIC_PREFIX + 'produce_failure_count', 'topic1', 'broker1:9092'), 1),
+            mock.call(('counter', METRIC_PREFIX + 'produce_failure_count', 'topic2', 'broker2:9092'), 1),
+        ])
+
+    def test_client_copy_reports_metrics(self, client, producer_metrics):
+        payloads = [ProduceRequest('topic1', 0, [mock.sentinel.msg1])]
+
+        client_copy = copy.deepcopy(client)
+        client_copy.send_produce_request(payloads)
+
+        # Sent by the copy and reported to the same metrics
+        assert client_copy.requests == [payloads]
+        assert client.requests == []
+        assert client_copy.metrics_responder.__self__ is producer_metrics
+        producer_metrics.metrics_responder.record.assert_any_call(
+            ('timer', METRIC_PREFIX + 'produce_batch_size', 'topic1', 'broker1:9092'),
+            1,
+        )
+
+    def test_request_emitters_are_cached(self, client, producer_metrics):
+        payloads = [ProduceRequest('topic1', 0, [mock.sentinel.msg1])]
+
+        client.send_produce_request(payloads)
+        client.send_produce_request(payloads)
+
+        assert producer_metrics.metrics_responder.get_timer_emitter.call_count == (
+            len(metrics.TIME_METRIC_NAMES) + 2
+        )
+
+
+def test_async_producer_reports_metrics(mock_cluster_config):
+    client = FakeClient()
+    responder = mock.Mock(spec=MetricsResponder)
+
+    with mock.patch.object(FakeClient, 'copy', create=True) as mock_copy:
+        mock_copy.side_effect = lambda: copy.deepcopy(client)
+        with mock.patch('kafka.producer.base.Thread', autospec=True) as mock_thread:
+            producer = YelpKafkaSimpleProducer(
+                client=client,
+                cluster_config=mock_cluster_config,
+                metrics_responder=responder,
+                **{'async': True}
+            )
+            producer.stop()
+
+    # The thread of async producers sends with a copy of the client
+    thread_client = mock_thread.call_args[1]['args'][1]
+    assert thread_client is not client
+    thread_client.send_produce_request([ProduceRequest('topic1', 0, [mock.sentinel.msg1])])
+    assert thread_client.requests
+    assert responder.record.called
+
+
 def test_send_msg_to_kafka_success(
     mock_kafka_producer,
     mock_kafka_send_messages,
@@ -125,6 +395,21 @@ def test_send_msg_to_kafka_success(
     mock_kafka_send_messages.assert_called_once_with('test_topic', mock_msg)
 
 
+@pytest.mark.parametrize('producer_class, key', [
+    (YelpKafkaSimpleProducer, ()),
+    (YelpKafkaKeyedProducer, (b'key',)),
+])
+def test_send_messages_returns_responses(producer_class, key):
+    client = mock.Mock()
+    client.get_partition_ids_for_topic.return_value = [0]
+    client.send_produce_request.return_value = [mock.sentinel.response]
+    producer = producer_class(client=client, report_metrics=False)
+
+    args = ('test_topic',) + key + (b'msg1', b'msg2')
+    assert producer.send_messages(*args) == [mock.sentinel.response]
+    assert client.send_produce_request.call_count == 1
+
+
 def test_send_task_to_kafka_failure(
     mock_kafka_producer,
     mock_metrics_responder,
@@ -141,3 +426,20 @@ def test_send_task_to_kafka_failure(
         mock_kafka_producer.metrics.kafka_enqueue_exception_count,
         1
     )
+
+
+def test_default_metrics_responder(
+    mock_kafka_client,
+    mock_kafka_send_messages,
+    mock_cluster_config,
+):
+    with mock.patch(
+        'yelp_kafka.producer.get_default_responder_if_available',
+        return_value=mock.MagicMock(),
+    ) as mock_default:
+        producer = YelpKafkaSimpleProducer(
+            client=mock_kafka_client,
+            cluster_config=mock_cluster_config,
+        )
+
+    assert producer.metrics.metrics_responder is mock_default.return_value
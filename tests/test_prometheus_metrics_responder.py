@@ -0,0 +1,208 @@
+# -*- coding: utf-8 -*-
+# Copyright 2016 Yelp Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+import threading
+
+import mock
+import pytest
+from six.moves.urllib.request import urlopen
+
+from yelp_kafka.prometheus_metrics_responder import Counter
+from yelp_kafka.prometheus_metrics_responder import PrometheusMetricsResponder
+from yelp_kafka.prometheus_metrics_responder import sanitize_metric_name
+from yelp_kafka.prometheus_metrics_responder import Timer
+
+
+def test_sanitize_metric_name():
+    assert sanitize_metric_name(
+        'yelp_kafka.KafkaConsumerGroup.fetch_request_timer'
+    ) == 'yelp_kafka_KafkaConsumerGroup_fetch_request_timer'
+    assert sanitize_metric_name('1-metric') == '_1_metric'
+
+
+class TestCounter(object):
+
+    def test_count_from_threads(self):
+        counter = Counter('metric', ())
+
+        def count():
+            for _ in range(1000):
+                counter.count(1)
+
+        threads = [threading.Thread(target=count) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        counter.count(5)
+
+        assert counter.value == 4005
+        # The shards of the exited threads are folded
+        assert len(counter._shards) == 1
+
+    def test_shards_of_exited_threads_are_folded(self):
+        counter = Counter('metric', ())
+        started = threading.Event()
+        stop = threading.Event()
+
+        def count():
+            counter.count(1)
+            started.set()
+            stop.wait()
+
+        running = threading.Thread(target=count)
+        running.start()
+        started.wait()
+        for _ in range(10):
+            thread = threading.Thread(target=counter.count, args=(2,))
+            thread.start()
+            thread.join()
+
+        assert counter.value == 21
+        assert len(counter._shards) == 1
+        stop.set()
+        running.join()
+        assert counter.value == 21
+        assert counter._shards == []
+
+
+class TestTimer(object):
+
+    def test_samples(self):
+        timer = Timer('metric', (), buckets=(1, 10))
+        for value in (0.5, 1, 5, 20):
+            timer.record(value)
+
+        assert timer.samples() == [
+            ('_bucket', (('le', '1'),), 2),
+            ('_bucket', (('le', '10'),), 3),
+            ('_bucket', (('le', '+Inf'),), 4),
+            ('_sum', (), 26.5),
+            ('_count', (), 4),
+        ]
+
+
+class TestPrometheusMetricsResponder(object):
+
+    @pytest.fixture
+    def responder(self):
+        return PrometheusMetricsResponder(timer_buckets=(10, 1))
+
+    def test_emitters_are_shared(self, responder):
+        counter = responder.get_counter_emitter('a.counter', {'b': 1, 'a': 2})
+
+        assert counter is responder.get_counter_emitter(
+            'a.counter',
+            {'a': 2, 'b': 1},
+        )
+        assert counter is not responder.get_counter_emitter('a.counter', {})
+        with pytest.raises(ValueError):
+            responder.get_timer_emitter('a.counter', {})
+
+    def test_record(self, responder):
+        counter = responder.get_counter_emitter('counter')
+        timer = responder.get_timer_emitter('timer')
+
+        responder.record(counter, 1)
+        responder.record(counter, 2)
+        responder.record(timer, 5)
+        with mock.patch.object(responder, 'log') as mock_log:
+            responder.record(mock.sentinel.unknown, 1)
+
+        assert counter.value == 3
+        assert timer.buckets == (1, 10)
+        assert timer.samples()[1] == ('_bucket', (('le', '10'),), 1)
+        assert mock_log.error.called
+
+    def test_record_many(self, responder):
+        counter = responder.get_counter_emitter('counter')
+        timer = responder.get_timer_emitter('timer')
+        gauge = responder.get_gauge_emitter('gauge')
+
+        responder.record_many(counter, 2, 3)
+        responder.record_many(timer, 5, 1000)
+        responder.record_many(gauge, 4, 2)
+
+        assert counter.value == 6
+        assert timer.samples() == [
+            ('_bucket', (('le', '1'),), 0),
+            ('_bucket', (('le', '10'),), 1000),
+            ('_bucket', (('le', '+Inf'),), 1000),
+            ('_sum', (), 5000),
+            ('_count', (), 1000),
+        ]
+        assert gauge.value == 4
+
+    def test_record_gauge(self, responder):
+        gauge = responder.get_gauge_emitter('yelp_kafka.lag', {'group_id': 'g'})
+
+        responder.record(gauge, 10)
+        responder.record(gauge, 4)
+
+        assert responder.render() == (
+            '# TYPE yelp_kafka_lag gauge\n'
+            'yelp_kafka_lag{group_id="g"} 4\n'
+        )
+
+    def test_render(self, responder):
+        responder.record(
+            responder.get_counter_emitter(
+                'yelp_kafka.failed_count',
+                {'group_id': b'my_group', 'cluster-name': 'c"1'},
+            ),
+            1,
+        )
+        responder.record(
+            responder.get_counter_emitter(
+                'yelp_kafka.failed_count',
+                {'group_id': b'other', 'cluster-name': 'c"1'},
+            ),
+            2,
+        )
+        responder.record(responder.get_timer_emitter('yelp_kafka.timer'), 2.5)
+
+        assert responder.render() == (
+            '# TYPE yelp_kafka_failed_count counter\n'
+            'yelp_kafka_failed_count{cluster_name="c\\"1",group_id="my_group"} 1\n'
+            'yelp_kafka_failed_count{cluster_name="c\\"1",group_id="other"} 2\n'
+            '# TYPE yelp_kafka_timer histogram\n'
+            'yelp_kafka_timer_bucket{le="1"} 0\n'
+            'yelp_kafka_timer_bucket{le="10"} 1\n'
+            'yelp_kafka_timer_bucket{le="+Inf"} 1\n'
+            'yelp_kafka_timer_sum 2.5\n'
+            'yelp_kafka_timer_count 1\n'
+        )
+
+    def test_write_textfile(self, responder, tmpdir):
+        responder.record(responder.get_counter_emitter('counter'), 7)
+        path = tmpdir.join('yelp_kafka.prom')
+
+        responder.write_textfile(str(path))
+
+        assert path.read() == '# TYPE counter counter\ncounter 7\n'
+        assert tmpdir.listdir() == [path]
+
+    def test_http_server(self, responder):
+        responder.record(responder.get_counter_emitter('counter'), 7)
+        port = responder.start_http_server(0, addr='127.0.0.1')
+        try:
+            response = urlopen('http://127.0.0.1:{0}/metrics'.format(port))
+            assert response.read() == b'# TYPE counter counter\ncounter 7\n'
+            assert response.info()['Content-Type'].startswith('text/plain')
+        finally:
+            responder.stop_http_server()
+        assert responder._http_server is None
@@ -0,0 +1,323 @@
+# -*- coding: utf-8 -*-
+# Copyright 2016 Yelp Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+import mock
+import pytest
+from kafka import KafkaConsumer
+from kafka.common import ConsumerTimeout
+from kafka.common import KafkaMessage
+from kafka.common import OffsetFetchResponse
+
+from yelp_kafka.error import ProcessMessageError
+from yelp_kafka.shared_memory_group import deserialize
+from yelp_kafka.shared_memory_group import MessageFetcher
+from yelp_kafka.shared_memory_group import serialize
+from yelp_kafka.shared_memory_group import SharedMemoryConsumerGroup
+from yelp_kafka.shared_memory_group import SharedMemoryWorker
+from yelp_kafka.shared_ring import SharedRingBuffer
+
+
+def get_message(partition, offset, topic='topic1'):
+    return KafkaMessage(topic, partition, offset, b'key', b'value')
+
+
+class TestSharedMemoryWorker(object):
+
+    @pytest.fixture
+    def worker(self, config):
+        worker = SharedMemoryWorker(config, 0)
+        worker.messages_ring = SharedRingBuffer(1024)
+        worker.acks_ring = SharedRingBuffer(1024)
+        return worker
+
+    def test_consume(self, worker):
+        messages = [get_message(0, 10), get_message(1, 5), get_message(0, 11)]
+        worker.messages_ring.put(serialize([tuple(m) for m in messages]))
+        processed = []
+
+        def process(message):
+            processed.append(message)
+            if len(processed) == len(messages):
+                worker.terminate()
+
+        with mock.patch.object(worker, 'process', side_effect=process):
+            worker._consume()
+
+        assert processed == messages
+        assert deserialize(worker.acks_ring.get(timeout=0)) == {
+            ('topic1', 0): 11,
+            ('topic1', 1): 5,
+        }
+
+    def test_consume_process_error(self, worker):
+        worker.messages_ring.put(serialize([tuple(get_message(0, 10))]))
+
+        with mock.patch.object(worker, 'process', side_effect=ValueError):
+            with pytest.raises(ProcessMessageError):
+                worker._consume()
+
+        assert worker.acks_ring.get(timeout=0) is None
+
+
+class TestMessageFetcher(object):
+
+    partitions = {'topic1': [0, 1, 2], 'topic2': [0]}
+
+    @pytest.fixture
+    def fetcher(self, config):
+        config = config.copy(max_termination_timeout_secs=0.1)
+        fetcher = MessageFetcher(
+            config,
+            self.partitions,
+            [SharedRingBuffer(1024), SharedRingBuffer(1024)],
+            [SharedRingBuffer(1024), SharedRingBuffer(1024)],
+        )
+        fetcher.consumer = mock.Mock()
+        fetcher.consumer._offsets.task_done = {}
+        fetcher.consumer._does_auto_commit_messages.return_value = False
+        fetcher.consumer._should_auto_commit.return_value = False
+        return fetcher
+
+    def test_workers(self, fetcher):
+        assert fetcher.workers == {
+            ('topic1', 0): 0,
+            ('topic1', 1): 1,
+            ('topic1', 2): 0,
+            ('topic2', 0): 1,
+        }
+
+    def test_dispatch_and_ack(self, fetcher):
+        fetcher._add(get_message(0, 10))
+        fetcher._add(get_message(1, 20))
+        fetcher._add(get_message(2, 30))
+        fetcher._flush_batches()
+
+        assert deserialize(fetcher.messages_rings[0].get(timeout=0)) == [
+            tuple(get_message(0, 10)),
+            tuple(get_message(2, 30)),
+        ]
+        assert deserialize(fetcher.messages_rings[1].get(timeout=0)) == [
+            tuple(get_message(1, 20)),
+        ]
+        assert fetcher._pending()
+
+        fetcher.acks_rings[0].put(serialize({('topic1', 0): 10, ('topic1', 2): 30}))
+        fetcher.acks_rings[1].put(serialize({('topic1', 1): 20}))
+        fetcher._read_acks()
+
+        assert not fetcher._pending()
+        assert fetcher.consumer._offsets.task_done == {
+            (b'topic1', 0): 10,
+            (b'topic1', 2): 30,
+            (b'topic1', 1): 20,
+        }
+        assert not fetcher.consumer.task_done.called
+
+    def test_ack_auto_commit(self, fetcher):
+        fetcher.consumer._does_auto_commit_messages.return_value = True
+        fetcher.consumer._should_auto_commit.side_effect = [False, True]
+
+        fetcher.acks_rings[0].put(serialize({('topic1', 0): 10}))
+        fetcher._read_acks()
+        fetcher.acks_rings[0].put(serialize({('topic1', 0): 15}))
+        fetcher._read_acks()
+
+        assert fetcher.consumer._incr_auto_commit_message_count.call_args_list == [
+            mock.call(1),
+            mock.call(5),
+        ]
+        fetcher.consumer.commit.assert_called_once_with()
+
+    @mock.patch('kafka.consumer.kafka.KafkaClient', autospec=True)
+    def test_ack_batches_logs_no_warning(self, mock_client, fetcher):
+        mock_client.return_value.topic_partitions = {b'topic1': {0: None}}
+        mock_client.return_value.get_partition_ids_for_topic.return_value = [0]
+        mock_client.return_value.send_offset_fetch_request.return_value = [
+            OffsetFetchResponse(b'topic1', 0, 10, b'', 0),
+        ]
+        fetcher.consumer = KafkaConsumer(
+            ('topic1', 0),
+            bootstrap_servers=['test_broker:9292'],
+            group_id='test_group',
+            auto_commit_enable=False,
+        )
+
+        with mock.patch('kafka.consumer.kafka.logger') as mock_logger:
+            for offset in (14, 20):
+                fetcher.acks_rings[0].put(serialize({('topic1', 0): offset}))
+                fetcher._read_acks()
+
+        assert fetcher.consumer._offsets.task_done[(b'topic1', 0)] == 20
+        assert not mock_logger.warning.called
+
+    def test_flush_expired_only(self, fetcher):
+        fetcher._add(get_message(0, 10))
+        fetcher._flush_batches(expired_only=True)
+
+        assert fetcher.messages_rings[0].get(timeout=0) is None
+
+        with mock.patch(
+            'yelp_kafka.shared_memory_group.MAX_BATCH_DELAY_SECS',
+            0,
+        ):
+            fetcher._flush_batches(expired_only=True)
+
+        assert fetcher.messages_rings[0].get(timeout=0) is not None
+
+    def test_send_splits_large_batches(self, fetcher):
+        batch = [
+            ('topic1', 0, offset, b'key', b'v' * 100)
+            for offset in range(4)
+        ]
+
+        fetcher._send(0, batch)
+
+        ring = fetcher.messages_rings[0]
+        received = []
+        data = ring.get(timeout=0)
+        while data is not None:
+            assert len(data) <= ring.max_record_size
+            received += deserialize(data)
+            data = ring.get(timeout=0)
+        assert received == batch
+
+    @mock.patch('yelp_kafka.shared_memory_group.KafkaConsumer', autospec=True)
+    def test_run_commits_processed_offsets(self, mock_consumer, fetcher):
+        messages = [get_message(0, 10), get_message(0, 11)]
+
+        def next_message():
+            if messages:
+                return messages.pop(0)
+            fetcher.terminate()
+            raise ConsumerTimeout()
+
+        mock_consumer.return_value.next.side_effect = next_message
+        mock_consumer.return_value._offsets = mock.Mock(task_done={})
+        mock_consumer.return_value._should_auto_commit.return_value = False
+        fetcher.acks_rings[0].put(serialize({('topic1', 0): 11}))
+
+        fetcher.run()
+
+        assert mock_consumer.call_args[0] == (self.partitions,)
+        assert mock_consumer.call_args[1]['consumer_timeout_ms'] == 100
+        assert mock_consumer.return_value._offsets.task_done == {
+            (b'topic1', 0): 11,
+        }
+        mock_consumer.return_value.commit.assert_called_once_with()
+        mock_consumer.return_value.close.assert_called_once_with()
+
+
+class TestSharedMemoryConsumerGroup(object):
+
+    topics = ['topic1', 'topic2']
+    partitions = {'topic1': [0, 1], 'topic2': [0]}
+
+    @pytest.fixture
+    @mock.patch('yelp_kafka.shared_memory_group.Partitioner', autospec=True)
+    def group(self, _, config):
+        config = config.copy(max_termination_timeout_secs=0.1)
+        return SharedMemoryConsumerGroup(
+            self.topics,
+            config,
+            SharedMemoryWorker,
+            worker_count=3,
+            ring_buffer_bytes=1024,
+        )
+
+    @mock.patch('yelp_kafka.shared_memory_group.Process', autospec=True)
+    def test_acquire(self, mock_process, group, mock_post_rebalance_cb):
+        group.acquire(self.partitions)
+
+        assert mock_process.call_count == 4
+        assert mock_process.return_value.start.call_count == 4
+        assert [w.worker_id for w in group.workers] == [0, 1, 2]
+        assert group.fetcher.partitions == self.partitions
+        assert group.fetcher.messages_rings == [
+            w.messages_ring for w in group.workers
+        ]
+        assert len(group.rings) == 6
+        mock_post_rebalance_cb.assert_called_once_with(self.partitions)
+
+    @mock.patch('yelp_kafka.shared_memory_group.os.kill', autospec=True)
+    def test_release(self, mock_kill, group, mock_pre_rebalance_cb):
+        fetcher = mock.Mock()
+        workers = [mock.Mock(), mock.Mock()]
+        procs = [mock.Mock(), mock.Mock(), mock.Mock()]
+        procs[0].is_alive.return_value = False
+        procs[1].is_alive.return_value = False
+        procs[2].is_alive.return_value = True
+        group.fetcher = fetcher
+        group.workers = workers
+        group.procs = dict(zip(procs, [fetcher] + workers))
+
+        group.release(self.partitions)
+
+        mock_pre_rebalance_cb.assert_called_once_with(self.partitions)
+        fetcher.terminate.assert_called_once_with()
+        assert all(w.terminate.called for w in workers)
+        assert all(p.join.called for p in procs)
+        mock_kill.assert_called_once_with(procs[2].pid, mock.ANY)
+        assert group.procs == {}
+        assert group.fetcher is None
+
+    def test_release_kept_partitions(self, group):
+        with mock.patch.object(
+            group, 'terminate', autospec=True,
+        ) as mock_terminate, mock.patch.object(
+            group, 'start', autospec=True,
+        ) as mock_start:
+            group.acquire(self.partitions)
+            group.release({'topic1': [1]})
+
+            # The fetcher consumes all the partitions, kept ones included
+            mock_terminate.assert_called_once_with()
+            assert mock_start.call_args_list == [
+                mock.call(self.partitions),
+                mock.call({'topic1': [0], 'topic2': [0]}),
+            ]
+
+            group.release({'topic1': [0], 'topic2': [0]})
+
+            assert mock_terminate.call_count == 2
+            assert mock_start.call_count == 2
+            assert group.acquired_partitions == {}
+
+    def test_monitor_restarts_all_processes(self, group):
+        proc = mock.Mock()
+        proc.is_alive.return_value = False
+        group.fetcher = mock.Mock(partitions=self.partitions)
+        group.procs = {proc: group.fetcher}
+
+        with mock.patch.object(
+            group, 'terminate', autospec=True,
+        ) as mock_terminate, mock.patch.object(
+            group, 'start', autospec=True,
+        ) as mock_start:
+            group.monitor()
+
+        mock_terminate.assert_called_once_with()
+        mock_start.assert_called_once_with(self.partitions)
+
+    def test_monitor_all_alive(self, group):
+        proc = mock.Mock()
+        proc.is_alive.return_value = True
+        group.procs = {proc: mock.Mock()}
+
+        with mock.patch.object(group, 'start', autospec=True) as mock_start:
+            group.monitor()
+
+        assert not mock_start.called
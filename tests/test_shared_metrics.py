@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+# Copyright 2016 Yelp Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+from multiprocessing import Process
+
+import mock
+import pytest
+
+from yelp_kafka.prometheus_metrics_responder import PrometheusMetricsResponder
+from yelp_kafka.prometheus_metrics_responder import Timer
+from yelp_kafka.shared_metrics import SharedMetrics
+from yelp_kafka.shared_metrics import SharedMetricsReporter
+
+
+@pytest.yield_fixture
+def shared_metrics():
+    shared_metrics = SharedMetrics(
+        ['failed_count'],
+        ['fetch_request_timer'],
+        slots=2,
+        timer_buckets=(10, 1),
+    )
+    yield shared_metrics
+    shared_metrics.close()
+
+
+class TestSharedMetrics(object):
+
+    def test_slots(self, shared_metrics):
+        assert shared_metrics.acquire_slot() == 0
+        assert shared_metrics.acquire_slot() == 1
+        assert shared_metrics.acquire_slot() is None
+        assert shared_metrics.get_recorder(None) is None
+
+        shared_metrics.release_slot(1)
+        shared_metrics.release_slot(1)
+        shared_metrics.release_slot(None)
+        assert shared_metrics.acquire_slot() == 1
+        assert shared_metrics.acquire_slot() is None
+
+    def test_collect(self, shared_metrics):
+        recorder1 = shared_metrics.get_recorder(0)
+        recorder2 = shared_metrics.get_recorder(1)
+
+        recorder1.count('failed_count')
+        recorder2.count('failed_count', 2)
+        recorder1.record('fetch_request_timer', 0.5)
+        recorder2.record('fetch_request_timer', 5)
+        recorder2.record('fetch_request_timer', 7)
+        recorder2.record('fetch_request_timer', 20)
+
+        counters, timers = shared_metrics.collect()
+        assert counters == {'failed_count': 3}
+        assert timers == {
+            'fetch_request_timer': ([1, 2, 1], [0.5, 12, 20]),
+        }
+
+    def test_record_kafka_metric(self, shared_metrics):
+        recorder = shared_metrics.get_recorder(0)
+
+        recorder.record_kafka_metric('fetch_request_timer', 0.002)
+        recorder.record_kafka_metric('failed_count', 10)
+        recorder.record_kafka_metric('unknown', 1)
+
+        counters, timers = shared_metrics.collect()
+        assert counters == {'failed_count': 1}
+        assert timers['fetch_request_timer'][1] == [0, 2, 0]
+
+    def test_record_from_other_process(self, shared_metrics):
+        recorder = shared_metrics.get_recorder(shared_metrics.acquire_slot())
+
+        def record():
+            for _ in range(100):
+                recorder.count('failed_count')
+
+        proc = Process(target=record)
+        proc.start()
+        proc.join()
+
+        counters, _ = shared_metrics.collect()
+        assert counters == {'failed_count': 100}
+
+
+class TestSharedMetricsReporter(object):
+
+    def test_flush(self, shared_metrics):
+        responder = mock.Mock()
+        responder.get_counter_emitter.side_effect = lambda name, _: 'counter:' + name
+        responder.get_timer_emitter.side_effect = lambda name, _: 'timer:' + name
+        recorder = shared_metrics.get_recorder(0)
+        recorder.count('failed_count')
+        reporter = SharedMetricsReporter(
+            shared_metrics,
+            responder,
+            'prefix',
+            {'group_id': 'my_group'},
+        )
+        responder.get_counter_emitter.assert_called_once_with(
+            'prefix.failed_count',
+            {'group_id': 'my_group'},
+        )
+
+        # Metrics recorded before the reporter creation are not reported
+        reporter.flush()
+        assert not responder.record.called
+
+        recorder.count('failed_count', 2)
+        recorder.record('fetch_request_timer', 2)
+        recorder.record('fetch_request_timer', 4)
+        recorder.record('fetch_request_timer', 30)
+        reporter.flush()
+
+        responder.record.assert_called_once_with('counter:prefix.failed_count', 2)
+        # Each bucket is recorded at once
+        assert responder.record_many.call_args_list == [
+            mock.call('timer:prefix.fetch_request_timer', 3, 2),
+            mock.call('timer:prefix.fetch_request_timer', 30, 1),
+        ]
+
+        responder.reset_mock()
+        reporter.flush()
+        assert not responder.record.called
+        assert not responder.record_many.called
+
+    def test_flush_prometheus_histogram(self, shared_metrics):
+        responder = PrometheusMetricsResponder(timer_buckets=(1, 10))
+        recorder = shared_metrics.get_recorder(0)
+        reporter = SharedMetricsReporter(shared_metrics, responder, 'prefix')
+        expected = Timer('expected', (), buckets=(1, 10))
+        for value in (0.5, 2, 3, 3, 4, 7, 30, 300):
+            recorder.record('fetch_request_timer', value)
+            expected.record(value)
+
+        reporter.flush()
+
+        # Same buckets, same histogram
+        assert reporter.timers['fetch_request_timer'].samples() == expected.samples()
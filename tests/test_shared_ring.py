@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+# Copyright 2016 Yelp Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+from multiprocessing import Process
+
+import pytest
+
+from yelp_kafka.shared_ring import SharedRingBuffer
+
+
+class TestSharedRingBuffer(object):
+
+    def test_put_get(self):
+        ring = SharedRingBuffer(64)
+
+        assert ring.put(b'hello')
+        assert ring.put(b'')
+        assert ring.put(b'world')
+
+        assert ring.get(timeout=0) == b'hello'
+        assert ring.get(timeout=0) == b''
+        assert ring.get(timeout=0) == b'world'
+        assert ring.get(timeout=0) is None
+
+    def test_wrap_around(self):
+        ring = SharedRingBuffer(64)
+        records = [
+            '{0:0>{1}}'.format(i, i % 20).encode()
+            for i in range(100)
+        ]
+
+        for record in records:
+            assert ring.put(record, timeout=0)
+            assert ring.get(timeout=0) == record
+
+    def test_full(self):
+        ring = SharedRingBuffer(64)
+
+        assert ring.put(b'a' * 28, timeout=0)
+        assert ring.put(b'b' * 28, timeout=0)
+        assert not ring.put(b'c', timeout=0.01)
+
+        assert ring.get(timeout=0) == b'a' * 28
+        assert ring.put(b'c', timeout=0)
+        assert ring.get(timeout=0) == b'b' * 28
+        assert ring.get(timeout=0) == b'c'
+
+    def test_record_too_large(self):
+        ring = SharedRingBuffer(64)
+
+        with pytest.raises(ValueError):
+            ring.put(b'a' * (ring.max_record_size + 1))
+
+    def test_across_processes(self):
+        ring = SharedRingBuffer(128)
+        records = [str(i).encode() * 10 for i in range(200)]
+
+        def produce():
+            for record in records:
+                ring.put(record)
+
+        proc = Process(target=produce)
+        proc.start()
+        received = [ring.get(timeout=5) for _ in records]
+        proc.join(5)
+
+        assert received == records
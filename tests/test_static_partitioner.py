@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+# Copyright 2016 Yelp Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+from kazoo.recipe.partitioner import PartitionState
+
+from yelp_kafka.static_partitioner import StaticSetPartitioner
+
+
+class TestStaticSetPartitioner(object):
+
+    items = set(['a', 'b', 'c', 'd', 'e'])
+
+    def test_init_acquired(self):
+        partitioner = StaticSetPartitioner(self.items, 1, 2)
+
+        assert partitioner.acquired
+        assert list(partitioner) == ['b', 'd']
+
+    def test_members_cover_set(self):
+        acquired = [
+            list(StaticSetPartitioner(self.items, i, 3))
+            for i in range(3)
+        ]
+
+        assert sorted(sum(acquired, [])) == sorted(self.items)
+        assert acquired == [['a', 'd'], ['b', 'e'], ['c']]
+
+    def test_more_members_than_items(self):
+        partitioner = StaticSetPartitioner(self.items, 6, 7)
+
+        assert partitioner.acquired
+        assert list(partitioner) == []
+
+    def test_release_set(self):
+        partitioner = StaticSetPartitioner(self.items, 0, 2)
+        state_id = partitioner.state_id
+
+        partitioner.release_set()
+
+        assert partitioner.state == PartitionState.ACQUIRED
+        assert partitioner.state_id == state_id + 1
+        assert list(partitioner) == ['a', 'c', 'e']
+
+    def test_finish(self):
+        partitioner = StaticSetPartitioner(self.items, 0, 2)
+
+        partitioner.finish()
+        partitioner.release_set()
+
+        assert partitioner.failed
+        assert list(partitioner) == []
@@ -15,9 +15,18 @@
 from __future__ import absolute_import
 from __future__ import unicode_literals
 
+import re
+import threading
+import time
+
 import mock
 import pytest
+from kafka import KafkaConsumer
 from kafka.common import KafkaUnavailableError
+from kafka.common import MetadataResponse
+from kafka.common import OffsetFetchResponse
+from kafka.common import PartitionMetadata
+from kafka.common import TopicMetadata
 
 from yelp_kafka import utils
 
@@ -29,6 +38,55 @@ def test_make_scribe_topic():
     )
 
 
+def test_topic_pattern():
+    pattern = re.compile(r'scribe\..*\.stream')
+
+    assert utils.is_topic_pattern(pattern)
+    assert not utils.is_topic_pattern(['topic1'])
+    assert utils.topic_matches(pattern, 'scribe.dc.stream')
+    assert not utils.topic_matches(pattern, 'scribe.dc.stream1')
+    assert not utils.topic_matches(pattern, 'other.scribe.dc.stream')
+
+
+def test_consumes_from():
+    consumer = mock.Mock(topic=b'topic1', partitions=[1])
+
+    assert utils.consumes_from(consumer, {'topic1': [0, 1]})
+    assert not utils.consumes_from(consumer, {'topic1': [0], 'topic2': [1]})
+    assert utils.consumes_from(consumer, None)
+
+
+@mock.patch('kafka.consumer.kafka.KafkaClient', autospec=True)
+def test_set_task_done_offsets(mock_client):
+    mock_client.return_value.topic_partitions = {b'topic1': {0: None, 1: None}}
+    mock_client.return_value.get_partition_ids_for_topic.return_value = [0, 1]
+    mock_client.return_value.send_offset_fetch_request.side_effect = [
+        [OffsetFetchResponse(b'topic1', 0, 10, b'', 0)],
+        [OffsetFetchResponse(b'topic1', 1, 10, b'', 0)],
+    ]
+    consumer = KafkaConsumer(
+        'topic1',
+        bootstrap_servers=['test_broker:9292'],
+        group_id='test_group',
+        auto_commit_enable=True,
+        auto_commit_interval_messages=10,
+        auto_commit_interval_ms=None,
+    )
+
+    with mock.patch('kafka.consumer.kafka.logger') as mock_logger:
+        utils.set_task_done_offsets(consumer, {('topic1', 0): 14}, 4)
+        assert not mock_client.return_value.send_offset_commit_request.called
+        utils.set_task_done_offsets(consumer, {('topic1', 1): 20}, 10)
+
+    assert consumer.offsets('task_done') == {
+        (b'topic1', 0): 14,
+        (b'topic1', 1): 20,
+    }
+    # Auto committed after 10 messages
+    assert mock_client.return_value.send_offset_commit_request.call_count == 1
+    assert not mock_logger.warning.called
+
+
 def test_get_kafka_topics():
     expected = {
         'topic1': [0, 1, 2, 3],
@@ -64,6 +122,25 @@ def test_get_kafka_topics_error():
         utils.get_kafka_topics(mock_client)
 
 
+def test_get_kafka_topics_partitions():
+    mock_client = mock.Mock()
+    mock_client.send_metadata_request.return_value = MetadataResponse(
+        [],
+        [
+            TopicMetadata(b'topic1', 0, [
+                PartitionMetadata(b'topic1', 1, 0, [], [], 0),
+                PartitionMetadata(b'topic1', 0, 0, [], [], 0),
+            ]),
+            TopicMetadata(b'topic2', 3, []),
+        ],
+    )
+    actual = utils.get_kafka_topics_partitions(mock_client, ['topic1', 'topic2'])
+    assert actual == {b'topic1': [0, 1]}
+    mock_client.send_metadata_request.assert_called_once_with(
+        [b'topic1', b'topic2'],
+    )
+
+
 def test_extract_datacenter():
     topic = "scribe.uswest1-devc.ranger"
     datacenter = utils.extract_datacenter(topic)
@@ -110,3 +187,110 @@ def test_extract_stream_name_error():
     topic = "scribble.uswest1-devc.ranger"
     with pytest.raises(ValueError):
         utils.extract_stream_name(topic)
+
+
+def test_cached():
+    func = mock.Mock(side_effect=lambda *args, **kwargs: (args, kwargs))
+    cached_func = utils.cached()(func)
+
+    assert cached_func(1, b=2) == ((1,), {'b': 2})
+    assert cached_func(1, b=2) == ((1,), {'b': 2})
+    assert cached_func(1) == ((1,), {})
+
+    assert func.call_count == 2
+    assert cached_func.cache_info() == utils.CacheInfo(1, 2, 128, 2)
+    cached_func.cache_clear()
+    assert cached_func.cache_info() == utils.CacheInfo(0, 0, 128, 0)
+
+
+def test_cached_lru_eviction():
+    func = mock.Mock(side_effect=lambda x: x)
+    cached_func = utils.cached(maxsize=2)(func)
+
+    cached_func(1)
+    cached_func(2)
+    cached_func(1)
+    cached_func(3)  # Evicts 2, the least recently used
+
+    assert func.call_count == 3
+    cached_func(1)
+    assert func.call_count == 3
+    cached_func(2)
+    assert func.call_count == 4
+
+
+def test_cached_ttl():
+    func = mock.Mock(side_effect=lambda x: x)
+    cached_func = utils.cached(ttl=10)(func)
+
+    with mock.patch.object(time, 'time', return_value=100):
+        cached_func(1)
+    with mock.patch.object(time, 'time', return_value=109):
+        cached_func(1)
+    assert func.call_count == 1
+    with mock.patch.object(time, 'time', return_value=110):
+        cached_func(1)
+    assert func.call_count == 2
+
+
+def test_cached_exception_not_cached():
+    func = mock.Mock(side_effect=[ValueError, 1])
+    cached_func = utils.cached()(func)
+
+    with pytest.raises(ValueError):
+        cached_func()
+    assert cached_func() == 1
+    assert cached_func() == 1
+    assert func.call_count == 2
+
+
+def test_cached_unhashable_arguments():
+    cached_func = utils.cached()(lambda x: x)
+
+    with pytest.raises(TypeError):
+        cached_func([1, 2])
+
+
+def test_cached_single_flight():
+    started = threading.Event()
+    release = threading.Event()
+    calls = []
+
+    @utils.cached()
+    def slow(x):
+        calls.append(x)
+        started.set()
+        release.wait(5)
+        return x
+
+    results = []
+    threads = [
+        threading.Thread(target=lambda: results.append(slow(1)))
+        for _ in range(4)
+    ]
+    threads[0].start()
+    started.wait(5)
+    for thread in threads[1:]:
+        thread.start()
+    release.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert calls == [1]
+    assert results == [1, 1, 1, 1]
+
+
+def test_zipkin_span():
+    func = mock.Mock(return_value=1)
+    traced_func = utils.zipkin_span('service', 'span')(func)
+
+    with mock.patch(
+        'py_zipkin.zipkin.zipkin_span',
+        autospec=True,
+    ) as mock_span:
+        mock_span.return_value.side_effect = lambda f: f
+        assert traced_func(2) == 1
+        assert traced_func(3) == 1
+
+    mock_span.assert_called_once_with(service_name='service', span_name='span')
+    assert func.call_args_list == [mock.call(2), mock.call(3)]
@@ -0,0 +1,180 @@
+# -*- coding: utf-8 -*-
+# Copyright 2016 Yelp Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+import os
+from multiprocessing import Queue
+
+import mock
+import pytest
+
+from yelp_kafka.worker_pool import ConsumerWorkerPool
+from yelp_kafka.worker_pool import PoolWorker
+
+
+class FakeConsumer(object):
+
+    runs = Queue()
+
+    def __init__(self, topic, config, partitions):
+        self.topic = topic
+        self.partitions = partitions
+        self.termination_flag = None
+
+    def run(self):
+        self.runs.put((os.getpid(), self.topic, self.partitions))
+        self.termination_flag.wait(5)
+
+
+class TestPoolWorker(object):
+
+    def test_run_many_assignments(self, config):
+        worker = PoolWorker(FakeConsumer, config, 0)
+        worker.start()
+        try:
+            worker.assign('topic1', [0])
+            assert FakeConsumer.runs.get(timeout=5) == (
+                worker.proc.pid, 'topic1', [0],
+            )
+            worker.terminate()
+            assert worker.wait_idle(5)
+
+            worker.assign('topic2', [1])
+            assert FakeConsumer.runs.get(timeout=5) == (
+                worker.proc.pid, 'topic2', [1],
+            )
+        finally:
+            worker.stop()
+            worker.proc.join(5)
+        assert not worker.is_alive()
+
+
+class TestConsumerWorkerPool(object):
+
+    @pytest.fixture
+    def pool(self, config):
+        with mock.patch(
+            'yelp_kafka.worker_pool.PoolWorker',
+            autospec=True,
+        ) as mock_worker:
+            mock_worker.side_effect = lambda *args: mock.Mock(busy=False)
+            pool = ConsumerWorkerPool(mock.Mock(), config, 2)
+            pool.start()
+            yield pool
+
+    def test_start(self, pool):
+        assert len(pool.workers) == 2
+        assert all(worker.start.called for worker in pool.workers)
+
+    def test_assign(self, pool):
+        worker = pool.assign('topic1', [0])
+
+        assert worker is pool.workers[0]
+        worker.assign.assert_called_once_with('topic1', [0])
+
+    def test_assign_grows_pool(self, pool):
+        for worker in pool.workers:
+            worker.busy = True
+
+        worker = pool.assign('topic1', [0])
+
+        assert len(pool.workers) == 3
+        assert worker is pool.workers[2]
+        worker.start.assert_called_once_with()
+
+    def test_release(self, pool):
+        busy, stuck = pool.workers
+        busy.busy = stuck.busy = True
+        busy.wait_idle.return_value = True
+        stuck.wait_idle.return_value = False
+
+        pool.release(0.1)
+
+        busy.terminate.assert_called_once_with()
+        busy.unassign.assert_called_once_with()
+        assert pool.workers[0] is busy
+        stuck.kill.assert_called_once_with()
+        assert pool.workers[1] is not stuck
+
+    def test_release_partitions(self, pool):
+        released, kept = pool.workers
+        released.busy = kept.busy = True
+        released.topic = kept.topic = 'topic1'
+        released.partitions = [0]
+        kept.partitions = [1]
+        released.wait_idle.return_value = True
+
+        pool.release(0.1, {'topic1': [0]})
+
+        released.terminate.assert_called_once_with()
+        released.unassign.assert_called_once_with()
+        assert not kept.terminate.called
+        assert not kept.unassign.called
+
+    def test_monitor(self, pool):
+        dead, alive = pool.workers
+        dead.is_alive.return_value = False
+        dead.busy = True
+        dead.topic = 'topic1'
+        dead.partitions = [0]
+        alive.is_alive.return_value = True
+
+        assert pool.monitor() == [dead]
+
+        assert pool.workers[0] is not dead
+        assert pool.workers[1] is alive
+        pool.workers[0].assign.assert_called_once_with('topic1', [0])
+
+    def test_stop(self, pool):
+        workers = pool.workers
+
+        pool.stop(0.1)
+
+        assert all(w.stop.called and w.kill.called for w in workers)
+        assert pool.workers == []
+
+    def test_metrics_slots(self, config):
+        consumer_factory = mock.Mock()
+        shared_metrics = mock.Mock()
+        shared_metrics.acquire_slot.side_effect = [0, 1, 2]
+        with mock.patch(
+            'yelp_kafka.worker_pool.PoolWorker',
+            autospec=True,
+        ) as mock_worker:
+            mock_worker.side_effect = lambda *args: mock.Mock(
+                busy=False,
+                worker_id=args[2],
+            )
+            pool = ConsumerWorkerPool(consumer_factory, config, 2, shared_metrics)
+            pool.start()
+
+            assert mock_worker.call_args_list == [
+                mock.call(
+                    consumer_factory,
+                    config,
+                    worker_id,
+                    shared_metrics.get_recorder.return_value,
+                )
+                for worker_id in (0, 1)
+            ]
+            pool.replace(pool.workers[1])
+            shared_metrics.release_slot.assert_called_once_with(1)
+            shared_metrics.get_recorder.assert_called_with(2)
+
+            pool.stop(0.1)
+            assert shared_metrics.release_slot.call_args_list == [
+                mock.call(1), mock.call(0), mock.call(2),
+            ]
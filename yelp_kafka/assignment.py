@@ -0,0 +1,324 @@
+# -*- coding: utf-8 -*-
+# Copyright 2016 Yelp Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Partition assignment strategies for :py:class:`yelp_kafka.partitioner.Partitioner`.
+
+Every member of a group runs the assignment independently, so an assignment
+strategy must be deterministic and all the members must use the same inputs.
+"""
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+import heapq
+import json
+import logging
+import time
+
+import six
+from kazoo.exceptions import BadVersionError
+from kazoo.exceptions import NodeExistsError
+from kazoo.exceptions import NoNodeError
+
+from yelp_kafka.offsets import get_topics_watermarks
+
+COUNT_ASSIGNMENT = 'count'
+THROUGHPUT_ASSIGNMENT = 'throughput'
+ASSIGNMENT_STRATEGIES = (COUNT_ASSIGNMENT, THROUGHPUT_ASSIGNMENT)
+
+# Minimum time between two measures of the partitions throughput.
+THROUGHPUT_REFRESH_SECS = 600
+# Weights are quantized to integers in [1, MAX_WEIGHT]. Idle partitions
+# have weight 1.
+MAX_WEIGHT = 100
+# New weights are published only if this fraction of the total weight moves
+# between partitions, so that rate fluctuations don't cause a rebalance.
+MIN_WEIGHTS_CHANGE = 0.1
+DEFAULT_WEIGHT = 1
+DEFAULT_CAPACITY = 1
+# Separator between the member identifier and its capacity.
+CAPACITY_SEPARATOR = '@'
+
+
+def make_member_identifier(identifier, capacity=DEFAULT_CAPACITY):
+    """Advertise the capacity of a group member in its identifier.
+    Members with the default capacity keep the plain identifier.
+    """
+    if capacity == DEFAULT_CAPACITY:
+        return identifier
+    return "{0}{1}{2:g}".format(identifier, CAPACITY_SEPARATOR, capacity)
+
+
+def get_member_capacity(identifier):
+    """Get the capacity advertised by a group member, see
+    :py:func:`make_member_identifier`."""
+    _, separator, capacity = identifier.rpartition(CAPACITY_SEPARATOR)
+    if not separator:
+        return DEFAULT_CAPACITY
+    try:
+        capacity = float(capacity)
+    except ValueError:
+        return DEFAULT_CAPACITY
+    return capacity if capacity > 0 else DEFAULT_CAPACITY
+
+
+class WeightedAssignment(object):
+    """kazoo SetPartitioner partition_func balancing the total weight of
+    the partitions assigned to each member, relative to the member capacity.
+
+    Partitions are assigned from the heaviest to the lightest to the member
+    with the lowest load per unit of capacity (longest processing time
+    first). Partitions without a weight get :py:data:`DEFAULT_WEIGHT` and
+    members advertise their capacity in their identifier, see
+    :py:func:`make_member_identifier`.
+
+    If there are no weights and all the members have the default capacity,
+    the assignment is the same as the kazoo default partition_func, so that
+    this function can be used along with consumers that don't support it.
+
+    :param weights: partition weights
+    :type weights: dict {<"topic-partition">: <int>}
+    """
+
+    def __init__(self, weights):
+        self.weights = weights
+
+    def get_weight(self, partition):
+        return self.weights.get(str(partition), DEFAULT_WEIGHT)
+
+    def assign(self, members, partitions):
+        """Assign partitions to members.
+
+        :returns: partitions of each member
+        :rtype: dict {<member>: <[partitions]>}
+        """
+        members = sorted(members)
+        capacities = [get_member_capacity(member) for member in members]
+        assignment = dict((member, []) for member in members)
+        if not self.weights and all(
+            capacity == DEFAULT_CAPACITY for capacity in capacities
+        ):
+            # Same as kazoo SetPartitioner._partitioner
+            all_partitions = sorted(partitions)
+            for i, member in enumerate(members):
+                assignment[member] = all_partitions[i::len(members)]
+            return assignment
+        loads = [0] * len(members)
+        heap = [(0, i) for i in range(len(members))]
+        heaviest_first = sorted(
+            partitions,
+            key=lambda partition: (-self.get_weight(partition), str(partition)),
+        )
+        for partition in heaviest_first:
+            _, i = heapq.heappop(heap)
+            assignment[members[i]].append(partition)
+            loads[i] += self.get_weight(partition)
+            heapq.heappush(heap, (float(loads[i]) / capacities[i], i))
+        return assignment
+
+    def __call__(self, identifier, members, partitions):
+        return sorted(self.assign(members, partitions)[identifier])
+
+
+class ThroughputAssignment(object):
+    """kazoo SetPartitioner partition_func assigning the partitions by
+    :py:class:`WeightedAssignment` with the weights published in zookeeper
+    when the partitions are allocated.
+
+    :param throughput_weights: the weights shared by the group members
+    :type throughput_weights: :py:class:`ThroughputWeights`
+    """
+
+    def __init__(self, throughput_weights):
+        self.throughput_weights = throughput_weights
+
+    def __call__(self, identifier, members, partitions):
+        weights = self.throughput_weights.read_weights()
+        return WeightedAssignment(weights)(identifier, members, partitions)
+
+
+def get_partition_rates(old_watermarks, new_watermarks, interval_secs):
+    """Messages per second produced to each partition between two
+    measures of the high watermarks.
+
+    :param old_watermarks: dict {<"topic-partition">: <highmark>}
+    :param new_watermarks: dict {<"topic-partition">: <highmark>}
+    :param interval_secs: time between the two measures
+    :rtype: dict {<"topic-partition">: <float>}
+    """
+    return dict(
+        (partition, max(highmark - old_watermarks[partition], 0) / interval_secs)
+        for partition, highmark in six.iteritems(new_watermarks)
+        if partition in old_watermarks
+    )
+
+
+def quantize_weights(rates):
+    """Map the partition rates to integer weights in [1, MAX_WEIGHT]
+    proportional to the rate of the busiest partition."""
+    max_rate = max(six.itervalues(rates)) if rates else 0
+    if not max_rate:
+        return {}
+    return dict(
+        (partition, max(int(round(rate * MAX_WEIGHT / max_rate)), DEFAULT_WEIGHT))
+        for partition, rate in six.iteritems(rates)
+    )
+
+
+def get_weights_change(old_weights, new_weights):
+    """Fraction of the total weight moving between partitions from
+    old_weights to new_weights, in [0, 1]. Partitions without a weight get
+    :py:data:`DEFAULT_WEIGHT`.
+
+    :param old_weights: dict {<"topic-partition">: <int>}
+    :param new_weights: dict {<"topic-partition">: <int>}
+    :rtype: float
+    """
+    partitions = set(old_weights) | set(new_weights)
+    if not partitions:
+        return 0.0
+    old_total = float(sum(old_weights.get(p, DEFAULT_WEIGHT) for p in partitions))
+    new_total = float(sum(new_weights.get(p, DEFAULT_WEIGHT) for p in partitions))
+    return sum(
+        abs(
+            old_weights.get(p, DEFAULT_WEIGHT) / old_total -
+            new_weights.get(p, DEFAULT_WEIGHT) / new_total
+        )
+        for p in partitions
+    ) / 2
+
+
+class ThroughputWeights(object):
+    """Partition weights shared by the members of a group, based on the
+    rate of messages produced to each partition.
+
+    The weights are stored in a zookeeper node along with the high watermarks
+    they have been measured from. Any member finding the measure older than
+    refresh_secs takes a new one, computes the weights from the watermark
+    deltas and updates the node. Conditional updates guarantee that only one
+    member per round succeeds. The new weights replace the published ones
+    only if they differ by at least :py:data:`MIN_WEIGHTS_CHANGE`.
+
+    The members read the published weights when they allocate the
+    partitions, see :py:class:`ThroughputAssignment`, so that all of them
+    use the same ones. The member publishing new weights must make the
+    group rebalance.
+
+    :param kazoo_client: connected kazoo client
+    :param path: zookeeper node path
+    :param kafka_client: KafkaClient used to get the watermarks
+    :param topics: group topics
+    :param refresh_secs: min time between two measures
+    """
+
+    def __init__(
+        self,
+        kazoo_client,
+        path,
+        kafka_client,
+        topics,
+        refresh_secs=THROUGHPUT_REFRESH_SECS,
+    ):
+        self.log = logging.getLogger(self.__class__.__name__)
+        self.kazoo_client = kazoo_client
+        self.path = path
+        self.kafka_client = kafka_client
+        self.topics = topics
+        self.refresh_secs = refresh_secs
+        # Last weights read, used if zookeeper can't be read
+        self._weights = {}
+
+    def read_weights(self):
+        """Read the published weights, without measuring the throughput.
+
+        :rtype: dict {<"topic-partition">: <int>}
+        """
+        try:
+            data, _ = self.kazoo_client.get(self.path)
+            self._weights = json.loads(data.decode('utf-8'))['weights']
+        except NoNodeError:
+            self._weights = {}
+        except Exception:
+            self.log.exception(
+                "Failed to read the partition weights, using the last ones.",
+            )
+        return self._weights
+
+    def refresh(self):
+        """Measure the throughput again if the last measure is too old and
+        publish the new weights if they changed enough.
+
+        :returns: True if new weights have been published by this member
+        """
+        try:
+            data, stat = self.kazoo_client.get(self.path)
+            state = json.loads(data.decode('utf-8'))
+        except NoNodeError:
+            stat, state = None, None
+        if state and time.time() - state['timestamp'] < self.refresh_secs:
+            return False
+        new_state = self._measure(state)
+        weights = state['weights'] if state else {}
+        changed = get_weights_change(
+            weights,
+            new_state['weights'],
+        ) >= MIN_WEIGHTS_CHANGE
+        if not changed:
+            # Measure again from the new watermarks, keeping the weights
+            new_state['weights'] = weights
+        try:
+            if stat is None:
+                self.kazoo_client.create(
+                    self.path,
+                    self._encode(new_state),
+                    makepath=True,
+                )
+            else:
+                self.kazoo_client.set(
+                    self.path,
+                    self._encode(new_state),
+                    version=stat.version,
+                )
+        except (BadVersionError, NodeExistsError):
+            # Another member measured the throughput first
+            return False
+        if changed:
+            self.log.info("Published new partition weights %s", new_state['weights'])
+        return changed
+
+    def _measure(self, state):
+        self.kafka_client.load_metadata_for_topics(*self.topics)
+        watermarks = get_topics_watermarks(
+            self.kafka_client,
+            self.topics,
+            raise_on_error=False,
+        )
+        now = time.time()
+        highmarks = dict(
+            ("{0}-{1}".format(topic, partition), offsets.highmark)
+            for topic, partitions in six.iteritems(watermarks)
+            for partition, offsets in six.iteritems(partitions)
+        )
+        weights = {}
+        if state:
+            rates = get_partition_rates(
+                state['watermarks'],
+                highmarks,
+                now - state['timestamp'],
+            )
+            weights = quantize_weights(rates)
+            self.log.debug("Partition rates %s, weights %s", rates, weights)
+        return {'timestamp': now, 'watermarks': highmarks, 'weights': weights}
+
+    def _encode(self, state):
+        return json.dumps(state, sort_keys=True).encode('utf-8')
@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+# Copyright 2016 Yelp Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""asyncio interface to :py:class:`yelp_kafka.consumer_group.KafkaConsumerGroup`.
+
+.. note:: This module requires python 3.5 or later.
+"""
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+import asyncio
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from kafka.common import ConsumerTimeout
+
+from yelp_kafka.consumer_group import KafkaConsumerGroup
+
+
+class AsyncKafkaConsumerGroup(object):
+    """AsyncKafkaConsumerGroup exposes a
+    :py:class:`yelp_kafka.consumer_group.KafkaConsumerGroup` as an asynchronous
+    iterator, so that messages can be consumed from a coroutine without
+    blocking the event loop.
+
+    All the blocking operations (fetching messages, refreshing the
+    partitioner, committing offsets and releasing the partitions) are run in
+    a single-threaded executor. kafka-python consumers are not thread safe,
+    using a single thread guarantees that the underlying consumer is always
+    accessed from the same thread.
+
+    Cancelling the task iterating over the group releases the partitions
+    and stops the group, committing the offsets if auto commit is enabled.
+
+    Example:
+
+    .. code-block:: python
+
+       from yelp_kafka import discovery
+       from yelp_kafka.asyncio_consumer_group import AsyncKafkaConsumerGroup
+       from yelp_kafka.config import KafkaConsumerConfig
+
+       async def consume():
+           cluster = discovery.get_region_cluster('standard', 'my_client')
+           config = KafkaConsumerConfig('my_group', cluster)
+           async with AsyncKafkaConsumerGroup(['topic1'], config) as group:
+               async for message in group:
+                   await do_something(message)
+                   await group.task_done(message)
+
+    :param topics: a list of topics to consume from.
+    :type topics: list
+    :param config: yelp_kakfa consumer config.
+    :type config: :py:class:`yelp_kafka.config.KafkaConsumerConfig`
+    :param metrics_responder: A metric responder to report metrics.
+        See :py:class:`yelp_kafka.consumer_group.KafkaConsumerGroup`.
+    :param loop: the event loop to use. Default: asyncio.get_event_loop()
+    """
+
+    def __init__(self, topics, config, metrics_responder=None, loop=None):
+        self.log = logging.getLogger(self.__class__.__name__)
+        self.loop = loop or asyncio.get_event_loop()
+        self.group = KafkaConsumerGroup(topics, config, metrics_responder)
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self._started = False
+
+    def _run_in_executor(self, func, *args):
+        return self.loop.run_in_executor(self._executor, func, *args)
+
+    async def start(self):
+        """Join the group and wait for the partitions to be acquired.
+        If start is cancelled the group keeps starting in the executor,
+        :py:meth:`stop` still has to be called to leave it.
+        """
+        # Set before awaiting, so that the group is stopped even if start
+        # is cancelled or fails. The single-threaded executor runs the stop
+        # after the start.
+        self._started = True
+        await self._run_in_executor(self.group.start)
+
+    async def stop(self):
+        """Release the partitions, leave the group and close the consumer.
+        It is safe to call stop multiple times.
+        """
+        if not self._started:
+            return
+        self._started = False
+        try:
+            await self._run_in_executor(self.group.stop)
+        finally:
+            self._executor.shutdown(wait=False)
+
+    async def next(self):
+        """Get the next message from kafka.
+
+        Each executor call waits for a message for at most
+        :py:data:`yelp_kafka.consumer_group.CONSUMER_GROUP_INTERNAL_TIMEOUT`,
+        so that commits and releases scheduled by other coroutines are never
+        blocked for longer than that.
+
+        :returns: a kafka-python KafkaMessage
+        :raises: ConsumerTimeout if no message has been received
+            within consumer_timeout_ms.
+        """
+        start_time = time.time()
+        while self.group._should_keep_trying(start_time):
+            message = await self._run_in_executor(self.group.poll)
+            if message is not None:
+                return message
+        error_msg = "AsyncKafkaConsumerGroup timed out after {0} ms"
+        raise ConsumerTimeout(error_msg.format(self.group.iter_timeout))
+
+    async def task_done(self, message):
+        return await self._run_in_executor(self.group.task_done, message)
+
+    async def commit(self):
+        return await self._run_in_executor(self.group.commit)
+
+    async def __aenter__(self):
+        try:
+            await self.start()
+        except BaseException:
+            await asyncio.shield(self.stop())
+            raise
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await asyncio.shield(self.stop())
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        try:
+            return await self.next()
+        except ConsumerTimeout:
+            raise StopAsyncIteration
+        except asyncio.CancelledError:
+            self.log.info("Consumer cancelled, releasing the group.")
+            await asyncio.shield(self.stop())
+            raise
@@ -0,0 +1,240 @@
+# -*- coding: utf-8 -*-
+# Copyright 2016 Yelp Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""asyncio interface to :py:class:`yelp_kafka.producer.YelpKafkaSimpleProducer`.
+
+.. note:: This module requires python 3.5 or later.
+"""
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+import asyncio
+import logging
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from yelp_kafka.error import ProducerClosedError
+from yelp_kafka.error import ProducerQueueFullError
+
+DEFAULT_MAX_IN_FLIGHT_MESSAGES = 10000
+
+
+class AsyncYelpKafkaProducer(object):
+    """AsyncYelpKafkaProducer wraps a synchronous
+    :py:class:`yelp_kafka.producer.YelpKafkaSimpleProducer` and makes it
+    usable from coroutines without blocking the event loop.
+
+    Messages sent concurrently by many coroutines are accumulated while a
+    produce request is in progress and sent together in the next one: all the
+    messages for the same topic are sent with a single call to
+    send_messages. Produce requests are run in a single-threaded executor,
+    since the kafka client is not thread safe. Metrics and zipkin spans are
+    reported by the wrapped producer.
+
+    The number of messages waiting to be acknowledged by kafka is bounded
+    by max_in_flight. :py:meth:`send` waits for room in the window, while
+    :py:meth:`send_nowait` raises
+    :py:class:`yelp_kafka.error.ProducerQueueFullError` when the window is
+    full.
+
+    Example:
+
+    .. code-block:: python
+
+       from kafka import KafkaClient
+       from yelp_kafka.asyncio_producer import AsyncYelpKafkaProducer
+       from yelp_kafka.producer import YelpKafkaSimpleProducer
+
+       producer = AsyncYelpKafkaProducer(
+           YelpKafkaSimpleProducer(client=KafkaClient(cluster.broker_list),
+                                   cluster_config=cluster),
+       )
+
+       async def handler(request):
+           await producer.send(b'my_topic', b'message1', b'message2')
+
+    :param producer: a synchronous yelp_kafka producer
+    :type producer: :py:class:`yelp_kafka.producer.YelpKafkaSimpleProducer`
+    :param max_in_flight: max number of messages not acknowledged yet.
+        Default: 10000.
+    :param loop: the event loop to use. Default: asyncio.get_event_loop()
+    """
+
+    def __init__(
+        self,
+        producer,
+        max_in_flight=DEFAULT_MAX_IN_FLIGHT_MESSAGES,
+        loop=None,
+    ):
+        self.log = logging.getLogger(self.__class__.__name__)
+        self.producer = producer
+        self.max_in_flight = max_in_flight
+        self.loop = loop or asyncio.get_event_loop()
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        # topic: [(messages, future)]
+        self._pending = OrderedDict()
+        self._in_flight = 0
+        self._sending = False
+        self._closed = False
+        self._flush_scheduled = False
+        self._window_waiters = []
+        self._idle_waiters = []
+
+    @property
+    def in_flight(self):
+        """Number of messages not acknowledged yet."""
+        return self._in_flight
+
+    async def send(self, topic, *msgs):
+        """Send messages to a topic and wait for kafka to acknowledge them.
+        Wait for room in the in-flight window if it is full.
+
+        :param topic: kafka topic
+        :param msgs: messages to send
+        :returns: the produce responses for the batch the messages were
+            sent with
+        :raises: :py:class:`yelp_kafka.error.ProducerClosedError` if the
+            producer is closed
+        """
+        while self._in_flight and self._in_flight + len(msgs) > self.max_in_flight:
+            self._check_not_closed()
+            waiter = self.loop.create_future()
+            self._window_waiters.append(waiter)
+            await waiter
+        return await self._enqueue(topic, msgs)
+
+    def send_nowait(self, topic, *msgs):
+        """Schedule messages to be sent to a topic without waiting for
+        them to be acknowledged. Send failures are logged.
+
+        :param topic: kafka topic
+        :param msgs: messages to send
+        :returns: a future resolved when the messages are acknowledged
+        :raises: :py:class:`yelp_kafka.error.ProducerQueueFullError` if the
+            in-flight window is full
+
+            :py:class:`yelp_kafka.error.ProducerClosedError` if the
+            producer is closed
+        """
+        self._check_not_closed()
+        if self._in_flight + len(msgs) > self.max_in_flight:
+            raise ProducerQueueFullError(
+                "{0} messages in flight, max_in_flight is {1}".format(
+                    self._in_flight,
+                    self.max_in_flight,
+                )
+            )
+        future = self._enqueue(topic, msgs)
+        future.add_done_callback(self._log_failure)
+        return future
+
+    async def flush(self):
+        """Wait until all the messages in flight have been acknowledged."""
+        while self._in_flight:
+            waiter = self.loop.create_future()
+            self._idle_waiters.append(waiter)
+            await waiter
+
+    async def close(self):
+        """Flush the messages in flight and shut the executor down. Messages
+        sent after close raise
+        :py:class:`yelp_kafka.error.ProducerClosedError`.
+        """
+        self._closed = True
+        # Coroutines waiting for room in the window fail right away
+        self._wake_up(self._window_waiters)
+        await self.flush()
+        self._executor.shutdown(wait=False)
+
+    def _check_not_closed(self):
+        if self._closed:
+            raise ProducerClosedError("The producer is closed")
+
+    def _enqueue(self, topic, msgs):
+        self._check_not_closed()
+        future = self.loop.create_future()
+        self._pending.setdefault(topic, []).append((msgs, future))
+        self._in_flight += len(msgs)
+        if not self._flush_scheduled:
+            # Wait for the current loop iteration to end, so that the messages
+            # sent by other ready coroutines end up in the same request.
+            self._flush_scheduled = True
+            self.loop.call_soon(self._maybe_flush)
+        return future
+
+    def _maybe_flush(self):
+        self._flush_scheduled = False
+        if self._sending or not self._pending:
+            return
+        batches, self._pending = self._pending, OrderedDict()
+        self._sending = True
+        topic_msgs = [
+            (topic, [msg for msgs, _ in entries for msg in msgs])
+            for topic, entries in batches.items()
+        ]
+        send_future = self.loop.run_in_executor(
+            self._executor,
+            self._send_batches,
+            topic_msgs,
+        )
+        send_future.add_done_callback(
+            lambda f: self._on_batches_sent(batches, f),
+        )
+
+    def _send_batches(self, topic_msgs):
+        """Send a produce request for each topic. Executed in the executor.
+
+        :returns: dict topic: (responses, exception)
+        """
+        results = {}
+        for topic, msgs in topic_msgs:
+            try:
+                results[topic] = (self.producer.send_messages(topic, *msgs), None)
+            except Exception as e:
+                results[topic] = (None, e)
+        return results
+
+    def _on_batches_sent(self, batches, send_future):
+        self._sending = False
+        exception = send_future.exception()
+        for topic, entries in batches.items():
+            if exception:
+                resp, error = None, exception
+            else:
+                resp, error = send_future.result()[topic]
+            for msgs, future in entries:
+                self._in_flight -= len(msgs)
+                if future.cancelled():
+                    continue
+                if error is not None:
+                    future.set_exception(error)
+                else:
+                    future.set_result(resp)
+        self._wake_up(self._window_waiters)
+        if not self._in_flight:
+            self._wake_up(self._idle_waiters)
+        self._maybe_flush()
+
+    def _wake_up(self, waiters):
+        while waiters:
+            waiter = waiters.pop(0)
+            if not waiter.done():
+                waiter.set_result(None)
+
+    def _log_failure(self, future):
+        if not future.cancelled() and future.exception() is not None:
+            self.log.error(
+                "Failed to send messages: %s",
+                future.exception(),
+            )
@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+# Copyright 2016 Yelp Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+import logging
+import threading
+
+import six
+from kafka import KafkaClient
+from kafka.common import KafkaError
+from kafka.common import OffsetCommitRequest
+from kafka.util import kafka_bytestring
+
+
+class OffsetCommitManager(object):
+    """Commit consumer offsets in background.
+
+    The manager keeps track of the highest offset marked for each topic
+    partition and coalesces them into a single multi-partition
+    OffsetCommitRequest per offset storage. Commits are sent by a background
+    thread every commit_interval_secs or as soon as commit_every_n offsets
+    have been marked, whichever comes first.
+
+    The manager uses its own KafkaClient, since kafka-python clients are not
+    thread safe.
+
+    .. note:: Offsets that fail to be committed are retried on the next
+       commit, unless a higher offset has been marked in the meantime.
+
+    :param config: consumer configuration
+    :type config: :py:class:`yelp_kafka.config.KafkaConsumerConfig`
+    :param commit_interval_secs: max time between two commits.
+    :param commit_every_n: commit as soon as n offsets have been marked.
+    """
+
+    def __init__(self, config, commit_interval_secs, commit_every_n):
+        self.log = logging.getLogger(self.__class__.__name__)
+        self.config = config
+        self.commit_interval_secs = commit_interval_secs
+        self.commit_every_n = commit_every_n
+        self.client = None
+        # (topic, partition): offset
+        self._pending = {}
+        self._marked_count = 0
+        self._pending_lock = threading.Lock()
+        # Serialize commits from the background thread and flush
+        self._commit_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Connect to kafka and start the background commit thread."""
+        self.client = KafkaClient(
+            self.config.broker_list,
+            client_id=self.config.client_id,
+        )
+        self._stopped.clear()
+        self._thread = threading.Thread(
+            target=self._run,
+            name='OffsetCommitManager-{0}'.format(self.config.group_id),
+        )
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """Stop the background thread, commit the pending offsets and
+        disconnect from kafka.
+
+        :return: True on success, False on failure.
+        """
+        self._stopped.set()
+        self._wakeup.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+        success = self.flush()
+        if self.client:
+            self.client.close()
+            self.client = None
+        return success
+
+    def mark(self, topic, partition, offset):
+        """Mark an offset to be committed. Offsets lower than the one
+        already marked for the same partition are ignored.
+        """
+        key = (kafka_bytestring(topic), partition)
+        with self._pending_lock:
+            if offset > self._pending.get(key, -1):
+                self._pending[key] = offset
+            self._marked_count += 1
+            if self._marked_count >= self.commit_every_n:
+                self._wakeup.set()
+
+    def flush(self):
+        """Synchronously commit the pending offsets.
+
+        :return: True on success, False on failure.
+        """
+        with self._commit_lock:
+            with self._pending_lock:
+                offsets, self._pending = self._pending, {}
+                self._marked_count = 0
+            if not offsets:
+                return True
+            try:
+                self._send_commit(offsets)
+            except KafkaError as e:
+                self.log.error("%s saving offsets: %s", e.__class__.__name__, e)
+                self._restore(offsets)
+                return False
+            return True
+
+    def _restore(self, offsets):
+        with self._pending_lock:
+            for key, offset in six.iteritems(offsets):
+                if offset > self._pending.get(key, -1):
+                    self._pending[key] = offset
+
+    def _send_commit(self, offsets):
+        reqs = [
+            OffsetCommitRequest(topic, partition, offset, None)
+            for (topic, partition), offset in sorted(six.iteritems(offsets))
+        ]
+        if self.config.offset_storage in [None, 'zookeeper', 'dual']:
+            self.client.send_offset_commit_request(self.config.group_id, reqs)
+        if self.config.offset_storage in ['kafka', 'dual']:
+            self.client.send_offset_commit_request_kafka(self.config.group_id, reqs)
+
+    def _run(self):
+        while not self._stopped.is_set():
+            self._wakeup.wait(self.commit_interval_secs)
+            self._wakeup.clear()
+            if self._stopped.is_set():
+                break
+            try:
+                self.flush()
+            except Exception:
+                self.log.exception("Unexpected error committing offsets")
@@ -17,24 +17,16 @@ from __future__ import unicode_literals
 
 import logging
 import os
+import threading
 from collections import namedtuple
 
 import six
-import yaml
-from bravado.client import SwaggerClient
-from bravado.requests_client import RequestsClient
-try:
-    from bravado_decorators.retry import SmartStackClient
-    from bravado_decorators.retry import UserFacingRetryConfig
-except ImportError:
-    pass
 from kafka.consumer.base import FETCH_MIN_BYTES
 from kafka.consumer.kafka import DEFAULT_CONSUMER_CONFIG
 from kafka.util import kafka_bytestring
-from swagger_zipkin.zipkin_decorator import ZipkinClientDecorator
 
 from yelp_kafka.error import ConfigurationError
-from yelp_kafka.utils import memoized
+from yelp_kafka.utils import cached
 
 
 DEFAULT_KAFKA_TOPOLOGY_BASE_PATH = '/nail/etc/kafka_discovery'
@@ -49,21 +41,45 @@ MAX_TERMINATION_TIMEOUT_SECS = 10
 MAX_ITERATOR_TIMEOUT_SECS = 0.1
 DEFAULT_OFFSET_RESET = 'largest'
 DEFAULT_OFFSET_STORAGE = None
+OFFSET_STORAGES = (None, 'zookeeper', 'kafka', 'dual')
 DEFAULT_CLIENT_ID = 'yelp-kafka'
 
 # The default has been changed from 100 to None.
 # https://github.com/Yelp/kafka-python/blob/master/kafka/consumer/base.py#L181
 AUTO_COMMIT_MSG_COUNT = None
 AUTO_COMMIT_INTERVAL_SECS = 1
+ASYNC_COMMIT_INTERVAL_SECS = 1
+ASYNC_COMMIT_EVERY_N = 1000
+CONCURRENT_WORKERS = 16
+MAX_IN_FLIGHT_MESSAGES = 1000
+
+# Environment variables used by the static rebalance protocol when the
+# member index and count are not in the consumer config.
+STATIC_MEMBER_INDEX_ENV = 'YELP_KAFKA_MEMBER_INDEX'
+STATIC_MEMBER_COUNT_ENV = 'YELP_KAFKA_MEMBER_COUNT'
 
 DEFAULT_KAFKA_DISCOVERY_SERVICE_PATH = '/nail/etc/services/services.yaml'
 
+TOPOLOGY_WATCH_INTERVAL_SECS = 10
+
 RESPONSE_TIMEOUT = 2.0  # Response timeout (2 sec) for kafka cluster-endpoints
+# Discovery clients are created again after this time, so that changes
+# of the kafka_discovery service endpoint are picked up.
+DISCOVERY_CLIENT_TTL_SECS = 600
+DISCOVERY_CLIENT_CACHE_SIZE = 32
 
 
-@memoized
+@cached(maxsize=DISCOVERY_CLIENT_CACHE_SIZE, ttl=DISCOVERY_CLIENT_TTL_SECS)
 def get_kafka_discovery_client(client_id):
     """Create smartstack-client for kafka_discovery service."""
+    # The swagger and zipkin dependencies are slow to import, only load
+    # them when a discovery client is needed.
+    from bravado.client import SwaggerClient
+    from bravado.requests_client import RequestsClient
+    from bravado_decorators.retry import SmartStackClient
+    from bravado_decorators.retry import UserFacingRetryConfig
+    from swagger_zipkin.zipkin_decorator import ZipkinClientDecorator
+
     # Default retry is 1 on response timeout
     retry_config = UserFacingRetryConfig(timeout=RESPONSE_TIMEOUT)
     swagger_url = get_swagger_url()
@@ -91,29 +107,70 @@ class ClusterConfig(
     :param name: cluster name
     :param broker_list: list of kafka brokers
     :param zookeeper: zookeeper connection string
+
+    Two cluster configs are equal if they have the same type and name, and
+    the same brokers and zookeeper hosts in any order. Brokers can be given
+    either as a list or as a comma separated string.
     """
 
+    @property
+    def canonical_key(self):
+        """Normalized, hashable form of the cluster config:
+        (type, name, sorted brokers tuple, sorted zookeeper hosts tuple).
+
+        The key is computed once per instance, so cluster configs are cheap
+        dict keys.
+        """
+        if getattr(self, '_canonical_key', None) is None:
+            self._build_canonical_key()
+        return self._canonical_key
+
+    def _build_canonical_key(self):
+        self._canonical_key = (
+            self.type,
+            self.name,
+            normalize_hosts(self.broker_list),
+            normalize_hosts(self.zookeeper),
+        )
+        self._hash = hash(self._canonical_key)
+
     def __ne__(self, other):
-        return self.__hash__() != other.__hash__()
+        return not self == other
 
     def __eq__(self, other):
-        return self.__hash__() == other.__hash__()
+        if self is other:
+            return True
+        if not isinstance(other, ClusterConfig):
+            return NotImplemented
+        return (
+            hash(self) == hash(other) and
+            self.canonical_key == other.canonical_key
+        )
 
     def __hash__(self):
-        if isinstance(self.broker_list, list):
-            broker_list = self.broker_list
-        else:
-            broker_list = self.broker_list.split(',')
-        zk_list = self.zookeeper.split(',')
-        return hash((
-            self.type,
-            self.name,
-            ",".join(sorted(filter(None, broker_list))),
-            ",".join(sorted(filter(None, zk_list)))
-        ))
+        if getattr(self, '_hash', None) is None:
+            self._build_canonical_key()
+        return self._hash
+
+    def __reduce__(self):
+        # The cached hash is not valid in other processes: string hashes
+        # are randomized.
+        return (self.__class__, tuple(self))
+
+
+def normalize_hosts(hosts):
+    """Sort a list or a comma separated string of hosts, removing the
+    empty entries.
+
+    :returns: tuple of hosts
+    """
+    if isinstance(hosts, six.string_types):
+        hosts = hosts.split(',')
+    return tuple(sorted(filter(None, hosts)))
 
 
 def load_yaml_config(config_path):
+    import yaml
     with open(config_path, 'r') as config_file:
         return yaml.safe_load(config_file)
 
@@ -125,11 +182,130 @@ def get_swagger_url(service_path=DEFAULT_KAFKA_DISCOVERY_SERVICE_PATH):
     return 'http://{0}:{1}/swagger.json'.format(host, port)
 
 
+def get_file_signature(path):
+    """Identify the current version of a file: a file rewritten in place
+    changes modification time or size, a file replaced by a rename changes
+    inode.
+
+    :raises OSError: if the file does not exist
+    """
+    stat = os.stat(path)
+    return (stat.st_dev, stat.st_ino, stat.st_mtime, stat.st_size)
+
+
+CachedTopology = namedtuple(
+    'CachedTopology',
+    ['signature', 'clusters', 'local_config', 'cluster_configs'],
+)
+"""Parsed topology file.
+
+* **signature**: see :py:func:`get_file_signature`
+* **clusters**: clusters section of the file
+* **local_config**: local_config section of the file
+* **cluster_configs**: dict {<cluster name>: :py:class:`ClusterConfig`}
+"""
+
+
+class TopologyCache(object):
+    """Process-wide cache of the parsed topology files, by path.
+
+    A file is parsed again only if its signature changed since it was
+    cached, so that topology changes are picked up without restarting the
+    process. The :py:class:`ClusterConfig` instances of a topology are
+    shared by all the users of the cache.
+    """
+
+    def __init__(self):
+        self.log = logging.getLogger(self.__class__.__name__)
+        self._lock = threading.Lock()
+        self._topologies = {}
+
+    def get(self, config_path, cluster_type):
+        """Get the topology in config_path, parsing the file if it changed.
+
+        :param config_path: path of the topology file
+        :param cluster_type: kafka cluster type of the topology
+        :rtype: :py:data:`CachedTopology`
+        :raises ConfigurationError: if the file does not exist or is invalid
+        """
+        try:
+            signature = get_file_signature(config_path)
+        except OSError:
+            raise ConfigurationError(
+                "Topology configuration {0} for cluster {1} "
+                "does not exist".format(
+                    config_path, cluster_type
+                )
+            )
+        with self._lock:
+            topology = self._topologies.get(config_path)
+            if topology is None or topology.signature != signature:
+                topology = self._load(config_path, cluster_type, signature)
+                self._topologies[config_path] = topology
+            return topology
+
+    def _load(self, config_path, cluster_type, signature):
+        self.log.debug("Loading configuration from %s", config_path)
+        try:
+            topology_config = load_yaml_config(config_path)
+        except Exception:
+            # Unreadable file or invalid yaml, e.g. a partially written file
+            self.log.exception("Failed to parse the topology file")
+            raise ConfigurationError("Invalid topology file {0}".format(
+                config_path))
+        self.log.debug("Topology configuration %s", topology_config)
+        try:
+            clusters = topology_config['clusters']
+            local_config = topology_config['local_config']
+            cluster_configs = dict(
+                (name, ClusterConfig(
+                    type=cluster_type,
+                    name=name,
+                    broker_list=cluster['broker_list'],
+                    zookeeper=cluster['zookeeper'],
+                ))
+                for name, cluster in six.iteritems(clusters)
+            )
+        except (KeyError, TypeError, AttributeError):
+            # Missing sections, or an empty file parsed as None
+            self.log.exception("Invalid topology file")
+            raise ConfigurationError("Invalid topology file {0}".format(
+                config_path))
+        return CachedTopology(signature, clusters, local_config, cluster_configs)
+
+    def clear(self):
+        with self._lock:
+            self._topologies.clear()
+
+
+_topology_cache = TopologyCache()
+
+
+def get_topology_cache():
+    """Get the topology cache of the process."""
+    return _topology_cache
+
+
+def get_topology_path(
+    cluster_type,
+    kafka_topology_path=DEFAULT_KAFKA_TOPOLOGY_BASE_PATH,
+):
+    return os.path.join(
+        kafka_topology_path,
+        '{id}.yaml'.format(id=cluster_type)
+    )
+
+
 class TopologyConfiguration(object):
     """Topology configuration for a kafka cluster.
     A topology configuration represents a kafka cluster
     in all the available regions at Yelp.
 
+    The topology files are cached by :py:class:`TopologyCache`: creating a
+    TopologyConfiguration only parses the file if it changed since it was
+    last loaded. An existing TopologyConfiguration is never updated, see
+    :py:class:`TopologyWatcher` to be notified of topology changes.
+
     :param cluster_type: kafka cluster type. Ex. standard, scribe, etc.
     :type cluster_type: string
     :param kafka_topology_path: path of the directory containing
@@ -147,6 +323,7 @@ class TopologyConfiguration(object):
         self.log = logging.getLogger(self.__class__.__name__)
         self.clusters = None
         self.local_config = None
+        self._cluster_configs = {}
         self.load_topology_config()
 
     def __eq__(self, other):
@@ -163,60 +340,26 @@ class TopologyConfiguration(object):
 
     def load_topology_config(self):
         """Load the topology configuration"""
-        config_path = os.path.join(
-            self.kafka_topology_path,
-            '{id}.yaml'.format(id=self.cluster_type)
+        topology = get_topology_cache().get(
+            get_topology_path(self.cluster_type, self.kafka_topology_path),
+            self.cluster_type,
         )
-        self.log.debug("Loading configuration from %s", config_path)
-        if os.path.isfile(config_path):
-            topology_config = load_yaml_config(config_path)
-        else:
-            raise ConfigurationError(
-                "Topology configuration {0} for cluster {1} "
-                "does not exist".format(
-                    config_path, self.cluster_type
-                )
-            )
-        self.log.debug("Topology configuration %s", topology_config)
-        try:
-            self.clusters = topology_config['clusters']
-            self.local_config = topology_config['local_config']
-        except KeyError:
-            self.log.exception("Invalid topology file")
-            raise ConfigurationError("Invalid topology file {0}".format(
-                config_path))
+        self.clusters = topology.clusters
+        self.local_config = topology.local_config
+        self._cluster_configs = topology.cluster_configs
 
     def get_all_clusters(self):
-        return [
-            ClusterConfig(
-                type=self.cluster_type,
-                name=name,
-                broker_list=cluster['broker_list'],
-                zookeeper=cluster['zookeeper'],
-            )
-            for name, cluster in six.iteritems(self.clusters)
-        ]
+        return list(self._cluster_configs.values())
 
     def get_cluster_by_name(self, name):
-        if name in self.clusters:
-            cluster = self.clusters[name]
-            return ClusterConfig(
-                type=self.cluster_type,
-                name=name,
-                broker_list=cluster['broker_list'],
-                zookeeper=cluster['zookeeper'],
-            )
+        if name in self._cluster_configs:
+            return self._cluster_configs[name]
         raise ConfigurationError("No cluster with name: {0}".format(name))
 
     def get_local_cluster(self):
         try:
             if self.local_config:
-                local_cluster = self.clusters[self.local_config['cluster']]
-                return ClusterConfig(
-                    type=self.cluster_type,
-                    name=self.local_config['cluster'],
-                    broker_list=local_cluster['broker_list'],
-                    zookeeper=local_cluster['zookeeper'])
+                return self._cluster_configs[self.local_config['cluster']]
         except KeyError:
             self.log.exception("Invalid topology file")
             raise ConfigurationError("Invalid topology file.")
@@ -234,6 +377,94 @@ class TopologyConfiguration(object):
                 ))
 
 
+class TopologyWatcher(object):
+    """Watch a topology file and call callback with a new
+    :py:class:`TopologyConfiguration` whenever the file changes.
+
+    The file signature is polled from a background thread every
+    interval_secs. Errors loading the new topology are logged and the file
+    is checked again at the next interval.
+
+    :param cluster_type: kafka cluster type. Ex. standard, scribe, etc.
+    :param callback: function called with the new TopologyConfiguration
+    :param kafka_topology_path: path of the directory containing
+        the kafka topology.yaml config
+    :param interval_secs: polling interval in seconds
+    """
+
+    def __init__(
+        self,
+        cluster_type,
+        callback,
+        kafka_topology_path=DEFAULT_KAFKA_TOPOLOGY_BASE_PATH,
+        interval_secs=TOPOLOGY_WATCH_INTERVAL_SECS,
+    ):
+        self.log = logging.getLogger(self.__class__.__name__)
+        self.cluster_type = cluster_type
+        self.callback = callback
+        self.kafka_topology_path = kafka_topology_path
+        self.interval_secs = interval_secs
+        self.config_path = get_topology_path(cluster_type, kafka_topology_path)
+        self._signature = None
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Start watching. The current signature of the file is the
+        reference for the following changes."""
+        try:
+            self._signature = get_file_signature(self.config_path)
+        except OSError:
+            self._signature = None
+        self._stopped.clear()
+        self._thread = threading.Thread(
+            target=self._run,
+            name='TopologyWatcher-{0}'.format(self.cluster_type),
+        )
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while not self._stopped.wait(self.interval_secs):
+            try:
+                self.check()
+            except Exception:
+                # Never let the watcher thread die, the file is checked
+                # again at the next interval.
+                self.log.exception("Failed to check the topology file")
+
+    def check(self):
+        """Call callback if the file changed since the last check.
+
+        :returns: True if the file changed
+        """
+        try:
+            signature = get_file_signature(self.config_path)
+        except OSError:
+            self.log.warning("Topology file %s does not exist", self.config_path)
+            return False
+        if signature == self._signature:
+            return False
+        try:
+            topology = TopologyConfiguration(
+                self.cluster_type,
+                self.kafka_topology_path,
+            )
+        except ConfigurationError:
+            self.log.exception("Failed to load the new topology")
+            return False
+        self._signature = signature
+        self.log.info("Topology %s changed", self.config_path)
+        self.callback(topology)
+        return True
+
+
 class KafkaConsumerConfig(object):
     """Config class for KafkaConsumerGroup, ConsumerGroup,
     MultiprocessingConsumerGroup, KafkaSimpleConsumer and KakfaConsumerBase.
@@ -254,6 +485,25 @@ class KafkaConsumerConfig(object):
         * **client_id**: client id to use on connection. Default: 'yelp-kafka'.
         * **partitioner_cooldown**: Waiting time for the consumer
           to acquire the partitions. Default: 30 seconds.
+        * **rebalance_protocol**: 'eager' or 'incremental'. With 'eager' all
+          the group members release all their partitions upon a group change
+          and wait partitioner_cooldown before acquiring them again. With
+          'incremental' only the partitions changing owner are handed off, as
+          soon as the old owner releases them, and partitioner_cooldown is
+          not used. The consumers of the kept partitions keep running, the
+          rebalance callbacks only get the released and acquired partitions.
+          With 'static' the group members don't coordinate through
+          zookeeper: every member gets a fixed share of the partitions based
+          on static_member_index and static_member_count. All the members of a
+          group must use the same protocol. Default: 'eager'.
+        * **static_member_index**: Index of this member in a group using the
+          'static' rebalance_protocol, from 0 to static_member_count - 1.
+          Every member of the group must have a different index.
+          Default: YELP_KAFKA_MEMBER_INDEX environment variable, read when the
+          config is created.
+        * **static_member_count**: Number of members of a group using the
+          'static' rebalance_protocol. Default: YELP_KAFKA_MEMBER_COUNT
+          environment variable, read when the config is created.
         * **use_group_sha**: Used by partitioner to establish group membership.
           When True the partitioner will use the topic list to represent group itself.
           Basically groups with the same name but subscribed to different topic
@@ -261,8 +511,25 @@ class KafkaConsumerConfig(object):
           name but a different topic list will coordinate with each other for
           consumption. NOTE: in this case some topics may not be assigned until all
           consumers of the group converge to the same topics list. Default: True.
+        * **partition_assignment**: How the partitioner splits the partitions
+          among the group members. 'count' gives each member the same number
+          of partitions, 'throughput' balances the recent message rate of the
+          partitions assigned to each member. The rates are measured every
+          10 minutes by one of the members, which makes the group rebalance
+          only if the weights of the partitions changed significantly. All
+          the members of a group must use the same value. Default: 'count'.
+        * **consumer_capacity**: Relative capacity of this consumer, e.g. the
+          number of cores of the host. The partitioner assigns partitions
+          (or partition throughput) in proportion to the capacity of each
+          member of the group. Capacities are honored only if all the group
+          members run a yelp_kafka version supporting them. Default: 1.
         * **max_termination_timeout_secs**: Used by MultiprocessinConsumerGroup
           time to wait for a consumer to terminate. Default 10 secs.
+        * **consumer_pool_size**: Used by MultiprocessingConsumerGroup. Number
+          of consumer processes forked when the group starts and reused for
+          the partitions acquired upon every rebalance. The pool grows if more
+          partitions are acquired. If 0 a new process is started for each
+          acquired partition. Default: 0.
         * **metrics_reporter**: Used by
           :py:class:`yelp_kafka.consumer_group.KafkaConsumerGroup` to emit
           metrics data. Please pass in an instance of
@@ -288,6 +555,25 @@ class KafkaConsumerConfig(object):
           available in the yelp fork of kafka-python to allow offset commits to kafka,
           zookeeper or both. Default of None uses zookeeper offset storage and is not
           passed to consumer for backwards compatibility.
+        * **async_commit**: Used by
+          :py:class:`yelp_kafka.consumer.KafkaSimpleConsumer`. If True,
+          offsets committed with commit_message are coalesced and committed in
+          background. Pending offsets are committed when the consumer is closed.
+          Default: False.
+        * **async_commit_interval_secs**: Max time between two background
+          commits. Default: 1 second.
+        * **async_commit_every_n**: Commit in background as soon as n
+          messages have been committed with commit_message. Default: 1000.
+        * **concurrent_workers**: Used by
+          :py:class:`yelp_kafka.consumer.KafkaConcurrentConsumerBase`.
+          Number of threads processing messages concurrently. Default: 16.
+        * **max_in_flight_messages**: Used by
+          :py:class:`yelp_kafka.consumer.KafkaConcurrentConsumerBase`.
+          Max number of messages being processed concurrently. Default: 1000.
+        * **dispatch_by_key**: Used by
+          :py:class:`yelp_kafka.consumer.KafkaConcurrentConsumerBase`. If True,
+          messages with the same key are processed in order by the same
+          worker thread. Default: False.
 
     Yelp_kafka overrides some kafka-python default settings:
 
@@ -299,6 +585,14 @@ class KafkaConsumerConfig(object):
       :py:class:`yelp_kafka.consumer_group.ConsumerGroup`.This means commit will
       happen only once every minute irrespective of number of messages in that second.
     * **auto_commit_interval_ms** is 1 seconds by default.
+
+    KafkaConsumerConfig is immutable: the settings are validated and the
+    kafka-python configurations are computed once, when the config is
+    created. Use :py:meth:`copy` to get a config with different settings.
+    Configs can be pickled, e.g. to be sent to other processes, if the
+    callbacks and the metrics_reporter they contain can be pickled.
+
+    :raises ConfigurationError: if a setting is invalid
     """
 
     NOT_CONVERTIBLE = object()
@@ -367,11 +661,154 @@ class KafkaConsumerConfig(object):
     }
     """SIMPLE_CONSUMER_DEFAULT_CONFIG converted into a KafkaConsumer config"""
 
+    POSITIVE_SETTINGS = (
+        'consumer_capacity',
+        'concurrent_workers',
+        'max_in_flight_messages',
+        'async_commit_every_n',
+        'async_commit_interval_secs',
+    )
+    NON_NEGATIVE_SETTINGS = (
+        'partitioner_cooldown',
+        'max_termination_timeout_secs',
+        'consumer_pool_size',
+    )
+    CALLBACK_SETTINGS = (
+        'pre_rebalance_callback',
+        'post_rebalance_callback',
+    )
+
     def __init__(self, group_id, cluster, **config):
-        self.log = logging.getLogger(self.__class__.__name__)
-        self._config = config
-        self.cluster = cluster
-        self.group_id = kafka_bytestring(group_id)
+        self._init(group_id, cluster, config)
+
+    def _init(self, group_id, cluster, config):
+        set_attr = super(KafkaConsumerConfig, self).__setattr__
+        set_attr('log', logging.getLogger(self.__class__.__name__))
+        set_attr('_config', dict(config))
+        set_attr('cluster', cluster)
+        set_attr('group_id', kafka_bytestring(group_id))
+        set_attr('_static_member_index', self._get_static_member_setting(
+            'static_member_index',
+            STATIC_MEMBER_INDEX_ENV,
+        ))
+        set_attr('_static_member_count', self._get_static_member_setting(
+            'static_member_count',
+            STATIC_MEMBER_COUNT_ENV,
+        ))
+        self._validate()
+        set_attr('_simple_consumer_args', self._build_simple_consumer_args())
+        set_attr('_kafka_consumer_config', self._build_kafka_consumer_config())
+        set_attr('_metrics_dimensions', self._build_metrics_dimensions())
+
+    def __setattr__(self, name, value):
+        raise AttributeError(
+            "KafkaConsumerConfig is immutable, use copy() to change {0}.".format(
+                name,
+            )
+        )
+
+    def __delattr__(self, name):
+        raise AttributeError("KafkaConsumerConfig is immutable.")
+
+    def __getstate__(self):
+        # Loggers and the kafka-python defaults (functions) can't be
+        # pickled, the defaults are restored by key on unpickling.
+        kafka_config = dict(self._kafka_consumer_config)
+        kafka_defaults = [
+            key for key, value in six.iteritems(kafka_config)
+            if key in DEFAULT_CONSUMER_CONFIG and
+            value is DEFAULT_CONSUMER_CONFIG[key]
+        ]
+        for key in kafka_defaults:
+            del kafka_config[key]
+        return {
+            'group_id': self.group_id,
+            'cluster': self.cluster,
+            'config': self._config,
+            'static_member_index': self._static_member_index,
+            'static_member_count': self._static_member_count,
+            'simple_consumer_args': self._simple_consumer_args,
+            'kafka_consumer_config': kafka_config,
+            'kafka_defaults': kafka_defaults,
+            'metrics_dimensions': self._metrics_dimensions,
+        }
+
+    def __setstate__(self, state):
+        # Nothing is derived again, e.g. from the environment of the
+        # unpickling process, the config stays the same.
+        set_attr = super(KafkaConsumerConfig, self).__setattr__
+        set_attr('log', logging.getLogger(self.__class__.__name__))
+        set_attr('_config', state['config'])
+        set_attr('cluster', state['cluster'])
+        set_attr('group_id', state['group_id'])
+        set_attr('_static_member_index', state['static_member_index'])
+        set_attr('_static_member_count', state['static_member_count'])
+        set_attr('_simple_consumer_args', state['simple_consumer_args'])
+        kafka_config = dict(state['kafka_consumer_config'])
+        for key in state['kafka_defaults']:
+            kafka_config[key] = DEFAULT_CONSUMER_CONFIG[key]
+        set_attr('_kafka_consumer_config', kafka_config)
+        set_attr('_metrics_dimensions', state['metrics_dimensions'])
+
+    def copy(self, **config):
+        """Get a new config with the same settings, except for the
+        settings passed as keyword arguments.
+
+        :param config: settings to change, as in :py:class:`KafkaConsumerConfig`
+        :rtype: :py:class:`KafkaConsumerConfig`
+        """
+        settings = dict(self._config)
+        settings.update(config)
+        return self.__class__(self.group_id, self.cluster, **settings)
+
+    def _validate(self):
+        for key in self.POSITIVE_SETTINGS:
+            value = self._config.get(key)
+            if value is not None and not value > 0:
+                raise ConfigurationError(
+                    "Invalid {key} {value}, it must be greater than 0.".format(
+                        key=key,
+                        value=value,
+                    )
+                )
+        for key in self.NON_NEGATIVE_SETTINGS:
+            value = self._config.get(key)
+            if value is not None and value < 0:
+                raise ConfigurationError(
+                    "Invalid {key} {value}, it can't be negative.".format(
+                        key=key,
+                        value=value,
+                    )
+                )
+        for key in self.CALLBACK_SETTINGS:
+            value = self._config.get(key)
+            if value is not None and not callable(value):
+                raise ConfigurationError(
+                    "Invalid {key} {value!r}, it must be callable.".format(
+                        key=key,
+                        value=value,
+                    )
+                )
+        if self.offset_storage not in OFFSET_STORAGES:
+            raise ConfigurationError(
+                "Invalid offset_storage {0}. Valid values: {1}".format(
+                    self.offset_storage,
+                    OFFSET_STORAGES,
+                )
+            )
+        if not isinstance(self._config.get('metrics_dimensions', {}), dict):
+            raise ConfigurationError("metrics_dimensions must be a dict.")
+        if (self._static_member_index is not None and
+                self._static_member_count is not None and
+                not 0 <= self._static_member_index < self._static_member_count):
+            raise ConfigurationError(
+                "Invalid static membership: static_member_index {0}, "
+                "static_member_count {1}. The index must be between 0 and "
+                "static_member_count - 1.".format(
+                    self._static_member_index,
+                    self._static_member_count,
+                )
+            )
 
     def __eq__(self, other):
         return all([
@@ -392,7 +829,12 @@ class KafkaConsumerConfig(object):
             2. User provided value for a KafkaConsumer config specified
                as keyword argument in KafkaConsumerConfig.
             3. Default value specified in yelp-kafka
+
+        The args are computed once, every call returns a new copy.
         """
+        return dict(self._simple_consumer_args)
+
+    def _build_simple_consumer_args(self):
         args = {}
         for key, default in six.iteritems(self.SIMPLE_CONSUMER_DEFAULT_CONFIG):
             if key in self._config:
@@ -422,9 +864,14 @@ class KafkaConsumerConfig(object):
             3. Default value specified in yelp-kafka for KafkaConsumer
             4. Default value specified in kafka-python
 
+        The config is computed once, every call returns a new copy.
+
         .. note:: SimpleConsumer is considered deprecated and not all of its
                   options can be converted in KafkaConsumer.
         """
+        return dict(self._kafka_consumer_config)
+
+    def _build_kafka_consumer_config(self):
         config = {}
         for key, default in six.iteritems(DEFAULT_CONSUMER_CONFIG):
             if key in self._config:
@@ -470,6 +917,39 @@ class KafkaConsumerConfig(object):
     def use_group_sha(self):
         return self._config.get('use_group_sha', True)
 
+    @property
+    def partition_assignment(self):
+        return self._config.get('partition_assignment', 'count')
+
+    @property
+    def rebalance_protocol(self):
+        return self._config.get('rebalance_protocol', 'eager')
+
+    @property
+    def static_member_index(self):
+        return self._static_member_index
+
+    @property
+    def static_member_count(self):
+        return self._static_member_count
+
+    def _get_static_member_setting(self, key, env_var):
+        value = self._config.get(key)
+        if value is None:
+            value = os.environ.get(env_var)
+        if value is None:
+            return None
+        try:
+            return int(value)
+        except ValueError:
+            raise ConfigurationError(
+                "Invalid {key} {value}.".format(key=key, value=value),
+            )
+
+    @property
+    def consumer_capacity(self):
+        return self._config.get('consumer_capacity', 1)
+
     @property
     def group_path(self):
         return '{zk_base}/{group_id}'.format(
@@ -494,7 +974,10 @@ class KafkaConsumerConfig(object):
 
     @property
     def metrics_dimensions(self):
-        dimensions = self._config.get('metrics_dimensions', {})
+        return dict(self._metrics_dimensions)
+
+    def _build_metrics_dimensions(self):
+        dimensions = dict(self._config.get('metrics_dimensions', {}))
         dimensions.update({
             'group_id': self.group_id,
             'cluster_name': self.cluster.name,
@@ -514,6 +997,37 @@ class KafkaConsumerConfig(object):
     def offset_storage(self):
         return self._config.get('offset_storage', DEFAULT_OFFSET_STORAGE)
 
+    @property
+    def async_commit(self):
+        return self._config.get('async_commit', False)
+
+    @property
+    def async_commit_interval_secs(self):
+        return self._config.get(
+            'async_commit_interval_secs',
+            ASYNC_COMMIT_INTERVAL_SECS,
+        )
+
+    @property
+    def async_commit_every_n(self):
+        return self._config.get('async_commit_every_n', ASYNC_COMMIT_EVERY_N)
+
+    @property
+    def consumer_pool_size(self):
+        return self._config.get('consumer_pool_size', 0)
+
+    @property
+    def concurrent_workers(self):
+        return self._config.get('concurrent_workers', CONCURRENT_WORKERS)
+
+    @property
+    def max_in_flight_messages(self):
+        return self._config.get('max_in_flight_messages', MAX_IN_FLIGHT_MESSAGES)
+
+    @property
+    def dispatch_by_key(self):
+        return self._config.get('dispatch_by_key', False)
+
     def __repr__(self):
         return (
             "KafkaConsumerConfig(group_id={group_id!r}, cluster={cluster!r}, "
@@ -16,6 +16,9 @@ from __future__ import absolute_import
 from __future__ import unicode_literals
 
 import logging
+import threading
+import time
+import traceback
 from collections import namedtuple
 from multiprocessing import Event
 
@@ -28,9 +31,17 @@ from kafka.util import kafka_bytestring
 from setproctitle import getproctitle
 from setproctitle import setproctitle
 
+from yelp_kafka.commit_manager import OffsetCommitManager
+from yelp_kafka.dispatcher import KeyedDispatcher
+from yelp_kafka.dispatcher import ThreadPoolDispatcher
 from yelp_kafka.error import ProcessMessageError
+from yelp_kafka.offset_tracker import OffsetTracker
 
 
+IN_FLIGHT_WAIT_TIMEOUT_SECS = 1
+"""Max time waiting for a free in flight slot before checking again the
+processing errors. Slots are notified as soon as they are freed."""
+
 Message = namedtuple("Message", ["partition", "offset", "key", "value"])
 """Tuple representing a kafka message.
 
@@ -71,7 +82,11 @@ class KafkaSimpleConsumer(object):
             raise TypeError("Partitions must be a list")
         self.partitions = partitions
         self.kafka_consumer = None
+        self.commit_manager = None
         self.config = config
+        # Set by MultiprocessingConsumerGroup to aggregate the metrics
+        # of its consumer processes.
+        self.metrics_recorder = None
 
     def connect(self):
         """ Connect to kafka and create a consumer.
@@ -83,20 +98,33 @@ class KafkaSimpleConsumer(object):
             self.config.broker_list,
             client_id=self.config.client_id
         )
+        if self.metrics_recorder:
+            self.client.metrics_responder = self.metrics_recorder.record_kafka_metric
 
         # Create a kafka SimpleConsumer.
+        simple_consumer_args = self._get_simple_consumer_args()
         self.kafka_consumer = SimpleConsumer(
             client=self.client, topic=self.topic, partitions=self.partitions,
-            **self.config.get_simple_consumer_args()
+            **simple_consumer_args
         )
         self.log.debug(
             "Connected to kafka. Topic %s, partitions %s, %s",
             self.topic,
             self.partitions,
             ','.join(['{0} {1}'.format(k, v) for k, v in
-                      six.iteritems(self.config.get_simple_consumer_args())])
+                      six.iteritems(simple_consumer_args)])
         )
         self.kafka_consumer.provide_partition_info()
+        if self.config.async_commit:
+            self.commit_manager = OffsetCommitManager(
+                self.config,
+                self.config.async_commit_interval_secs,
+                self.config.async_commit_every_n,
+            )
+            self.commit_manager.start()
+
+    def _get_simple_consumer_args(self):
+        return self.config.get_simple_consumer_args()
 
     def __iter__(self):
         for partition, kafka_message in self.kafka_consumer:
@@ -123,10 +151,20 @@ class KafkaSimpleConsumer(object):
             except:
                 self.log.exception("Commit error. "
                                    "Offsets may not have been committed")
+        self._stop_commit_manager()
         # Close all the connections to kafka brokers. KafkaClient open
         # connections to all the partition leaders.
         self.client.close()
 
+    def _stop_commit_manager(self):
+        """Flush the offsets marked by commit_message and stop the
+        background commits.
+        """
+        if self.commit_manager:
+            if not self.commit_manager.stop():
+                self.log.error("Offsets may not have been committed")
+            self.commit_manager = None
+
     def get_message(self, block=True, timeout=0.1):
         """Get message from kafka. It supports the same arguments of get_message
         in kafka-python SimpleConsumer.
@@ -173,18 +211,36 @@ class KafkaSimpleConsumer(object):
         .. note:: all the messages received before message itself will be committed
                   as consequence.
 
+        .. note:: if async_commit is enabled the offset is committed in
+                  background and the function always returns True.
+                  See :py:class:`yelp_kafka.commit_manager.OffsetCommitManager`.
+
         :param message: message to commit.
         :type message: Message namedtuple, which consists of: partition number,
                        offset, key, and message value
         :return: True on success, False on failure.
         """
+        return self._commit_offsets({message.partition: message.offset})
+
+    def _commit_offsets(self, offsets):
+        """Commit offsets for many partitions with a single request.
+
+        :param offsets: dict <partition>: <offset>
+        :return: True on success, False on failure.
+        """
+        if self.commit_manager:
+            for partition, offset in six.iteritems(offsets):
+                self.commit_manager.mark(self.topic, partition, offset)
+            return True
+
         reqs = [
             OffsetCommitRequest(
                 self.topic,
-                message.partition,
-                message.offset,
+                partition,
+                offset,
                 None,
             )
+            for partition, offset in sorted(six.iteritems(offsets))
         ]
 
         try:
@@ -278,6 +334,11 @@ class KafkaConsumerBase(KafkaSimpleConsumer):
                 self.config
             )
             raise
+        self._consume()
+        self._terminate()
+
+    def _consume(self):
+        """Consume messages until the consumer is terminated."""
         while not self.termination_flag.is_set():
             for message in self:
                 try:
@@ -293,12 +354,160 @@ class KafkaConsumerBase(KafkaSimpleConsumer):
                 # 99d4a3a8b1dbae514b1c6d367908010b65fc8d0c/kafka/consumer/simple.py#L348
                 if self.termination_flag.is_set():
                     break
-        self._terminate()
 
     def _terminate(self):
         """Commit offsets and terminate the consumer.
         """
         self.log.info("Terminating consumer topic %s ", self.topic)
         self.commit()
+        self._stop_commit_manager()
         self.client.close()
         self.dispose()
+
+
+class KafkaConcurrentConsumerBase(KafkaConsumerBase):
+    """Kafka consumer processing many messages concurrently.
+    Inherit from :class:`yelp_kafka.consumer.KafkaConsumerBase`.
+
+    Messages are dispatched to a pool of concurrent_workers threads that call
+    :py:meth:`process`. Since messages can complete out of order, the
+    consumer tracks the processed offsets of each partition and only commits
+    the offset of the first message not processed yet. This preserves the
+    at-least-once semantics: after a restart the consumer may process again
+    messages that were already processed, but it never skips one.
+
+    At most max_in_flight_messages are dispatched and not processed yet. See
+    :py:class:`yelp_kafka.config.KafkaConsumerConfig`.
+
+    If dispatch_by_key is enabled in config, messages with the same key are
+    processed sequentially, in offset order, by the same worker thread while
+    messages with different keys are still processed in parallel. This
+    allows to scale the processing of a single partition without losing the
+    per-key ordering.
+
+    The SimpleConsumer auto commit is disabled, since it would commit
+    messages not processed yet. If auto_commit is enabled in config,
+    processed offsets are committed every auto_commit_every_t milliseconds.
+    Processed offsets are always committed at termination.
+
+    .. note:: process is called concurrently from many threads
+       and it must be thread safe.
+    """
+
+    def __init__(self, topic, config, partitions=None):
+        super(KafkaConcurrentConsumerBase, self).__init__(topic, config, partitions)
+        self.offset_tracker = OffsetTracker()
+        self.dispatcher = None
+        # Messages dispatched and not processed yet
+        self._in_flight = 0
+        self._in_flight_cond = threading.Condition()
+        self._process_errors = []
+        self._committed_offsets = {}
+        self._commit_interval_secs = None
+        self._last_commit = 0
+
+    def _get_simple_consumer_args(self):
+        args = super(KafkaConcurrentConsumerBase, self)._get_simple_consumer_args()
+        args['auto_commit'] = False
+        return args
+
+    def _create_dispatcher(self):
+        if self.config.dispatch_by_key:
+            dispatcher_cls = KeyedDispatcher
+        else:
+            dispatcher_cls = ThreadPoolDispatcher
+        return dispatcher_cls(
+            self.config.concurrent_workers,
+            self.process,
+            self._on_done,
+            name='Consumer-{0}'.format(self.topic.decode()),
+        )
+
+    def _consume(self):
+        self._in_flight = 0
+        args = self.config.get_simple_consumer_args()
+        if args['auto_commit']:
+            self._commit_interval_secs = args['auto_commit_every_t'] / 1000.0
+        self._last_commit = time.time()
+        self.dispatcher = self._create_dispatcher()
+        self.dispatcher.start()
+        try:
+            while not self.termination_flag.is_set():
+                for message in self:
+                    self._dispatch(message)
+                    self._maybe_commit()
+                    # See KafkaConsumerBase
+                    if self.termination_flag.is_set():
+                        break
+                self._raise_on_process_error()
+                self._maybe_commit()
+        finally:
+            # Wait for the dispatched messages to be processed
+            self.dispatcher.stop()
+        self._raise_on_process_error()
+
+    def _dispatch(self, message):
+        with self._in_flight_cond:
+            while self._in_flight >= self.config.max_in_flight_messages:
+                self._raise_on_process_error()
+                self._in_flight_cond.wait(IN_FLIGHT_WAIT_TIMEOUT_SECS)
+            self._in_flight += 1
+        self._raise_on_process_error()
+        self.offset_tracker.add(message.partition, message.offset)
+        self.dispatcher.dispatch(message)
+
+    def _on_done(self, message, exc_info):
+        if exc_info is None:
+            self.offset_tracker.done(message.partition, message.offset)
+        else:
+            self.log.error(
+                "Error processing message: %s",
+                message,
+                exc_info=exc_info,
+            )
+            self._process_errors.append(
+                (message, ''.join(traceback.format_exception(*exc_info))),
+            )
+        with self._in_flight_cond:
+            self._in_flight -= 1
+            self._in_flight_cond.notify()
+
+    def _raise_on_process_error(self):
+        if self._process_errors:
+            message, trace = self._process_errors[0]
+            raise ProcessMessageError(
+                "Error processing message: {0}\n\nException "
+                "caught inside processing message function:\n{1}".format(
+                    message,
+                    trace,
+                )
+            )
+
+    def _maybe_commit(self):
+        if self._commit_interval_secs is None:
+            return
+        if time.time() - self._last_commit >= self._commit_interval_secs:
+            self.commit()
+
+    def commit(self, partitions=None):
+        """Commit the offsets of the processed messages.
+
+        :param partitions: list of partitions to commit, default commits to all
+            partitions.
+        :return: True on success, False on failure.
+        """
+        self._last_commit = time.time()
+        offsets = dict(
+            (partition, offset)
+            for partition, offset in six.iteritems(
+                self.offset_tracker.committable_offsets(),
+            )
+            if self._committed_offsets.get(partition) != offset and
+            (not partitions or partition in partitions)
+        )
+        if not offsets:
+            return True
+        success = self._commit_offsets(offsets)
+        if success:
+            self._committed_offsets.update(offsets)
+        return success
@@ -27,6 +27,7 @@ from multiprocessing import Process
 import six
 from kafka import KafkaConsumer
 from kafka.common import ConsumerTimeout
+from kafka.util import kafka_bytestring
 from retrying import retry
 
 from yelp_kafka import metrics
@@ -37,8 +38,14 @@ from yelp_kafka.error import PartitionerZookeeperError
 from yelp_kafka.error import ProcessMessageError
 from yelp_kafka.metrics_responder import MetricsResponder
 from yelp_kafka.partitioner import Partitioner
+from yelp_kafka.shared_metrics import SharedMetrics
+from yelp_kafka.shared_metrics import SharedMetricsReporter
+from yelp_kafka.utils import consumes_from
 from yelp_kafka.utils import get_default_responder_if_available
+from yelp_kafka.utils import is_topic_pattern
 from yelp_kafka.utils import retry_if_kafka_unavailable_error
+from yelp_kafka.utils import set_task_done_offsets
+from yelp_kafka.worker_pool import ConsumerWorkerPool
 
 DEFAULT_REFRESH_TIMEOUT_IN_SEC = 0.5
 CONSUMER_GROUP_INTERNAL_TIMEOUT = 100  # milliseconds
@@ -83,8 +90,9 @@ class ConsumerGroup(object):
        consumer = ConsumerGroup('test_topic', config, my_process_function)
        consumer.run()
 
-    :param topics: topics to consume from
-    :type topics: list
+    :param topics: topics to consume from, or a compiled regular expression
+        matching the topics to consume from.
+    :type topics: list or regular expression
     :param config: yelp_kakfa config. See :py:mod:`yelp_kafka.config`
     :type config: dict
     :param process_func: function used to process the message.
@@ -98,11 +106,13 @@ class ConsumerGroup(object):
         self.topic = topic
         self.partitioner = Partitioner(
             config,
-            topic if isinstance(topic, list) else [topic],
+            topic if isinstance(topic, list) or is_topic_pattern(topic) else [topic],
             self._acquire,
             self._release
         )
         self.consumer = None
+        # Partitions of the consumer
+        self.partitions = []
         self.process = process_func
 
     def run(self, refresh_timeout=DEFAULT_REFRESH_TIMEOUT_IN_SEC):
@@ -162,23 +172,9 @@ class ConsumerGroup(object):
            changes and the partitions have been acquired.
         """
         if partitions.get(self.topic):
-            self.consumer = KafkaSimpleConsumer(
-                self.topic,
-                self.config,
-                partitions[self.topic]
-            )
-            try:
-                # We explicitly catch and log the exception.
-                self.consumer.connect()
-            except:
-                self.log.exception(
-                    "Consumer topic %s, partition %s, config %s:"
-                    " failed connecting to kafka",
-                    self.topic,
-                    partitions,
-                    self.config,
-                )
-                raise
+            # Incremental rebalances acquire partitions in addition to the
+            # kept ones.
+            self._start_consumer(self.partitions + list(partitions[self.topic]))
 
     def _release(self, partitions):
         """Release the consumer.
@@ -190,6 +186,34 @@ class ConsumerGroup(object):
         if self.consumer:
             self.consumer.close()
             self.consumer = None
+        released = partitions.get(self.topic, ())
+        kept = [p for p in self.partitions if p not in released]
+        self.partitions = []
+        if kept:
+            # Kept by an incremental rebalance
+            self._start_consumer(kept)
+
+    def _start_consumer(self, partitions):
+        if self.consumer:
+            self.consumer.close()
+        self.consumer = KafkaSimpleConsumer(
+            self.topic,
+            self.config,
+            partitions,
+        )
+        self.partitions = partitions
+        try:
+            # We explicitly catch and log the exception.
+            self.consumer.connect()
+        except:
+            self.log.exception(
+                "Consumer topic %s, partition %s, config %s:"
+                " failed connecting to kafka",
+                self.topic,
+                partitions,
+                self.config,
+            )
+            raise
 
 
 class KafkaConsumerGroup(object):
@@ -203,15 +227,15 @@ class KafkaConsumerGroup(object):
     the event that rebalancing does occur and that you have enabled
     auto-committing, any messages marked as done using `task_done()` will be
     committed before repartitioning. To commit messages immediately, you can
-    call `commit()`.
+    call `commit()`. With the incremental rebalance protocol the partitions
+    kept by the consumer are consumed without interruption from their
+    current offsets.
 
     If metrics_reporter is enabled in config, the metrics prefix in
     will be: "yelp_kafka.KafkaConsumerGroup."
 
-    .. warning::
-        Do not create multiple KafkaConsumerGroups in the same process;
-        the Partitioner class does not work if there are multiple instances of it in
-        the same process.
+    Multiple KafkaConsumerGroups, for the same or different groups, can run in
+    the same process. They share a single zookeeper session.
 
     .. warning::
         Messages will be instances of kafka-python KafkaMessage, which is
@@ -219,8 +243,10 @@ class KafkaConsumerGroup(object):
         "value". This message format is different from those yielded by
         :py:class:`yelp_kafka.consumer_group.ConsumerGroup`.
 
-    :param topics: a list of topics to consume from.
-    :type topics: list
+    :param topics: a list of topics to consume from, or a compiled regular
+        expression matching the topics to consume from. See
+        :py:class:`yelp_kafka.partitioner.Partitioner`.
+    :type topics: list or regular expression
     :param config: yelp_kakfa consumer config.
     :type config: :py:class:`yelp_kafka.config.KafkaConsumerConfig`
     :param metrics_responder: A metric responder to report metrics, defaults to
@@ -232,7 +258,8 @@ class KafkaConsumerGroup(object):
     METRIC_PREFIX = 'yelp_kafka.KafkaConsumerGroup'
 
     def __init__(self, topics, config, metrics_responder=None):
-        assert isinstance(topics, list), "Topics must be a list"
+        assert isinstance(topics, list) or is_topic_pattern(topics), \
+            "Topics must be a list or a regular expression"
 
         self.log = logging.getLogger(self.__class__.__name__)
         self.topics = topics
@@ -297,21 +324,39 @@ class KafkaConsumerGroup(object):
 
     def stop(self):
         self.partitioner.stop()
-        self.consumer.close()
+        # A static member may have no partitions, and no consumer.
+        if self.consumer is not None:
+            self.consumer.close()
 
     def next(self):
         start_time = time.time()
         while self._should_keep_trying(start_time):
-            self.partitioner.refresh()
-            try:
-                return self.consumer.next()
-            except ConsumerTimeout:
-                # This is due to the internal timeout, not the user's provided
-                # one.
-                pass
+            message = self.poll()
+            if message is not None:
+                return message
         error_msg = "KafkaConsumerGroup timed out after {0} ms"
         raise ConsumerTimeout(error_msg.format(self.iter_timeout))
 
+    def poll(self):
+        """Refresh the group and wait for a message for at most
+        CONSUMER_GROUP_INTERNAL_TIMEOUT milliseconds.
+
+        :returns: a kafka-python KafkaMessage or None if no message
+            has been received within the internal timeout.
+        """
+        self.partitioner.refresh()
+        if self.consumer is None:
+            # No partitions acquired, e.g. a static member beyond the number
+            # of partitions.
+            time.sleep(CONSUMER_GROUP_INTERNAL_TIMEOUT / 1000.0)
+            return None
+        try:
+            return self.consumer.next()
+        except ConsumerTimeout:
+            # This is due to the internal timeout, not the user's provided
+            # one.
+            return None
+
     def _should_keep_trying(self, start_time):
         if self.iter_timeout < 0:
             return True
@@ -322,25 +367,54 @@ class KafkaConsumerGroup(object):
         return self.consumer.task_done(message)
 
     def commit(self):
+        if self.consumer is None:
+            return None
         return self.consumer.commit()
 
     def _acquire(self, partitions):
         if not self.consumer:
             self.consumer = KafkaConsumer(partitions, **self.config)
         else:
-            self.consumer.set_topic_partitions(partitions)
+            self._update_topic_partitions(added=partitions)
         if self.post_rebalance_callback:
             self.post_rebalance_callback(partitions)
 
-    # set_topic_partitions causes a metadata request, which may fail on the
-    # first try.
-    @retry(stop_max_attempt_number=2, retry_on_exception=retry_if_kafka_unavailable_error)
     def _release(self, partitions):
         if self.pre_rebalance_callback:
             self.pre_rebalance_callback(partitions)
         if self._auto_commit_enabled():
             self.consumer.commit()
-        self.consumer.set_topic_partitions({})
+        self._update_topic_partitions(removed=partitions)
+
+    def _update_topic_partitions(self, added=None, removed=None):
+        """Add or remove partitions of the consumer. The other partitions
+        keep being consumed from their current fetch offsets, and the
+        offsets marked as done are kept.
+        """
+        removed_keys = set(
+            (kafka_bytestring(topic), partition)
+            for topic, topic_partitions in six.iteritems(removed or {})
+            for partition in topic_partitions
+        )
+        offsets = self.consumer.offsets()
+        kept = [key for key in offsets['fetch'] if key not in removed_keys]
+        topics = []
+        if kept:
+            topics.append(dict((key, offsets['fetch'][key]) for key in kept))
+        topics.append(added or {})
+        task_done = dict(
+            (key, offsets['task_done'][key]) for key in kept
+            if offsets['task_done'].get(key) is not None
+        )
+        self._set_topic_partitions(*topics)
+        # set_topic_partitions resets the offsets marked as done
+        set_task_done_offsets(self.consumer, task_done)
+
+    # set_topic_partitions causes a metadata request, which may fail on the
+    # first try.
+    @retry(stop_max_attempt_number=2, retry_on_exception=retry_if_kafka_unavailable_error)
+    def _set_topic_partitions(self, *topics):
+        self.consumer.set_topic_partitions(*topics)
 
     def _auto_commit_enabled(self):
         return self.config['auto_commit_enable']
@@ -368,6 +442,24 @@ class MultiprocessingConsumerGroup(object):
 
     .. note: This class is thread safe.
 
+    If consumer_pool_size is set in config, consumer processes are forked
+    once when the group starts and kept in a
+    :py:class:`yelp_kafka.worker_pool.ConsumerWorkerPool`. Upon rebalance the
+    acquired partitions are sent to the idle processes of the pool, instead
+    of starting a new process for each of them. In this case the consumers
+    are created in the pool processes, and :py:meth:`get_consumers` returns
+    the :py:class:`yelp_kafka.worker_pool.PoolWorker` running them.
+
+    If a metrics_responder is given, the consumer processes record the
+    kafka client metrics in shared memory, see
+    :py:mod:`yelp_kafka.shared_metrics`. The group reports the aggregated
+    metrics of all its processes through metrics_responder, every
+    refresh_timeout seconds.
+
+    .. seealso:: :py:class:`yelp_kafka.shared_memory_group.SharedMemoryConsumerGroup`
+       where a single process fetches the messages for all the worker
+       processes.
+
     Example:
 
     .. code-block:: python
@@ -407,8 +499,9 @@ class MultiprocessingConsumerGroup(object):
        time.sleep(600)
        group.stop_group()
 
-    :param topics: a list of topics to consume from.
-    :type topics: list
+    :param topics: a list of topics to consume from, or a compiled regular
+        expression matching the topics to consume from.
+    :type topics: list or regular expression
     :param config: yelp_kakfa config. See :py:mod:`yelp_kafka.config`
     :type config: dict
     :param consumer_factory: the function used to instantiate the consumer.
@@ -416,9 +509,16 @@ class MultiprocessingConsumerGroup(object):
         :py:class:`yelp_kafka.consumer.KafkaConsumerBase`. It has to return
         an instance of a subclass of
         :py:class:`yelp_kafka.consumer.KafkaConsumerBase`.
+    :param metrics_responder: optional metrics responder the metrics of the
+        consumer processes are reported to.
+    :type metrics_responder: class which implements metric_responder.MetricsResponder
     """
 
-    def __init__(self, topics, config, consumer_factory):
+    METRIC_PREFIX = 'yelp_kafka.MultiprocessingConsumerGroup'
+
+    def __init__(self, topics, config, consumer_factory, metrics_responder=None):
+        assert not metrics_responder or isinstance(metrics_responder, MetricsResponder), \
+            "Metric Reporter is not of type yelp_kafka.metrics_responder.MetricsResponder"
         self.config = config
         self.termination_flag = None
         self.partitioner = Partitioner(
@@ -431,6 +531,12 @@ class MultiprocessingConsumerGroup(object):
         self.consumers_lock = Lock()
         self.consumer_procs = {}
         self.consumer_factory = consumer_factory
+        self.worker_pool = None
+        self.metrics_responder = metrics_responder
+        self.shared_metrics = None
+        self.metrics_reporter = None
+        # Shared metrics slot of each consumer process
+        self.metrics_slots = {}
         self.log = logging.getLogger(self.__class__.__name__)
         self.pre_rebalance_callback = config.pre_rebalance_callback
         self.post_rebalance_callback = config.post_rebalance_callback
@@ -451,16 +557,57 @@ class MultiprocessingConsumerGroup(object):
         """
         # Create the termination flag
         self.termination_flag = Event()
+        if self.metrics_responder:
+            # Shared with the consumer processes forked from now on
+            self.shared_metrics = SharedMetrics(
+                metrics.FAILURE_COUNT_METRIC_NAMES,
+                metrics.TIME_METRIC_NAMES,
+            )
+            self.metrics_reporter = SharedMetricsReporter(
+                self.shared_metrics,
+                self.metrics_responder,
+                self.METRIC_PREFIX,
+                self.config.metrics_dimensions,
+            )
+        if self.config.consumer_pool_size:
+            # Fork the workers before connecting to zookeeper
+            self.worker_pool = ConsumerWorkerPool(
+                self.consumer_factory,
+                self.config,
+                self.config.consumer_pool_size,
+                self.shared_metrics,
+            )
+            self.worker_pool.start()
 
-        with self.partitioner:
-            while not self.termination_flag.is_set():
-                self.termination_flag.wait(refresh_timeout)
-                self.monitor()
-                try:
-                    self.partitioner.refresh()
-                except (PartitionerZookeeperError, PartitionerError):
-                    self.log.exception("Encountered a partitioner error")
-                    raise
+        try:
+            with self.partitioner:
+                while not self.termination_flag.is_set():
+                    self.termination_flag.wait(refresh_timeout)
+                    self.monitor()
+                    self.flush_metrics()
+                    try:
+                        self.partitioner.refresh()
+                    except (PartitionerZookeeperError, PartitionerError):
+                        self.log.exception("Encountered a partitioner error")
+                        raise
+        finally:
+            if self.worker_pool:
+                self.worker_pool.stop(self.config.max_termination_timeout_secs)
+                self.worker_pool = None
+            if self.shared_metrics:
+                self.flush_metrics()
+                self.shared_metrics.close()
+                self.shared_metrics = None
+                self.metrics_reporter = None
+
+    def flush_metrics(self):
+        """Report the metrics of the consumer processes recorded since
+        the previous flush."""
+        if self.metrics_reporter:
+            try:
+                self.metrics_reporter.flush()
+            except Exception:
+                self.log.exception("Error reporting the consumer metrics")
 
     def stop_group(self):
         """Set the termination flag to stop the group.
@@ -503,8 +650,19 @@ class MultiprocessingConsumerGroup(object):
                     "Creating consumer topic = %s, config = %s,"
                     " partition = %s", topic, self.config, p
                 )
-                consumer = self.consumer_factory(topic, self.config, [p])
-                self.consumer_procs[self.start_consumer(consumer)] = consumer
+                if self.worker_pool:
+                    self.worker_pool.assign(topic, [p])
+                else:
+                    consumer = self.consumer_factory(topic, self.config, [p])
+                    slot = None
+                    if self.shared_metrics:
+                        slot = self.shared_metrics.acquire_slot()
+                        consumer.metrics_recorder = self.shared_metrics.get_recorder(slot)
+                    proc = self.start_consumer(consumer)
+                    self.consumer_procs[proc] = consumer
+                    self.metrics_slots[proc] = slot
+        if self.worker_pool:
+            return [w for w in self.worker_pool.workers if w.busy]
         return self.consumer_procs.values()
 
     def start_consumer(self, consumer):
@@ -536,22 +694,42 @@ class MultiprocessingConsumerGroup(object):
         return proc
 
     def release(self, partitions):
-        """Terminate all the consumer processes"""
+        """Terminate the consumer processes of the released partitions.
+
+        :param partitions: released topics partitions, None to terminate
+            all the consumers
+        :type: dict {<topic>: <[partitions]>}
+        """
         if self.pre_rebalance_callback:
             self.pre_rebalance_callback(partitions)
-        self.log.info("Terminating consumer group")
-        for consumer in six.itervalues(self.consumer_procs):
+        self.log.info("Terminating consumers of partitions %s", partitions)
+        if self.worker_pool:
+            self.worker_pool.release(
+                self.config.max_termination_timeout_secs,
+                partitions,
+            )
+            with self.consumers_lock:
+                self.consumers = [
+                    w for w in self.worker_pool.workers if w.busy
+                ] or None
+            return
+        released_procs = dict(
+            (proc, consumer)
+            for proc, consumer in six.iteritems(self.consumer_procs)
+            if consumes_from(consumer, partitions)
+        )
+        for consumer in six.itervalues(released_procs):
             consumer.terminate()
 
         timeout = time.time() + self.config.max_termination_timeout_secs
         while (
             time.time() <= timeout and any(
-                [proc.is_alive() for proc in six.iterkeys(self.consumer_procs)]
+                [proc.is_alive() for proc in six.iterkeys(released_procs)]
             )
         ):
             continue
 
-        for proc, consumer in six.iteritems(self.consumer_procs):
+        for proc, consumer in six.iteritems(released_procs):
             if proc.is_alive():
                 os.kill(proc.pid, signal.SIGKILL)
                 self.log.error(
@@ -561,12 +739,23 @@ class MultiprocessingConsumerGroup(object):
                     consumer.topic,
                     consumer.partitions,
                 )
-        self.consumer_procs.clear()
+            del self.consumer_procs[proc]
+            slot = self.metrics_slots.pop(proc, None)
+            if self.shared_metrics:
+                self.shared_metrics.release_slot(slot)
         with self.consumers_lock:
-            self.consumers = None
+            self.consumers = list(self.consumer_procs.values()) or None
 
     def monitor(self):
         """Respawn consumer processes upon failures."""
+        if self.worker_pool:
+            dead_workers = self.worker_pool.monitor()
+            if dead_workers:
+                with self.consumers_lock:
+                    self.consumers = [
+                        w for w in self.worker_pool.workers if w.busy
+                    ]
+            return
         # We don't use the iterator because the dict may change during the loop
         for proc, consumer in self.consumer_procs.items():
             if not proc.is_alive():
@@ -578,7 +767,10 @@ class MultiprocessingConsumerGroup(object):
                     consumer.partitions, proc.exitcode,
                 )
                 # Restart consumer process
-                self.consumer_procs[self.start_consumer(consumer)] = consumer
+                new_proc = self.start_consumer(consumer)
+                self.consumer_procs[new_proc] = consumer
+                # The new process records to the slot of the dead one
+                self.metrics_slots[new_proc] = self.metrics_slots.pop(proc, None)
                 # Remove dead process
                 del self.consumer_procs[proc]
 
@@ -33,12 +33,15 @@ from yelp_kafka.error import InvalidClusterTypeOrRegionError
 from yelp_kafka.error import InvalidClusterTypeOrSuperregionError
 from yelp_kafka.error import InvalidLogOrRegionError
 from yelp_kafka.error import InvalidLogOrSuperregionError
+from yelp_kafka.utils import cached
 from yelp_kafka.utils import get_kafka_topics
 
 DEFAULT_KAFKA_SCRIBE = 'scribe'
 DEFAULT_CLIENT_ID = 'yelp_kafka.default'
 REGION_FILE_PATH = '/nail/etc/region'
 SUPERREGION_FILE_PATH = '/nail/etc/superregion'
+# Region files rarely change, they are read again after this time.
+REGION_CACHE_TTL_SECS = 300
 
 
 log = logging.getLogger(__name__)
@@ -98,6 +101,7 @@ def search_topics_by_regex(pattern, clusters=None):
     return matches
 
 
+@cached(maxsize=1, ttl=REGION_CACHE_TTL_SECS)
 def _get_local_region():
     """Get name of the region at Yelp where yelp_kafka instance is running (caller)
     from region-file path."""
@@ -112,6 +116,7 @@ def _get_local_region():
         raise
 
 
+@cached(maxsize=1, ttl=REGION_CACHE_TTL_SECS)
 def _get_local_superregion():
     """Get name of the superregion at Yelp where yelp_kafka instance is running (caller)
     from superregion-file path."""
@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+# Copyright 2016 Yelp Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+import itertools
+import logging
+import sys
+import threading
+import zlib
+
+from six.moves import queue
+
+_STOP = object()
+
+
+class ThreadPoolDispatcher(object):
+    """Process messages concurrently with a pool of worker threads.
+    Messages are processed in no particular order.
+
+    :param workers: number of worker threads
+    :param process: function called with each message
+    :param on_done: function called with the message and the exception info
+        (as returned by sys.exc_info()) once the message has been processed.
+        exc_info is None if process succeeded.
+    :param name: prefix of the worker thread names
+    """
+
+    def __init__(self, workers, process, on_done, name='Dispatcher'):
+        self.log = logging.getLogger(self.__class__.__name__)
+        self.workers = workers
+        self.process = process
+        self.on_done = on_done
+        self.name = name
+        self._queue = queue.Queue()
+        self._threads = []
+
+    def start(self):
+        self._threads = [
+            self._start_worker(self._get_queue(i), i)
+            for i in range(self.workers)
+        ]
+
+    def stop(self):
+        """Wait for the dispatched messages to be processed and stop
+        the workers."""
+        for i in range(self.workers):
+            self._get_queue(i).put(_STOP)
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def dispatch(self, message):
+        self._queue_for(message).put(message)
+
+    def _get_queue(self, worker):
+        return self._queue
+
+    def _queue_for(self, message):
+        return self._get_queue(0)
+
+    def _start_worker(self, messages, index):
+        thread = threading.Thread(
+            target=self._work,
+            args=(messages,),
+            name='{0}-{1}'.format(self.name, index),
+        )
+        thread.daemon = True
+        thread.start()
+        return thread
+
+    def _work(self, messages):
+        while True:
+            message = messages.get()
+            if message is _STOP:
+                return
+            try:
+                self.process(message)
+            except Exception:
+                self.on_done(message, sys.exc_info())
+            else:
+                self.on_done(message, None)
+
+
+class KeyedDispatcher(ThreadPoolDispatcher):
+    """Process messages concurrently preserving the order of messages
+    with the same key.
+
+    Each worker has its own queue and messages are assigned to a worker by
+    the hash of their key. Messages with the same key are always processed by
+    the same worker, in the order they have been dispatched, while messages
+    with different keys are processed in parallel. Messages without a key
+    are assigned to the workers in round robin.
+
+    See :py:class:`ThreadPoolDispatcher` for the parameters.
+    """
+
+    def __init__(self, workers, process, on_done, name='KeyedDispatcher'):
+        super(KeyedDispatcher, self).__init__(workers, process, on_done, name)
+        self._queues = [queue.Queue() for _ in range(workers)]
+        self._round_robin = itertools.cycle(range(workers))
+
+    def _get_queue(self, worker):
+        return self._queues[worker]
+
+    def _queue_for(self, message):
+        if message.key is None:
+            return self._get_queue(next(self._round_robin))
+        return self._get_queue(self.get_worker(message.key))
+
+    def get_worker(self, key):
+        """Return the index of the worker processing messages with key."""
+        if not isinstance(key, bytes):
+            key = key.encode('utf-8')
+        return (zlib.crc32(key) & 0xffffffff) % self.workers
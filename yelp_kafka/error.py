@@ -47,6 +47,16 @@ class ProcessMessageError(YelpKafkaError):
     pass
 
 
+class ProducerQueueFullError(YelpKafkaError):
+    """The producer has too many messages in flight."""
+    pass
+
+
+class ProducerClosedError(YelpKafkaError):
+    """The producer has been closed."""
+    pass
+
+
 class ConsumerGroupError(YelpKafkaError):
     """Error in the consumer group"""
     pass
@@ -0,0 +1,371 @@
+# -*- coding: utf-8 -*-
+# Copyright 2016 Yelp Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+import logging
+import os
+import socket
+from functools import partial
+
+from kazoo.exceptions import KazooException
+from kazoo.exceptions import LockTimeout
+from kazoo.protocol.states import KazooState
+from kazoo.recipe.partitioner import PartitionState
+from kazoo.recipe.watchers import PatientChildrenWatch
+
+# The party must be stable for this time before the set is partitioned.
+# Much shorter than the default SetPartitioner time_boundary, since a
+# party change only moves the partitions that change owner.
+DEFAULT_TIME_BOUNDARY = 1
+
+
+def default_partition_func(identifier, members, partitions):
+    """Same as the default kazoo SetPartitioner partition_func."""
+    all_partitions = sorted(partitions)
+    workers = sorted(members)
+    i = workers.index(identifier)
+    return all_partitions[i::len(workers)]
+
+
+class IncrementalSetPartitioner(object):
+    """Partition a set amongst the members of a party, moving only the
+    items that change owner upon party changes.
+
+    IncrementalSetPartitioner has the same interface, states and zookeeper
+    layout (party and lock nodes) of
+    :py:class:`kazoo.recipe.partitioner.SetPartitioner`, but a different
+    rebalance protocol. With SetPartitioner every member releases all its
+    locks upon a party change and waits for the party to be stable for
+    time_boundary before acquiring the new partitions. Instead, when
+    :py:meth:`release_set` is called, IncrementalSetPartitioner computes the
+    new assignment and releases only the locks of the items moving to other
+    members, then acquires the items it gained as soon as their previous
+    owner releases them. Items that don't move stay locked for the whole
+    rebalance.
+
+    The user is still expected to call :py:meth:`release_set` in
+    :py:data:`~kazoo.recipe.partitioner.PartitionState.RELEASE` state and to
+    read the acquired set in
+    :py:data:`~kazoo.recipe.partitioner.PartitionState.ACQUIRED` state.
+
+    .. note:: All the members of a party must use the same rebalance
+       protocol and partition_func.
+
+    :param client: a :py:class:`kazoo.client.KazooClient`
+    :param path: the partition path
+    :param set: the set of items to partition
+    :param partition_func: function(identifier, members, set) returning the
+        items of the member identifier. It must be deterministic.
+    :param identifier: identifier of this member, default: hostname-pid
+    :param time_boundary: how long the party must be stable before the set
+        is partitioned
+    :param max_reaction_time: max time to react to party changes while
+        waiting for a lock
+    """
+
+    def __init__(
+        self,
+        client,
+        path,
+        set,
+        partition_func=None,
+        identifier=None,
+        time_boundary=DEFAULT_TIME_BOUNDARY,
+        max_reaction_time=1,
+    ):
+        self.log = logging.getLogger(self.__class__.__name__)
+        # Used to differentiate two states with the same names in time
+        self.state_id = 0
+        self.state = PartitionState.ALLOCATING
+        self._client = client
+        self._set = set
+        self._partition_set = []
+        # Acquired items still held by the user, their locks can only be
+        # released by release_set.
+        self._user_items = frozenset()
+        self._partition_func = partition_func or default_partition_func
+        self._identifier = identifier or "{0}-{1}".format(
+            socket.getfqdn(),
+            os.getpid(),
+        )
+        # Locks held, by item
+        self._locks = {}
+        self._lock_path = "/".join([path, "locks"])
+        self._party_path = "/".join([path, "party"])
+        self._time_boundary = time_boundary
+        self._max_reaction_time = max_reaction_time
+
+        self._acquire_event = client.handler.event_object()
+        self._state_change = client.handler.rlock_object()
+
+        client.ensure_path(path)
+        client.ensure_path(self._lock_path)
+        client.ensure_path(self._party_path)
+
+        self._party = client.ShallowParty(
+            self._party_path,
+            identifier=self._identifier,
+        )
+        self._party.join()
+
+        client.add_listener(self._establish_sessionwatch)
+        self._child_watching(self._allocate_transition)
+
+    def __iter__(self):
+        """Return the items acquired by this member."""
+        for item in self._partition_set:
+            yield item
+
+    @property
+    def failed(self):
+        return self.state == PartitionState.FAILURE
+
+    @property
+    def release(self):
+        return self.state == PartitionState.RELEASE
+
+    @property
+    def allocating(self):
+        return self.state == PartitionState.ALLOCATING
+
+    @property
+    def acquired(self):
+        return self.state == PartitionState.ACQUIRED
+
+    def wait_for_acquire(self, timeout=30):
+        """Wait for the set to be partitioned and acquired."""
+        self._acquire_event.wait(timeout)
+
+    def get_kept_items(self):
+        """Get the acquired items staying with this member according to the
+        current party.
+
+        :returns: the kept items, none if the new assignment can't be
+            computed
+        :rtype: frozenset
+        """
+        try:
+            keep = frozenset(self._partition_func(
+                self._identifier,
+                list(self._party),
+                self._set,
+            ))
+        except Exception:
+            # We may not be in the party anymore, release everything.
+            self.log.exception("Cannot compute the new assignment.")
+            return frozenset()
+        return keep.intersection(self._locks)
+
+    def release_set(self, keep=None):
+        """Release the items moving to other members according to the
+        current party and start allocating the set.
+
+        :param keep: the items to keep, as returned by
+            :py:meth:`get_kept_items`. Default: computed from the current
+            party.
+        """
+        if keep is None:
+            keep = self.get_kept_items()
+        self.log.debug(
+            "Releasing %s items, keeping %s",
+            len(self._locks) - len(keep.intersection(self._locks)),
+            len(keep.intersection(self._locks)),
+        )
+        if not self._release_locks(keep):
+            # We couldn't release our locks, abort
+            self._fail_out()
+            return
+        with self._state_change:
+            if self.failed:
+                return
+            self._user_items = self._user_items.intersection(keep)
+            self._set_state(PartitionState.ALLOCATING)
+        self._child_watching(self._allocate_transition)
+
+    def update_set(self, set, notify=True):
+        """Change the set to partition.
+
+        The members of the party are notified by leaving and joining the
+        party again, which triggers a rebalance where only the items
+        changing owner are released.
+
+        :param notify: False to change the set without notifying the party,
+            e.g. upon a rebalance started by the member that noticed the
+            change first.
+        """
+        with self._state_change:
+            self._set = set
+            if not notify:
+                return
+            if self.acquired:
+                self._set_state(PartitionState.RELEASE)
+        try:
+            self._party.leave()
+            self._party.join()
+        except KazooException:
+            self.log.exception("Failed to notify the party of the set change.")
+            self._fail_out()
+
+    def finish(self):
+        """Release the set and leave the party."""
+        self._release_locks()
+        self._user_items = frozenset()
+        self._fail_out()
+        # The client session may outlive this partitioner
+        self._client.remove_listener(self._establish_sessionwatch)
+
+    def _fail_out(self):
+        with self._state_change:
+            self._set_state(PartitionState.FAILURE)
+        if self._party.participating:
+            try:
+                self._party.leave()
+            except KazooException:
+                pass
+
+    def _allocate_transition(self, result):
+        """Called when in allocating state and the party is stable."""
+        if result.exception:
+            self._fail_out()
+            return
+
+        children, async_result = result.get()
+        children_changed = self._client.handler.event_object()
+
+        def updated(result):
+            with self._state_change:
+                children_changed.set()
+                if self.acquired:
+                    self._set_state(PartitionState.RELEASE)
+
+        with self._state_change:
+            if not self.allocating:
+                return
+            state_id = self.state_id
+            async_result.rawlink(updated)
+
+        def abort_if_needed():
+            if self.state_id == state_id:
+                if children_changed.is_set():
+                    # The party has changed. Partition again keeping the
+                    # locks acquired so far.
+                    self._child_watching(self._allocate_transition)
+                    return True
+                return False
+            with self._state_change:
+                # The connection was lost and a new allocation may have
+                # been started. Abort it to avoid racing on the locks.
+                if self.allocating or self.acquired:
+                    self._set_state(PartitionState.RELEASE)
+            return True
+
+        partition_set = self._partition_func(
+            self._identifier,
+            list(self._party),
+            self._set,
+        )
+        if not self._user_items.issubset(partition_set):
+            # The party changed again since release_set. The user must
+            # release the items moving away before their locks are
+            # released, otherwise the new owner could consume them before
+            # the user commits their offsets.
+            with self._state_change:
+                if self.state_id == state_id:
+                    self._set_state(PartitionState.RELEASE)
+            return
+        # Items acquired during an aborted allocation, not used yet
+        if not self._release_locks(frozenset(partition_set)):
+            self._fail_out()
+            return
+
+        for item in partition_set:
+            if item in self._locks:
+                continue
+            lock = self._client.Lock(
+                "/".join([self._lock_path, str(item)]),
+                self._identifier,
+            )
+            while True:
+                try:
+                    # The previous owner releases the lock as soon as it
+                    # notices the party change.
+                    lock.acquire(timeout=self._max_reaction_time)
+                except LockTimeout:
+                    if abort_if_needed():
+                        return
+                except KazooException:
+                    return self.finish()
+                else:
+                    break
+            self._locks[item] = lock
+            if abort_if_needed():
+                return
+
+        with self._state_change:
+            if self.state_id == state_id and not children_changed.is_set():
+                self._partition_set = partition_set
+                self._user_items = frozenset(partition_set)
+                self._set_state(PartitionState.ACQUIRED)
+                self._acquire_event.set()
+                return
+
+        if not abort_if_needed():
+            # This mustn't happen. Means a logical error.
+            self._fail_out()
+
+    def _release_locks(self, keep=frozenset()):
+        """Release the locks of the items not in keep.
+
+        :returns: True if all of them have been released
+        """
+        self._acquire_event.clear()
+        for item, lock in list(self._locks.items()):
+            if item in keep:
+                continue
+            try:
+                lock.release()
+            except KazooException:
+                # Proceed releasing as many locks as possible
+                pass
+            else:
+                del self._locks[item]
+        return all(item in keep for item in self._locks)
+
+    def _child_watching(self, func):
+        """Wait for the party to be stable and call func in a separate
+        thread/greenlet of the client handler."""
+        watcher = PatientChildrenWatch(
+            self._client,
+            self._party_path,
+            self._time_boundary,
+        )
+        watcher.start().rawlink(partial(self._client.handler.spawn, func))
+
+    def _establish_sessionwatch(self, state):
+        """Release upon connection issues, fail if the session is lost."""
+        with self._state_change:
+            if self.failed:
+                pass
+            elif state == KazooState.LOST:
+                self._client.handler.spawn(self._fail_out)
+            elif not self.release:
+                self._set_state(PartitionState.RELEASE)
+
+        return state == KazooState.LOST
+
+    def _set_state(self, state):
+        self.state = state
+        self.state_id += 1
@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+# Copyright 2016 Yelp Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+import logging
+import os
+import threading
+
+from kazoo.protocol.states import KazooState
+from kazoo.retry import KazooRetry
+
+
+class _KazooSession(object):
+
+    def __init__(self, client):
+        self.client = client
+        self.refcount = 0
+
+
+class KazooSessionManager(object):
+    """Share a single zookeeper session among all the users of the same
+    zookeeper cluster in this process.
+
+    Clients are reference counted: :py:meth:`acquire` returns the client
+    of the cluster, creating it if needed, and the client is stopped and
+    closed once every user has called :py:meth:`release`.
+
+    Sessions are never shared with a forked child process, the child gets
+    new clients instead.
+    """
+
+    def __init__(self):
+        self.log = logging.getLogger(self.__class__.__name__)
+        self._lock = threading.RLock()
+        self._sessions = {}
+        self._pid = os.getpid()
+
+    def acquire(self, hosts, retry_policy):
+        """Get the kazoo client connected to hosts.
+        The client may not be started yet, see :py:meth:`ensure_connected`.
+
+        :param hosts: zookeeper hosts
+        :param retry_policy: KazooRetry arguments used for the connection
+            retries, if a new client is created.
+        :rtype: :py:class:`kazoo.client.KazooClient`
+        """
+        with self._lock:
+            if self._pid != os.getpid():
+                # Forked process, the kazoo threads of the parent sessions
+                # don't exist here.
+                self._sessions = {}
+                self._pid = os.getpid()
+            session = self._sessions.get(hosts)
+            if session is None:
+                # kazoo.client loads all the kazoo recipes, only import it
+                # when a session is needed.
+                from kazoo.client import KazooClient
+                self.log.debug("Creating zookeeper session for %s", hosts)
+                session = _KazooSession(KazooClient(
+                    hosts,
+                    connection_retry=KazooRetry(**retry_policy),
+                ))
+                self._sessions[hosts] = session
+            session.refcount += 1
+            return session.client
+
+    def ensure_connected(self, client):
+        """Start client unless it is already connected. Only one user of
+        the session starts the client at a time.
+
+        :raises: kazoo timeout exception if the connection fails.
+        """
+        with self._lock:
+            if client.state != KazooState.CONNECTED:
+                client.start()
+
+    def release(self, client):
+        """Release a client returned by :py:meth:`acquire`. The client is
+        stopped and closed when it is not used anymore.
+        """
+        with self._lock:
+            for hosts, session in list(self._sessions.items()):
+                if session.client is client:
+                    session.refcount -= 1
+                    if session.refcount > 0:
+                        return
+                    del self._sessions[hosts]
+                    break
+            self.log.debug("Closing zookeeper session")
+            client.stop()
+            client.close()
+
+    def __len__(self):
+        return len(self._sessions)
+
+
+_session_manager = KazooSessionManager()
+
+
+def get_kazoo_session_manager():
+    """Get the :py:class:`KazooSessionManager` of this process."""
+    return _session_manager
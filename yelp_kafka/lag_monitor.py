@@ -0,0 +1,360 @@
+# -*- coding: utf-8 -*-
+# Copyright 2016 Yelp Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Lag statistics of consumer groups, to scale the number of consumers of a
+group on its predicted lag rather than on their CPU usage.
+
+:py:class:`ConsumerGroupLagMonitor` periodically samples the offsets of a
+group (see :py:func:`yelp_kafka.monitoring.get_consumer_offsets_metadata`)
+and the members of the group registered in zookeeper by the
+:py:class:`yelp_kafka.partitioner.Partitioner`. From the samples in its
+window it computes the total lag of the group, how fast the lag grows and
+how fast the group consumes, then estimates the time needed to catch up and
+the number of consumers needed to catch up within a target time.
+
+Example:
+
+.. code-block:: python
+
+   from yelp_kafka.lag_monitor import ConsumerGroupLagMonitor
+
+   with ConsumerGroupLagMonitor(['topic1'], config) as monitor:
+       while True:
+           stats = monitor.sample()
+           if stats.consumers_needed is not None:
+               scale_to(stats.consumers_needed)
+           time.sleep(30)
+"""
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+import logging
+import math
+import time
+from collections import deque
+from collections import namedtuple
+
+import six
+from kafka.client import KafkaClient
+from kazoo.exceptions import NoNodeError
+
+from yelp_kafka.error import ConfigurationError
+from yelp_kafka.kazoo_session import get_kazoo_session_manager
+from yelp_kafka.monitoring import get_consumer_offsets_metadata
+from yelp_kafka.partitioner import build_zk_group_path
+from yelp_kafka.partitioner import KAZOO_RETRY_DEFAULTS
+from yelp_kafka.partitioner import STATIC_REBALANCE
+
+
+DEFAULT_TARGET_CATCH_UP_SECS = 300
+# Number of samples used to compute the rates
+DEFAULT_WINDOW_SIZE = 10
+METRIC_PREFIX = 'yelp_kafka.ConsumerGroupLag'
+
+GroupOffsetsSample = namedtuple(
+    'GroupOffsetsSample',
+    ['timestamp', 'consumed', 'produced', 'lag', 'partitions'],
+)
+"""Offsets of a group at a point in time, summed over all its partitions.
+
+* **timestamp**\(``float``): time of the sample
+* **consumed**\(``int``): sum of the group offsets
+* **produced**\(``int``): sum of the high watermarks
+* **lag**\(``int``): total number of messages still to consume
+* **partitions**\(``int``): number of partitions
+"""
+
+GroupLagStats = namedtuple(
+    'GroupLagStats',
+    [
+        'total_lag',
+        'lag_growth_rate',
+        'consumption_rate',
+        'production_rate',
+        'members',
+        'time_to_catch_up',
+        'consumers_needed',
+    ],
+)
+"""Lag statistics of a consumer group.
+
+* **total_lag**\(``int``): messages still to consume in all the partitions
+* **lag_growth_rate**\(``float``): lag growth in messages/s, negative while
+  the group is catching up
+* **consumption_rate**\(``float``): messages/s consumed by the group
+* **production_rate**\(``float``): messages/s produced to the topics
+* **members**\(``int``): number of consumers in the group
+* **time_to_catch_up**\(``float``): estimated seconds until the lag is 0,
+  None if the lag is not decreasing
+* **consumers_needed**\(``int``): estimated number of consumers to catch
+  up within the target time, None if it can't be estimated
+"""
+
+
+def get_party_members(kazoo_client, zk_group_path):
+    """Get the identifiers of the members of a group, as registered in the
+    party of the partitioner at zk_group_path.
+
+    :param kazoo_client: connected kazoo client
+    :param zk_group_path: zookeeper path of the group partitioner
+    :returns: list of member identifiers, empty if the group doesn't exist
+    """
+    try:
+        children = kazoo_client.get_children(zk_group_path + '/party')
+    except NoNodeError:
+        return []
+    # Party nodes are named <uuid>-<identifier>
+    return [child[child.find('-') + 1:] for child in children]
+
+
+def estimate_time_to_catch_up(total_lag, lag_growth_rate):
+    """Estimate the seconds needed to consume the lag at the current rate.
+
+    :param total_lag: number of messages still to consume
+    :param lag_growth_rate: lag growth in messages/s
+    :returns: seconds, or None if the lag is not decreasing
+    """
+    if total_lag <= 0:
+        return 0
+    if lag_growth_rate >= 0:
+        return None
+    return total_lag / -lag_growth_rate
+
+
+def estimate_consumers_needed(
+    total_lag,
+    production_rate,
+    consumer_rate,
+    target_secs,
+    max_consumers=None,
+):
+    """Estimate the number of consumers needed to consume the incoming
+    messages and the current lag within target_secs.
+
+    :param total_lag: number of messages still to consume
+    :param production_rate: messages/s produced to the topics
+    :param consumer_rate: messages/s a single consumer can consume
+    :param target_secs: seconds to catch up within
+    :param max_consumers: upper bound of the estimate, usually the number
+        of partitions since extra consumers would be idle
+    :returns: number of consumers, or None if consumer_rate is unknown
+    """
+    if not consumer_rate or consumer_rate <= 0:
+        return None
+    required_rate = production_rate + float(total_lag) / target_secs
+    consumers = int(math.ceil(required_rate / consumer_rate))
+    if max_consumers is not None:
+        consumers = min(consumers, max_consumers)
+    return consumers
+
+
+class ConsumerGroupLagMonitor(object):
+    """Compute the lag statistics of a consumer group, see the module
+    documentation.
+
+    Each call to :py:meth:`sample` fetches the group offsets and the high
+    watermarks and returns the :py:data:`GroupLagStats` over the samples
+    in the window. Rates are 0 until two samples have been taken.
+
+    The throughput of a single consumer is the consumption rate divided by
+    the number of members. While the group is caught up it consumes at
+    the production rate, so the estimate is never lower than the current
+    number of members: pass consumer_rate, the known throughput of a
+    consumer, to get estimates below it.
+
+    :param topics: list of topics consumed by the group
+    :param config: consumer config of the group
+    :type config: :py:class:`yelp_kafka.config.KafkaConsumerConfig`
+    :param target_catch_up_secs: time within which the lag should be
+        consumed. Default: :py:data:`DEFAULT_TARGET_CATCH_UP_SECS`
+    :param consumer_rate: messages/s consumed by a single consumer. Default:
+        estimated from the consumption rate.
+    :param window_size: number of samples the rates are computed over.
+        Default: :py:data:`DEFAULT_WINDOW_SIZE`
+    :param metrics_responder: if set, the statistics of every sample are
+        reported as gauges with the metrics dimensions of config.
+    :type metrics_responder: :py:class:`yelp_kafka.metrics_responder.MetricsResponder`
+    """
+
+    def __init__(
+        self,
+        topics,
+        config,
+        target_catch_up_secs=DEFAULT_TARGET_CATCH_UP_SECS,
+        consumer_rate=None,
+        window_size=DEFAULT_WINDOW_SIZE,
+        metrics_responder=None,
+    ):
+        self.log = logging.getLogger(self.__class__.__name__)
+        if target_catch_up_secs <= 0:
+            raise ConfigurationError(
+                "target_catch_up_secs should be positive, got {0}".format(
+                    target_catch_up_secs,
+                )
+            )
+        if window_size < 2:
+            raise ConfigurationError(
+                "window_size should be at least 2, got {0}".format(window_size)
+            )
+        self.topics = topics
+        self.config = config
+        self.target_catch_up_secs = target_catch_up_secs
+        self.consumer_rate = consumer_rate
+        self.samples = deque(maxlen=window_size)
+        self.zk_group_path = build_zk_group_path(
+            config.group_path,
+            topics,
+        ) if config.use_group_sha else config.group_path
+        self.kazoo_session_manager = get_kazoo_session_manager()
+        self.kafka_client = None
+        self.kazoo_client = None
+        self.metrics_responder = metrics_responder
+        self.gauges = None
+        if metrics_responder:
+            self._setup_metrics()
+
+    @property
+    def is_static(self):
+        return self.config.rebalance_protocol == STATIC_REBALANCE
+
+    @property
+    def offset_storage(self):
+        if self.config.offset_storage in ('kafka', 'dual'):
+            return 'kafka'
+        return 'zookeeper'
+
+    def _setup_metrics(self):
+        self.gauges = dict(
+            (field, self.metrics_responder.get_gauge_emitter(
+                METRIC_PREFIX + '.' + field,
+                self.config.metrics_dimensions,
+            ))
+            for field in GroupLagStats._fields
+        )
+
+    def start(self):
+        """Connect to kafka and, unless the group uses the static rebalance
+        protocol, to zookeeper."""
+        self.kafka_client = KafkaClient(self.config.broker_list)
+        if not self.is_static:
+            self.kazoo_client = self.kazoo_session_manager.acquire(
+                self.config.zookeeper,
+                KAZOO_RETRY_DEFAULTS,
+            )
+            self.kazoo_session_manager.ensure_connected(self.kazoo_client)
+
+    def stop(self):
+        """Close the connections."""
+        if self.kafka_client is not None:
+            self.kafka_client.close()
+            self.kafka_client = None
+        if self.kazoo_client is not None:
+            self.kazoo_session_manager.release(self.kazoo_client)
+            self.kazoo_client = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def get_members(self):
+        """Get the number of consumers in the group. Static groups have
+        static_member_count members."""
+        if self.is_static:
+            return self.config.static_member_count
+        return len(get_party_members(self.kazoo_client, self.zk_group_path))
+
+    def _get_offsets_sample(self):
+        offsets = get_consumer_offsets_metadata(
+            self.kafka_client,
+            self.config.group_id,
+            self.topics,
+            offset_storage=self.offset_storage,
+        )
+        consumed = produced = lag = partitions = 0
+        for partition_offsets in six.itervalues(offsets):
+            for offset in partition_offsets:
+                # Messages below the low watermark are gone, they will
+                # never be consumed.
+                current = max(offset.current, offset.lowmark)
+                consumed += current
+                produced += offset.highmark
+                lag += max(offset.highmark - current, 0)
+                partitions += 1
+        return GroupOffsetsSample(
+            timestamp=time.time(),
+            consumed=consumed,
+            produced=produced,
+            lag=lag,
+            partitions=partitions,
+        )
+
+    def sample(self):
+        """Take a new sample of the group offsets and members.
+
+        :returns: the :py:data:`GroupLagStats` of the group
+        """
+        self.samples.append(self._get_offsets_sample())
+        stats = self.get_stats(self.get_members())
+        if self.gauges:
+            self.emit_metrics(stats)
+        return stats
+
+    def get_stats(self, members):
+        """Compute the lag statistics from the samples in the window.
+
+        :param members: number of consumers in the group
+        :returns: :py:data:`GroupLagStats`
+        """
+        last = self.samples[-1]
+        first = self.samples[0]
+        elapsed = last.timestamp - first.timestamp
+        if elapsed > 0:
+            # Offsets go back if they are reset, the group consumed
+            # nothing then.
+            consumption_rate = max(last.consumed - first.consumed, 0) / elapsed
+            production_rate = max(last.produced - first.produced, 0) / elapsed
+            lag_growth_rate = (last.lag - first.lag) / elapsed
+        else:
+            consumption_rate = production_rate = lag_growth_rate = 0.0
+        consumer_rate = self.consumer_rate
+        if consumer_rate is None and members:
+            consumer_rate = consumption_rate / members
+        return GroupLagStats(
+            total_lag=last.lag,
+            lag_growth_rate=lag_growth_rate,
+            consumption_rate=consumption_rate,
+            production_rate=production_rate,
+            members=members,
+            time_to_catch_up=estimate_time_to_catch_up(
+                last.lag,
+                lag_growth_rate,
+            ),
+            consumers_needed=estimate_consumers_needed(
+                last.lag,
+                production_rate,
+                consumer_rate,
+                self.target_catch_up_secs,
+                max_consumers=last.partitions,
+            ),
+        )
+
+    def emit_metrics(self, stats):
+        """Report stats through the metrics responder. Estimates that can't
+        be computed are not reported."""
+        for field, value in zip(GroupLagStats._fields, stats):
+            if value is not None:
+                self.metrics_responder.record(self.gauges[field], value)
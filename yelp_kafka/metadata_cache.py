@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+# Copyright 2016 Yelp Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+import itertools
+import logging
+import threading
+import time
+from collections import namedtuple
+
+import six
+from kafka.util import kafka_bytestring
+
+from yelp_kafka.utils import get_kafka_topics
+from yelp_kafka.utils import get_kafka_topics_partitions
+from yelp_kafka.utils import topic_matches
+
+
+TopicMetadata = namedtuple("TopicMetadata", ["partitions", "version", "timestamp"])
+"""Cached metadata of a topic.
+
+* **partitions** (tuple): sorted partition ids, empty if the topic doesn't exist
+* **version** (int): changes every time the partitions of the topic change
+* **timestamp** (float): time of the last metadata refresh
+"""
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def get_metadata_cache(broker_list):
+    """Get the metadata cache shared by all the consumers of a cluster
+    in this process.
+
+    :param broker_list: cluster broker list, either a list of brokers or
+        a comma separated string.
+    :rtype: :py:class:`TopicMetadataCache`
+    """
+    if isinstance(broker_list, six.string_types):
+        broker_list = broker_list.split(',')
+    key = tuple(sorted(broker.strip() for broker in broker_list))
+    with _caches_lock:
+        if key not in _caches:
+            _caches[key] = TopicMetadataCache()
+        return _caches[key]
+
+
+class TopicMetadataCache(object):
+    """Thread safe cache of the topics partitions.
+
+    Only the requested topics are loaded from Kafka and each topic is
+    refreshed independently when its metadata is older than the requested
+    max age. Every topic has a version that only changes when its partitions
+    change, so that the callers can cheaply detect if the metadata of their
+    topics has changed since the last time they looked at it.
+    """
+
+    def __init__(self):
+        self.log = logging.getLogger(self.__class__.__name__)
+        self._lock = threading.Lock()
+        self._topics = {}
+        self._versions = itertools.count(1)
+        # All the topics of the cluster, only loaded for pattern subscriptions
+        self._all_topics = None
+        self._all_topics_timestamp = 0
+
+    def get_topics_metadata(self, kafka_client, topics, max_age_secs):
+        """Get the metadata of topics, loading from Kafka the ones that
+        are not cached or older than max_age_secs.
+
+        :param kafka_client: KafkaClient used to load the missing metadata
+        :param topics: list of topics
+        :param max_age_secs: max age of the cached metadata in seconds
+        :returns: metadata for each topic
+        :rtype: dict {<topic>: :py:data:`TopicMetadata`}
+        """
+        topics = [kafka_bytestring(topic) for topic in topics]
+        with self._lock:
+            oldest = time.time() - max_age_secs
+            stale_topics = [
+                topic for topic in topics
+                if topic not in self._topics or
+                self._topics[topic].timestamp < oldest
+            ]
+            if stale_topics:
+                self._refresh(kafka_client, stale_topics)
+            return dict((topic, self._topics[topic]) for topic in topics)
+
+    def get_matching_topics(self, kafka_client, pattern, max_age_secs):
+        """Get the topics whose whole name matches pattern.
+
+        Loads the metadata of all the topics of the cluster if the cached
+        topic list is older than max_age_secs. The full metadata response
+        also refreshes the cached partitions of every topic.
+
+        :param kafka_client: KafkaClient used to load the metadata
+        :param pattern: compiled regular expression
+        :param max_age_secs: max age of the cached topic list in seconds
+        :returns: sorted matching topic names
+        :rtype: list
+        """
+        with self._lock:
+            if (self._all_topics is None or
+                    self._all_topics_timestamp < time.time() - max_age_secs):
+                self.log.debug("Loading metadata for all the topics")
+                topic_partitions = get_kafka_topics(kafka_client)
+                self._update(
+                    topic_partitions,
+                    set(topic_partitions) | set(self._topics),
+                    time.time(),
+                )
+                self._all_topics = [
+                    topic.decode('utf-8') if isinstance(topic, bytes) else topic
+                    for topic in topic_partitions
+                ]
+                self._all_topics_timestamp = time.time()
+            return sorted(
+                topic for topic in self._all_topics
+                if topic_matches(pattern, topic)
+            )
+
+    def _refresh(self, kafka_client, topics):
+        self.log.debug("Loading metadata for topics %s", topics)
+        topic_partitions = get_kafka_topics_partitions(kafka_client, topics)
+        self._update(topic_partitions, topics, time.time())
+
+    def _update(self, topic_partitions, topics, timestamp):
+        for topic in topics:
+            partitions = tuple(sorted(topic_partitions.get(topic, ())))
+            cached = self._topics.get(topic)
+            if cached and cached.partitions == partitions:
+                version = cached.version
+            else:
+                version = next(self._versions)
+            self._topics[topic] = TopicMetadata(partitions, version, timestamp)
+
+    def clear(self):
+        with self._lock:
+            self._topics.clear()
+            self._all_topics = None
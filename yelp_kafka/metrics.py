@@ -17,6 +17,11 @@ from __future__ import unicode_literals
 
 PRODUCE_EXCEPTION_COUNT = 'produce_exception_count'
 
+# Produce requests metrics, with topic and broker dimensions
+PRODUCE_LATENCY = 'produce_latency'
+PRODUCE_BATCH_SIZE = 'produce_batch_size'
+PRODUCE_FAILURE_COUNT = 'produce_failure_count'
+
 TIME_METRIC_NAMES = set([
     'metadata_request_timer',
     'produce_request_timer',
@@ -35,3 +40,8 @@ FAILURE_COUNT_METRIC_NAMES = set([
     'not_leader_for_partition_count',
     'request_timed_out_count'
 ])
+
+# Upper bounds of the timer histogram buckets, in milliseconds
+DEFAULT_TIMER_BUCKETS_MS = (
+    1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000,
+)
@@ -52,6 +52,19 @@ class MetricsResponder(object):
 
         raise NotImplementedError
 
+    def get_gauge_emitter(self, metric, default_dimensions=None):
+        """
+        Creates and returns an instance for recording the current value
+        of a specific metric. Responders without gauges record the values
+        with a timer emitter.
+
+        :param metric: the name of the metric
+        :param default_dimensions: the extra dimensions provided for the metric
+        :return: an instance of responder for recording gauge based metrics
+        """
+
+        return self.get_timer_emitter(metric, default_dimensions)
+
     @abc.abstractmethod
     def record(self, registered_reporter, value, timestamp=None):
         """
@@ -63,3 +76,19 @@ class MetricsResponder(object):
         """
 
         raise NotImplementedError
+
+    def record_many(self, registered_reporter, value, count, timestamp=None):
+        """
+        Used to record the same value many times for the registered
+        reporter, e.g. the mean of timer values aggregated elsewhere.
+        Responders able to record an aggregate should override it, by
+        default the value is recorded count times.
+
+        :param registered_reporter: The instance of the reporter
+        :param value: The value to be recorded
+        :param count: How many times the value is recorded
+        :param timestamp: The timestamp when the metric is recorded
+        """
+
+        for _ in range(count):
+            self.record(registered_reporter, value, timestamp)
@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+# Copyright 2016 Yelp Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+import threading
+from collections import deque
+
+import six
+
+
+class PartitionOffsetTracker(object):
+    """Track the messages of a partition being processed out of order
+    and compute the offset that can be safely committed.
+
+    Offsets are added in the same order they are consumed and can be marked
+    as done in any order. The committable offset is the offset of the first
+    message not processed yet, so that committing it never skips a message
+    still being processed.
+
+    .. note:: This class is not thread safe.
+       See :py:class:`OffsetTracker`.
+    """
+
+    def __init__(self):
+        # Offsets consumed and not committable yet, in consuming order
+        self._pending = deque()
+        # Offsets processed but preceded by offsets still being processed
+        self._done = set()
+        self._committable = None
+
+    def add(self, offset):
+        """Track a message that is about to be processed.
+
+        :raises: ValueError if offset is not greater than the last offset
+        """
+        if self._pending and offset <= self._pending[-1] or \
+                self._committable is not None and offset < self._committable:
+            raise ValueError(
+                "Offset {0} has been added out of order".format(offset),
+            )
+        self._pending.append(offset)
+
+    def done(self, offset):
+        """Mark a message as processed.
+
+        :returns: the new committable offset or None if it has not changed
+        """
+        self._done.add(offset)
+        advanced = False
+        while self._pending and self._pending[0] in self._done:
+            committed = self._pending.popleft()
+            self._done.discard(committed)
+            self._committable = committed + 1
+            advanced = True
+        return self._committable if advanced else None
+
+    @property
+    def committable_offset(self):
+        """Offset of the first message not processed yet, or None
+        if no message has been processed."""
+        return self._committable
+
+    @property
+    def in_flight(self):
+        """Number of messages being processed."""
+        return len(self._pending) - len(self._done)
+
+    def __len__(self):
+        return len(self._pending)
+
+
+class OffsetTracker(object):
+    """Thread safe offsets tracker for many partitions.
+    See :py:class:`PartitionOffsetTracker`.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._partitions = {}
+
+    def add(self, partition, offset):
+        with self._lock:
+            tracker = self._partitions.get(partition)
+            if tracker is None:
+                tracker = self._partitions[partition] = PartitionOffsetTracker()
+            tracker.add(offset)
+
+    def done(self, partition, offset):
+        """Mark a message as processed.
+
+        :returns: the new committable offset for partition or None if it has
+            not changed
+        """
+        with self._lock:
+            return self._partitions[partition].done(offset)
+
+    def committable_offsets(self):
+        """Get the committable offsets.
+
+        :returns: dict <partition>: <offset>
+        """
+        with self._lock:
+            return dict(
+                (partition, tracker.committable_offset)
+                for partition, tracker in six.iteritems(self._partitions)
+                if tracker.committable_offset is not None
+            )
+
+    @property
+    def in_flight(self):
+        """Number of messages being processed for all the partitions."""
+        with self._lock:
+            return sum(
+                tracker.in_flight
+                for tracker in six.itervalues(self._partitions)
+            )
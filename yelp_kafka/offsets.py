@@ -21,6 +21,8 @@ from collections import namedtuple
 import six
 from kafka.common import BrokerResponseError
 from kafka.common import check_error
+from kafka.common import ConsumerFetchSizeTooSmall
+from kafka.common import FetchRequest
 from kafka.common import OffsetCommitRequest
 from kafka.common import OffsetFetchRequest
 from kafka.common import OffsetFetchResponse
@@ -29,6 +31,7 @@ from kafka.common import OffsetResponse
 from kafka.common import UnknownTopicOrPartitionError
 from kafka.util import kafka_bytestring
 
+from yelp_kafka.config import MAX_MESSAGE_SIZE_BYTES
 from yelp_kafka.error import InvalidOffsetStorageError
 from yelp_kafka.error import OffsetCommitError
 from yelp_kafka.error import UnknownPartitions
@@ -542,3 +545,233 @@ def set_consumer_offsets(
             )
 
     return filter(None, status)
+
+
+def get_offsets_for_times(
+    kafka_client,
+    topics,
+    timestamp,
+    raise_on_error=True,
+    timestamp_fn=None,
+    max_bytes=MAX_MESSAGE_SIZE_BYTES,
+):
+    """Get the offsets of the first messages produced at or after timestamp.
+
+    NOTE: This method does not refresh client metadata. It is up to the caller
+    to avoid using stale metadata.
+
+    Kafka answers time based offset requests with the first offset of the
+    last log segment written before timestamp, so the offsets are coarse:
+    some of the messages after them may be older than timestamp. If
+    timestamp_fn is given, each offset is refined by a binary search between
+    it and the high watermark, assuming the timestamps of the messages in a
+    partition never decrease. All the partitions are searched together:
+    each step of the search sends a single fetch request per broker.
+
+    The offsets are never after the first message produced at timestamp,
+    messages may be consumed twice but never skipped.
+
+    :param kafka_client: a connected KafkaClient
+    :param topics: topic list or dict {<topic>: [partitions]}
+    :param timestamp: seconds since the epoch
+    :param raise_on_error: if False the method ignores missing topics
+      and missing partitions. It still may fail on the request send.
+    :param timestamp_fn: function getting the timestamp, in seconds since
+      the epoch, of a kafka-python Message.
+    :param max_bytes: fetch size of the binary search, it must be larger than
+      the largest message.
+    :returns: a dict topic: partition: offset. Partitions whose offset or
+      watermark requests failed are missing.
+    :raises:
+      :py:class:`~yelp_kafka.error.UnknownTopic`: upon missing
+      topics and raise_on_error=True
+
+      :py:class:`~yelp_kafka.error.UnknownPartition`: upon missing
+      partitions and raise_on_error=True
+
+      FailedPayloadsError: upon send request error.
+    """
+    topics = _verify_topics_and_partitions(kafka_client, topics, raise_on_error)
+
+    # Requests are grouped by partition leader by the client
+    time_offset_reqs = [
+        OffsetRequest(
+            kafka_bytestring(topic),
+            partition,
+            int(timestamp * 1000),
+            max_offsets=1,
+        )
+        for topic, partitions in six.iteritems(topics)
+        for partition in partitions
+    ]
+    if not time_offset_reqs:
+        return {}
+
+    watermarks = get_topics_watermarks(kafka_client, topics, raise_on_error)
+    # fail_on_error = False does not prevent network errors
+    time_resps = kafka_client.send_offset_request(
+        time_offset_reqs,
+        fail_on_error=False,
+        callback=_check_fetch_response_error,
+    )
+
+    bounds = {}
+    for resp in time_resps:
+        if resp.offsets and resp.offsets[0] == -1:
+            continue
+        partition_watermarks = watermarks[resp.topic][resp.partition]
+        # Failed watermark requests, see _check_fetch_response_error
+        if -1 in (partition_watermarks.highmark, partition_watermarks.lowmark):
+            continue
+        if resp.offsets:
+            offset = min(
+                max(resp.offsets[0], partition_watermarks.lowmark),
+                partition_watermarks.highmark,
+            )
+        else:
+            # No segment was written before timestamp
+            offset = partition_watermarks.lowmark
+        bounds[resp.topic, resp.partition] = (
+            offset,
+            partition_watermarks.highmark,
+        )
+
+    if timestamp_fn is not None:
+        bounds = _search_offsets_for_time(
+            kafka_client,
+            bounds,
+            timestamp,
+            timestamp_fn,
+            max_bytes,
+        )
+
+    offsets = {}
+    for (topic, partition), (offset, _) in six.iteritems(bounds):
+        offsets.setdefault(topic, {})[partition] = offset
+    return offsets
+
+
+def _search_offsets_for_time(
+    kafka_client,
+    bounds,
+    timestamp,
+    timestamp_fn,
+    max_bytes,
+):
+    """Narrow the bounds (low, high) of every partition until low is the
+    offset of the first message at or after timestamp.
+    The search of a partition stops at low upon fetch errors.
+
+    :returns: a dict (topic, partition): (offset, offset)
+    """
+    result = {}
+    bounds = dict(bounds)
+    while bounds:
+        for key, (low, high) in list(bounds.items()):
+            if low >= high:
+                result[key] = (low, low)
+                del bounds[key]
+        if not bounds:
+            break
+
+        fetch_reqs = [
+            FetchRequest(
+                kafka_bytestring(topic),
+                partition,
+                (low + high) // 2,
+                max_bytes,
+            )
+            for (topic, partition), (low, high) in six.iteritems(bounds)
+        ]
+        # fail_on_error = False does not prevent network errors
+        fetch_resps = kafka_client.send_fetch_request(
+            fetch_reqs,
+            fail_on_error=False,
+            min_bytes=1,
+        )
+
+        pending = set(bounds)
+        for resp in fetch_resps:
+            key = (resp.topic, resp.partition)
+            if key not in pending:
+                continue
+            pending.discard(key)
+            low, high = bounds[key]
+            middle = (low + high) // 2
+            try:
+                check_error(resp)
+                # Compressed message sets may start before the requested offset
+                message = next(
+                    (
+                        offset_message for offset_message in resp.messages
+                        if offset_message.offset >= middle
+                    ),
+                    None,
+                )
+            except (BrokerResponseError, ConsumerFetchSizeTooSmall):
+                pending.add(key)
+                continue
+            if message is not None and timestamp_fn(message.message) < timestamp:
+                bounds[key] = (message.offset + 1, high)
+            else:
+                bounds[key] = (low, middle)
+
+        for key in pending:
+            low, _ = bounds.pop(key)
+            result[key] = (low, low)
+    return result
+
+
+def set_consumer_offsets_to_time(
+    kafka_client,
+    group,
+    topics,
+    timestamp,
+    raise_on_error=True,
+    offset_storage='zookeeper',
+    timestamp_fn=None,
+):
+    """Set consumer offsets to the first messages produced at or after
+    timestamp, e.g. to consume again the messages of the last hour.
+    See :py:func:`get_offsets_for_times`.
+
+    This method shall refresh the client metadata prior to updating
+    the offsets.
+
+    :param kafka_client: a connected KafkaClient
+    :param group: kafka group_id
+    :param topics: topic list or dict {<topic>: [partitions]}
+    :param timestamp: seconds since the epoch
+    :param raise_on_error: if False the method does not raise exceptions
+      on missing topics/partitions. It may still fail on the request send.
+    :param offset_storage: String, one of {zookeeper, kafka, dual}.
+    :param timestamp_fn: function getting the timestamp, in seconds since
+      the epoch, of a kafka-python Message. It makes the offsets precise
+      instead of aligned to log segments.
+    :returns: a list of errors for each partition offset update that failed.
+    :rtype: list [OffsetCommitError]
+    :raises:
+      :py:class:`yelp_kafka.error.UnknownTopic`: upon missing
+      topics and raise_on_error=True
+
+      :py:class:`yelp_kafka.error.UnknownPartition`: upon missing
+      partitions and raise_on_error=True
+
+      FailedPayloadsError: upon send request error.
+    """
+    kafka_client.load_metadata_for_topics()
+
+    new_offsets = get_offsets_for_times(
+        kafka_client,
+        topics,
+        timestamp,
+        raise_on_error,
+        timestamp_fn,
+    )
+    return set_consumer_offsets(
+        kafka_client,
+        group,
+        new_offsets,
+        raise_on_error,
+        offset_storage,
+    )
@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+# Copyright 2016 Yelp Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+from collections import defaultdict
+
+import six
+
+
+@six.python_2_unicode_compatible
+class PartitionKey(object):
+    """Identifier of a topic partition, interned by :py:class:`PartitionTable`.
+
+    Keys of the same table are unique, so they are compared and hashed by
+    identity. The string representation "<topic>-<partition>" is computed once
+    and it is used by the kazoo SetPartitioner to name the partition locks.
+    Keys sort like their string representation, so that the partitions
+    assignment is the same as the one of the consumers using plain strings.
+    """
+
+    __slots__ = ('topic_id', 'topic', 'partition', '_name')
+
+    def __init__(self, topic_id, topic, partition):
+        self.topic_id = topic_id
+        self.topic = topic
+        self.partition = partition
+        self._name = "{0}-{1}".format(topic, partition)
+
+    def __str__(self):
+        return self._name
+
+    def __repr__(self):
+        return "PartitionKey({0!r}, {1})".format(self.topic, self.partition)
+
+    def __lt__(self, other):
+        return self._name < other._name
+
+    def __gt__(self, other):
+        return self._name > other._name
+
+
+class PartitionTable(object):
+    """Intern the partitions of a set of topics.
+
+    Each topic gets an integer id and each (topic id, partition) pair maps to
+    a single :py:class:`PartitionKey` for the lifetime of the table.
+
+    .. note:: PartitionTable is not thread safe.
+    """
+
+    def __init__(self):
+        self._topic_ids = {}
+        self._partitions = []
+
+    def get_topic_id(self, topic):
+        """Get the id of topic, assigning a new one if the topic is unknown."""
+        topic_id = self._topic_ids.get(topic)
+        if topic_id is None:
+            topic_id = len(self._partitions)
+            self._topic_ids[topic] = topic_id
+            self._partitions.append({})
+        return topic_id
+
+    def get_key(self, topic, partition):
+        """Get the interned key of a topic partition.
+
+        :rtype: :py:class:`PartitionKey`
+        """
+        return self.get_keys(topic, [partition])[0]
+
+    def get_keys(self, topic, partitions):
+        """Get the interned keys of many partitions of the same topic.
+
+        :returns: keys in the same order of partitions
+        :rtype: list of :py:class:`PartitionKey`
+        """
+        topic_id = self.get_topic_id(topic)
+        keys = self._partitions[topic_id]
+        result = []
+        for partition in partitions:
+            key = keys.get(partition)
+            if key is None:
+                key = keys[partition] = PartitionKey(topic_id, topic, partition)
+            result.append(key)
+        return result
+
+    def __len__(self):
+        return sum(len(keys) for keys in self._partitions)
+
+
+def diff_partitions(old, new):
+    """Compare two collections of partition keys.
+
+    :returns: the added and the removed keys
+    :rtype: tuple (frozenset, frozenset)
+    """
+    old, new = frozenset(old), frozenset(new)
+    return new - old, old - new
+
+
+def group_by_topic(keys):
+    """Group partition keys by topic, preserving the iteration order.
+
+    :rtype: dict {<topic>: <[partitions]>}
+    """
+    partitions = defaultdict(list)
+    for key in keys:
+        partitions[key.topic].append(key.partition)
+    return partitions
+
+
+def add_partitions(partitions, added):
+    """Merge two dicts of topics partitions.
+
+    :type partitions: dict {<topic>: <[partitions]>}
+    :type added: dict {<topic>: <[partitions]>}
+    :returns: a new dict with the partitions of both
+    :rtype: dict {<topic>: <[partitions]>}
+    """
+    merged = dict(
+        (topic, list(topic_partitions))
+        for topic, topic_partitions in six.iteritems(partitions)
+    )
+    for topic, topic_partitions in six.iteritems(added):
+        merged_partitions = merged.setdefault(topic, [])
+        for partition in topic_partitions:
+            if partition not in merged_partitions:
+                merged_partitions.append(partition)
+    return merged
+
+
+def remove_partitions(partitions, removed):
+    """Remove the partitions of removed from a dict of topics partitions.
+
+    :type partitions: dict {<topic>: <[partitions]>}
+    :type removed: dict {<topic>: <[partitions]>}
+    :returns: a new dict without the removed partitions and topics left
+        without partitions
+    :rtype: dict {<topic>: <[partitions]>}
+    """
+    kept = {}
+    for topic, topic_partitions in six.iteritems(partitions):
+        removed_partitions = removed.get(topic, ())
+        topic_kept = [
+            partition for partition in topic_partitions
+            if partition not in removed_partitions
+        ]
+        if topic_kept:
+            kept[topic] = topic_kept
+    return kept
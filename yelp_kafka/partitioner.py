@@ -15,28 +15,47 @@
 from __future__ import absolute_import
 from __future__ import unicode_literals
 
-import copy
 import hashlib
+import itertools
 import logging
+import os
+import socket
 import time
 import traceback
 from collections import defaultdict
 
+import six
 from kafka.client import KafkaClient
 from kafka.util import kafka_bytestring
-from kazoo.client import KazooClient
-from kazoo.protocol.states import KazooState
 from kazoo.recipe.partitioner import PartitionState
-from kazoo.retry import KazooRetry
-
+from kazoo.recipe.partitioner import SetPartitioner
+
+from yelp_kafka.assignment import ASSIGNMENT_STRATEGIES
+from yelp_kafka.assignment import make_member_identifier
+from yelp_kafka.assignment import THROUGHPUT_ASSIGNMENT
+from yelp_kafka.assignment import ThroughputAssignment
+from yelp_kafka.assignment import ThroughputWeights
+from yelp_kafka.assignment import WeightedAssignment
+from yelp_kafka.error import ConfigurationError
 from yelp_kafka.error import PartitionerError
 from yelp_kafka.error import PartitionerZookeeperError
-from yelp_kafka.utils import get_kafka_topics
+from yelp_kafka.incremental_partitioner import IncrementalSetPartitioner
+from yelp_kafka.kazoo_session import get_kazoo_session_manager
+from yelp_kafka.metadata_cache import get_metadata_cache
+from yelp_kafka.partition_table import diff_partitions
+from yelp_kafka.partition_table import group_by_topic
+from yelp_kafka.partition_table import PartitionTable
+from yelp_kafka.static_partitioner import StaticSetPartitioner
+from yelp_kafka.utils import is_topic_pattern
 
 MAX_START_TIME_SECS = 300
 # The java kafka api updates every 600s by default. We update the
 # number of partitions every 120 seconds.
 PARTITIONS_REFRESH_TIMEOUT = 120
+# Max age of the cached metadata used by a forced partitions refresh. Many
+# partitioners in the same process release their partitions at the same time
+# upon rebalance, they can share a fresh enough metadata response.
+FORCED_PARTITIONS_REFRESH_MAX_AGE = 5
 
 # Define the connection retry policy for kazoo in case of flaky
 # zookeeper connections. This ensures we don't keep indefinitely
@@ -49,8 +68,23 @@ KAZOO_RETRY_DEFAULTS = {
     'max_delay': 60,
 }
 
+EAGER_REBALANCE = 'eager'
+INCREMENTAL_REBALANCE = 'incremental'
+STATIC_REBALANCE = 'static'
+REBALANCE_PROTOCOLS = (
+    EAGER_REBALANCE,
+    INCREMENTAL_REBALANCE,
+    STATIC_REBALANCE,
+)
+
+# Partitioners in the same process need different identifiers to be
+# different members of a group.
+_partitioner_ids = itertools.count()
+
 
 def build_zk_group_path(group_path, topics):
+    if is_topic_pattern(topics):
+        topics = [topics.pattern]
     return "{group_path}/{sha}".format(
         group_path=group_path,
         sha=hashlib.sha1(repr(sorted(topics)).encode()).hexdigest(),
@@ -61,13 +95,19 @@ class Partitioner(object):
     """Partitioner is used to handle distributed a set of
     topics/partitions among a group of consumers.
 
-    :param topics: kafka topics
-    :type topics: list
+    :param topics: kafka topics, or a compiled regular expression to
+        subscribe to all the topics whose name matches it. Matching topics
+        created at runtime are picked up at the next partitions refresh.
+    :type topics: list or regular expression
     :param acquire: function to be called when a set of partitions
                     has been acquired. It should usually allocate the consumers.
     :param release: function to be called when the acquired
                     partitions have to be release. It should usually stops the consumers.
 
+    With the incremental rebalance protocol, upon group changes release is
+    only called with the partitions moving to other members and acquire
+    with the partitions gained. The consumers of the other partitions are
+    expected to keep running.
     """
 
     def __init__(self, config, topics, acquire, release):
@@ -77,15 +117,24 @@ class Partitioner(object):
         self.kazoo_client = None
         self.kafka_client = None
         self.topics = topics
+        # Topics currently subscribed, matching topics for a topic pattern
+        self.subscribed_topics = [] if is_topic_pattern(topics) else topics
         self.acquired_partitions = defaultdict(list)
+        self._acquired_keys = frozenset()
         self.partitions_set = set()
+        # Interned partition keys used as SetPartitioner set
+        self.partition_table = PartitionTable()
+        # Topics metadata shared by the partitioners of the same cluster
+        self.metadata_cache = get_metadata_cache(config.broker_list)
+        self._metadata_versions = None
+        self._metadata_partitions = frozenset()
         # User callbacks
         self.acquire = acquire
         self.release = release
         # We guarantee that the user defined release function call follows
         # always the acquire. release function will never be called twice in a
-        # row. Initialize to true because no partitions have been acquired at
-        # startup.
+        # row for the same partitions. Initialize to true because no partitions
+        # have been acquired at startup.
         self.released_flag = True
         # Kafka metadata refresh
         self.force_partitions_refresh = True
@@ -96,29 +145,71 @@ class Partitioner(object):
         self.actions = {
             PartitionState.ALLOCATING: self._allocating,
             PartitionState.ACQUIRED: self._acquire,
-            PartitionState.RELEASE: self._release,
+            PartitionState.RELEASE: self._rebalance_release,
             PartitionState.FAILURE: self._fail
         }
 
-        self.kazoo_retry = None
+        self.kazoo_session_manager = get_kazoo_session_manager()
+        if self.config.partition_assignment not in ASSIGNMENT_STRATEGIES:
+            raise ConfigurationError(
+                "Invalid partition_assignment {0}. Valid values: {1}".format(
+                    self.config.partition_assignment,
+                    ASSIGNMENT_STRATEGIES,
+                )
+            )
+        if self.config.rebalance_protocol not in REBALANCE_PROTOCOLS:
+            raise ConfigurationError(
+                "Invalid rebalance_protocol {0}. Valid values: {1}".format(
+                    self.config.rebalance_protocol,
+                    REBALANCE_PROTOCOLS,
+                )
+            )
+        if self.is_static:
+            self._validate_static_membership()
+        # Partition weights shared by the group, for throughput assignment
+        self._throughput_weights = None
+        self._partitioner_id = next(_partitioner_ids)
         self.zk_group_path = build_zk_group_path(
             self.config.group_path,
             self.topics,
         ) if self.config.use_group_sha else self.config.group_path
 
+    @property
+    def is_static(self):
+        """True if the partitions are statically assigned, without
+        coordination through zookeeper."""
+        return self.config.rebalance_protocol == STATIC_REBALANCE
+
+    def _validate_static_membership(self):
+        if self.config.partition_assignment == THROUGHPUT_ASSIGNMENT:
+            raise ConfigurationError(
+                "Throughput partition_assignment requires zookeeper, it can't "
+                "be used with the static rebalance_protocol."
+            )
+        member_index = self.config.static_member_index
+        member_count = self.config.static_member_count
+        if (member_index is None or member_count is None or
+                not 0 <= member_index < member_count):
+            raise ConfigurationError(
+                "Invalid static membership: static_member_index {0}, "
+                "static_member_count {1}. The index must be between 0 and "
+                "static_member_count - 1.".format(member_index, member_count)
+            )
+
     def start(self):
         """Create a new group and wait until the partitions have been
         acquired. This function should never be called twice.
+        With the static rebalance protocol zookeeper is never contacted.
 
         :raises: PartitionerError upon partitioner failures
 
         .. note: This is a blocking operation.
         """
-        self.kazoo_retry = KazooRetry(**KAZOO_RETRY_DEFAULTS)
-        self.kazoo_client = KazooClient(
-            self.config.zookeeper,
-            connection_retry=self.kazoo_retry,
-        )
+        if not self.is_static:
+            self.kazoo_client = self.kazoo_session_manager.acquire(
+                self.config.zookeeper,
+                KAZOO_RETRY_DEFAULTS,
+            )
         self.kafka_client = KafkaClient(self.config.broker_list)
 
         self.log.debug("Starting a new group for topics %s", self.topics)
@@ -153,7 +244,9 @@ class Partitioner(object):
         while True:
             partitioner = self._get_partitioner()
             self._handle_group(partitioner)
-            if self.acquired_partitions:
+            # A static member may have no partitions assigned at all, there
+            # is no point in waiting for a rebalance that would never happen.
+            if self.acquired_partitions or self.is_static:
                 break
 
     def need_partitions_refresh(self):
@@ -173,71 +266,163 @@ class Partitioner(object):
         :type partitions: set
         """
         if self.need_partitions_refresh() or not self._partitioner:
-            try:
-                partitions = self.get_partitions_set()
-            except Exception:
-                self.log.exception(
-                    "Failed to get partitions set from Kafka."
-                    "Releasing the group."
-                )
-                self.release_and_finish()
-                raise PartitionerError(
-                    "Failed to get partitions set from Kafka",
-                )
-            self.force_partitions_refresh = False
-            self.last_partitions_refresh = time.time()
-            if partitions != self.partitions_set:
+            partitions = self._refresh_partitions_set()
+            weights_published = self.refresh_partition_weights()
+            if partitions != self.partitions_set or weights_published:
                 # If partitions changed we release the consumers, destroy the
                 # partitioner and disconnect from zookeeper.
-                self.log.info(
-                    "Partitions set changed. New partitions: %s. "
-                    "Old partitions %s. Rebalancing...",
-                    [p for p in partitions if p not in self.partitions_set],
-                    [p for p in self.partitions_set if p not in partitions]
-                )
-                # We need to destroy the existing partitioner before creating
-                # a new one.
-                self.release_and_finish()
-                self._partitioner = self._create_partitioner(partitions)
+                if partitions != self.partitions_set:
+                    added, removed = diff_partitions(self.partitions_set, partitions)
+                    self.log.info(
+                        "Partitions set changed. New partitions: %s. "
+                        "Old partitions %s. Rebalancing...",
+                        sorted(added),
+                        sorted(removed),
+                    )
+                else:
+                    # The other members rebalance upon the party change and
+                    # read the new weights.
+                    self.log.info("Partition weights changed. Rebalancing...")
+                if (isinstance(self._partitioner, IncrementalSetPartitioner) and
+                        not self._partitioner.failed):
+                    # Only the partitions changing owner are handed off
+                    self._partitioner.update_set(partitions)
+                else:
+                    # We need to destroy the existing partitioner before
+                    # creating a new one.
+                    self.release_and_finish()
+                    self._partitioner = self._create_partitioner(partitions)
                 self.partitions_set = partitions
         return self._partitioner
 
+    def _refresh_partitions_set(self):
+        try:
+            partitions = self.get_partitions_set()
+        except Exception:
+            self.log.exception(
+                "Failed to get partitions set from Kafka."
+                "Releasing the group."
+            )
+            self.release_and_finish()
+            raise PartitionerError(
+                "Failed to get partitions set from Kafka",
+            )
+        self.force_partitions_refresh = False
+        self.last_partitions_refresh = time.time()
+        return partitions
+
+    def refresh_partition_weights(self):
+        """Measure the partitions throughput, if the last measure is too
+        old, and publish the new weights if they changed enough.
+
+        :returns: True if this member published new weights. The group must
+            rebalance to use them. Always False for count based assignment.
+        :rtype: bool
+        """
+        if self.config.partition_assignment != THROUGHPUT_ASSIGNMENT:
+            return False
+        throughput_weights = self._get_throughput_weights()
+        throughput_weights.topics = self.subscribed_topics
+        try:
+            return throughput_weights.refresh()
+        except Exception:
+            self.log.exception("Failed to refresh the partition weights.")
+            return False
+
+    def _get_throughput_weights(self):
+        self._connect_zookeeper()
+        if self._throughput_weights is None:
+            self._throughput_weights = ThroughputWeights(
+                self.kazoo_client,
+                "{0}/weights".format(self.zk_group_path),
+                self.kafka_client,
+                self.subscribed_topics,
+            )
+        return self._throughput_weights
+
+    def _get_partition_func(self):
+        if self.config.partition_assignment == THROUGHPUT_ASSIGNMENT:
+            # The weights are read when the partitions are allocated, all
+            # the members use the same ones.
+            return ThroughputAssignment(self._get_throughput_weights())
+        return WeightedAssignment({})
+
+    def _connect_zookeeper(self):
+        try:
+            self.kazoo_session_manager.ensure_connected(self.kazoo_client)
+        except Exception:
+            self.log.exception("Impossible to connect to zookeeper")
+            self.release_and_finish()
+            raise PartitionerError("Zookeeper connection failure")
+
     def _create_partitioner(self, partitions):
         """Connect to zookeeper and create a partitioner"""
-        if self.kazoo_client.state != KazooState.CONNECTED:
-            try:
-                self.kazoo_client.start()
-            except Exception:
-                self.log.exception("Impossible to connect to zookeeper")
-                self.release_and_finish()
-                raise PartitionerError("Zookeeper connection failure")
-
         self.log.debug(
             "Creating partitioner for group %s, topic %s,"
             " partitions set %s", self.config.group_id,
             self.topics,
             partitions
         )
+        if self.is_static:
+            return StaticSetPartitioner(
+                partitions,
+                self.config.static_member_index,
+                self.config.static_member_count,
+            )
+        self._connect_zookeeper()
+        if self.config.rebalance_protocol == INCREMENTAL_REBALANCE:
+            return IncrementalSetPartitioner(
+                self.kazoo_client,
+                path=self.zk_group_path,
+                set=partitions,
+                partition_func=self._get_partition_func(),
+                identifier=self.get_identifier(),
+            )
         return self.kazoo_client.SetPartitioner(
             path=self.zk_group_path,
             set=partitions,
+            partition_func=self._get_partition_func(),
+            identifier=self.get_identifier(),
             time_boundary=self.config.partitioner_cooldown,
         )
 
+    def get_identifier(self):
+        """Identifier of this partitioner in the group: <fqdn>-<pid>-<id>,
+        unique among the partitioners of the process, followed by
+        @<capacity> if consumer_capacity is set in config."""
+        return make_member_identifier(
+            "{host}-{pid}-{id}".format(
+                host=socket.getfqdn(),
+                pid=os.getpid(),
+                id=self._partitioner_id,
+            ),
+            self.config.consumer_capacity,
+        )
+
     def release_and_finish(self):
         """Release consumers and terminate the partitioner"""
         if self._partitioner:
             self._release(self._partitioner)
             self._partitioner.finish()
+            if isinstance(self._partitioner, SetPartitioner):
+                # kazoo doesn't remove the session listener of a finished
+                # SetPartitioner and the session is shared.
+                self._partitioner._client.remove_listener(
+                    self._partitioner._establish_sessionwatch,
+                )
         self._partitioner = None
 
     def _close_connections(self):
-        self.kafka_client.close()
+        # The kafka client doesn't exist if start failed early
+        if self.kafka_client is not None:
+            self.kafka_client.close()
         self.partitions_set = set()
+        self._metadata_versions = None
         self.last_partitions_refresh = 0
-        self.kazoo_client.stop()
-        self.kazoo_client.close()
-        self.kazoo_retry = None
+        if self.kazoo_client is not None:
+            self.kazoo_session_manager.release(self.kazoo_client)
+            self.kazoo_client = None
+        self._throughput_weights = None
 
     def _handle_group(self, partitioner):
         """Handle group status changes, for example when a new
@@ -262,27 +447,33 @@ class Partitioner(object):
         """Acquire kafka topics-[partitions] and start the
         consumers for them.
         """
-        acquired_partitions = self._get_acquired_partitions(partitioner)
-        if acquired_partitions != self.acquired_partitions:
+        acquired_keys = frozenset(partitioner)
+        if acquired_keys != self._acquired_keys:
+            added, removed = diff_partitions(self._acquired_keys, acquired_keys)
             # TODO: Decrease logging level
             self.log.info(
                 "Total number of acquired partitions = %s"
                 "It was %s before. Added partitions %s. Removed partitions %s",
-                len(acquired_partitions),
-                len(self.acquired_partitions),
-                [
-                    p for p in acquired_partitions
-                    if p not in self.acquired_partitions
-                ],
-                [
-                    p for p in self.acquired_partitions
-                    if p not in acquired_partitions
-                ],
+                len(acquired_keys),
+                len(self._acquired_keys),
+                sorted(added),
+                sorted(removed),
             )
-            self.acquired_partitions = acquired_partitions
+            if removed and not self.released_flag:
+                # The party changed again after an incremental release, some
+                # of the kept partitions moved to other members.
+                self._release_partitions(group_by_topic(sorted(removed)))
+            self._acquired_keys = acquired_keys
+            self.acquired_partitions = self._get_acquired_partitions(partitioner)
             try:
-                self.acquire(copy.deepcopy(self.acquired_partitions))
-                self.released_flag = False
+                if added:
+                    self.acquire(dict(
+                        (topic, list(partitions))
+                        for topic, partitions in six.iteritems(group_by_topic(
+                            key for key in partitioner if key in added
+                        ))
+                    ))
+                self.released_flag = not acquired_keys
             except Exception:
                 self.log.exception("Acquire action failed.")
                 trace = traceback.format_exc()
@@ -292,16 +483,58 @@ class Partitioner(object):
                     "Acquire error: {trace}".format(trace=trace)
                 )
 
-    def _release(self, partitioner):
+    def _rebalance_release(self, partitioner):
+        """Release the partitions upon group changes. With the incremental
+        rebalance protocol only the partitions moving to other members are
+        released.
+        """
+        if isinstance(partitioner, IncrementalSetPartitioner):
+            # The party may have changed because another member noticed new
+            # partitions, e.g. a new topic matching the topic pattern. All
+            # the members use the new set in this rebalance, instead of
+            # notifying the party again when they notice it.
+            self.force_partitions_refresh = True
+            partitions = self._refresh_partitions_set()
+            if partitions != self.partitions_set:
+                self.log.info("Partitions set changed upon rebalance.")
+                partitioner.update_set(partitions, notify=False)
+                self.partitions_set = partitions
+            self._release(partitioner, partitioner.get_kept_items())
+        else:
+            self._release(partitioner)
+
+    def _release(self, partitioner, keep=None):
         """Release the consumers and acquired partitions.
         This function is executed either at termination time or
         whenever there is a group change.
+
+        :param keep: partitions kept by an incremental partitioner, as
+            returned by IncrementalSetPartitioner.get_kept_items. Their
+            consumers keep running. Default: release all the partitions.
         """
         self.log.debug("Releasing partitions")
-        try:
-            if not self.released_flag:
-                self.release(self.acquired_partitions)
+        kept_keys = self._acquired_keys.intersection(keep or ())
+        if not self.released_flag:
+            if kept_keys:
+                released_keys = self._acquired_keys - kept_keys
+                if released_keys:
+                    self._release_partitions(group_by_topic(sorted(released_keys)))
+            else:
+                self._release_partitions(self.acquired_partitions)
                 self.released_flag = True
+        if keep is None:
+            partitioner.release_set()
+        else:
+            partitioner.release_set(keep)
+        # A new dict, the user may hold the released one
+        self.acquired_partitions = group_by_topic(sorted(kept_keys))
+        self._acquired_keys = kept_keys
+        self.force_partitions_refresh = True
+
+    def _release_partitions(self, partitions):
+        """Call the user release function."""
+        try:
+            self.release(partitions)
         except Exception:
             trace = traceback.format_exc()
             self.log.exception("Release action failed.")
@@ -309,9 +542,6 @@ class Partitioner(object):
                 "Release action failed."
                 "Release error: {trace}".format(trace=trace),
             )
-        partitioner.release_set()
-        self.acquired_partitions.clear()
-        self.force_partitions_refresh = True
 
     def _fail(self, partitioner):
         """Handle zookeeper failures.
@@ -334,37 +564,74 @@ class Partitioner(object):
         :returns: acquired topic and partitions
         :rtype: dict {<topic>: <[partitions]>}
         """
-        acquired_partitions = defaultdict(list)
-        for partition in partitioner:
-            topic, partition_id = partition.rsplit('-', 1)
-            acquired_partitions[topic].append(int(partition_id))
-        return acquired_partitions
+        return group_by_topic(partitioner)
 
     def get_partitions_set(self):
         """ Load partitions metadata from kafka and create
-        a set containing "<topic>-<partition_id>"
+        a set of :py:class:`yelp_kafka.partition_table.PartitionKey`,
+        whose string representation is "<topic>-<partition_id>".
+
+        The metadata of the consumer topics is loaded through the metadata cache
+        shared by the partitioners of the same cluster. The set is only built
+        again when the partitions of any of the topics have changed. For a
+        topic pattern the subscribed topics are the matching topics of the
+        cluster.
 
         :returns: partitions for user topics
-        :rtype: set
+        :rtype: frozenset
         :raises PartitionerError: if no partitions have been found
         """
-        topic_partitions = get_kafka_topics(self.kafka_client)
-        partitions = []
-        missing_topics = set()
-        for topic in self.topics:
-            kafka_topic = kafka_bytestring(topic)
-            if kafka_topic not in topic_partitions:
-                missing_topics.add(topic)
-            else:
-                partitions += ["{0}-{1}".format(topic, p)
-                               for p in topic_partitions[kafka_topic]]
-        if missing_topics:
-            self.log.info("Missing topics: %s", missing_topics)
-        if not partitions:
+        if self.force_partitions_refresh:
+            max_age_secs = FORCED_PARTITIONS_REFRESH_MAX_AGE
+        else:
+            max_age_secs = PARTITIONS_REFRESH_TIMEOUT
+        if is_topic_pattern(self.topics):
+            topics = self.metadata_cache.get_matching_topics(
+                self.kafka_client,
+                self.topics,
+                max_age_secs,
+            )
+            if topics != self.subscribed_topics:
+                self.log.info("Subscribed topics: %s", topics)
+        else:
+            topics = self.topics
+        topics_metadata = self.metadata_cache.get_topics_metadata(
+            self.kafka_client,
+            topics,
+            max_age_secs,
+        )
+        versions = dict(
+            (topic, metadata.version)
+            for topic, metadata in six.iteritems(topics_metadata)
+        )
+        if versions != self._metadata_versions:
+            self._metadata_partitions = self._build_partitions_set(
+                topics,
+                topics_metadata,
+            )
+            self._metadata_versions = versions
+        self.subscribed_topics = topics
+        if not self._metadata_partitions:
             self.release_and_finish()
             raise PartitionerError(
                 "No partitions found for topics: {topics}".format(
                     topics=self.topics
                 )
             )
-        return set(partitions)
+        return self._metadata_partitions
+
+    def _build_partitions_set(self, topics, topics_metadata):
+        partitions = []
+        missing_topics = set()
+        for topic in topics:
+            metadata = topics_metadata[kafka_bytestring(topic)]
+            if not metadata.partitions:
+                missing_topics.add(topic)
+            else:
+                partitions += self.partition_table.get_keys(
+                    topic,
+                    metadata.partitions,
+                )
+        if missing_topics:
+            self.log.info("Missing topics: %s", missing_topics)
+        return frozenset(partitions)
@@ -15,23 +15,42 @@
 from __future__ import absolute_import
 from __future__ import unicode_literals
 
+import functools
 import logging
+import time
 
+import six
 from kafka import KeyedProducer
 from kafka import SimpleProducer
+from kafka.common import FailedPayloadsError
 from kafka.common import KafkaError
-from py_zipkin.zipkin import zipkin_span
+from kafka.common import ProduceResponse
+from kafka.common import TopicAndPartition
 
 from yelp_kafka import metrics
 from yelp_kafka.error import YelpKafkaError
 from yelp_kafka.metrics_responder import MetricsResponder
 from yelp_kafka.utils import get_default_responder_if_available
+from yelp_kafka.utils import zipkin_span
 METRIC_PREFIX = 'yelp_kafka.YelpKafkaProducer.'
 
 
 class YelpKafkaProducerMetrics(object):
     """Used to setup and report producer metrics
 
+    Besides the kafka client timers and failure counters, the produce
+    requests sent by the client are timed. Their latency in milliseconds
+    and their batch size, in number of messages, are reported for each
+    topic and leader broker, with topic and broker (host:port) dimensions.
+    The latency of a request sent to several leaders is only known for the
+    whole request: it is reported with the broker dimension 'multiple'.
+    Failed partitions, either raised or returned as error responses when
+    fail_on_error is False, are counted for each topic and broker.
+
+    Async producers send from a thread using a copy of the client, see
+    KafkaClient.copy. The client must be instrumented before the producer
+    is initialized, the copy then reports to the same metrics.
+
     :param cluster_config: producer cluster configuration
     :type cluster_config: config.ClusterConfig
     :param client: Kafka client for which metrics are to be reported
@@ -50,6 +69,10 @@ class YelpKafkaProducerMetrics(object):
         self.cluster_config = cluster_config
         self.client = client
         self.timers = {}
+        self.counters = {}
+        # Emitters of the produce request metrics by (name, topic, broker)
+        self.request_emitters = {}
+        self._unknown_metrics = set()
         self.metrics_responder = metrics_responder
         if metrics_responder:
             self.setup_metrics()
@@ -70,6 +93,17 @@ class YelpKafkaProducerMetrics(object):
         )
         for name in metrics.TIME_METRIC_NAMES:
             self._create_timer(name, kafka_dimensions)
+        for name in metrics.FAILURE_COUNT_METRIC_NAMES:
+            self._create_counter(name, kafka_dimensions)
+        self.client.send_produce_request = _ProduceRequestReporter(
+            self,
+            self.client,
+            self.client.send_produce_request,
+        )
+
+    def __deepcopy__(self, memo):
+        # Shared by the copies of the client
+        return self
 
     def _send_kafka_metrics(self, key, value):
         if key in metrics.TIME_METRIC_NAMES:
@@ -77,8 +111,138 @@ class YelpKafkaProducerMetrics(object):
             # milliseconds
             time_in_ms = value * 1000
             self.metrics_responder.record(self._get_timer(key), time_in_ms)
+        elif key in metrics.FAILURE_COUNT_METRIC_NAMES:
+            self.metrics_responder.record(self._get_counter(key), 1)
+        elif key not in self._unknown_metrics:
+            # Logged once, unknown metrics may be emitted for every request
+            self._unknown_metrics.add(key)
+            self.log.debug("Unknown metric: %s", key)
+
+    def _send_produce_request(
+        self,
+        client,
+        send_produce_request,
+        payloads=(),
+        acks=1,
+        timeout=1000,
+        fail_on_error=True,
+        callback=None,
+    ):
+        """Wrap KafkaClient.send_produce_request to report the request
+        metrics of each topic and leader broker."""
+        # Leaders are looked up before sending, errors reset the metadata
+        brokers = dict(
+            (
+                (payload.topic, payload.partition),
+                self._get_broker(client, payload.topic, payload.partition),
+            )
+            for payload in payloads
+        )
+
+        def check_response(response):
+            self._record_failure(brokers, response)
+            return callback(response) if callback else response
+
+        start = time.time()
+        try:
+            return send_produce_request(
+                payloads,
+                acks=acks,
+                timeout=timeout,
+                fail_on_error=fail_on_error,
+                callback=check_response,
+            )
+        except Exception as e:
+            if not self._record_failure(brokers, e):
+                for topic, broker in set(
+                    (topic, broker)
+                    for (topic, _), broker in six.iteritems(brokers)
+                ):
+                    self._record_request_metric(
+                        metrics.PRODUCE_FAILURE_COUNT,
+                        topic,
+                        broker,
+                        1,
+                    )
+            raise
+        finally:
+            # Recorded for failed requests too, slow failures matter.
+            elapsed_ms = (time.time() - start) * 1000
+            leaders = set(six.itervalues(brokers))
+            broker = leaders.pop() if len(leaders) == 1 else 'multiple'
+            for topic in set(payload.topic for payload in payloads):
+                self._record_request_metric(
+                    metrics.PRODUCE_LATENCY,
+                    topic,
+                    broker,
+                    elapsed_ms,
+                )
+            for payload in payloads:
+                self._record_request_metric(
+                    metrics.PRODUCE_BATCH_SIZE,
+                    payload.topic,
+                    brokers[(payload.topic, payload.partition)],
+                    len(payload.messages),
+                )
+
+    def _record_failure(self, brokers, response):
+        """Count the failure of the partition of an error response or
+        exception.
+
+        :returns: False if no failed partition is found in response
+        """
+        if isinstance(response, FailedPayloadsError):
+            partition = (response.payload.topic, response.payload.partition)
         else:
-            self.log.warn("Unknown metric: {0}".format(key))
+            if isinstance(response, KafkaError) and response.args:
+                # Raised broker errors hold the response
+                response = response.args[0]
+            if not isinstance(response, ProduceResponse) or not response.error:
+                return False
+            partition = (response.topic, response.partition)
+        self._record_request_metric(
+            metrics.PRODUCE_FAILURE_COUNT,
+            partition[0],
+            brokers.get(partition, 'unknown'),
+            1,
+        )
+        return True
+
+    def _record_request_metric(self, name, topic, broker, value):
+        self.metrics_responder.record(
+            self._get_request_emitter(name, topic, broker),
+            value,
+        )
+
+    def _get_broker(self, client, topic, partition):
+        """Get the leader of partition from the client metadata, without
+        sending any metadata request."""
+        leader = client.topics_to_brokers.get(
+            TopicAndPartition(topic, partition),
+        )
+        if leader is None:
+            return 'unknown'
+        return '{0}:{1}'.format(leader.host, leader.port)
+
+    def _get_request_emitter(self, name, topic, broker):
+        key = (name, topic, broker)
+        emitter = self.request_emitters.get(key)
+        if emitter is None:
+            dimensions = self.get_kafka_dimensions()
+            dimensions['topic'] = topic
+            dimensions['broker'] = broker
+            if name == metrics.PRODUCE_FAILURE_COUNT:
+                emitter = self.metrics_responder.get_counter_emitter(
+                    METRIC_PREFIX + name,
+                    dimensions,
+                )
+            else:
+                emitter = self.metrics_responder.get_timer_emitter(
+                    METRIC_PREFIX + name,
+                    default_dimensions=dimensions,
+                )
+            self.request_emitters[key] = emitter
+        return emitter
 
     def _create_timer(self, name, dimensions=None):
         if dimensions is None:
@@ -92,6 +256,68 @@ class YelpKafkaProducerMetrics(object):
     def _get_timer(self, name):
         return self.timers[METRIC_PREFIX + name]
 
+    def _create_counter(self, name, dimensions=None):
+        new_name = METRIC_PREFIX + name
+        self.counters[new_name] = self.metrics_responder.get_counter_emitter(
+            new_name,
+            dimensions or {},
+        )
+
+    def _get_counter(self, name):
+        return self.counters[METRIC_PREFIX + name]
+
+
+class _ProduceRequestReporter(object):
+    """Replaces the send_produce_request method of a KafkaClient to report
+    the produce request metrics.
+
+    A deep copy of the client, as made by KafkaClient.copy, gets a reporter
+    sending with the send_produce_request method of the copy.
+    """
+
+    def __init__(self, producer_metrics, client, send_produce_request):
+        self.producer_metrics = producer_metrics
+        self.client = client
+        self.send_produce_request = send_produce_request
+
+    def __call__(
+        self,
+        payloads=(),
+        acks=1,
+        timeout=1000,
+        fail_on_error=True,
+        callback=None,
+    ):
+        return self.producer_metrics._send_produce_request(
+            self.client,
+            self.send_produce_request,
+            payloads,
+            acks,
+            timeout,
+            fail_on_error,
+            callback,
+        )
+
+    def __deepcopy__(self, memo):
+        client = memo.get(id(self.client))
+        if client is None:
+            # Not copied along with its client
+            return self
+        return _ProduceRequestReporter(
+            self.producer_metrics,
+            client,
+            functools.partial(type(client).send_produce_request, client),
+        )
+
+
+def _get_producer_client(args, kwargs):
+    """Get the client argument of kafka Producer.__init__"""
+    if 'client' in kwargs:
+        return kwargs['client']
+    if args:
+        return args[0]
+    raise TypeError("__init__() missing required argument: 'client'")
+
 
 class YelpKafkaSimpleProducer(SimpleProducer):
     """ YelpKafkaSimpleProducer is an extension of the kafka SimpleProducer that
@@ -127,8 +353,6 @@ class YelpKafkaSimpleProducer(SimpleProducer):
         metrics_responder=None,
         *args, **kwargs
     ):
-        super(YelpKafkaSimpleProducer, self).__init__(*args, **kwargs)
-
         if report_metrics:
             self.metrics_responder = metrics_responder or get_default_responder_if_available()
             assert not metrics_responder or isinstance(metrics_responder, MetricsResponder), \
@@ -136,16 +360,18 @@ class YelpKafkaSimpleProducer(SimpleProducer):
         else:
             self.metrics_responder = None
 
+        # Before the kafka init, for the client copy of async producers
         self.metrics = YelpKafkaProducerMetrics(
             cluster_config=cluster_config,
-            client=self.client,
-            metrics_responder=metrics_responder
+            client=_get_producer_client(args, kwargs),
+            metrics_responder=self.metrics_responder
         )
+        super(YelpKafkaSimpleProducer, self).__init__(*args, **kwargs)
 
     @zipkin_span(service_name='yelp_kafka', span_name='send_messages_simple_producer')
     def send_messages(self, topic, *msg):
         try:
-            super(YelpKafkaSimpleProducer, self).send_messages(topic, *msg)
+            return super(YelpKafkaSimpleProducer, self).send_messages(topic, *msg)
         except (YelpKafkaError, KafkaError):
             if self.metrics.metrics_responder:
                 self.metrics.metrics_responder.record(self.metrics.kafka_enqueue_exception_count, 1)
@@ -181,8 +407,6 @@ class YelpKafkaKeyedProducer(KeyedProducer):
         *args,
         **kwargs
     ):
-        super(YelpKafkaKeyedProducer, self).__init__(*args, **kwargs)
-
         if report_metrics:
             self.metrics_responder = metrics_responder or get_default_responder_if_available()
             assert not metrics_responder or isinstance(metrics_responder, MetricsResponder), \
@@ -190,16 +414,18 @@ class YelpKafkaKeyedProducer(KeyedProducer):
         else:
             self.metrics_responder = None
 
+        # Before the kafka init, for the client copy of async producers
         self.metrics = YelpKafkaProducerMetrics(
             cluster_config,
-            self.client,
-            metrics_responder
+            _get_producer_client(args, kwargs),
+            self.metrics_responder
         )
+        super(YelpKafkaKeyedProducer, self).__init__(*args, **kwargs)
 
     @zipkin_span(service_name='yelp_kafka', span_name='send_messages_keyed_producer')
     def send_messages(self, topic, key, *msg):
         try:
-            super(YelpKafkaKeyedProducer, self).send_messages(topic, key, *msg)
+            return super(YelpKafkaKeyedProducer, self).send_messages(topic, key, *msg)
         except (YelpKafkaError, KafkaError):
             if self.metrics.metrics_responder:
                 self.metrics.metrics_responder.record(self.metrics.kafka_enqueue_exception_count, 1)
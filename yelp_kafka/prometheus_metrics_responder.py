@@ -0,0 +1,403 @@
+# -*- coding: utf-8 -*-
+# Copyright 2016 Yelp Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Metrics responder aggregating the yelp_kafka metrics in-process and
+exporting them in the Prometheus text exposition format, either from a
+small HTTP endpoint or by writing a textfile for the node exporter textfile
+collector. It doesn't require any external package.
+
+Example:
+
+.. code-block:: python
+
+   from yelp_kafka.consumer_group import KafkaConsumerGroup
+   from yelp_kafka.prometheus_metrics_responder import PrometheusMetricsResponder
+
+   responder = PrometheusMetricsResponder()
+   responder.start_http_server(9102)
+   group = KafkaConsumerGroup(['topic1'], config, metrics_responder=responder)
+"""
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+import bisect
+import os
+import re
+import tempfile
+import threading
+
+import six
+from six.moves.BaseHTTPServer import BaseHTTPRequestHandler
+from six.moves.BaseHTTPServer import HTTPServer
+
+from yelp_kafka.metrics import DEFAULT_TIMER_BUCKETS_MS
+from yelp_kafka.metrics_responder import MetricsResponder
+
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+_INVALID_NAME_CHARS = re.compile(r'[^a-zA-Z0-9_:]')
+_INVALID_LABEL_CHARS = re.compile(r'[^a-zA-Z0-9_]')
+
+
+def sanitize_metric_name(name):
+    """Replace the characters not allowed in Prometheus metric names,
+    e.g. yelp_kafka.KafkaConsumerGroup.fetch_request_timer becomes
+    yelp_kafka_KafkaConsumerGroup_fetch_request_timer.
+    """
+    name = _INVALID_NAME_CHARS.sub('_', name)
+    if name[:1].isdigit():
+        name = '_' + name
+    return name
+
+
+def _escape_label_value(value):
+    # group ids are bytes
+    if isinstance(value, bytes):
+        value = value.decode('utf-8', 'replace')
+    return six.text_type(value).replace('\\', '\\\\').replace(
+        '\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(
+        '{0}="{1}"'.format(key, _escape_label_value(value))
+        for key, value in pairs
+    ) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class ShardedMetric(object):
+    """Base class of the metrics recorded by PrometheusMetricsResponder.
+
+    Every thread recording a metric gets its own shard, so recording never
+    takes a lock: a shard is only written by its own thread. Shards are
+    summed when the metric is exported. The shards of the threads that
+    exited are added to a base shard and dropped, so that threads started
+    over time, e.g. upon rebalances, don't make the shards grow.
+
+    :param name: sanitized metric name
+    :param labels: tuple of (label name, value) pairs
+    """
+
+    metric_type = None
+
+    def __init__(self, name, labels):
+        self.name = name
+        self.labels = labels
+        self._local = threading.local()
+        # (thread, shard) pairs
+        self._shards = []
+        self._base = None
+        self._shards_lock = threading.Lock()
+
+    def _new_shard(self):
+        raise NotImplementedError
+
+    def _get_shard(self):
+        shard = getattr(self._local, 'shard', None)
+        if shard is None:
+            shard = self._new_shard()
+            with self._shards_lock:
+                self._fold_dead_shards()
+                self._shards.append((threading.current_thread(), shard))
+            self._local.shard = shard
+        return shard
+
+    def _fold_dead_shards(self):
+        """Add the shards of the exited threads to the base shard. They
+        can't be written anymore. Called with the shards lock held.
+        """
+        if self._base is None:
+            self._base = self._new_shard()
+        alive = []
+        for thread, shard in self._shards:
+            if thread.is_alive():
+                alive.append((thread, shard))
+            else:
+                for i, value in enumerate(shard):
+                    self._base[i] += value
+        self._shards = alive
+
+    def _collect(self):
+        """Sum the shards of all the threads.
+
+        :returns: list with the sum of each shard field
+        """
+        with self._shards_lock:
+            self._fold_dead_shards()
+            total = list(self._base)
+            shards = [shard for _, shard in self._shards]
+        for shard in shards:
+            for i, value in enumerate(list(shard)):
+                total[i] += value
+        return total
+
+    def samples(self):
+        """Get the current samples of the metric.
+
+        :returns: list of (suffix, extra labels, value)
+        """
+        raise NotImplementedError
+
+
+class Counter(ShardedMetric):
+
+    metric_type = 'counter'
+
+    def _new_shard(self):
+        return [0]
+
+    def count(self, value=1):
+        self._get_shard()[0] += value
+
+    @property
+    def value(self):
+        return self._collect()[0]
+
+    def samples(self):
+        return [('', (), self.value)]
+
+
+class Timer(ShardedMetric):
+    """Histogram of the recorded times.
+
+    :param buckets: sorted upper bounds of the buckets
+    """
+
+    metric_type = 'histogram'
+
+    def __init__(self, name, labels, buckets=DEFAULT_TIMER_BUCKETS_MS):
+        super(Timer, self).__init__(name, labels)
+        self.buckets = tuple(buckets)
+
+    def _new_shard(self):
+        # One count for each bucket, one for +Inf and the sum of the values
+        return [0] * (len(self.buckets) + 2)
+
+    def record(self, value, count=1):
+        shard = self._get_shard()
+        shard[bisect.bisect_left(self.buckets, value)] += count
+        shard[-1] += value * count
+
+    def samples(self):
+        total = self._collect()
+        samples = []
+        cumulative = 0
+        bounds = self.buckets + (float('inf'),)
+        for bound, count in zip(bounds, total[:-1]):
+            cumulative += count
+            samples.append(('_bucket', (('le', _format_value(bound)),), cumulative))
+        samples.append(('_sum', (), total[-1]))
+        samples.append(('_count', (), cumulative))
+        return samples
+
+
+class Gauge(object):
+    """Last value recorded, from any thread. Gauges are not exported until
+    a value has been recorded.
+
+    :param name: sanitized metric name
+    :param labels: tuple of (label name, value) pairs
+    """
+
+    metric_type = 'gauge'
+
+    def __init__(self, name, labels):
+        self.name = name
+        self.labels = labels
+        self.value = None
+
+    def set(self, value):
+        self.value = value
+
+    def samples(self):
+        value = self.value
+        if value is None:
+            return []
+        return [('', (), value)]
+
+
+class PrometheusMetricsResponder(MetricsResponder):
+    """Metrics responder keeping the metrics in memory, see the module
+    documentation.
+
+    Counters are exported as Prometheus counters, gauges as gauges and timers
+    as histograms of the recorded times in milliseconds. The metric names are sanitized
+    and the default dimensions of the emitters become labels. Emitters
+    requested twice with the same name and dimensions are shared.
+
+    :param timer_buckets: upper bounds of the timer histogram buckets, in ms.
+        Default: :py:data:`yelp_kafka.metrics.DEFAULT_TIMER_BUCKETS_MS`
+    """
+
+    def __init__(self, timer_buckets=DEFAULT_TIMER_BUCKETS_MS):
+        super(PrometheusMetricsResponder, self).__init__()
+        self.timer_buckets = tuple(sorted(timer_buckets))
+        self._metrics = {}
+        self._lock = threading.Lock()
+        self._http_server = None
+
+    def _get_metric(self, metric_class, metric, default_dimensions, **kwargs):
+        name = sanitize_metric_name(metric)
+        labels = tuple(sorted(
+            (_INVALID_LABEL_CHARS.sub('_', six.text_type(key)), value)
+            for key, value in six.iteritems(default_dimensions or {})
+        ))
+        with self._lock:
+            emitter = self._metrics.get((name, labels))
+            if emitter is None:
+                emitter = metric_class(name, labels, **kwargs)
+                self._metrics[(name, labels)] = emitter
+            elif not isinstance(emitter, metric_class):
+                raise ValueError(
+                    "Metric {0} is already registered as a {1}".format(
+                        name,
+                        emitter.metric_type,
+                    )
+                )
+            return emitter
+
+    def get_counter_emitter(self, metric, default_dimensions=None):
+        return self._get_metric(Counter, metric, default_dimensions)
+
+    def get_timer_emitter(self, metric, default_dimensions=None):
+        return self._get_metric(
+            Timer,
+            metric,
+            default_dimensions,
+            buckets=self.timer_buckets,
+        )
+
+    def get_gauge_emitter(self, metric, default_dimensions=None):
+        return self._get_metric(Gauge, metric, default_dimensions)
+
+    def record(self, registered_reporter, value, timestamp=None):
+        if isinstance(registered_reporter, Counter):
+            registered_reporter.count(value)
+        elif isinstance(registered_reporter, Gauge):
+            registered_reporter.set(value)
+        elif isinstance(registered_reporter, Timer):
+            registered_reporter.record(value)
+        else:
+            self.log.error("Reporter Instance is not defined")
+
+    def record_many(self, registered_reporter, value, count, timestamp=None):
+        if isinstance(registered_reporter, Timer):
+            registered_reporter.record(value, count)
+        elif isinstance(registered_reporter, Counter):
+            registered_reporter.count(value * count)
+        else:
+            super(PrometheusMetricsResponder, self).record_many(
+                registered_reporter,
+                value,
+                count,
+                timestamp,
+            )
+
+    def render(self):
+        """Get all the metrics in the Prometheus text exposition format.
+
+        :rtype: unicode
+        """
+        with self._lock:
+            emitters = sorted(
+                six.itervalues(self._metrics),
+                key=lambda emitter: (emitter.name, emitter.labels),
+            )
+        lines = []
+        current_name = None
+        for emitter in emitters:
+            if emitter.name != current_name:
+                current_name = emitter.name
+                lines.append('# TYPE {0} {1}'.format(
+                    emitter.name,
+                    emitter.metric_type,
+                ))
+            for suffix, extra_labels, value in emitter.samples():
+                lines.append('{name}{suffix}{labels} {value}'.format(
+                    name=emitter.name,
+                    suffix=suffix,
+                    labels=_format_labels(emitter.labels, extra_labels),
+                    value=_format_value(value),
+                ))
+        return '\n'.join(lines) + '\n'
+
+    def write_textfile(self, path):
+        """Write the metrics to path, atomically replacing the file.
+        Meant for the node exporter textfile collector, the file name should
+        end with .prom.
+
+        :param path: path of the file
+        """
+        directory = os.path.dirname(os.path.abspath(path))
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as tmp_file:
+                tmp_file.write(self.render().encode('utf-8'))
+            os.rename(tmp_path, path)
+        except Exception:
+            os.unlink(tmp_path)
+            raise
+
+    def start_http_server(self, port, addr=''):
+        """Serve the metrics over HTTP from a daemon thread. Every GET
+        request gets the metrics, regardless of the path.
+
+        :param port: port to listen on, 0 to pick a free port
+        :param addr: address to listen on. Default: all the interfaces
+        :returns: the port the server is listening on
+        """
+        if self._http_server is not None:
+            raise RuntimeError("The metrics HTTP server is already running")
+        self._http_server = HTTPServer((addr, port), _make_handler(self))
+        thread = threading.Thread(
+            target=self._http_server.serve_forever,
+            name='PrometheusMetricsResponder-http',
+        )
+        thread.daemon = True
+        thread.start()
+        return self._http_server.server_address[1]
+
+    def stop_http_server(self):
+        if self._http_server is not None:
+            self._http_server.shutdown()
+            self._http_server.server_close()
+            self._http_server = None
+
+
+def _make_handler(responder):
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+
+        def do_GET(self):
+            body = responder.render().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', CONTENT_TYPE)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            responder.log.debug(format, *args)
+
+    return MetricsHandler
@@ -0,0 +1,554 @@
+# -*- coding: utf-8 -*-
+# Copyright 2016 Yelp Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Consumer group where a single fetcher process consumes all the acquired
+partitions and hands the messages to a pool of worker processes through
+shared memory ring buffers.
+"""
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+import logging
+import multiprocessing
+import os
+import signal
+import time
+from multiprocessing import Event
+from multiprocessing import Process
+
+import six
+from kafka import KafkaConsumer
+from kafka.common import ConsumerTimeout
+from kafka.common import KafkaMessage
+from setproctitle import getproctitle
+from setproctitle import setproctitle
+from six.moves import cPickle as pickle
+
+from yelp_kafka.consumer_group import CONSUMER_GROUP_INTERNAL_TIMEOUT
+from yelp_kafka.consumer_group import DEFAULT_REFRESH_TIMEOUT_IN_SEC
+from yelp_kafka.error import ConsumerGroupError
+from yelp_kafka.error import PartitionerError
+from yelp_kafka.error import PartitionerZookeeperError
+from yelp_kafka.error import ProcessMessageError
+from yelp_kafka.partition_table import add_partitions
+from yelp_kafka.partition_table import remove_partitions
+from yelp_kafka.partitioner import Partitioner
+from yelp_kafka.shared_ring import SharedRingBuffer
+from yelp_kafka.utils import set_task_done_offsets
+
+DEFAULT_RING_BUFFER_BYTES = 16 * 1024 * 1024
+MAX_BATCH_MESSAGES = 500
+# Max time a fetched message waits for its batch to be full.
+MAX_BATCH_DELAY_SECS = 0.05
+# Max time a process blocks on a ring buffer before checking for
+# termination.
+RING_TIMEOUT_SECS = 0.1
+
+
+def serialize(obj):
+    # Protocol 2 is supported by both python 2 and python 3
+    return pickle.dumps(obj, 2)
+
+
+def deserialize(data):
+    return pickle.loads(data)
+
+
+class SharedMemoryWorker(object):
+    """Base class of the worker processes of
+    :py:class:`SharedMemoryConsumerGroup`.
+
+    Workers don't connect to kafka, they receive batches of messages from
+    the fetcher process through a shared memory ring buffer and acknowledge
+    the processed offsets through another one. All the messages of a
+    partition are processed by the same worker, in order.
+
+    :param config: yelp_kafka consumer config
+    :type config: :py:class:`yelp_kafka.config.KafkaConsumerConfig`
+    :param worker_id: index of the worker in the group, from 0 to
+        worker_count - 1.
+    :type worker_id: int
+    """
+
+    def __init__(self, config, worker_id):
+        self.log = logging.getLogger(self.__class__.__name__)
+        self.config = config
+        self.worker_id = worker_id
+        self.termination_flag = Event()
+        # Set by the group before the worker process is started
+        self.messages_ring = None
+        self.acks_ring = None
+
+    def initialize(self):
+        """Initialize the worker. Called once in the worker process, before
+        processing any message.
+
+        .. note: implement in subclass.
+        """
+        pass
+
+    def dispose(self):
+        """Called just before the worker process exits.
+
+        .. note: implement in subclass.
+        """
+        pass
+
+    def process(self, message):
+        """Process a message.
+
+        .. note: implement in subclass.
+
+        :param message: message to process
+        :type message: kafka-python KafkaMessage
+        """
+        pass
+
+    def terminate(self):
+        """Terminate the worker. The batch being processed is completed
+        before terminating.
+        """
+        self.termination_flag.set()
+
+    def set_process_name(self):
+        setproctitle('{0}-worker-{1}'.format(getproctitle(), self.worker_id))
+
+    def run(self):
+        """Process the messages until the worker is terminated.
+
+        :raises: ProcessMessageError when the process function fails
+        """
+        self.set_process_name()
+        self.initialize()
+        self._consume()
+        self.dispose()
+
+    def _consume(self):
+        while not self.termination_flag.is_set():
+            data = self.messages_ring.get(timeout=RING_TIMEOUT_SECS)
+            if data is None:
+                continue
+            offsets = {}
+            for fields in deserialize(data):
+                message = KafkaMessage(*fields)
+                try:
+                    self.process(message)
+                except:
+                    self.log.exception("Error processing message: %s", message)
+                    raise ProcessMessageError(
+                        "Error processing message: %s",
+                        message,
+                    )
+                offsets[(message.topic, message.partition)] = message.offset
+            self._ack(offsets)
+
+    def _ack(self, offsets):
+        data = serialize(offsets)
+        while not self.acks_ring.put(data, timeout=RING_TIMEOUT_SECS):
+            if self.termination_flag.is_set():
+                return
+
+
+class MessageFetcher(object):
+    """Consume all the acquired partitions and dispatch the messages to
+    the workers of :py:class:`SharedMemoryConsumerGroup`.
+
+    Messages are sent in batches, each partition to a single worker. The
+    offsets acknowledged by the workers are marked as done in the kafka-python
+    KafkaConsumer and committed according to the auto commit configuration.
+    Upon termination the fetcher stops fetching, waits up to
+    max_termination_timeout_secs for the workers to process the dispatched
+    messages and commits the processed offsets.
+
+    :param config: yelp_kafka consumer config
+    :type config: :py:class:`yelp_kafka.config.KafkaConsumerConfig`
+    :param partitions: acquired partitions
+    :type partitions: dict {<topic>: <[partitions]>}
+    :param messages_rings: a ring buffer to send messages to each worker
+    :type messages_rings: list of :py:class:`yelp_kafka.shared_ring.SharedRingBuffer`
+    :param acks_rings: a ring buffer to receive the acks from each worker
+    :type acks_rings: list of :py:class:`yelp_kafka.shared_ring.SharedRingBuffer`
+    """
+
+    def __init__(self, config, partitions, messages_rings, acks_rings):
+        self.log = logging.getLogger(self.__class__.__name__)
+        self.config = config
+        self.partitions = partitions
+        self.messages_rings = messages_rings
+        self.acks_rings = acks_rings
+        self.termination_flag = Event()
+        self.consumer = None
+        topic_partitions = sorted(
+            (topic, partition)
+            for topic, topic_partitions in six.iteritems(partitions)
+            for partition in topic_partitions
+        )
+        # Worker index of each partition
+        self.workers = dict(
+            (topic_partition, i % len(messages_rings))
+            for i, topic_partition in enumerate(topic_partitions)
+        )
+        self._batches = [[] for _ in messages_rings]
+        self._batch_start = [None for _ in messages_rings]
+        # Last dispatched and acknowledged offset of each partition
+        self._dispatched = {}
+        self._acked = {}
+
+    def terminate(self):
+        self.termination_flag.set()
+
+    def run(self):
+        setproctitle('{0}-fetcher'.format(getproctitle()))
+        consumer_config = self.config.get_kafka_consumer_config()
+        consumer_config['consumer_timeout_ms'] = CONSUMER_GROUP_INTERNAL_TIMEOUT
+        self.consumer = KafkaConsumer(self.partitions, **consumer_config)
+        try:
+            self._fetch()
+            self._drain()
+            if consumer_config['auto_commit_enable']:
+                self.consumer.commit()
+        finally:
+            self.consumer.close()
+
+    def _fetch(self):
+        while not self.termination_flag.is_set():
+            try:
+                message = self.consumer.next()
+            except ConsumerTimeout:
+                message = None
+            if message is not None:
+                self._add(message)
+            self._flush_batches(expired_only=True)
+            self._read_acks()
+
+    def _add(self, message):
+        worker = self.workers[(message.topic, message.partition)]
+        if not self._batches[worker]:
+            self._batch_start[worker] = time.time()
+        self._batches[worker].append(tuple(message))
+        if len(self._batches[worker]) >= MAX_BATCH_MESSAGES:
+            self._flush(worker)
+
+    def _flush_batches(self, expired_only=False):
+        now = time.time()
+        for worker, batch in enumerate(self._batches):
+            if batch and (
+                not expired_only or
+                now - self._batch_start[worker] >= MAX_BATCH_DELAY_SECS
+            ):
+                self._flush(worker)
+
+    def _flush(self, worker):
+        batch = self._batches[worker]
+        self._batches[worker] = []
+        self._send(worker, batch)
+        for topic, partition, offset, _, _ in batch:
+            self._dispatched[(topic, partition)] = offset
+
+    def _send(self, worker, batch):
+        ring = self.messages_rings[worker]
+        data = serialize(batch)
+        if len(data) > ring.max_record_size and len(batch) > 1:
+            middle = len(batch) // 2
+            self._send(worker, batch[:middle])
+            self._send(worker, batch[middle:])
+            return
+        # Keep reading the acks while the worker is busy, it may be waiting
+        # for free space in its acks ring buffer.
+        while not ring.put(data, timeout=RING_TIMEOUT_SECS):
+            self._read_acks()
+
+    def _read_acks(self):
+        for ring in self.acks_rings:
+            while True:
+                data = ring.get(timeout=0)
+                if data is None:
+                    break
+                for (topic, partition), offset in six.iteritems(deserialize(data)):
+                    previous = self._acked.get((topic, partition))
+                    self._acked[(topic, partition)] = offset
+                    self._mark_done(
+                        topic,
+                        partition,
+                        offset,
+                        offset - previous if previous is not None else 1,
+                    )
+
+    def _mark_done(self, topic, partition, offset, count):
+        """Mark the messages up to offset as done in the consumer, so that
+        they are committed.
+
+        The workers only acknowledge the last offset of each batch, but
+        KafkaConsumer.task_done logs a warning for every offset that doesn't
+        follow the previous one.
+
+        :param count: number of messages acknowledged
+        """
+        set_task_done_offsets(
+            self.consumer,
+            {(topic, partition): offset},
+            max(count, 1),
+        )
+
+    def _pending(self):
+        return any(
+            self._acked.get(topic_partition) != offset
+            for topic_partition, offset in six.iteritems(self._dispatched)
+        )
+
+    def _drain(self):
+        """Wait for the workers to process the dispatched messages."""
+        self._flush_batches()
+        timeout = time.time() + self.config.max_termination_timeout_secs
+        self._read_acks()
+        while self._pending() and time.time() < timeout:
+            time.sleep(RING_TIMEOUT_SECS / 10)
+            self._read_acks()
+        if self._pending():
+            self.log.warning(
+                "Terminating with unprocessed messages. Processed offsets "
+                "%s, dispatched offsets %s",
+                self._acked,
+                self._dispatched,
+            )
+
+
+class SharedMemoryConsumerGroup(object):
+    """Consumer group where one fetcher process consumes all the
+    acquired partitions and hands the messages to worker_count worker
+    processes through shared memory ring buffers.
+
+    This is an alternative to
+    :py:class:`yelp_kafka.consumer_group.MultiprocessingConsumerGroup`, where
+    every process consumes from kafka on its own. Only the fetcher connects to
+    the kafka brokers, so the number of broker connections and fetch buffers
+    doesn't grow with the number of processes, and the workers only spend
+    time in :py:meth:`SharedMemoryWorker.process`. The number of workers
+    doesn't depend on the number of acquired partitions.
+
+    The workers acknowledge the processed offsets back to the fetcher, which
+    commits them according to the auto commit configuration. Offsets are
+    committed only once the messages have been processed.
+
+    Fetcher and workers are restarted upon rebalance, with the incremental
+    rebalance protocol too since the fetcher consumes all the partitions,
+    kept and acquired ones. If any of them dies,
+    all of them are restarted from the last committed offsets.
+
+    .. note:: The processes are forked and share the ring buffers memory,
+       this class requires the fork start method.
+
+    Example:
+
+    .. code-block:: python
+
+       from yelp_kafka import discovery
+       from yelp_kafka.config import KafkaConsumerConfig
+       from yelp_kafka.shared_memory_group import SharedMemoryConsumerGroup
+       from yelp_kafka.shared_memory_group import SharedMemoryWorker
+
+       class MyWorker(SharedMemoryWorker):
+
+           def process(self, message):
+               print message.topic, message.partition, message.value
+
+       cluster = discovery.get_local_cluster('standard')
+       config = KafkaConsumerConfig('my_group', cluster)
+       group = SharedMemoryConsumerGroup(['topic1'], config, MyWorker, 8)
+       group.start_group()
+
+    :param topics: a list of topics to consume from, or a compiled regular
+        expression matching the topics to consume from.
+    :type topics: list or regular expression
+    :param config: yelp_kafka consumer config
+    :type config: :py:class:`yelp_kafka.config.KafkaConsumerConfig`
+    :param worker_factory: function(config, worker_id) returning an instance
+        of a subclass of :py:class:`SharedMemoryWorker`.
+    :param worker_count: number of worker processes. Default: number of cpus.
+    :param ring_buffer_bytes: size of each ring buffer. A buffer must fit at
+        least a message. Default: 16MiB.
+    """
+
+    def __init__(
+        self,
+        topics,
+        config,
+        worker_factory,
+        worker_count=None,
+        ring_buffer_bytes=DEFAULT_RING_BUFFER_BYTES,
+    ):
+        self.log = logging.getLogger(self.__class__.__name__)
+        self.config = config
+        self.worker_factory = worker_factory
+        self.worker_count = worker_count or multiprocessing.cpu_count()
+        self.ring_buffer_bytes = ring_buffer_bytes
+        self.termination_flag = None
+        self.partitioner = Partitioner(
+            config,
+            topics,
+            self.acquire,
+            self.release,
+        )
+        self.fetcher = None
+        # Partitions consumed by the fetcher, kept upon incremental rebalances
+        self.acquired_partitions = {}
+        self.workers = []
+        # Map process to fetcher or worker
+        self.procs = {}
+        self.rings = []
+        self.pre_rebalance_callback = config.pre_rebalance_callback
+        self.post_rebalance_callback = config.post_rebalance_callback
+
+    def start_group(self, refresh_timeout=DEFAULT_REFRESH_TIMEOUT_IN_SEC):
+        """Start the consumer group. See
+        :py:meth:`yelp_kafka.consumer_group.MultiprocessingConsumerGroup.start_group`.
+
+        .. note: this function does not return. You may want to run it into
+            a separate thread.
+        """
+        self.termination_flag = Event()
+
+        with self.partitioner:
+            while not self.termination_flag.is_set():
+                self.termination_flag.wait(refresh_timeout)
+                self.monitor()
+                try:
+                    self.partitioner.refresh()
+                except (PartitionerZookeeperError, PartitionerError):
+                    self.log.exception("Encountered a partitioner error")
+                    raise
+
+    def stop_group(self):
+        """Set the termination flag to stop the group.
+
+        :raises: ConsumerGroupError is the group has not been started, yet.
+        """
+        if not self.termination_flag:
+            raise ConsumerGroupError("Group not running")
+        self.termination_flag.set()
+
+    def acquire(self, partitions):
+        """Start the fetcher and the workers for the acquired partitions and
+        the ones kept by an incremental rebalance."""
+        self.log.debug("Acquired partitions: %s", partitions)
+        if self.fetcher:
+            self.terminate()
+        self.acquired_partitions = add_partitions(self.acquired_partitions, partitions)
+        self.start(self.acquired_partitions)
+        if self.post_rebalance_callback:
+            self.post_rebalance_callback(partitions)
+
+    def release(self, partitions):
+        """Terminate the fetcher and the workers, then start them again for
+        the partitions kept by an incremental rebalance."""
+        if self.pre_rebalance_callback:
+            self.pre_rebalance_callback(partitions)
+        self.log.info("Terminating consumer group")
+        self.terminate()
+        self.acquired_partitions = remove_partitions(self.acquired_partitions, partitions)
+        if self.acquired_partitions:
+            self.start(self.acquired_partitions)
+
+    def start(self, acquired_partitions):
+        """Create the ring buffers and start the fetcher and worker
+        processes.
+
+        :param acquired_partitions: acquired topics partitions
+        :type: dict {<topic>: <[partitions]>}
+        """
+        messages_rings = []
+        acks_rings = []
+        self.workers = []
+        for worker_id in range(self.worker_count):
+            worker = self.worker_factory(self.config, worker_id)
+            worker.messages_ring = SharedRingBuffer(self.ring_buffer_bytes)
+            worker.acks_ring = SharedRingBuffer(self.ring_buffer_bytes)
+            messages_rings.append(worker.messages_ring)
+            acks_rings.append(worker.acks_ring)
+            self.workers.append(worker)
+        self.rings = messages_rings + acks_rings
+        self.fetcher = MessageFetcher(
+            self.config,
+            acquired_partitions,
+            messages_rings,
+            acks_rings,
+        )
+        for worker in self.workers:
+            name = 'Worker-{0}'.format(worker.worker_id)
+            self.procs[self.start_process(worker.run, name)] = worker
+        self.procs[self.start_process(self.fetcher.run, 'Fetcher')] = self.fetcher
+
+    def start_process(self, target, name):
+        """Create a new fetcher or worker process"""
+        try:
+            proc = Process(target=target, name=name)
+            proc.daemon = True
+            proc.start()
+        except Exception:
+            self.log.exception("Impossible to start process %s.", name)
+            raise ConsumerGroupError(
+                "Error starting process {name}.".format(name=name),
+            )
+        return proc
+
+    def terminate(self):
+        """Terminate the fetcher, wait for it to commit the processed
+        offsets and terminate the workers.
+        """
+        timeout = self.config.max_termination_timeout_secs
+        fetcher_procs = [
+            proc for proc, target in six.iteritems(self.procs)
+            if target is self.fetcher
+        ]
+        if self.fetcher:
+            self.fetcher.terminate()
+        # The fetcher waits up to timeout for the workers, give it the
+        # same time to commit.
+        self._join(fetcher_procs, time.time() + 2 * timeout)
+        for worker in self.workers:
+            worker.terminate()
+        self._join(list(self.procs), time.time() + timeout)
+
+        for proc in self.procs:
+            if proc.is_alive():
+                os.kill(proc.pid, signal.SIGKILL)
+                self.log.error("Process %s killed due to timeout", proc.name)
+        self.procs.clear()
+        for ring in self.rings:
+            ring.close()
+        self.rings = []
+        self.workers = []
+        self.fetcher = None
+
+    def _join(self, procs, deadline):
+        for proc in procs:
+            proc.join(max(deadline - time.time(), 0))
+
+    def monitor(self):
+        """Restart the fetcher and the workers if any of them died. The
+        messages dispatched to a dead worker are consumed again from the
+        last committed offsets.
+        """
+        dead_procs = [proc for proc in self.procs if not proc.is_alive()]
+        if not dead_procs:
+            return
+        for proc in dead_procs:
+            self.log.error(
+                "Process %s died exit status %s",
+                proc.name,
+                proc.exitcode,
+            )
+        partitions = self.fetcher.partitions
+        self.terminate()
+        self.start(partitions)
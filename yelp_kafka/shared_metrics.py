@@ -0,0 +1,259 @@
+# -*- coding: utf-8 -*-
+# Copyright 2016 Yelp Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Metrics of many consumer processes aggregated in shared memory and
+reported by their parent process through a single
+:py:class:`yelp_kafka.metrics_responder.MetricsResponder`.
+
+Every process records its metrics in its own slot of an anonymous shared
+memory map. The parent sums the slots and reports the difference with the
+previous flush.
+"""
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+import logging
+import mmap
+import struct
+import threading
+
+import six
+
+from yelp_kafka.metrics import DEFAULT_TIMER_BUCKETS_MS
+
+
+DEFAULT_SLOTS = 256
+"""Max number of processes recording metrics at the same time"""
+
+VALUE = struct.Struct(str('d'))
+
+
+class SharedMetrics(object):
+    """Counters and timer histograms shared by the processes forked
+    after its creation.
+
+    Each slot has a single writer process, that takes the slot from
+    :py:meth:`acquire_slot` in the parent before forking and records through
+    :py:meth:`get_recorder`. Slots don't need cross-process locks: a process
+    killed while recording can't block the others. Values of released slots
+    are kept, the next owner of a slot keeps adding to them.
+
+    :param counter_names: names of the counters
+    :param timer_names: names of the timers
+    :param slots: number of slots, see :py:data:`DEFAULT_SLOTS`
+    :param timer_buckets: upper bounds of the timer histogram buckets
+    """
+
+    def __init__(
+        self,
+        counter_names,
+        timer_names,
+        slots=DEFAULT_SLOTS,
+        timer_buckets=DEFAULT_TIMER_BUCKETS_MS,
+    ):
+        self.log = logging.getLogger(self.__class__.__name__)
+        self.counter_names = sorted(counter_names)
+        self.timer_names = sorted(timer_names)
+        self.slots = slots
+        self.timer_buckets = tuple(sorted(timer_buckets))
+        # Count and sum of the values of each bucket, last one is +Inf
+        self._timer_size = 2 * (len(self.timer_buckets) + 1)
+        self._offsets = {}
+        for index, name in enumerate(self.counter_names):
+            self._offsets[name] = index
+        timers_start = len(self.counter_names)
+        for index, name in enumerate(self.timer_names):
+            self._offsets[name] = timers_start + index * self._timer_size
+        self._slot_values = (
+            timers_start + len(self.timer_names) * self._timer_size
+        )
+        self._slot_struct = struct.Struct(str('{0}d'.format(self._slot_values)))
+        self._buffer = mmap.mmap(-1, self.slots * self._slot_struct.size)
+        self._free_slots = list(range(self.slots - 1, -1, -1))
+
+    def acquire_slot(self):
+        """Get a free slot for a new process.
+
+        :returns: the slot, None if all the slots are in use
+        """
+        if not self._free_slots:
+            self.log.warning(
+                "All the %d metrics slots are in use, metrics of the new "
+                "process will not be reported.",
+                self.slots,
+            )
+            return None
+        return self._free_slots.pop()
+
+    def release_slot(self, slot):
+        """Release the slot of a process that is no longer running."""
+        if slot is not None and slot not in self._free_slots:
+            self._free_slots.append(slot)
+
+    def get_recorder(self, slot):
+        """Get the recorder writing to slot.
+
+        :rtype: :py:class:`MetricsRecorder`, None if slot is None
+        """
+        if slot is None:
+            return None
+        return MetricsRecorder(self, slot)
+
+    def _position(self, slot, index):
+        return (slot * self._slot_values + index) * VALUE.size
+
+    def _add(self, slot, index, value):
+        position = self._position(slot, index)
+        total = VALUE.unpack_from(self._buffer, position)[0]
+        VALUE.pack_into(self._buffer, position, total + value)
+
+    def _count(self, slot, name, value):
+        self._add(slot, self._offsets[name], value)
+
+    def _record(self, slot, name, value):
+        index = self._offsets[name] + self._bucket(value)
+        self._add(slot, index, 1)
+        self._add(slot, index + len(self.timer_buckets) + 1, value)
+
+    def _bucket(self, value):
+        for index, bound in enumerate(self.timer_buckets):
+            if value <= bound:
+                return index
+        return len(self.timer_buckets)
+
+    def collect(self):
+        """Sum the values of all the slots.
+
+        :returns: counters {<name>: total}, timers {<name>: (counts, sums)}
+            with the count and the sum of the values of each bucket.
+        """
+        totals = [0.0] * self._slot_values
+        for slot in range(self.slots):
+            values = self._slot_struct.unpack_from(
+                self._buffer,
+                slot * self._slot_struct.size,
+            )
+            totals = [total + value for total, value in zip(totals, values)]
+        counters = dict(
+            (name, totals[self._offsets[name]]) for name in self.counter_names
+        )
+        timers = {}
+        buckets = len(self.timer_buckets) + 1
+        for name in self.timer_names:
+            start = self._offsets[name]
+            timers[name] = (
+                totals[start:start + buckets],
+                totals[start + buckets:start + 2 * buckets],
+            )
+        return counters, timers
+
+    def close(self):
+        self._buffer.close()
+
+
+class MetricsRecorder(object):
+    """Records metrics in a slot of :py:class:`SharedMetrics`. Thread safe,
+    but only one process may use the recorder of a slot.
+    """
+
+    def __init__(self, shared_metrics, slot):
+        self.shared_metrics = shared_metrics
+        self.slot = slot
+        self._lock = threading.Lock()
+
+    def count(self, name, value=1):
+        with self._lock:
+            self.shared_metrics._count(self.slot, name, value)
+
+    def record(self, name, value):
+        with self._lock:
+            self.shared_metrics._record(self.slot, name, value)
+
+    def record_kafka_metric(self, key, value):
+        """Metrics callback for kafka-python KafkaClient. Times are
+        converted from seconds to milliseconds, failures are counted.
+        Unknown metrics are ignored.
+        """
+        if key in self.shared_metrics.timer_names:
+            self.record(key, value * 1000)
+        elif key in self.shared_metrics.counter_names:
+            self.count(key)
+
+
+class SharedMetricsReporter(object):
+    """Report the metrics in a :py:class:`SharedMetrics` through a metrics
+    responder, by calling :py:meth:`flush` periodically.
+
+    Counters are incremented by the total of all the processes since the
+    previous flush. The values of each timer bucket since the previous flush
+    are recorded at once as their mean, through
+    :py:meth:`yelp_kafka.metrics_responder.MetricsResponder.record_many`.
+    The mean stays in its bucket, so responders with the same buckets get
+    the same histogram.
+
+    :param shared_metrics: the :py:class:`SharedMetrics` to report
+    :param metrics_responder: the responder the metrics are reported to
+    :type metrics_responder: :py:class:`yelp_kafka.metrics_responder.MetricsResponder`
+    :param metric_prefix: prefix of the reported metric names
+    :param dimensions: dimensions of the reported metrics
+    """
+
+    def __init__(
+        self,
+        shared_metrics,
+        metrics_responder,
+        metric_prefix,
+        dimensions=None,
+    ):
+        self.shared_metrics = shared_metrics
+        self.metrics_responder = metrics_responder
+        self.counters = dict(
+            (name, metrics_responder.get_counter_emitter(
+                metric_prefix + '.' + name,
+                dimensions,
+            ))
+            for name in shared_metrics.counter_names
+        )
+        self.timers = dict(
+            (name, metrics_responder.get_timer_emitter(
+                metric_prefix + '.' + name,
+                dimensions,
+            ))
+            for name in shared_metrics.timer_names
+        )
+        self._last_counters, self._last_timers = shared_metrics.collect()
+
+    def flush(self):
+        counters, timers = self.shared_metrics.collect()
+        for name, total in six.iteritems(counters):
+            delta = int(round(total - self._last_counters[name]))
+            if delta > 0:
+                self.metrics_responder.record(self.counters[name], delta)
+        for name, (counts, sums) in six.iteritems(timers):
+            last_counts, last_sums = self._last_timers[name]
+            for count, total, last_count, last_total in zip(
+                counts,
+                sums,
+                last_counts,
+                last_sums,
+            ):
+                delta = int(round(count - last_count))
+                if delta <= 0:
+                    continue
+                self.metrics_responder.record_many(
+                    self.timers[name],
+                    (total - last_total) / delta,
+                    delta,
+                )
+        self._last_counters, self._last_timers = counters, timers
@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+# Copyright 2016 Yelp Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+import mmap
+import struct
+import time
+from multiprocessing import Lock
+from multiprocessing import Semaphore
+
+# Total number of bytes read and written since the buffer creation.
+POSITIONS = struct.Struct(str('!QQ'))
+RECORD_HEADER = struct.Struct(str('!I'))
+# Written in place of a record header when the next record doesn't fit
+# before the end of the buffer. The reader restarts from the beginning.
+WRAP_MARKER = 0xFFFFFFFF
+# Records are aligned to the record header size, so that there is always
+# room for a wrap marker at the end of the buffer.
+ALIGNMENT = RECORD_HEADER.size
+# Sleep time while waiting for free space.
+POLL_INTERVAL_SECS = 0.001
+
+
+def _aligned(size):
+    return (size + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+class SharedRingBuffer(object):
+    """Single producer, single consumer queue of byte strings backed by
+    an anonymous shared memory map.
+
+    The buffer must be created before forking the producer and the consumer
+    processes, which share the same memory. Records are copied once in the
+    shared memory by :py:meth:`put` and once out of it by :py:meth:`get`,
+    without any pipe or socket in between.
+
+    .. note:: Only one process may put and only one process may get records.
+
+    :param size: size of the buffer in bytes. The largest record that can be
+        put is half of the buffer size.
+    :type size: int
+    """
+
+    def __init__(self, size):
+        self.size = _aligned(size)
+        self.max_record_size = self.size // 2 - RECORD_HEADER.size
+        self._buffer = mmap.mmap(-1, POSITIONS.size + self.size)
+        # Protects the read and write positions
+        self._lock = Lock()
+        # Number of records ready to be read
+        self._records = Semaphore(0)
+
+    def _get_positions(self):
+        with self._lock:
+            return POSITIONS.unpack_from(self._buffer, 0)
+
+    def _set_position(self, index, value):
+        with self._lock:
+            positions = list(POSITIONS.unpack_from(self._buffer, 0))
+            positions[index] = value
+            POSITIONS.pack_into(self._buffer, 0, *positions)
+
+    def put(self, data, timeout=None):
+        """Put a record in the buffer, waiting for free space if needed.
+
+        :param data: the record
+        :type data: bytes
+        :param timeout: max time to wait for free space in seconds,
+            None waits forever.
+        :returns: True if the record has been put, False upon timeout.
+        :raises ValueError: if the record is larger than max_record_size.
+        """
+        if len(data) > self.max_record_size:
+            raise ValueError(
+                "Record of {0} bytes larger than max size {1}".format(
+                    len(data),
+                    self.max_record_size,
+                )
+            )
+        record_size = _aligned(RECORD_HEADER.size + len(data))
+        deadline = None if timeout is None else time.time() + timeout
+        while True:
+            head, tail = self._get_positions()
+            index = tail % self.size
+            padding = 0
+            if index + record_size > self.size:
+                padding = self.size - index
+            if self.size - (tail - head) >= padding + record_size:
+                break
+            if deadline is not None and time.time() >= deadline:
+                return False
+            time.sleep(POLL_INTERVAL_SECS)
+        # The free space is only read by the consumer after the write
+        # position is updated.
+        if padding:
+            self._write_header(index, WRAP_MARKER)
+            index = 0
+        self._write_header(index, len(data))
+        start = POSITIONS.size + index + RECORD_HEADER.size
+        self._buffer[start:start + len(data)] = data
+        self._set_position(1, tail + padding + record_size)
+        self._records.release()
+        return True
+
+    def get(self, timeout=None):
+        """Get the oldest record of the buffer.
+
+        :param timeout: max time to wait for a record in seconds,
+            None waits forever.
+        :returns: the record or None upon timeout.
+        :rtype: bytes
+        """
+        if timeout is None:
+            self._records.acquire()
+        elif not self._records.acquire(True, timeout):
+            return None
+        head, _ = self._get_positions()
+        index = head % self.size
+        length = self._read_header(index)
+        if length == WRAP_MARKER:
+            head += self.size - index
+            index = 0
+            length = self._read_header(index)
+        start = POSITIONS.size + index + RECORD_HEADER.size
+        data = self._buffer[start:start + length]
+        self._set_position(0, head + _aligned(RECORD_HEADER.size + length))
+        return data
+
+    def _write_header(self, index, value):
+        RECORD_HEADER.pack_into(self._buffer, POSITIONS.size + index, value)
+
+    def _read_header(self, index):
+        return RECORD_HEADER.unpack_from(self._buffer, POSITIONS.size + index)[0]
+
+    def close(self):
+        """Unmap the buffer in the current process."""
+        self._buffer.close()
@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+# Copyright 2016 Yelp Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+from kazoo.recipe.partitioner import PartitionState
+
+
+def static_partition_func(member_index, member_count, partitions):
+    """Items of the member member_index in a group of member_count members.
+    Same split of the default kazoo SetPartitioner partition_func, where the
+    position of the member is given instead of being derived from the party.
+    """
+    return sorted(partitions)[member_index::member_count]
+
+
+class StaticSetPartitioner(object):
+    """Partition a set amongst a fixed number of members without any
+    coordination.
+
+    Each member knows its own index and the total number of members in the
+    group, so that the assignment is computed locally and deterministically.
+    There is no zookeeper party, no lock and no cooldown: the set is acquired
+    as soon as the partitioner is created. It is meant for groups with a
+    fixed number of members, such as batch jobs, where a member joining or
+    leaving the group doesn't need to trigger a rebalance.
+
+    StaticSetPartitioner has the same interface and states of
+    :py:class:`kazoo.recipe.partitioner.SetPartitioner`.
+
+    .. note:: Static members don't check each other. Every member of the
+       group must be configured with a different index and the same count,
+       otherwise some items may be consumed twice or not at all.
+
+    :param set: the set of items to partition
+    :param member_index: index of this member, 0 <= member_index < member_count
+    :param member_count: number of members of the group
+    """
+
+    def __init__(self, set, member_index, member_count):
+        # Used to differentiate two states with the same names in time
+        self.state_id = 0
+        self.state = PartitionState.ACQUIRED
+        self._set = set
+        self._member_index = member_index
+        self._member_count = member_count
+        self._partition_set = static_partition_func(
+            member_index,
+            member_count,
+            set,
+        )
+
+    def __iter__(self):
+        """Return the items acquired by this member."""
+        for item in self._partition_set:
+            yield item
+
+    @property
+    def failed(self):
+        return self.state == PartitionState.FAILURE
+
+    @property
+    def release(self):
+        return self.state == PartitionState.RELEASE
+
+    @property
+    def allocating(self):
+        return self.state == PartitionState.ALLOCATING
+
+    @property
+    def acquired(self):
+        return self.state == PartitionState.ACQUIRED
+
+    def wait_for_acquire(self, timeout=30):
+        """The set is always acquired, nothing to wait for."""
+        pass
+
+    def release_set(self):
+        """Release the set and acquire the items of this member again."""
+        if self.failed:
+            return
+        self._partition_set = static_partition_func(
+            self._member_index,
+            self._member_count,
+            self._set,
+        )
+        self._set_state(PartitionState.ACQUIRED)
+
+    def finish(self):
+        """Release the set. The partitioner can't be used anymore."""
+        self._partition_set = []
+        self._set_state(PartitionState.FAILURE)
+
+    def _set_state(self, state):
+        self.state = state
+        self.state_id += 1
@@ -17,13 +17,20 @@ from __future__ import unicode_literals
 
 import functools
 import logging
+import threading
+import time
+from collections import namedtuple
+from collections import OrderedDict
 
 from kafka.common import KafkaUnavailableError
+from kafka.util import kafka_bytestring
 from six.moves import cPickle as pickle
 
 
 log = logging.getLogger(__name__)
 
+CacheInfo = namedtuple('CacheInfo', ['hits', 'misses', 'maxsize', 'currsize'])
+
 
 def get_kafka_topics(kafkaclient):
     """Connect to kafka and fetch all the topics/partitions."""
@@ -39,6 +46,102 @@ def get_kafka_topics(kafkaclient):
     return kafkaclient.topic_partitions
 
 
+def get_kafka_topics_partitions(kafkaclient, topics):
+    """Connect to kafka and fetch the partitions of the given topics only.
+    Unlike :py:func:`get_kafka_topics` the metadata response only contains
+    the requested topics, which makes it cheap on clusters with many topics.
+
+    .. note:: Kafka auto-creates the requested topics that don't exist
+       if the cluster has auto.create.topics.enable set.
+
+    :param kafkaclient: a connected KafkaClient
+    :param topics: list of topics
+    :returns: partitions ids for each topic that exists and has a leader
+    :rtype: dict {<topic>: <[partitions]>}
+    """
+    topics = [kafka_bytestring(topic) for topic in topics]
+    try:
+        response = kafkaclient.send_metadata_request(topics)
+    except KafkaUnavailableError:
+        # See get_kafka_topics
+        log.debug("First call to kafka for loading metadata failed."
+                  " Trying again.")
+        response = kafkaclient.send_metadata_request(topics)
+    topic_partitions = {}
+    for topic_metadata in response.topics:
+        if topic_metadata.error:
+            log.debug(
+                "Error %s loading metadata for topic %s",
+                topic_metadata.error,
+                topic_metadata.topic,
+            )
+            continue
+        topic_partitions[topic_metadata.topic] = sorted(
+            partition.partition for partition in topic_metadata.partitions
+        )
+    return topic_partitions
+
+
+def is_topic_pattern(topics):
+    """True if topics is a compiled regular expression rather than a list
+    of topic names."""
+    return hasattr(topics, 'match') and hasattr(topics, 'pattern')
+
+
+def topic_matches(pattern, topic):
+    """True if the whole topic name matches the compiled pattern."""
+    match = pattern.match(topic)
+    return match is not None and match.end() == len(topic)
+
+
+def consumes_from(consumer, partitions):
+    """True if the consumer consumes from any of partitions.
+
+    :param consumer: object with topic and partitions attributes, such as
+        :py:class:`yelp_kafka.consumer.KafkaConsumerBase`
+    :param partitions: topics partitions, None matches any consumer
+    :type partitions: dict {<topic>: <[partitions]>}
+    """
+    if partitions is None:
+        return True
+    topic = kafka_bytestring(consumer.topic)
+    return any(
+        partition in topic_partitions
+        for name, topic_partitions in partitions.items()
+        if kafka_bytestring(name) == topic
+        for partition in consumer.partitions
+    )
+
+
+def set_task_done_offsets(consumer, offsets, count=0):
+    """Mark the messages up to offsets as done in a KafkaConsumer, so that
+    they are committed.
+
+    Unlike KafkaConsumer.task_done, the offsets don't need to follow the
+    previous ones, e.g. when only the last offset of a batch is acknowledged
+    or when the offsets are restored after set_topic_partitions.
+
+    .. note:: KafkaConsumer has no public API for it. This relies on the
+       internals of kafka-python 0.9.5, the version pinned in setup.py.
+
+    :param consumer: a :py:class:`kafka.KafkaConsumer`
+    :param offsets: offsets marked as done
+    :type offsets: dict {(<topic>, <partition>): <offset>}
+    :param count: number of messages done, counted for auto commit like
+        KafkaConsumer.task_done does. Default: 0, no auto commit.
+    """
+    consumer._offsets.task_done.update(
+        ((kafka_bytestring(topic), partition), offset)
+        for (topic, partition), offset in offsets.items()
+    )
+    if not count:
+        return
+    if consumer._does_auto_commit_messages():
+        consumer._incr_auto_commit_message_count(count)
+    if consumer._should_auto_commit():
+        consumer.commit()
+
+
 def make_scribe_topic(stream, datacenter):
     """Get a scribe topic name
 
@@ -84,7 +187,38 @@ def get_default_responder_if_available():
         from yelp_kafka.yelp_metrics_responder import MeteoriteMetricsResponder
         return MeteoriteMetricsResponder()
     except ImportError:
-        logging.error("yelp_meteorite is not present")
+        logging.error(
+            "yelp_meteorite is not present, metrics are not reported. Use "
+            "yelp_kafka.prometheus_metrics_responder.PrometheusMetricsResponder "
+            "to export them without yelp_meteorite."
+        )
+
+
+def zipkin_span(service_name, span_name):
+    """Decorator tracing a function like py_zipkin.zipkin.zipkin_span.
+    py_zipkin is slow to import, it is only imported when the decorated
+    function is called for the first time.
+
+    :param service_name: zipkin service name
+    :param span_name: zipkin span name
+    """
+
+    def decorator(func):
+        traced = []
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not traced:
+                from py_zipkin.zipkin import zipkin_span
+                traced.append(zipkin_span(
+                    service_name=service_name,
+                    span_name=span_name,
+                )(func))
+            return traced[0](*args, **kwargs)
+
+        return wrapper
+
+    return decorator
 
 
 def retry_if_kafka_unavailable_error(exception):
@@ -103,8 +237,7 @@ class memoized(object):
 
     Based upon from http://wiki.python.org/moin/PythonDecoratorLibrary#Memoize
     Nota bene: this decorator memoizes /all/ calls to the function.  For a memoization
-    decorator with limited cache size, consider:
-    http://code.activestate.com/recipes/496879-memoize-decorator-function-with-cache-size-limit/
+    decorator with limited cache size, see :py:func:`cached`.
     """
 
     def __init__(self, func):
@@ -128,3 +261,108 @@ class memoized(object):
     def __get__(self, obj, objtype):
         """Support instance methods."""
         return functools.partial(self.__call__, obj)
+
+
+# Separates positional and keyword arguments in cache keys
+_KWARGS_MARK = (object(),)
+
+
+def _make_key(args, kwargs):
+    """Build a cache key from the function arguments. The arguments must be
+    hashable."""
+    key = args
+    if kwargs:
+        key += _KWARGS_MARK + tuple(sorted(kwargs.items()))
+    hash(key)
+    return key
+
+
+class _CacheEntry(object):
+
+    __slots__ = ('value', 'expire_at')
+
+    def __init__(self, value, expire_at):
+        self.value = value
+        self.expire_at = expire_at
+
+
+def cached(maxsize=128, ttl=None):
+    """Decorator caching the values returned by a function for the same
+    arguments.
+
+    At most maxsize values are cached, the least recently used value is
+    evicted when the cache is full. If ttl is set, values older than ttl
+    seconds are evaluated again. Exceptions are not cached.
+
+    The cache is thread safe. Concurrent calls with the same arguments
+    evaluate the function only once, the other callers wait for its value.
+
+    The decorated function exposes cache_info(), returning a
+    :py:data:`CacheInfo` (hits, misses, maxsize, currsize), and
+    cache_clear().
+
+    :param maxsize: max number of cached values, None for no limit
+    :param ttl: time to live of the cached values in seconds, None for
+        no expiration
+    :raises TypeError: when called with unhashable arguments
+    """
+
+    def decorator(func):
+        entries = OrderedDict()
+        # Evaluations in progress, by key
+        pending = {}
+        lock = threading.Lock()
+        stats = {'hits': 0, 'misses': 0}
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            key = _make_key(args, kwargs)
+            while True:
+                with lock:
+                    entry = entries.pop(key, None)
+                    if entry is not None and (
+                        entry.expire_at is None or entry.expire_at > time.time()
+                    ):
+                        # Move to the most recently used position
+                        entries[key] = entry
+                        stats['hits'] += 1
+                        return entry.value
+                    done = pending.get(key)
+                    if done is None:
+                        done = pending[key] = threading.Event()
+                        stats['misses'] += 1
+                        break
+                # Another thread is evaluating the same key
+                done.wait()
+            try:
+                value = func(*args, **kwargs)
+                with lock:
+                    expire_at = None if ttl is None else time.time() + ttl
+                    entries[key] = _CacheEntry(value, expire_at)
+                    if maxsize is not None and len(entries) > maxsize:
+                        entries.popitem(last=False)
+                return value
+            finally:
+                with lock:
+                    del pending[key]
+                done.set()
+
+        def cache_info():
+            with lock:
+                return CacheInfo(
+                    stats['hits'],
+                    stats['misses'],
+                    maxsize,
+                    len(entries),
+                )
+
+        def cache_clear():
+            with lock:
+                entries.clear()
+                stats['hits'] = stats['misses'] = 0
+
+        wrapper.cache_info = cache_info
+        wrapper.cache_clear = cache_clear
+        return wrapper
+
+    return decorator
@@ -0,0 +1,291 @@
+# -*- coding: utf-8 -*-
+# Copyright 2016 Yelp Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+import itertools
+import logging
+import os
+import signal
+import time
+from multiprocessing import Event
+from multiprocessing import Process
+from multiprocessing import Queue
+
+from setproctitle import getproctitle
+from setproctitle import setproctitle
+
+from yelp_kafka.error import ConsumerGroupError
+from yelp_kafka.utils import consumes_from
+
+
+class PoolWorker(object):
+    """A long lived process running the consumers assigned to it, one at a
+    time.
+
+    The consumer is created in the worker process by consumer_factory
+    when an assignment is received, and runs until :py:meth:`terminate` is
+    called. The worker process then waits for the next assignment.
+
+    :param consumer_factory: see
+        :py:class:`yelp_kafka.consumer_group.MultiprocessingConsumerGroup`
+    :param config: yelp_kafka consumer config
+    :param worker_id: identifier of the worker in the pool
+    :param metrics_recorder: optional
+        :py:class:`yelp_kafka.shared_metrics.MetricsRecorder` given to the
+        consumers of the worker
+    """
+
+    def __init__(self, consumer_factory, config, worker_id, metrics_recorder=None):
+        self.log = logging.getLogger(self.__class__.__name__)
+        self.consumer_factory = consumer_factory
+        self.config = config
+        self.worker_id = worker_id
+        self.metrics_recorder = metrics_recorder
+        # Current assignment, None if the worker is idle
+        self.topic = None
+        self.partitions = None
+        self.proc = None
+        self._assignments = Queue()
+        self._termination_flag = Event()
+        self._idle = Event()
+        self._idle.set()
+
+    @property
+    def name(self):
+        return 'PoolWorker-{0}'.format(self.worker_id)
+
+    @property
+    def busy(self):
+        return self.topic is not None
+
+    def start(self):
+        """Fork the worker process."""
+        try:
+            self.proc = Process(target=self.run, name=self.name)
+            self.proc.daemon = True
+            self.proc.start()
+        except Exception:
+            self.log.exception("Impossible to start worker %s.", self.name)
+            raise ConsumerGroupError(
+                "Error starting worker {name}.".format(name=self.name),
+            )
+
+    def is_alive(self):
+        return self.proc is not None and self.proc.is_alive()
+
+    def assign(self, topic, partitions):
+        """Start consuming from partitions in the worker process.
+
+        :param topic: the topic to consume from
+        :param partitions: the partitions of the topic to consume from
+        :type partitions: list
+        """
+        self.topic = topic
+        self.partitions = partitions
+        self._termination_flag.clear()
+        self._idle.clear()
+        self._assignments.put((topic, partitions))
+
+    def terminate(self):
+        """Terminate the current consumer. The worker process stays alive."""
+        self._termination_flag.set()
+
+    def wait_idle(self, timeout):
+        """Wait for the current consumer to terminate.
+
+        :returns: True if the worker is idle.
+        """
+        return self._idle.wait(timeout)
+
+    def unassign(self):
+        self.topic = None
+        self.partitions = None
+
+    def stop(self):
+        """Terminate the current consumer and ask the process to exit."""
+        self.terminate()
+        self._assignments.put(None)
+
+    def kill(self):
+        if self.is_alive():
+            os.kill(self.proc.pid, signal.SIGKILL)
+
+    def run(self):
+        """Run the assigned consumers until the worker is stopped."""
+        process_name = getproctitle()
+        while True:
+            assignment = self._assignments.get()
+            if assignment is None:
+                return
+            topic, partitions = assignment
+            setproctitle(process_name)
+            consumer = self.consumer_factory(topic, self.config, partitions)
+            # The group terminates the consumer through the worker
+            consumer.termination_flag = self._termination_flag
+            consumer.metrics_recorder = self.metrics_recorder
+            consumer.run()
+            self._idle.set()
+
+
+class ConsumerWorkerPool(object):
+    """Pool of preforked processes running
+    :py:class:`yelp_kafka.consumer.KafkaConsumerBase` consumers.
+
+    Worker processes are forked once, when the pool starts, and are reused
+    for the consumers of every rebalance. Assigning partitions to a worker
+    only sends it a message, so that consuming starts without paying for a
+    new process and for the modules imported by it. The pool grows if more
+    consumers than workers are needed.
+
+    :param consumer_factory: see
+        :py:class:`yelp_kafka.consumer_group.MultiprocessingConsumerGroup`
+    :param config: yelp_kafka consumer config
+    :type config: :py:class:`yelp_kafka.config.KafkaConsumerConfig`
+    :param size: number of workers to fork at start
+    :param shared_metrics: optional
+        :py:class:`yelp_kafka.shared_metrics.SharedMetrics` the consumers
+        record their metrics to. Each worker gets its own slot.
+    """
+
+    def __init__(self, consumer_factory, config, size, shared_metrics=None):
+        self.log = logging.getLogger(self.__class__.__name__)
+        self.consumer_factory = consumer_factory
+        self.config = config
+        self.size = size
+        self.shared_metrics = shared_metrics
+        self.workers = []
+        self._worker_ids = itertools.count()
+        self._metrics_slots = {}
+
+    def _create_worker(self):
+        metrics_recorder = None
+        worker_id = next(self._worker_ids)
+        if self.shared_metrics:
+            slot = self.shared_metrics.acquire_slot()
+            self._metrics_slots[worker_id] = slot
+            metrics_recorder = self.shared_metrics.get_recorder(slot)
+        worker = PoolWorker(
+            self.consumer_factory,
+            self.config,
+            worker_id,
+            metrics_recorder,
+        )
+        worker.start()
+        return worker
+
+    def _release_metrics_slot(self, worker):
+        if self.shared_metrics:
+            self.shared_metrics.release_slot(
+                self._metrics_slots.pop(worker.worker_id, None),
+            )
+
+    def start(self):
+        """Fork the worker processes."""
+        self.workers = [self._create_worker() for _ in range(self.size)]
+
+    def assign(self, topic, partitions):
+        """Assign partitions to an idle worker.
+
+        :returns: the worker consuming from partitions
+        :rtype: :py:class:`PoolWorker`
+        """
+        for worker in self.workers:
+            if not worker.busy:
+                break
+        else:
+            self.log.info("No idle worker, growing the pool.")
+            worker = self._create_worker()
+            self.workers.append(worker)
+        worker.assign(topic, partitions)
+        return worker
+
+    def release(self, timeout, partitions=None):
+        """Terminate the consumers of the workers consuming from partitions.
+        Workers whose consumer doesn't terminate within timeout are replaced.
+
+        :param timeout: max time to wait for the consumers in seconds
+        :param partitions: released topics partitions, None to terminate
+            the consumers of all the workers
+        :type partitions: dict {<topic>: <[partitions]>}
+        """
+        busy_workers = [
+            worker for worker in self.workers
+            if worker.busy and consumes_from(worker, partitions)
+        ]
+        for worker in busy_workers:
+            worker.terminate()
+        deadline = time.time() + timeout
+        for worker in busy_workers:
+            if not worker.wait_idle(max(deadline - time.time(), 0)):
+                self.log.error(
+                    "Worker %s, topic %s, partitions %s: "
+                    "killed due to timeout",
+                    worker.name,
+                    worker.topic,
+                    worker.partitions,
+                )
+                self.replace(worker)
+            else:
+                worker.unassign()
+
+    def replace(self, worker):
+        """Kill a worker and replace it with a new idle one.
+
+        :returns: the new worker
+        :rtype: :py:class:`PoolWorker`
+        """
+        worker.kill()
+        self._release_metrics_slot(worker)
+        new_worker = self._create_worker()
+        self.workers[self.workers.index(worker)] = new_worker
+        return new_worker
+
+    def monitor(self):
+        """Replace the dead workers, assigning the partitions of the
+        dead workers to the new ones.
+
+        :returns: the dead workers
+        :rtype: list
+        """
+        dead_workers = [
+            worker for worker in self.workers if not worker.is_alive()
+        ]
+        for worker in dead_workers:
+            self.log.error(
+                "Worker %s topic %s partitions %s: died exit status %s",
+                worker.name,
+                worker.topic,
+                worker.partitions,
+                worker.proc.exitcode,
+            )
+            new_worker = self.replace(worker)
+            if worker.busy:
+                new_worker.assign(worker.topic, worker.partitions)
+        return dead_workers
+
+    def stop(self, timeout):
+        """Terminate all the consumers and the worker processes.
+
+        :param timeout: max time to wait for the processes in seconds
+        """
+        for worker in self.workers:
+            worker.stop()
+        deadline = time.time() + timeout
+        for worker in self.workers:
+            worker.proc.join(max(deadline - time.time(), 0))
+            worker.kill()
+            self._release_metrics_slot(worker)
+        self.workers = []
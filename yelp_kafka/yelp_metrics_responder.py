@@ -43,10 +43,18 @@ class MeteoriteMetricsResponder(MetricsResponder):
             default_dimensions
         )
 
+    def get_gauge_emitter(self, metric, default_dimensions=None):
+        return yelp_meteorite.create_gauge(
+            metric,
+            default_dimensions
+        )
+
     def record(self, registered_reporter, value, timestamp=None):
         if isinstance(registered_reporter, yelp_meteorite.metrics.Counter):
             registered_reporter.count(value)
-        if isinstance(registered_reporter, yelp_meteorite.metrics.Timer):
+        elif isinstance(registered_reporter, yelp_meteorite.metrics.Timer):
             registered_reporter.record(value)
+        elif isinstance(registered_reporter, yelp_meteorite.metrics.Gauge):
+            registered_reporter.set(value)
         else:
             self.log.error("Reporter Instance is not defined")